@@ -83,6 +83,9 @@ db.createCollection("bookings", {
         payment_transaction_id: {
           bsonType: "string"
         },
+        payment_status: {
+          enum: ["authorized", "captured", "capture_failed"]
+        },
         confirmed_at: {
           bsonType: "date"
         },
@@ -104,43 +107,93 @@ db.createCollection("bookings", {
 });
 
 // Transaction logs collection
+// Version 1 documents use API field names; version 2 ("v": 2) documents are the
+// compact encoding from services/payment-service/transaction_codec.py
 db.createCollection("transaction_logs", {
   validator: {
     $jsonSchema: {
       bsonType: "object",
-      required: ["transaction_id", "booking_id", "amount", "payment_method", "status", "created_at"],
-      properties: {
-        transaction_id: {
-          bsonType: "string"
-        },
-        booking_id: {
-          bsonType: "string"
-        },
-        amount: {
-          bsonType: "double"
-        },
-        payment_method: {
-          enum: ["credit_card", "debit_card", "digital_wallet", "net_banking"]
-        },
-        status: {
-          enum: ["pending", "success", "failed", "refunded"]
-        },
-        payment_details: {
-          bsonType: "object"
-        },
-        gateway_response: {
-          bsonType: "object"
-        },
-        failure_reason: {
-          bsonType: "string"
-        },
-        created_at: {
-          bsonType: "date"
+      anyOf: [
+        {
+          required: ["transaction_id", "booking_id", "amount", "payment_method", "status", "created_at"],
+          properties: {
+            transaction_id: {
+              bsonType: "string"
+            },
+            booking_id: {
+              bsonType: "string"
+            },
+            user_id: {
+              bsonType: ["string", "null"]
+            },
+            amount: {
+              bsonType: "double"
+            },
+            payment_method: {
+              enum: ["credit_card", "debit_card", "digital_wallet", "net_banking"]
+            },
+            status: {
+              enum: ["pending", "success", "failed", "refunded", "authorized", "voided"]
+            },
+            payment_details: {
+              bsonType: "object"
+            },
+            gateway_response: {
+              bsonType: "object"
+            },
+            failure_reason: {
+              bsonType: "string"
+            },
+            created_at: {
+              bsonType: "date"
+            },
+            updated_at: {
+              bsonType: "date"
+            }
+          }
         },
-        updated_at: {
-          bsonType: "date"
+        {
+          required: ["v", "t", "b", "a", "m", "s", "c"],
+          properties: {
+            v: {
+              enum: [2]
+            },
+            t: {
+              bsonType: "string"
+            },
+            b: {
+              bsonType: "string"
+            },
+            u: {
+              bsonType: "string"
+            },
+            a: {
+              bsonType: ["int", "long"]
+            },
+            m: {
+              bsonType: "int"
+            },
+            s: {
+              bsonType: "int"
+            },
+            d: {
+              bsonType: "object"
+            },
+            g: {
+              bsonType: "object"
+            },
+            f: {
+              bsonType: "string"
+            },
+            c: {
+              bsonType: "date"
+            },
+            up: {
+              bsonType: "date"
+            }
+          }
         }
-      }
+      ]
     }
   }
 });
@@ -190,12 +243,25 @@ db.bookings.createIndex({ "showtime_id": 1 });
 db.bookings.createIndex({ "status": 1 });
 db.bookings.createIndex({ "created_at": -1 });
 db.bookings.createIndex({ "lock_expires_at": 1 });
+db.bookings.createIndex({ "payment_status": 1, "confirmed_at": 1 });
+db.bookings.createIndex({ "payment_transaction_id": 1 });
 
-db.transaction_logs.createIndex({ "transaction_id": 1 }, { unique: true });
+db.transaction_logs.createIndex({ "t": 1 }, { unique: true, partialFilterExpression: { "v": 2 } });
+db.transaction_logs.createIndex({ "b": 1 });
+db.transaction_logs.createIndex({ "s": 1 });
+db.transaction_logs.createIndex({ "c": -1 });
+// Open authorizations only (s: 4), for the stale-authorization sweep
+db.transaction_logs.createIndex({ "c": 1 }, { name: "authorized_c_1", partialFilterExpression: { "s": 4 } });
+db.transaction_logs.createIndex(
+  { "transaction_id": 1 },
+  { unique: true, partialFilterExpression: { "transaction_id": { "$exists": true } } }
+);
 db.transaction_logs.createIndex({ "booking_id": 1 });
 db.transaction_logs.createIndex({ "status": 1 });
 db.transaction_logs.createIndex({ "created_at": -1 });
 
+db.payment_rollups.createIndex({ "day": 1, "payment_method": 1, "status": 1 });
+
 db.notification_logs.createIndex({ "event_id": 1 });
 db.notification_logs.createIndex({ "recipient": 1 });
 db.notification_logs.createIndex({ "notification_type": 1 });
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Open-loop load generator for the movie ticket booking services
+Sends requests at a constant arrival rate regardless of how fast the target
+responds, and measures latency from each request's *intended* send time so
+queueing delay is not hidden (coordinated omission).
+
+Example:
+    python scripts/load-tests/load_generator.py \\
+        --url http://localhost:8003/payments --method POST \\
+        --body-file scripts/load-tests/payment_request.json \\
+        --rate 50 --duration 60 --warmup 5 \\
+        --report payment-load.json --threshold p99=2500 --max-error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+# Percentiles included in every report
+REPORT_PERCENTILES = [50.0, 90.0, 95.0, 99.0, 99.9]
+
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram of latencies in microseconds
+    Each power-of-two range is split into linear sub-buckets, giving a
+    relative error below 1/2**(precision_bits - 1) with fixed memory.
+    """
+
+    def __init__(self, max_value_us: int = 120_000_000, precision_bits: int = 7):
+        self.precision_bits = precision_bits
+        self.sub_bucket_count = 1 << precision_bits
+        self.max_value_us = max_value_us
+        bucket_groups = max(1, math.ceil(math.log2(max_value_us)) - precision_bits + 1)
+        self.counts = [0] * ((bucket_groups + 1) * self.sub_bucket_count)
+        self.total_count = 0
+        self.min_value = None
+        self.max_value = 0
+        self.sum = 0
+
+    def _index(self, value: int) -> int:
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.precision_bits
+        return shift * self.sub_bucket_count + (value >> shift)
+
+    def _value_at(self, index: int) -> int:
+        """Highest value that maps to a bucket index"""
+        if index < self.sub_bucket_count:
+            return index
+        shift, offset = divmod(index, self.sub_bucket_count)
+        return (offset << shift) + (1 << shift) - 1
+
+    def record(self, value_us: float, count: int = 1):
+        value = min(max(0, int(value_us)), self.max_value_us)
+        self.counts[self._index(value)] += count
+        self.total_count += count
+        self.sum += value * count
+        self.max_value = max(self.max_value, value)
+        self.min_value = value if self.min_value is None else min(self.min_value, value)
+
+    def percentile(self, percentile: float) -> int:
+        if self.total_count == 0:
+            return 0
+        target = max(1, math.ceil(percentile / 100.0 * self.total_count))
+        running = 0
+        for index, count in enumerate(self.counts):
+            running += count
+            if running >= target:
+                return min(self._value_at(index), self.max_value)
+        return self.max_value
+
+    def mean(self) -> float:
+        return self.sum / self.total_count if self.total_count else 0.0
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total_count += other.total_count
+        self.sum += other.sum
+        self.max_value = max(self.max_value, other.max_value)
+        if other.min_value is not None:
+            self.min_value = other.min_value if self.min_value is None else min(self.min_value, other.min_value)
+
+    def summary_ms(self) -> Dict[str, float]:
+        """Percentile summary in milliseconds for reports"""
+        summary = {
+            "count": self.total_count,
+            "min": (self.min_value or 0) / 1000,
+            "mean": round(self.mean() / 1000, 3),
+            "max": self.max_value / 1000,
+        }
+        for percentile in REPORT_PERCENTILES:
+            summary[percentile_key(percentile)] = self.percentile(percentile) / 1000
+        return summary
+
+
+def percentile_key(percentile: float) -> str:
+    """50.0 -> 'p50', 99.9 -> 'p99.9'"""
+    return f"p{percentile:g}"
+
+
+def render_template(value: Any, sequence: int) -> Any:
+    """Substitute {uuid} and {seq} placeholders anywhere in a request body"""
+    if isinstance(value, str):
+        return value.replace("{uuid}", uuid.uuid4().hex).replace("{seq}", str(sequence))
+    if isinstance(value, dict):
+        return {key: render_template(item, sequence) for key, item in value.items()}
+    if isinstance(value, list):
+        return [render_template(item, sequence) for item in value]
+    return value
+
+
+@dataclass
+class LoadTestConfig:
+    url: str
+    method: str = "GET"
+    body: Optional[Any] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    rate: float = 10.0
+    duration: float = 30.0
+    warmup: float = 0.0
+    timeout: float = 30.0
+    max_connections: int = 1000
+    expect_status: List[int] = field(default_factory=list)
+
+
+class OpenLoopLoadGenerator:
+    """Constant-arrival-rate load generator"""
+
+    def __init__(self, config: LoadTestConfig):
+        self.config = config
+        self.response_time = LatencyHistogram()
+        self.service_time = LatencyHistogram()
+        self.status_codes: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.sent = 0
+        self.completed = 0
+        self.max_send_lag_us = 0
+
+    def _is_success(self, status: int) -> bool:
+        if self.config.expect_status:
+            return status in self.config.expect_status
+        return status < 400
+
+    async def _fire(self, session: aiohttp.ClientSession, sequence: int, intended_start: float, measured: bool):
+        actual_start = time.perf_counter()
+        body = render_template(self.config.body, sequence) if self.config.body is not None else None
+        error = None
+        status = None
+
+        try:
+            async with session.request(
+                self.config.method, self.config.url, json=body, headers=self.config.headers
+            ) as response:
+                await response.read()
+                status = response.status
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except aiohttp.ClientError as e:
+            error = type(e).__name__
+
+        finished = time.perf_counter()
+        if not measured:
+            return
+
+        self.completed += 1
+        # Latency from the intended send time includes any time the request
+        # waited behind a slow system; service time alone would hide it
+        self.response_time.record((finished - intended_start) * 1_000_000)
+        self.service_time.record((finished - actual_start) * 1_000_000)
+
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+        else:
+            self.status_codes[str(status)] = self.status_codes.get(str(status), 0) + 1
+            if not self._is_success(status):
+                self.errors[f"http_{status}"] = self.errors.get(f"http_{status}", 0) + 1
+
+    async def run(self) -> Dict[str, Any]:
+        config = self.config
+        interval = 1.0 / config.rate
+        total_requests = int((config.warmup + config.duration) * config.rate)
+        warmup_requests = int(config.warmup * config.rate)
+
+        connector = aiohttp.TCPConnector(limit=config.max_connections)
+        timeout = aiohttp.ClientTimeout(total=config.timeout)
+        tasks = set()
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            start = time.perf_counter()
+
+            for sequence in range(total_requests):
+                # Schedule against the start time, not the previous send, so the
+                # arrival rate never drifts when the target slows down
+                intended_start = start + sequence * interval
+                delay = intended_start - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.max_send_lag_us = max(self.max_send_lag_us, int(-delay * 1_000_000))
+
+                task = asyncio.create_task(
+                    self._fire(session, sequence, intended_start, sequence >= warmup_requests)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if sequence >= warmup_requests:
+                    self.sent += 1
+
+            measured_start = start + config.warmup
+            send_finished = time.perf_counter()
+            if tasks:
+                await asyncio.gather(*tasks)
+            finished = time.perf_counter()
+
+        return self.report(send_finished - measured_start, finished - measured_start)
+
+    def report(self, send_window: float, elapsed: float) -> Dict[str, Any]:
+        error_count = sum(self.errors.values())
+        return {
+            "target": {"url": self.config.url, "method": self.config.method},
+            "config": {
+                "rate": self.config.rate,
+                "duration": self.config.duration,
+                "warmup": self.config.warmup,
+            },
+            "requests": {
+                "sent": self.sent,
+                "completed": self.completed,
+                "errors": error_count,
+                "error_rate": error_count / self.completed if self.completed else 0.0,
+                "status_codes": self.status_codes,
+                "error_kinds": self.errors,
+            },
+            "achieved_rate": self.sent / send_window if send_window > 0 else 0.0,
+            "elapsed_seconds": round(elapsed, 3),
+            "max_send_lag_ms": self.max_send_lag_us / 1000,
+            "latency_ms": {
+                "response_time": self.response_time.summary_ms(),
+                "service_time": self.service_time.summary_ms(),
+            },
+        }
+
+
+def parse_thresholds(values: List[str]) -> Dict[str, float]:
+    """Parse ['p99=250', 'mean=80'] into {'p99': 250.0, 'mean': 80.0}"""
+    thresholds = {}
+    for value in values:
+        key, _, limit = value.partition("=")
+        if not limit:
+            raise ValueError(f"Invalid threshold '{value}', expected e.g. p99=250")
+        thresholds[key.strip()] = float(limit)
+    return thresholds
+
+
+def check_thresholds(
+    report: Dict[str, Any],
+    thresholds: Dict[str, float],
+    max_error_rate: Optional[float] = None,
+    baseline: Optional[Dict[str, Any]] = None,
+    max_regression: Optional[float] = None,
+    min_rate_ratio: Optional[float] = 0.95,
+) -> List[str]:
+    """Return a list of violated thresholds (empty when the run passes)"""
+    violations = []
+    latency = report["latency_ms"]["response_time"]
+
+    for key, limit in thresholds.items():
+        if key not in latency:
+            violations.append(f"unknown latency metric '{key}'")
+        elif latency[key] > limit:
+            violations.append(f"{key} {latency[key]:.3f}ms exceeds {limit:.3f}ms")
+
+    if max_error_rate is not None and report["requests"]["error_rate"] > max_error_rate:
+        violations.append(
+            f"error rate {report['requests']['error_rate']:.4f} exceeds {max_error_rate:.4f}"
+        )
+
+    if min_rate_ratio is not None:
+        target_rate = report["config"]["rate"]
+        if report["achieved_rate"] < target_rate * min_rate_ratio:
+            violations.append(
+                f"achieved rate {report['achieved_rate']:.2f}/s below target {target_rate:.2f}/s; "
+                "the generator itself was saturated"
+            )
+
+    if baseline is not None and max_regression is not None:
+        baseline_latency = baseline["latency_ms"]["response_time"]
+        for key in [percentile_key(p) for p in REPORT_PERCENTILES]:
+            previous = baseline_latency.get(key)
+            if previous and latency[key] > previous * (1 + max_regression):
+                violations.append(
+                    f"{key} regressed from {previous:.3f}ms to {latency[key]:.3f}ms "
+                    f"(allowed {max_regression:.0%})"
+                )
+
+    return violations
+
+
+def print_summary(report: Dict[str, Any]):
+    requests = report["requests"]
+    print(f"\n{'='*60}")
+    print(f"📊 {report['target']['method']} {report['target']['url']}")
+    print(f"{'='*60}")
+    print(f"Target rate:   {report['config']['rate']:.2f}/s")
+    print(f"Achieved rate: {report['achieved_rate']:.2f}/s")
+    print(f"Completed:     {requests['completed']} ({requests['errors']} errors, {requests['error_rate']:.2%})")
+    for name, summary in report["latency_ms"].items():
+        percentiles = "  ".join(
+            f"{percentile_key(p)}={summary[percentile_key(p)]:.1f}ms" for p in REPORT_PERCENTILES
+        )
+        print(f"{name:<14} {percentiles}  max={summary['max']:.1f}ms")
+    print(f"{'='*60}\n")
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Open-loop constant-arrival-rate load generator")
+    parser.add_argument("--url", required=True, help="Target URL")
+    parser.add_argument("--method", default="GET", help="HTTP method")
+    parser.add_argument("--body-file", help="JSON request body; {uuid} and {seq} are substituted")
+    parser.add_argument("--header", action="append", default=[], help="Extra header as Name:Value")
+    parser.add_argument("--rate", type=float, default=10.0, help="Requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured duration in seconds")
+    parser.add_argument("--warmup", type=float, default=0.0, help="Unmeasured warm-up in seconds")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--expect-status", type=int, action="append", default=[],
+                        help="Status codes counted as success (default: any < 400)")
+    parser.add_argument("--report", help="Write the JSON report to this file")
+    parser.add_argument("--threshold", action="append", default=[],
+                        help="Response time limit in ms, e.g. p99=250")
+    parser.add_argument("--max-error-rate", type=float, help="Fail when the error rate exceeds this")
+    parser.add_argument("--baseline", help="Previous JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                        help="Allowed percentile regression vs the baseline (fraction)")
+    return parser.parse_args(argv)
+
+
+async def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+
+    body = None
+    if args.body_file:
+        with open(args.body_file) as f:
+            body = json.load(f)
+
+    headers = {}
+    for header in args.header:
+        name, _, value = header.partition(":")
+        headers[name.strip()] = value.strip()
+
+    config = LoadTestConfig(
+        url=args.url,
+        method=args.method.upper(),
+        body=body,
+        headers=headers,
+        rate=args.rate,
+        duration=args.duration,
+        warmup=args.warmup,
+        timeout=args.timeout,
+        max_connections=args.max_connections,
+        expect_status=args.expect_status,
+    )
+
+    print(f"🚀 Open-loop load: {config.rate}/s for {config.duration}s against {config.url}")
+    report = await OpenLoopLoadGenerator(config).run()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    violations = check_thresholds(
+        report,
+        parse_thresholds(args.threshold),
+        max_error_rate=args.max_error_rate,
+        baseline=baseline,
+        max_regression=args.max_regression if baseline else None,
+    )
+    report["thresholds"] = {"passed": not violations, "violations": violations}
+
+    print_summary(report)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📁 Report written to {args.report}")
+
+    if violations:
+        for violation in violations:
+            print(f"❌ {violation}")
+        return 1
+
+    print("✅ All thresholds passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,131 @@
+"""
+Unit tests for the open-loop load generator
+Tests histogram accuracy, open-loop scheduling and threshold checks
+"""
+
+import asyncio
+import os
+import random
+import sys
+
+import pytest
+from aiohttp import web
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from load_generator import (
+    LatencyHistogram,
+    LoadTestConfig,
+    OpenLoopLoadGenerator,
+    check_thresholds,
+    parse_thresholds,
+    render_template,
+)
+
+
+class TestLatencyHistogram:
+    """Test cases for the HDR-style histogram"""
+
+    def test_percentiles_within_precision(self):
+        histogram = LatencyHistogram()
+        values = sorted(random.Random(7).randint(1, 10_000_000) for _ in range(20000))
+        for value in values:
+            histogram.record(value)
+
+        for percentile in (50, 90, 99):
+            exact = values[int(percentile / 100 * len(values)) - 1]
+            assert abs(histogram.percentile(percentile) - exact) / exact < 0.02
+
+        assert histogram.percentile(100) == values[-1]
+        assert histogram.total_count == len(values)
+
+    def test_small_values_are_exact(self):
+        histogram = LatencyHistogram()
+        for value in range(1, 101):
+            histogram.record(value)
+
+        assert histogram.percentile(50) == 50
+        assert histogram.min_value == 1
+
+    def test_merge(self):
+        first, second = LatencyHistogram(), LatencyHistogram()
+        first.record(1000)
+        second.record(5000)
+
+        first.merge(second)
+
+        assert first.total_count == 2
+        assert first.max_value == 5000
+
+
+class TestThresholds:
+    """Test cases for regression thresholds"""
+
+    def make_report(self, p99=100.0, error_rate=0.0, achieved_rate=10.0):
+        latency = {"p50": 10.0, "p90": 50.0, "p95": 80.0, "p99": p99, "p99.9": p99, "mean": 20.0, "max": p99}
+        return {
+            "config": {"rate": 10.0},
+            "achieved_rate": achieved_rate,
+            "requests": {"error_rate": error_rate},
+            "latency_ms": {"response_time": latency},
+        }
+
+    def test_parse_thresholds(self):
+        assert parse_thresholds(["p99=250", "mean=80.5"]) == {"p99": 250.0, "mean": 80.5}
+        with pytest.raises(ValueError):
+            parse_thresholds(["p99"])
+
+    def test_passing_run(self):
+        assert check_thresholds(self.make_report(), {"p99": 200}, max_error_rate=0.01) == []
+
+    def test_violations(self):
+        violations = check_thresholds(
+            self.make_report(p99=300, error_rate=0.05, achieved_rate=5.0),
+            {"p99": 200},
+            max_error_rate=0.01,
+        )
+        assert len(violations) == 3
+
+    def test_baseline_regression(self):
+        baseline = self.make_report(p99=100)
+        violations = check_thresholds(
+            self.make_report(p99=130), {}, baseline=baseline, max_regression=0.10
+        )
+        assert any("p99 regressed" in violation for violation in violations)
+
+
+class TestOpenLoopGenerator:
+    """Test cases for constant-arrival-rate scheduling"""
+
+    def test_render_template(self):
+        body = render_template({"id": "b-{seq}", "items": ["{seq}"], "n": 1}, 7)
+        assert body == {"id": "b-7", "items": ["7"], "n": 1}
+
+    @pytest.mark.asyncio
+    async def test_slow_responses_do_not_lower_arrival_rate(self):
+        async def slow_handler(request):
+            await asyncio.sleep(0.2)
+            return web.json_response({"ok": True})
+
+        app = web.Application()
+        app.router.add_post("/slow", slow_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        try:
+            config = LoadTestConfig(
+                url=f"http://127.0.0.1:{port}/slow", method="POST", body={"seq": "{seq}"},
+                rate=50, duration=1.0,
+            )
+            report = await OpenLoopLoadGenerator(config).run()
+        finally:
+            await runner.cleanup()
+
+        # A closed loop with one in-flight request would manage ~5/s here
+        assert report["requests"]["sent"] == 50
+        assert report["requests"]["completed"] == 50
+        assert report["achieved_rate"] > 40
+        assert report["latency_ms"]["response_time"]["p50"] >= 200
@@ -0,0 +1,62 @@
+"""
+Unit tests for the worker scaling benchmark
+Tests worker-count selection, scaling maths and closed-loop measurement
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+from aiohttp import web
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from worker_scaling import ScalingConfig, default_worker_counts, measure_throughput, scaling_rows
+
+
+class TestScalingReport:
+    """Test cases for worker counts and speedup/efficiency"""
+
+    def test_default_worker_counts(self):
+        assert default_worker_counts(1) == [1]
+        assert default_worker_counts(8) == [1, 2, 4, 8]
+        assert default_worker_counts(6) == [1, 2, 4, 6]
+
+    def test_scaling_rows(self):
+        rows = scaling_rows([
+            {"workers": 1, "throughput": 1000.0},
+            {"workers": 2, "throughput": 1900.0},
+            {"workers": 4, "throughput": 3000.0},
+        ])
+        assert [row["speedup"] for row in rows] == [1.0, 1.9, 3.0]
+        assert [row["efficiency"] for row in rows] == [1.0, 0.95, 0.75]
+
+
+class TestClosedLoop:
+    """Test cases for throughput measurement"""
+
+    @pytest.mark.asyncio
+    async def test_throughput_is_bounded_by_concurrency(self):
+        async def handler(request):
+            await asyncio.sleep(0.05)
+            return web.json_response({"ok": True})
+
+        app = web.Application()
+        app.router.add_get("/work", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        try:
+            config = ScalingConfig(url=f"http://127.0.0.1:{port}/work", concurrency=4, duration=1.0, warmup=0.2)
+            result = await measure_throughput(config)
+        finally:
+            await runner.cleanup()
+
+        # Four clients each finishing a 50ms request back to back: ~80/s
+        assert 50 < result["throughput"] <= 80
+        assert result["errors"] == 0
+        assert result["latency_ms"]["p50"] >= 50
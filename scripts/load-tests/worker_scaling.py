@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Worker scaling benchmark for the FastAPI services
+Starts a service under its gunicorn_conf.py once per worker count, saturates
+it with a fixed number of concurrent closed-loop clients, and reports
+throughput, speedup over one worker and per-worker efficiency.
+
+Closed-loop on purpose: the question is how many requests per second the
+service can complete, not what latency it shows at a chosen arrival rate
+(use load_generator.py for that).
+
+Example:
+    python scripts/load-tests/worker_scaling.py \\
+        --service-dir services/payment-service --app main:app \\
+        --path /health --workers 1,2,4,8 --duration 20 --report scaling.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from load_generator import LatencyHistogram, render_template
+
+
+@dataclass
+class ScalingConfig:
+    url: str
+    method: str = "GET"
+    body: Optional[Any] = None
+    concurrency: int = 256
+    duration: float = 20.0
+    warmup: float = 3.0
+    timeout: float = 30.0
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+def default_worker_counts(cores: Optional[int] = None) -> List[int]:
+    """Powers of two up to the core count, always ending at the core count"""
+    cores = cores or os.cpu_count() or 1
+    counts = []
+    count = 1
+    while count < cores:
+        counts.append(count)
+        count *= 2
+    counts.append(cores)
+    return counts
+
+
+async def measure_throughput(config: ScalingConfig) -> Dict[str, Any]:
+    """Run concurrency clients back to back until the deadline and count completions"""
+    histogram = LatencyHistogram()
+    counts = {"completed": 0, "errors": 0}
+    sequence = 0
+
+    connector = aiohttp.TCPConnector(limit=config.concurrency)
+    timeout = aiohttp.ClientTimeout(total=config.timeout)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        measure_from = start + config.warmup
+        deadline = measure_from + config.duration
+
+        async def client():
+            nonlocal sequence
+            while True:
+                started = time.perf_counter()
+                if started >= deadline:
+                    return
+                sequence += 1
+                body = render_template(config.body, sequence) if config.body is not None else None
+                try:
+                    async with session.request(
+                        config.method, config.url, json=body, headers=config.headers
+                    ) as response:
+                        await response.read()
+                        failed = response.status >= 500
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    failed = True
+
+                finished = time.perf_counter()
+                if started < measure_from or finished > deadline:
+                    continue
+                counts["completed"] += 1
+                counts["errors"] += failed
+                histogram.record((finished - started) * 1_000_000)
+
+        await asyncio.gather(*(client() for _ in range(config.concurrency)))
+
+    return {
+        "throughput": counts["completed"] / config.duration,
+        "completed": counts["completed"],
+        "errors": counts["errors"],
+        "latency_ms": histogram.summary_ms(),
+    }
+
+
+def scaling_rows(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Add speedup and efficiency relative to the smallest worker count"""
+    if not results:
+        return []
+    base = results[0]
+    base_per_worker = base["throughput"] / base["workers"] if base["throughput"] else 0.0
+
+    rows = []
+    for result in results:
+        speedup = result["throughput"] / base["throughput"] if base["throughput"] else 0.0
+        ideal = base_per_worker * result["workers"]
+        rows.append({
+            **result,
+            "speedup": round(speedup, 2),
+            "efficiency": round(result["throughput"] / ideal, 2) if ideal else 0.0,
+        })
+    return rows
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Service exited with code {process.returncode}")
+            try:
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=2)) as response:
+                    if response.status < 500:
+                        return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Service did not become ready at {url}")
+
+
+def start_service(service_dir: str, app: str, workers: int, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    environment = {**os.environ, **env, "WEB_CONCURRENCY": str(workers), "BIND": f"127.0.0.1:{port}"}
+    # The services import the shared package from services/, next to the service directory
+    services_dir = os.path.dirname(os.path.abspath(service_dir))
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, [services_dir, environment.get("PYTHONPATH")]))
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", app],
+        cwd=service_dir,
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def stop_service(process: subprocess.Popen, timeout: float = 30.0):
+    """SIGTERM lets workers drain, the same path a deploy takes"""
+    process.terminate()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def print_table(rows: List[Dict[str, Any]]):
+    print(f"\n{'='*72}")
+    print(f"{'workers':>8} {'req/s':>12} {'speedup':>9} {'efficiency':>11} {'p50 ms':>9} {'p99 ms':>9} {'errors':>8}")
+    print(f"{'-'*72}")
+    for row in rows:
+        latency = row["latency_ms"]
+        print(
+            f"{row['workers']:>8} {row['throughput']:>12.1f} {row['speedup']:>9.2f} "
+            f"{row['efficiency']:>11.2f} {latency['p50']:>9.1f} {latency['p99']:>9.1f} {row['errors']:>8}"
+        )
+    print(f"{'='*72}\n")
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measure throughput scaling with gunicorn worker count")
+    parser.add_argument("--service-dir", required=True, help="Directory containing gunicorn_conf.py")
+    parser.add_argument("--app", required=True, help="ASGI app, e.g. main:app or app.main:app")
+    parser.add_argument("--path", default="/health", help="Request path to benchmark")
+    parser.add_argument("--ready-path", default="/health", help="Path polled until the service is up")
+    parser.add_argument("--method", default="GET", help="HTTP method")
+    parser.add_argument("--body-file", help="JSON request body; {uuid} and {seq} are substituted")
+    parser.add_argument("--workers", help="Comma-separated worker counts (default: powers of two up to cores)")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--concurrency", type=int, default=256, help="Concurrent closed-loop clients")
+    parser.add_argument("--duration", type=float, default=20.0, help="Measured seconds per worker count")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds per worker count")
+    parser.add_argument("--env", action="append", default=[], help="Extra service env as NAME=VALUE")
+    parser.add_argument("--report", help="Write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+async def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+
+    body = None
+    if args.body_file:
+        with open(args.body_file) as f:
+            body = json.load(f)
+
+    env = {}
+    for value in args.env:
+        name, _, setting = value.partition("=")
+        env[name] = setting
+
+    worker_counts = [int(count) for count in args.workers.split(",")] if args.workers else default_worker_counts()
+    base_url = f"http://127.0.0.1:{args.port}"
+    config = ScalingConfig(
+        url=f"{base_url}{args.path}",
+        method=args.method.upper(),
+        body=body,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        warmup=args.warmup,
+    )
+
+    results = []
+    for workers in worker_counts:
+        print(f"🚀 {workers} worker(s): {config.concurrency} clients for {config.duration}s against {config.url}")
+        process = start_service(args.service_dir, args.app, workers, args.port, env)
+        try:
+            await wait_until_ready(f"{base_url}{args.ready_path}", process)
+            results.append({"workers": workers, **await measure_throughput(config)})
+        finally:
+            stop_service(process)
+
+    rows = scaling_rows(results)
+    print_table(rows)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"cores": os.cpu_count(), "config": vars(args), "results": rows}, f, indent=2)
+        print(f"📁 Report written to {args.report}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -7,6 +7,8 @@ from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from pymongo.errors import ConnectionFailure
 import logging
 
+from shared.mongo_config import mongo_client_kwargs, warm_up_pool, write_concern
+
 # Setup logging
 logger = logging.getLogger(__name__)
 
@@ -26,12 +28,15 @@ async def connect_to_mongo():
     )
     
     try:
-        client = AsyncIOMotorClient(mongo_url)
+        client = AsyncIOMotorClient(mongo_url, **mongo_client_kwargs())
         
         # Test the connection
         await client.admin.command('ping')
         
-        database = client.movie_booking
+        # Bookings hold seats and money: acknowledge writes once a majority has them
+        database = client.get_database("movie_booking", write_concern=write_concern("critical"))
+        
+        await warm_up_pool(client)
         
         # Create indexes for better performance
         await create_indexes()
@@ -86,4 +91,8 @@ async def create_indexes():
     # Compound index for user + status queries
     await bookings_collection.create_index([("user_id", 1), ("status", 1)])
     
+    # Indexes for the deferred payment capture loop
+    await bookings_collection.create_index([("payment_status", 1), ("confirmed_at", 1)])
+    await bookings_collection.create_index("payment_transaction_id")
+    
     print("✅ Database indexes created")
\ No newline at end of file
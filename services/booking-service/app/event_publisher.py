@@ -12,6 +12,8 @@ import aio_pika
 from aio_pika import connect_robust, Message, DeliveryMode
 import logging
 
+from shared.event_priorities import event_priority
+
 # Setup logging
 logger = logging.getLogger(__name__)
 
@@ -67,6 +69,7 @@ class EventPublisher:
         seats: List[str],
         total_amount: float,
         cinema_name: Optional[str] = None,
+        priority: Optional[int] = None,
         **event_data
     ):
         """
@@ -82,6 +85,7 @@ class EventPublisher:
             seats: List of seat numbers
             total_amount: Total booking amount
             cinema_name: Name of the cinema
+            priority: Message priority 0-9 (defaults to the event type's priority)
             **event_data: Additional event data
         """
         if not self.channel or self.channel.is_closed:
@@ -111,7 +115,8 @@ class EventPublisher:
                 json.dumps(event_payload).encode(),
                 delivery_mode=DeliveryMode.PERSISTENT,
                 content_type='application/json',
-                timestamp=datetime.now(timezone.utc)
+                timestamp=datetime.now(timezone.utc),
+                priority=priority if priority is not None else event_priority(event_type)
             )
             
             # Publish event using the event type as routing key
@@ -147,5 +152,6 @@ BOOKING EVENTS (routing keys):
 PAYMENT EVENTS (published by payment service, consumed by notification service):
 - payment.success: When payment is successful
 - payment.failed: When payment fails
-- payment.refund: When refund is completed
+- payment.refunded: When refund is completed
+- payment.voided: When an authorization is released
 """
\ No newline at end of file
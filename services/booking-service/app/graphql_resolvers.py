@@ -11,11 +11,13 @@ from typing import List, Optional
 import strawberry
 from strawberry.types import Info
 
+from .config import config
 from .models import Booking, BookingStatus, SeatInfo
 from .grpc_client import CinemaServiceClient
-from .rest_client import UserServiceClient, PaymentServiceClient
+from .rest_client import PAYMENT_PENDING, SETTLED_PAYMENT_FAILURES, UserServiceClient, PaymentServiceClient
 from .event_publisher import EventPublisher
 from .database import get_database
+from .payment_capture import AUTHORIZED
 
 
 @strawberry.type
@@ -273,9 +275,27 @@ class Mutation:
             cinema_client = CinemaServiceClient()
             showtime_details = await cinema_client.get_showtime_details(booking_doc["showtime_id"])
 
-            # Process payment via REST API call to payment-service
+            # Process payment via REST API call to payment-service. In the
+            # two-phase flow this only authorizes, so seats are confirmed
+            # without waiting for capture; payment_capture captures in batches.
             payment_client = PaymentServiceClient()
-            payment_result = await payment_client.process_payment(
+
+            # An earlier attempt whose outcome the gateway never reported may
+            # still have charged the card; pay again only once it has failed
+            pending_transaction_id = booking_doc.get("payment_transaction_id")
+            if pending_transaction_id:
+                previous = await payment_client.get_payment_status(pending_transaction_id)
+                if previous.get("status") not in SETTLED_PAYMENT_FAILURES:
+                    return CreateBookingResponse(
+                        success=False,
+                        booking=None,
+                        message="A previous payment for this booking is still being confirmed",
+                        lock_id=None
+                    )
+
+            two_phase = config.is_two_phase_payment()
+            charge = payment_client.authorize_payment if two_phase else payment_client.process_payment
+            payment_result = await charge(
                 user_id=booking_doc["user_id"],
                 booking_id=booking_id,
                 amount=booking_doc["total_amount"],
@@ -283,6 +303,22 @@ class Mutation:
                 card_details=None  # Using default test card details
             )
 
+            if payment_result.get("status") == PAYMENT_PENDING:
+                # Not a failure: the payment service is reconciling it with the gateway
+                await db.bookings.update_one(
+                    {"_id": booking_id},
+                    {"$set": {
+                        "payment_transaction_id": payment_result["transaction_id"],
+                        "updated_at": datetime.utcnow()
+                    }}
+                )
+                return CreateBookingResponse(
+                    success=False,
+                    booking=None,
+                    message=f"Payment pending: {payment_result['message']}",
+                    lock_id=None
+                )
+
             if not payment_result["success"]:
                 return CreateBookingResponse(
                     success=False,
@@ -298,6 +334,18 @@ class Mutation:
                 user_id=booking_doc["user_id"]
             )
 
+            if not confirm_result.success and two_phase:
+                # Nothing was charged yet: release the authorization
+                await self._handle_authorization_seat_confirmation_failure(
+                    booking_id, payment_result["transaction_id"]
+                )
+                return CreateBookingResponse(
+                    success=False,
+                    booking=None,
+                    message="Seat confirmation failed. Payment authorization released.",
+                    lock_id=None
+                )
+
             if not confirm_result.success:
                 # Payment succeeded but seat confirmation failed
                 # This should trigger a refund process
@@ -312,16 +360,17 @@ class Mutation:
                 )
 
             # Update booking status to confirmed
+            confirmation = {
+                "status": BookingStatus.CONFIRMED.value,
+                "payment_transaction_id": payment_result["transaction_id"],
+                "confirmed_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow()
+            }
+            if two_phase:
+                confirmation["payment_status"] = AUTHORIZED
             updated_booking = await db.bookings.find_one_and_update(
                 {"_id": booking_id},
-                {
-                    "$set": {
-                        "status": BookingStatus.CONFIRMED.value,
-                        "payment_transaction_id": payment_result["transaction_id"],
-                        "confirmed_at": datetime.utcnow(),
-                        "updated_at": datetime.utcnow()
-                    }
-                },
+                {"$set": confirmation},
                 return_document=True
             )
 
@@ -365,6 +414,29 @@ class Mutation:
                 lock_id=None
             )
 
+    async def _handle_authorization_seat_confirmation_failure(self, booking_id: str, transaction_id: str):
+        """Void the authorization and cancel the booking when seats could not be confirmed"""
+        payment_client = PaymentServiceClient()
+        void_result = await payment_client.void_payment(
+            transaction_id, "Seat confirmation failed after authorization"
+        )
+        if not void_result["success"]:
+            # The payment service voids stale authorizations on its own
+            print(f"Failed to void authorization {transaction_id}: {void_result['message']}")
+
+        db = await get_database()
+        await db.bookings.update_one(
+            {"_id": booking_id},
+            {
+                "$set": {
+                    "status": BookingStatus.CANCELLED.value,
+                    "cancelled_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow(),
+                    "cancellation_reason": "Seat confirmation failed after authorization"
+                }
+            }
+        )
+
     async def _handle_payment_seat_confirmation_failure(self, booking_id: str, transaction_id: str, user_email: str):
         """Handle the edge case where payment succeeds but seat confirmation fails"""
         # This should trigger a refund process and proper error handling
@@ -7,6 +7,7 @@ This service orchestrates the booking workflow using multiple communication patt
 - RabbitMQ for event publishing
 """
 
+import asyncio
 import os
 from contextlib import asynccontextmanager
 
@@ -14,15 +15,29 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from strawberry.fastapi import GraphQLRouter
 
+from .config import config
 from .graphql_resolvers import schema
-from .database import connect_to_mongo, close_mongo_connection
+from .database import connect_to_mongo, close_mongo_connection, get_database
 from .event_publisher import EventPublisher
+from .rate_limiter import (
+    RateLimitMiddleware,
+    RateLimitPolicy,
+    RateLimiter,
+    client_key,
+    graphql_argument_key,
+    trusted_proxies,
+)
+from .payment_capture import run_capture_loop
+from .redis_client import close_redis
+from .rest_client import close_http_client
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
     event_publisher = None
+    capture_task = None
+    proxies_task = None
     try:
         # Startup
         await connect_to_mongo()
@@ -36,13 +51,25 @@ async def lifespan(app: FastAPI):
         # Store event publisher in app state
         app.state.event_publisher = event_publisher
         
+        # Resolve trusted proxy hostnames off the request path
+        proxies_task = await trusted_proxies.start()
+
+        # Capture authorized payments of confirmed bookings in batches
+        if config.is_two_phase_payment():
+            capture_task = asyncio.create_task(run_capture_loop(get_database, event_publisher))
+        
         yield
         
     finally:
         # Shutdown
+        for task in (capture_task, proxies_task):
+            if task:
+                task.cancel()
         await close_mongo_connection()
         if event_publisher:
             await event_publisher.close()
+        await close_redis()
+        await close_http_client()
         print("✅ Disconnected from databases")
 
 
@@ -63,6 +90,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Rate limiting: throttle abusive clients, users and hot showtimes before
+# resolvers touch MongoDB or the cinema service
+rate_limiter = RateLimiter()
+graphql_policies = [
+    RateLimitPolicy.from_spec("graphql-client", config.RATE_LIMIT_GRAPHQL_CLIENT, client_key),
+    RateLimitPolicy.from_spec(
+        "graphql-user", config.RATE_LIMIT_GRAPHQL_USER, graphql_argument_key("userId"), needs_body=True
+    ),
+    RateLimitPolicy.from_spec(
+        "showtime", config.RATE_LIMIT_SHOWTIME, graphql_argument_key("showtimeId"), needs_body=True
+    ),
+]
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    routes={("POST", "/graphql"): graphql_policies},
+)
+
 # GraphQL router
 graphql_app = GraphQLRouter(schema)
 app.include_router(graphql_app, prefix="/graphql")
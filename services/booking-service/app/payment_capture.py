@@ -0,0 +1,178 @@
+"""
+Deferred payment capture for Booking Service
+With PAYMENT_FLOW=two_phase a booking is confirmed as soon as its payment is
+authorized. This loop then captures confirmed bookings' authorizations in
+batches through the payment service's batch capture endpoint.
+
+Capture state lives on the booking document (payment_status "authorized" ->
+"captured" or "capture_failed"), so pending captures survive restarts. Every
+worker runs the loop, but only the one holding the payment-capture lease
+(shared/leases.py) captures, so each booking is sent to the payment service
+once rather than once per worker.
+
+A booking whose capture fails was never paid for: it is cancelled, its
+authorization voided, its seats released and the user notified. The payment
+service voids authorizations older than its AUTHORIZATION_TTL_SECONDS, so each
+pass also alerts when the oldest uncaptured booking is older than
+PAYMENT_CAPTURE_ALERT_AGE, before the backlog turns into voided payments.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from shared.leases import LEASES_COLLECTION, lease_owner, take_lease
+
+from .config import config
+from .event_publisher import EventPublisher
+from .grpc_client import CinemaServiceClient
+from .models import BookingStatus
+from .rest_client import PaymentServiceClient
+
+logger = logging.getLogger(__name__)
+
+AUTHORIZED = "authorized"
+CAPTURED = "captured"
+CAPTURE_FAILED = "capture_failed"
+
+PAYMENT_CAPTURE_LEASE = "payment-capture"
+
+
+async def cancel_uncaptured_booking(
+    db,
+    booking: Dict[str, Any],
+    reason: str,
+    payment_client: PaymentServiceClient,
+    event_publisher: Optional[EventPublisher] = None
+) -> bool:
+    """Cancel a confirmed booking whose payment could not be captured"""
+    transaction_id = booking["payment_transaction_id"]
+    now = datetime.utcnow()
+    result = await db.bookings.update_one(
+        {"payment_transaction_id": transaction_id, "payment_status": AUTHORIZED},
+        {"$set": {
+            "status": BookingStatus.CANCELLED.value,
+            "payment_status": CAPTURE_FAILED,
+            "capture_failure_reason": reason,
+            "cancellation_reason": f"Payment capture failed: {reason}",
+            "cancelled_at": now,
+            "updated_at": now
+        }}
+    )
+    if result.modified_count == 0:
+        # Another worker already handled it
+        return False
+
+    logger.error(f"Booking {booking['_id']} cancelled: payment {transaction_id} could not be captured ({reason})")
+
+    # Usually already voided by the payment service; otherwise release the hold now
+    void_result = await payment_client.void_payment(transaction_id, "Payment capture failed")
+    if not void_result["success"]:
+        print(f"❌ Failed to void authorization {transaction_id}: {void_result['message']}")
+
+    if booking.get("lock_id") and not await CinemaServiceClient().release_seat_lock(booking["lock_id"]):
+        logger.error(f"Seats of cancelled booking {booking['_id']} could not be released")
+
+    if event_publisher:
+        await event_publisher.publish_booking_event(
+            event_type="booking.cancelled",
+            booking_id=booking["_id"],
+            user_email="",
+            user_id=booking.get("user_id", ""),
+            movie_title="",
+            showtime="",
+            seats=booking.get("seats", []),
+            total_amount=booking.get("total_amount", 0.0),
+            transaction_id=transaction_id,
+            reason="Payment could not be completed"
+        )
+    return True
+
+
+def check_backlog_age(oldest_confirmed_at: datetime, max_age: float = config.PAYMENT_CAPTURE_ALERT_AGE) -> float:
+    """Seconds the oldest uncaptured booking has waited; alerts past max_age"""
+    age = (datetime.utcnow() - oldest_confirmed_at).total_seconds()
+    if age > max_age:
+        logger.error(
+            f"Payment capture backlog is {age:.0f}s old (alert at {max_age:.0f}s); "
+            f"authorizations left uncaptured are voided by the payment service"
+        )
+    return age
+
+
+async def capture_authorized_bookings(
+    db,
+    payment_client: PaymentServiceClient,
+    batch_size: int = config.PAYMENT_CAPTURE_BATCH_SIZE,
+    event_publisher: Optional[EventPublisher] = None
+) -> Dict[str, Any]:
+    """Capture the oldest batch of confirmed-but-uncaptured bookings"""
+    cursor = db.bookings.find(
+        {"payment_status": AUTHORIZED},
+        {"payment_transaction_id": 1, "confirmed_at": 1, "lock_id": 1, "user_id": 1, "seats": 1, "total_amount": 1}
+    ).sort("confirmed_at", 1).limit(batch_size)
+    bookings = await cursor.to_list(length=batch_size)
+
+    if not bookings:
+        return {"captured": 0, "failed": 0, "backlog_age": 0.0}
+
+    # Checked before capturing so the alert still fires while the payment service is down
+    backlog_age = check_backlog_age(bookings[0]["confirmed_at"])
+
+    transaction_ids = [booking["payment_transaction_id"] for booking in bookings]
+    result = await payment_client.capture_payments(transaction_ids)
+
+    if not result["success"]:
+        # Nothing changed; the same bookings are retried on the next pass
+        print(f"❌ Payment capture batch failed: {result['message']}")
+        return {"captured": 0, "failed": 0, "backlog_age": backlog_age}
+
+    captured = [item["transaction_id"] for item in result["results"] if item["success"]]
+    failed = [item for item in result["results"] if not item["success"]]
+    now = datetime.utcnow()
+
+    if captured:
+        await db.bookings.update_many(
+            {"payment_transaction_id": {"$in": captured}, "payment_status": AUTHORIZED},
+            {"$set": {"payment_status": CAPTURED, "payment_captured_at": now, "updated_at": now}}
+        )
+
+    by_transaction = {booking["payment_transaction_id"]: booking for booking in bookings}
+    for item in failed:
+        # Typically voided after AUTHORIZATION_TTL_SECONDS: the booking was never paid for
+        await cancel_uncaptured_booking(
+            db, by_transaction[item["transaction_id"]], item["message"], payment_client, event_publisher
+        )
+
+    return {"captured": len(captured), "failed": len(failed), "backlog_age": backlog_age}
+
+
+async def run_capture_loop(
+    get_db,
+    event_publisher: Optional[EventPublisher] = None,
+    interval: float = config.PAYMENT_CAPTURE_INTERVAL
+):
+    """
+    Capture authorized bookings every interval seconds until cancelled
+    Only the worker holding the capture lease captures; another takes over
+    once the holder misses three intervals.
+    """
+    payment_client = PaymentServiceClient()
+    owner = lease_owner()
+    lease = timedelta(seconds=interval * 3)
+    while True:
+        try:
+            db = await get_db()
+            if not await take_lease(db[LEASES_COLLECTION], PAYMENT_CAPTURE_LEASE, owner, lease):
+                await asyncio.sleep(interval)
+                continue
+            counts = await capture_authorized_bookings(db, payment_client, event_publisher=event_publisher)
+            if counts["captured"] or counts["failed"]:
+                print(f"✅ Captured {counts['captured']} payments ({counts['failed']} failed)")
+                # A full batch likely means more are waiting
+                if counts["captured"] + counts["failed"] >= config.PAYMENT_CAPTURE_BATCH_SIZE:
+                    continue
+        except Exception as e:
+            print(f"❌ Payment capture loop error: {e}")
+        await asyncio.sleep(interval)
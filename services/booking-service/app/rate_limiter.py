@@ -0,0 +1,132 @@
+"""
+Token-bucket rate limiting for Booking Service
+The buckets, key functions and middleware live in shared/rate_limiter.py;
+this module binds them to the booking Redis client and settings and adds
+keys taken from GraphQL requests.
+"""
+
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from graphql import GraphQLError, parse
+from graphql.language import (
+    DocumentNode,
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    InlineFragmentNode,
+    OperationDefinitionNode,
+    OperationType,
+    VariableNode,
+)
+from shared.rate_limiter import (
+    KeyFunc,
+    LocalTokenBuckets,
+    RateLimitMiddleware,
+    RateLimitPolicy,
+    RateLimitRequest,
+    RateLimitResult,
+    RateLimiter as SharedRateLimiter,
+    TrustedProxies,
+    body_field_key,
+    build_result,
+    client_key_for,
+    rate_limit_headers,
+)
+
+from .config import config
+from .redis_client import get_redis
+
+# Hostnames among them are resolved at startup (see main.lifespan), not per request
+trusted_proxies = TrustedProxies.from_spec(config.RATE_LIMIT_TRUSTED_PROXIES)
+client_key = client_key_for(trusted_proxies)
+
+
+class RateLimiter(SharedRateLimiter):
+    """Booking buckets in the service's Redis"""
+
+    def __init__(
+        self,
+        redis_getter: Callable = get_redis,
+        key_prefix: str = "booking:ratelimit:",
+        local: Optional[LocalTokenBuckets] = None,
+        enabled: bool = config.RATE_LIMIT_ENABLED,
+    ):
+        super().__init__(
+            redis_getter, key_prefix, local or LocalTokenBuckets(config.RATE_LIMIT_LOCAL_MAX_KEYS), enabled
+        )
+
+
+@lru_cache(maxsize=256)
+def _parse(query: str) -> Optional[DocumentNode]:
+    try:
+        return parse(query)
+    except GraphQLError:
+        # The GraphQL endpoint rejects it without running anything
+        return None
+
+
+def selected_operation(body: Dict[str, Any]) -> Optional[OperationDefinitionNode]:
+    """The operation a GraphQL request runs, chosen by operationName as the server does"""
+    query = body.get("query")
+    document = _parse(query) if isinstance(query, str) else None
+    if document is None:
+        return None
+
+    operations = [node for node in document.definitions if isinstance(node, OperationDefinitionNode)]
+    name = body.get("operationName")
+    if name:
+        return next((node for node in operations if node.name and node.name.value == name), None)
+    return operations[0] if len(operations) == 1 else None
+
+
+def _fields(selections: Iterable[Any], fragments: Dict[str, FragmentDefinitionNode], seen: set):
+    """Every field in a selection set, following inline fragments and fragment spreads"""
+    for selection in selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+            if selection.selection_set:
+                yield from _fields(selection.selection_set.selections, fragments, seen)
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _fields(selection.selection_set.selections, fragments, seen)
+        elif isinstance(selection, FragmentSpreadNode) and selection.name.value not in seen:
+            seen.add(selection.name.value)
+            fragment = fragments.get(selection.name.value)
+            if fragment:
+                yield from _fields(fragment.selection_set.selections, fragments, seen)
+
+
+def graphql_argument_key(argument: str, mutations_only: bool = True) -> KeyFunc:
+    """
+    Key on a GraphQL argument, given as a variable or an inline literal
+    e.g. graphql_argument_key("showtimeId") throttles createBooking per showtime.
+    The query is parsed, so the operation type and argument come from the
+    operation that actually runs, not from the text before it.
+    """
+    def key_func(request: RateLimitRequest) -> Optional[str]:
+        if not isinstance(request.body, dict):
+            return None
+
+        operation = selected_operation(request.body)
+        if operation is None:
+            return None
+        if mutations_only and operation.operation != OperationType.MUTATION:
+            return None
+
+        document = _parse(request.body["query"])
+        fragments = {
+            node.name.value: node for node in document.definitions if isinstance(node, FragmentDefinitionNode)
+        }
+        variables = request.body.get("variables") or {}
+        for field in _fields(operation.selection_set.selections, fragments, set()):
+            for node in field.arguments or ():
+                if node.name.value != argument:
+                    continue
+                if isinstance(node.value, VariableNode):
+                    value = variables.get(node.value.name.value) if isinstance(variables, dict) else None
+                else:
+                    value = getattr(node.value, "value", None)
+                if value:
+                    return str(value)
+        return None
+    return key_func
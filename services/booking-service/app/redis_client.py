@@ -0,0 +1,39 @@
+"""
+Shared Redis connection for Booking Service
+Redis is optional: rate limiting falls back to in-process buckets when
+REDIS_URL is unset
+"""
+
+import logging
+from typing import Optional
+
+import redis.asyncio as redis
+
+from .config import config
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
+
+
+def get_redis() -> Optional[redis.Redis]:
+    """Return the process-wide Redis client, or None when Redis is not configured"""
+    global _redis_client
+
+    if not config.REDIS_URL:
+        return None
+
+    if _redis_client is None:
+        _redis_client = redis.from_url(config.REDIS_URL)
+        logger.info(f"Redis client created for {config.REDIS_URL}")
+
+    return _redis_client
+
+
+async def close_redis():
+    """Close the Redis client on shutdown"""
+    global _redis_client
+
+    if _redis_client is not None:
+        await _redis_client.close()
+        _redis_client = None
@@ -5,10 +5,39 @@ This demonstrates HTTP-based microservice communication
 
 import os
 import httpx
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
+from .config import config
 from .models import User, PaymentResponse
 
+# One pooled client per worker process, created lazily on that worker's
+# event loop so keep-alive connections are reused across requests
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide HTTP client for service-to-service calls"""
+    global _http_client
+
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.API_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=config.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """Close the HTTP client on shutdown"""
+    global _http_client
+
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 
 class UserServiceClient:
     """
@@ -23,23 +52,23 @@ class UserServiceClient:
     async def get_user(self, user_id: str) -> Optional[User]:
         """Get user details from user service"""
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(f"{self.base_url}/api/v1/users/{user_id}")
+            client = get_http_client()
+            response = await client.get(f"{self.base_url}/api/v1/users/{user_id}", timeout=self.timeout)
                 
-                if response.status_code == 200:
-                    user_data = response.json()
-                    return User(
-                        id=user_data["id"],
-                        email=user_data["email"],
-                        first_name=user_data.get("first_name", ""),
-                        last_name=user_data.get("last_name", ""),
-                        phone=user_data.get("phone")
-                    )
-                elif response.status_code == 404:
-                    return None
-                else:
-                    print(f"Error getting user {user_id}: {response.status_code}")
-                    return None
+            if response.status_code == 200:
+                user_data = response.json()
+                return User(
+                    id=user_data["id"],
+                    email=user_data["email"],
+                    first_name=user_data.get("first_name", ""),
+                    last_name=user_data.get("last_name", ""),
+                    phone=user_data.get("phone")
+                )
+            elif response.status_code == 404:
+                return None
+            else:
+                print(f"Error getting user {user_id}: {response.status_code}")
+                return None
                     
         except httpx.TimeoutException:
             print(f"Timeout getting user {user_id}")
@@ -57,6 +86,12 @@ class UserServiceClient:
         return user is not None
 
 
+# Payment status for a charge the gateway may have taken without answering;
+# the payment service reconciles it and it ends up "failed" (or "success")
+PAYMENT_PENDING = "pending"
+SETTLED_PAYMENT_FAILURES = ("failed", "voided")
+
+
 class PaymentServiceClient:
     """
     HTTP client for payment service communication
@@ -66,6 +101,15 @@ class PaymentServiceClient:
     def __init__(self):
         self.base_url = os.getenv("PAYMENT_SERVICE_REST_URL", "http://localhost:8003")
         self.timeout = httpx.Timeout(30.0)
+
+    @staticmethod
+    def identity_headers(user_id: Optional[str] = None) -> Dict[str, str]:
+        """
+        Caller identity for the payment service's rate limiter, which trusts it
+        from booking-service (RATE_LIMIT_TRUSTED_PROXIES). Without it every
+        booking shares the booking service's IP bucket.
+        """
+        return {"x-user-id": user_id} if user_id else {"x-consumer-id": "booking-service"}
     
     async def process_payment(
         self, 
@@ -94,25 +138,28 @@ class PaymentServiceClient:
                 }
             }
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.base_url}/payment/process",
-                    json=payment_data
-                )
+            client = get_http_client()
+            response = await client.post(
+                f"{self.base_url}/payment/process",
+                json=payment_data,
+                headers=self.identity_headers(user_id),
+                timeout=self.timeout
+            )
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    return {
-                        "success": True,
-                        "transaction_id": result.get("transaction_id"),
-                        "message": result.get("message", "Payment processed successfully")
-                    }
-                else:
-                    error_data = response.json() if response.headers.get("content-type") == "application/json" else {}
-                    return {
-                        "success": False,
-                        "message": error_data.get("message", f"Payment failed with status {response.status_code}")
-                    }
+            if response.status_code == 200:
+                result = response.json()
+                return {
+                    "success": result.get("success", True),
+                    "transaction_id": result.get("transaction_id"),
+                    "message": result.get("message", "Payment processed successfully"),
+                    "status": result.get("status")
+                }
+            else:
+                error_data = response.json() if response.headers.get("content-type") == "application/json" else {}
+                return {
+                    "success": False,
+                    "message": error_data.get("message", f"Payment failed with status {response.status_code}")
+                }
                     
         except httpx.TimeoutException:
             return {
@@ -130,6 +177,126 @@ class PaymentServiceClient:
                 "message": f"Payment processing error: {str(e)}"
             }
     
+    async def authorize_payment(
+        self,
+        user_id: str,
+        booking_id: str,
+        amount: float,
+        payment_method: str = "credit_card",
+        card_details: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Authorize (reserve) a payment without capturing it
+        Returns the authorization's transaction ID for a later capture or void
+        """
+        try:
+            payment_data = {
+                "user_id": user_id,
+                "booking_id": booking_id,
+                "amount": amount,
+                "payment_method": payment_method,
+                "payment_details": card_details or {
+                    "card_number": "4111111111111111",
+                    "expiry_month": "12",
+                    "expiry_year": "2025",
+                    "cvv": "123",
+                    "cardholder_name": "Test User"
+                }
+            }
+            
+            client = get_http_client()
+            response = await client.post(
+                f"{self.base_url}/payments/authorize",
+                json=payment_data,
+                headers=self.identity_headers(user_id),
+                timeout=self.timeout
+            )
+            
+            if response.status_code == 200:
+                result = response.json()
+                return {
+                    "success": result.get("success", False),
+                    "transaction_id": result.get("transaction_id"),
+                    "message": result.get("message", "Payment authorized"),
+                    "status": result.get("status")
+                }
+            else:
+                error_data = response.json() if response.headers.get("content-type") == "application/json" else {}
+                return {
+                    "success": False,
+                    "message": error_data.get("detail", f"Authorization failed with status {response.status_code}")
+                }
+                    
+        except httpx.TimeoutException:
+            return {
+                "success": False,
+                "message": "Payment authorization timeout"
+            }
+        except httpx.RequestError as e:
+            return {
+                "success": False,
+                "message": f"Payment request error: {str(e)}"
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "message": f"Payment authorization error: {str(e)}"
+            }
+    
+    async def capture_payments(self, transaction_ids: List[str]) -> Dict[str, Any]:
+        """
+        Capture many authorizations in one call
+        Returns per-transaction results; capturing twice is reported as success
+        """
+        try:
+            client = get_http_client()
+            response = await client.post(
+                f"{self.base_url}/payments/capture/batch",
+                json={"transaction_ids": transaction_ids},
+                headers=self.identity_headers(),
+                timeout=self.timeout
+            )
+            
+            if response.status_code == 200:
+                return {"success": True, "results": response.json()["results"]}
+            else:
+                return {
+                    "success": False,
+                    "message": f"Capture failed with status {response.status_code}"
+                }
+                    
+        except Exception as e:
+            return {
+                "success": False,
+                "message": f"Capture processing error: {str(e)}"
+            }
+    
+    async def void_payment(self, transaction_id: str, reason: str) -> Dict[str, Any]:
+        """Release an authorization that will not be captured"""
+        try:
+            client = get_http_client()
+            response = await client.post(
+                f"{self.base_url}/payments/{transaction_id}/void",
+                params={"reason": reason},
+                headers=self.identity_headers(),
+                timeout=self.timeout
+            )
+            
+            if response.status_code == 200:
+                return {"success": True, "message": response.json().get("message", "Payment voided")}
+            else:
+                error_data = response.json() if response.headers.get("content-type") == "application/json" else {}
+                return {
+                    "success": False,
+                    "message": error_data.get("detail", f"Void failed with status {response.status_code}")
+                }
+                    
+        except Exception as e:
+            return {
+                "success": False,
+                "message": f"Void processing error: {str(e)}"
+            }
+    
     async def initiate_refund(
         self, 
         booking_id: str,
@@ -150,25 +317,27 @@ class PaymentServiceClient:
                 "user_id": user_id
             }
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.base_url}/payment/refund",
-                    json=refund_data
-                )
+            client = get_http_client()
+            response = await client.post(
+                f"{self.base_url}/payment/refund",
+                json=refund_data,
+                headers=self.identity_headers(user_id),
+                timeout=self.timeout
+            )
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    return {
-                        "success": True,
-                        "refund_id": result.get("refund_id"),
-                        "message": result.get("message", "Refund initiated successfully")
-                    }
-                else:
-                    error_data = response.json() if response.headers.get("content-type") == "application/json" else {}
-                    return {
-                        "success": False,
-                        "message": error_data.get("message", f"Refund failed with status {response.status_code}")
-                    }
+            if response.status_code == 200:
+                result = response.json()
+                return {
+                    "success": True,
+                    "refund_id": result.get("refund_id"),
+                    "message": result.get("message", "Refund initiated successfully")
+                }
+            else:
+                error_data = response.json() if response.headers.get("content-type") == "application/json" else {}
+                return {
+                    "success": False,
+                    "message": error_data.get("message", f"Refund failed with status {response.status_code}")
+                }
                     
         except Exception as e:
             return {
@@ -179,16 +348,16 @@ class PaymentServiceClient:
     async def get_payment_status(self, transaction_id: str) -> Dict[str, Any]:
         """Get payment status from payment service"""
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(f"{self.base_url}/payment/status/{transaction_id}")
+            client = get_http_client()
+            response = await client.get(f"{self.base_url}/payment/status/{transaction_id}", timeout=self.timeout)
                 
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    return {
-                        "success": False,
-                        "message": f"Failed to get payment status: {response.status_code}"
-                    }
+            if response.status_code == 200:
+                return response.json()
+            else:
+                return {
+                    "success": False,
+                    "message": f"Failed to get payment status: {response.status_code}"
+                }
                     
         except Exception as e:
             return {
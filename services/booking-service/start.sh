@@ -55,5 +55,6 @@ echo "📡 GraphQL endpoint will be available at: http://localhost:8000/graphql"
 echo "🏥 Health check endpoint: http://localhost:8000/health"
 echo ""
 
-# Start the service
+# Start the service (services/ on the path for the shared package)
+export PYTHONPATH="$(cd "$(dirname "$0")/.." && pwd)${PYTHONPATH:+:$PYTHONPATH}"
 exec uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload
\ No newline at end of file
@@ -2,6 +2,12 @@
 Test configuration and fixtures for booking service tests
 """
 
+import sys
+from pathlib import Path
+
+# The shared package lives in services/, as it does next to the code in the image
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
 import pytest
 import asyncio
 from unittest.mock import AsyncMock, MagicMock, patch
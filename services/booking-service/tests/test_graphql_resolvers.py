@@ -3,7 +3,7 @@ Integration tests for GraphQL resolvers
 """
 
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import datetime, timezone
 
 from app.graphql_resolvers import Query, Mutation
@@ -173,4 +173,49 @@ class TestGraphQLMutationFunctions:
         
         assert result.success is False
         assert result.booking is None
-        assert "User not found" in result.message
\ No newline at end of file
+        assert "User not found" in result.message
+    @pytest.mark.asyncio
+    async def test_pending_payment_keeps_booking_waiting(self, mock_database):
+        """A payment with an unknown gateway outcome neither confirms nor fails the booking"""
+        mutation = Mutation()
+        booking_doc = {
+            "_id": "booking_123",
+            "user_id": "user_123",
+            "showtime_id": "showtime_456",
+            "total_amount": 31.98,
+            "status": BookingStatus.PENDING_PAYMENT.value,
+        }
+        mock_database.bookings.find_one.return_value = booking_doc
+
+        with patch('app.graphql_resolvers.UserServiceClient') as mock_user_client_class, \
+             patch('app.graphql_resolvers.CinemaServiceClient') as mock_cinema_client_class, \
+             patch('app.graphql_resolvers.PaymentServiceClient') as mock_payment_client_class, \
+             patch('app.graphql_resolvers.config.is_two_phase_payment', return_value=False), \
+             patch('app.graphql_resolvers.get_database', return_value=mock_database):
+            mock_user_client_class.return_value = AsyncMock(get_user=AsyncMock(return_value=MagicMock(email="test@example.com")))
+            mock_cinema_client = AsyncMock()
+            mock_cinema_client_class.return_value = mock_cinema_client
+            mock_payment_client = AsyncMock()
+            mock_payment_client.process_payment.return_value = {
+                "success": False,
+                "transaction_id": "txn_pending",
+                "message": "Payment outcome unknown; it is being confirmed with the gateway",
+                "status": "pending"
+            }
+            mock_payment_client_class.return_value = mock_payment_client
+
+            result = await mutation.process_payment(booking_id="booking_123")
+
+            # Paying again is refused until the pending payment has failed
+            booking_doc["payment_transaction_id"] = "txn_pending"
+            mock_payment_client.get_payment_status.return_value = {"status": "pending"}
+            retry = await mutation.process_payment(booking_id="booking_123")
+
+        assert result.success is False
+        assert result.message.startswith("Payment pending")
+        update = mock_database.bookings.update_one.call_args[0][1]["$set"]
+        assert update["payment_transaction_id"] == "txn_pending"
+        assert "status" not in update
+        mock_cinema_client.confirm_seat_booking.assert_not_awaited()
+        assert "still being confirmed" in retry.message
+        mock_payment_client.process_payment.assert_awaited_once()
@@ -0,0 +1,115 @@
+"""
+Unit tests for deferred payment capture
+"""
+
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.payment_capture import PAYMENT_CAPTURE_LEASE, capture_authorized_bookings, run_capture_loop
+
+
+def make_booking(transaction_id, age_seconds=10):
+    return {
+        "_id": f"booking_{transaction_id}",
+        "payment_transaction_id": transaction_id,
+        "confirmed_at": datetime.utcnow() - timedelta(seconds=age_seconds),
+        "lock_id": f"lock_{transaction_id}",
+        "user_id": "user_1",
+        "seats": ["A1"],
+        "total_amount": 25.0,
+    }
+
+
+def make_db(bookings):
+    db = MagicMock()
+    cursor = MagicMock()
+    cursor.sort.return_value = cursor
+    cursor.limit.return_value = cursor
+    cursor.to_list = AsyncMock(return_value=bookings)
+    db.bookings.find.return_value = cursor
+    db.bookings.update_many = AsyncMock()
+    db.bookings.update_one = AsyncMock()
+    return db
+
+
+class TestCaptureAuthorizedBookings:
+    """Test batch capture of confirmed bookings"""
+
+    @pytest.mark.asyncio
+    async def test_captures_in_one_batch(self):
+        db = make_db([make_booking("txn_1"), make_booking("txn_2")])
+        payment_client = MagicMock()
+        payment_client.void_payment = AsyncMock(return_value={"success": True, "message": "Payment voided"})
+        payment_client.capture_payments = AsyncMock(return_value={
+            "success": True,
+            "results": [
+                {"transaction_id": "txn_1", "success": True, "message": "Payment captured"},
+                {"transaction_id": "txn_2", "success": False, "message": "Cannot capture a voided payment"},
+            ]
+        })
+
+        event_publisher = MagicMock(publish_booking_event=AsyncMock())
+        with patch("app.payment_capture.CinemaServiceClient") as cinema_client:
+            cinema_client.return_value.release_seat_lock = AsyncMock(return_value=True)
+            counts = await capture_authorized_bookings(
+                db, payment_client, batch_size=10, event_publisher=event_publisher
+            )
+
+        assert counts["captured"] == 1 and counts["failed"] == 1
+        payment_client.capture_payments.assert_awaited_once_with(["txn_1", "txn_2"])
+        captured_filter, captured_update = db.bookings.update_many.call_args[0]
+        assert captured_filter == {"payment_transaction_id": {"$in": ["txn_1"]}, "payment_status": "authorized"}
+        assert captured_update["$set"]["payment_status"] == "captured"
+        failed_update = db.bookings.update_one.call_args[0][1]
+        assert failed_update["$set"]["payment_status"] == "capture_failed"
+        # The uncaptured booking is cancelled, its hold voided, seats released and the user told
+        assert failed_update["$set"]["status"] == "cancelled"
+        payment_client.void_payment.assert_awaited_once_with("txn_2", "Payment capture failed")
+        cinema_client.return_value.release_seat_lock.assert_awaited_once_with("lock_txn_2")
+        assert event_publisher.publish_booking_event.call_args[1]["event_type"] == "booking.cancelled"
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_is_retried_later(self):
+        db = make_db([make_booking("txn_1")])
+        payment_client = MagicMock()
+        payment_client.capture_payments = AsyncMock(return_value={"success": False, "message": "timeout"})
+
+        counts = await capture_authorized_bookings(db, payment_client, batch_size=10)
+
+        assert counts["captured"] == 0 and counts["failed"] == 0
+        db.bookings.update_many.assert_not_awaited()
+        db.bookings.update_one.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_old_backlog_alerts_even_when_capture_is_down(self, caplog):
+        db = make_db([make_booking("txn_1", age_seconds=600)])
+        payment_client = MagicMock()
+        payment_client.capture_payments = AsyncMock(return_value={"success": False, "message": "timeout"})
+
+        counts = await capture_authorized_bookings(db, payment_client, batch_size=10)
+
+        assert counts["backlog_age"] >= 600
+        assert "Payment capture backlog is" in caplog.text
+
+
+class TestCaptureLoop:
+    """Test that only the lease holder captures"""
+
+    @pytest.mark.asyncio
+    async def test_captures_only_while_holding_the_lease(self):
+        db = make_db([])
+        db.__getitem__.return_value.find_one_and_update = AsyncMock(side_effect=[None, {"owner": "this-worker"}])
+        capture = AsyncMock(return_value={"captured": 0, "failed": 0, "backlog_age": 0})
+        sleep = AsyncMock(side_effect=[None, asyncio.CancelledError()])
+
+        with patch("app.payment_capture.capture_authorized_bookings", capture), \
+             patch("app.payment_capture.PaymentServiceClient"), \
+             patch("app.payment_capture.asyncio.sleep", sleep):
+            with pytest.raises(asyncio.CancelledError):
+                await run_capture_loop(AsyncMock(return_value=db), interval=1)
+
+        capture.assert_awaited_once()
+        lease_filter = db.__getitem__.return_value.find_one_and_update.call_args[0][0]
+        assert lease_filter["_id"] == PAYMENT_CAPTURE_LEASE
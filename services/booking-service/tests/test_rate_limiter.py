@@ -0,0 +1,108 @@
+"""
+Tests for GraphQL rate limiting
+"""
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.rate_limiter import (
+    LocalTokenBuckets,
+    RateLimitMiddleware,
+    RateLimitPolicy,
+    RateLimitRequest,
+    RateLimiter,
+    client_key,
+    graphql_argument_key,
+)
+
+
+CREATE_BOOKING = """
+mutation CreateBooking($userId: String!, $showtimeId: String!) {
+  createBooking(userId: $userId, showtimeId: $showtimeId, seatNumbers: ["A1"]) { success }
+}
+"""
+
+
+def graphql_body(user_id: str, showtime_id: str) -> dict:
+    return {"query": CREATE_BOOKING, "variables": {"userId": user_id, "showtimeId": showtime_id}}
+
+
+@pytest.fixture
+def limited_client():
+    """Echo app behind the middleware with one booking per showtime allowed"""
+    echo = FastAPI()
+
+    @echo.post("/graphql")
+    async def graphql(request: Request):
+        return await request.json()
+
+    limiter = RateLimiter(redis_getter=lambda: None, local=LocalTokenBuckets())
+    policies = [
+        RateLimitPolicy.from_spec("graphql-client", "100/60", client_key),
+        RateLimitPolicy.from_spec("showtime", "1/60", graphql_argument_key("showtimeId"), needs_body=True),
+    ]
+    echo.add_middleware(RateLimitMiddleware, limiter=limiter, routes={("POST", "/graphql"): policies})
+    return TestClient(echo)
+
+
+class TestGraphQLArgumentKey:
+    """Test extracting rate-limit keys from GraphQL requests"""
+
+    def make_request(self, body) -> RateLimitRequest:
+        return RateLimitRequest("POST", "/graphql", {}, "127.0.0.1", body)
+
+    def test_key_from_variables(self):
+        key_func = graphql_argument_key("showtimeId")
+        assert key_func(self.make_request(graphql_body("u1", "s1"))) == "s1"
+
+    def test_key_from_inline_literal(self):
+        key_func = graphql_argument_key("userId")
+        body = {"query": 'mutation { createBooking(userId: "u42", showtimeId: "s1", seatNumbers: []) { success } }'}
+        assert key_func(self.make_request(body)) == "u42"
+
+    def test_queries_are_not_keyed_by_default(self):
+        key_func = graphql_argument_key("userId")
+        body = {"query": 'query { getUserBookings(userId: "u1") { id } }'}
+        assert key_func(self.make_request(body)) is None
+        assert graphql_argument_key("userId", mutations_only=False)(self.make_request(body)) == "u1"
+
+    def test_mutation_cannot_hide_behind_leading_text(self):
+        key_func = graphql_argument_key("showtimeId")
+        mutation = 'mutation M { createBooking(userId: "u1", showtimeId: "s9", seatNumbers: []) { success } }'
+        commented = {"query": f"# hi\n{mutation}"}
+        picked = {"query": f"query Q {{ x }} {mutation}", "operationName": "M"}
+        assert key_func(self.make_request(commented)) == "s9"
+        assert key_func(self.make_request(picked)) == "s9"
+        assert key_func(self.make_request({**picked, "operationName": "Q"})) is None
+
+    def test_key_from_fragment_and_renamed_variable(self):
+        key_func = graphql_argument_key("showtimeId")
+        body = {
+            "query": """
+                mutation Book($s: String!) { ...Booking }
+                fragment Booking on Mutation { createBooking(userId: "u1", showtimeId: $s, seatNumbers: []) { success } }
+            """,
+            "variables": {"s": "s7"},
+        }
+        assert key_func(self.make_request(body)) == "s7"
+
+
+class TestRateLimitMiddleware:
+    """Test per-showtime throttling on POST /graphql"""
+
+    def test_hot_showtime_is_throttled(self, limited_client):
+        first = limited_client.post("/graphql", json=graphql_body("u1", "s1"))
+        second = limited_client.post("/graphql", json=graphql_body("u2", "s1"))
+        other_showtime = limited_client.post("/graphql", json=graphql_body("u3", "s2"))
+
+        assert first.status_code == 200
+        assert first.json()["variables"]["showtimeId"] == "s1"  # body replayed downstream
+        assert first.headers["RateLimit-Limit"] == "1"
+        assert second.status_code == 429
+        assert second.headers["Retry-After"] == "60"
+        assert other_showtime.status_code == 200
+
+    def test_get_requests_are_not_limited(self, limited_client):
+        response = limited_client.get("/graphql")
+        assert "RateLimit-Limit" not in response.headers
@@ -3,7 +3,7 @@ Unit tests for REST API clients
 """
 
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 import httpx
 
 from app.rest_client import UserServiceClient, PaymentServiceClient
@@ -30,10 +30,10 @@ class TestUserServiceClient:
         mock_response.status_code = 200
         mock_response.json.return_value = user_data
         
-        with patch('httpx.AsyncClient') as mock_client_class:
+        with patch('app.rest_client.get_http_client') as mock_get_client:
             mock_client = AsyncMock()
             mock_client.get.return_value = mock_response
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+            mock_get_client.return_value = mock_client
             
             result = await client.get_user("user_123")
         
@@ -52,10 +52,10 @@ class TestUserServiceClient:
         mock_response = AsyncMock()
         mock_response.status_code = 404
         
-        with patch('httpx.AsyncClient') as mock_client_class:
+        with patch('app.rest_client.get_http_client') as mock_get_client:
             mock_client = AsyncMock()
             mock_client.get.return_value = mock_response
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+            mock_get_client.return_value = mock_client
             
             result = await client.get_user("nonexistent_user")
         
@@ -66,10 +66,10 @@ class TestUserServiceClient:
         """Test user service timeout"""
         client = UserServiceClient()
         
-        with patch('httpx.AsyncClient') as mock_client_class:
+        with patch('app.rest_client.get_http_client') as mock_get_client:
             mock_client = AsyncMock()
             mock_client.get.side_effect = httpx.TimeoutException("Timeout")
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+            mock_get_client.return_value = mock_client
             
             result = await client.get_user("user_123")
         
@@ -90,10 +90,10 @@ class TestUserServiceClient:
         mock_response.status_code = 200
         mock_response.json.return_value = user_data
         
-        with patch('httpx.AsyncClient') as mock_client_class:
+        with patch('app.rest_client.get_http_client') as mock_get_client:
             mock_client = AsyncMock()
             mock_client.get.return_value = mock_response
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+            mock_get_client.return_value = mock_client
             
             result = await client.validate_user_exists("user_123")
         
@@ -107,10 +107,10 @@ class TestUserServiceClient:
         mock_response = AsyncMock()
         mock_response.status_code = 404
         
-        with patch('httpx.AsyncClient') as mock_client_class:
+        with patch('app.rest_client.get_http_client') as mock_get_client:
             mock_client = AsyncMock()
             mock_client.get.return_value = mock_response
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+            mock_get_client.return_value = mock_client
             
             result = await client.validate_user_exists("nonexistent_user")
         
@@ -134,10 +134,10 @@ class TestPaymentServiceClient:
         mock_response.status_code = 200
         mock_response.json.return_value = payment_response
         
-        with patch('httpx.AsyncClient') as mock_client_class:
+        with patch('app.rest_client.get_http_client') as mock_get_client:
             mock_client = AsyncMock()
             mock_client.post.return_value = mock_response
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+            mock_get_client.return_value = mock_client
             
             result = await client.process_payment(
                 booking_id="booking_123",
@@ -164,10 +164,10 @@ class TestPaymentServiceClient:
         mock_response.json.return_value = error_response
         mock_response.headers = {"content-type": "application/json"}
         
-        with patch('httpx.AsyncClient') as mock_client_class:
+        with patch('app.rest_client.get_http_client') as mock_get_client:
             mock_client = AsyncMock()
             mock_client.post.return_value = mock_response
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+            mock_get_client.return_value = mock_client
             
             result = await client.process_payment(
                 booking_id="booking_123",
@@ -184,10 +184,10 @@ class TestPaymentServiceClient:
         """Test payment processing timeout"""
         client = PaymentServiceClient()
         
-        with patch('httpx.AsyncClient') as mock_client_class:
+        with patch('app.rest_client.get_http_client') as mock_get_client:
             mock_client = AsyncMock()
             mock_client.post.side_effect = httpx.TimeoutException("Timeout")
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+            mock_get_client.return_value = mock_client
             
             result = await client.process_payment(
                 booking_id="booking_123",
@@ -213,10 +213,10 @@ class TestPaymentServiceClient:
         mock_response.status_code = 200
         mock_response.json.return_value = refund_response
         
-        with patch('httpx.AsyncClient') as mock_client_class:
+        with patch('app.rest_client.get_http_client') as mock_get_client:
             mock_client = AsyncMock()
             mock_client.post.return_value = mock_response
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+            mock_get_client.return_value = mock_client
             
             result = await client.initiate_refund(
                 transaction_id="txn_123",
@@ -243,13 +243,88 @@ class TestPaymentServiceClient:
         mock_response.status_code = 200
         mock_response.json.return_value = status_response
         
-        with patch('httpx.AsyncClient') as mock_client_class:
+        with patch('app.rest_client.get_http_client') as mock_get_client:
             mock_client = AsyncMock()
             mock_client.get.return_value = mock_response
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+            mock_get_client.return_value = mock_client
             
             result = await client.get_payment_status("txn_123")
         
         assert result["transaction_id"] == "txn_123"
         assert result["status"] == "completed"
-        assert result["amount"] == 31.98
\ No newline at end of file
+        assert result["amount"] == 31.98
+
+    @pytest.mark.asyncio
+    async def test_authorize_payment_success(self):
+        """Test payment authorization against the payment service's own API"""
+        client = PaymentServiceClient()
+        
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "success": True,
+            "transaction_id": "txn_auth",
+            "message": "Payment authorized",
+            "status": "authorized"
+        }
+        
+        with patch('app.rest_client.get_http_client') as mock_get_client:
+            mock_client = AsyncMock()
+            mock_client.post.return_value = mock_response
+            mock_get_client.return_value = mock_client
+            
+            result = await client.authorize_payment(
+                user_id="user_123",
+                booking_id="booking_123",
+                amount=31.98
+            )
+        
+        assert result == {
+            "success": True, "transaction_id": "txn_auth", "message": "Payment authorized", "status": "authorized"
+        }
+        url = mock_client.post.call_args[0][0]
+        assert url.endswith("/payments/authorize")
+        assert "payment_details" in mock_client.post.call_args[1]["json"]
+        # Lets the payment service rate limit per user instead of per booking-service IP
+        assert mock_client.post.call_args[1]["headers"] == {"x-user-id": "user_123"}
+    
+    @pytest.mark.asyncio
+    async def test_capture_payments_batches_ids(self):
+        """Test batch capture returns per-transaction results"""
+        client = PaymentServiceClient()
+        
+        results = [{"transaction_id": "txn_1", "success": True, "message": "Payment captured"}]
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"total": 1, "captured": 1, "failed": 0, "results": results}
+        
+        with patch('app.rest_client.get_http_client') as mock_get_client:
+            mock_client = AsyncMock()
+            mock_client.post.return_value = mock_response
+            mock_get_client.return_value = mock_client
+            
+            result = await client.capture_payments(["txn_1"])
+        
+        assert result == {"success": True, "results": results}
+        assert mock_client.post.call_args[1]["json"] == {"transaction_ids": ["txn_1"]}
+        assert mock_client.post.call_args[1]["headers"] == {"x-consumer-id": "booking-service"}
+    
+    @pytest.mark.asyncio
+    async def test_void_payment_conflict(self):
+        """Test voiding a payment that was already captured"""
+        client = PaymentServiceClient()
+        
+        mock_response = MagicMock()
+        mock_response.status_code = 409
+        mock_response.headers = {"content-type": "application/json"}
+        mock_response.json.return_value = {"detail": "Cannot void a success payment"}
+        
+        with patch('app.rest_client.get_http_client') as mock_get_client:
+            mock_client = AsyncMock()
+            mock_client.post.return_value = mock_response
+            mock_get_client.return_value = mock_client
+            
+            result = await client.void_payment("txn_1", "Seat confirmation failed")
+        
+        assert result == {"success": False, "message": "Cannot void a success payment"}
+        assert mock_client.post.call_args[1]["params"] == {"reason": "Seat confirmation failed"}
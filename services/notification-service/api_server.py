@@ -46,6 +46,7 @@ async def lifespan(app: FastAPI):
     # Shutdown
     if notification_worker:
         await notification_worker.cleanup()
+    await email_service.close()
 
 app = FastAPI(
     title="Notification Service API", 
@@ -347,6 +348,11 @@ async def get_notification_stats():
             "timestamp": datetime.utcnow().isoformat()
         }
         
+        # Deferred sends and local queue depth per recipient domain
+        stats["email_domains"] = email_service.shaper.stats()
+        if notification_worker:
+            stats["worker_email_domains"] = notification_worker.email_service.shaper.stats()
+        
         # Add database stats if available
         if notification_worker and notification_worker.db is not None:
             try:
@@ -0,0 +1,119 @@
+"""
+Notification coalescing for Notification Worker
+A purchase produces booking.confirmed and payment.success for the same
+booking within moments of each other. Instead of two emails, the first of
+them waits up to NOTIFICATION_COALESCE_WINDOW_MS for the other and both are
+answered with one digest email.
+
+The first event of a booking leads its group: when the group is complete or
+the window expires, the leader sends the digest (or, if nothing joined, its
+own email) and publishes the outcome. Events that joined wait for that
+outcome. Every event's message is still acknowledged, or retried, on its own.
+Other event types pass straight through.
+
+Coalescing is per worker process; related events consumed by different
+replicas are sent separately once the window expires.
+
+It only pays off when both events arrive together, as with PAYMENT_FLOW=single.
+In the two-phase flow (the booking service's default) booking.confirmed goes
+out at authorization, but payment.success only comes at capture, batched every
+PAYMENT_CAPTURE_INTERVAL (5s) or later. A window that long would hold a handler
+slot per confirmation for nothing, so coalescing is off unless the flow is
+single or NOTIFICATION_COALESCE_WINDOW_MS is set explicitly.
+"""
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Must match the booking service: "two_phase" captures payments long after confirming
+PAYMENT_FLOW = os.getenv("PAYMENT_FLOW", "two_phase").lower()
+
+# How long the first event of a booking waits for its partner (0 disables coalescing)
+NOTIFICATION_COALESCE_WINDOW_MS = float(
+    os.getenv("NOTIFICATION_COALESCE_WINDOW_MS", "1500" if PAYMENT_FLOW == "single" else "0")
+)
+
+# Events answered together by one digest email
+COALESCED_EVENTS = ("booking.confirmed", "payment.success")
+
+
+@dataclass
+class CoalescedGroup:
+    """Related events of one booking waiting to be sent together"""
+    booking_id: str
+    events: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    complete: asyncio.Event = field(default_factory=asyncio.Event)
+    outcome: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+    @property
+    def is_digest(self) -> bool:
+        return len(self.events) > 1
+
+
+class NotificationCoalescer:
+    """Groups related events by booking_id for a short window"""
+
+    def __init__(self, window_ms: float = NOTIFICATION_COALESCE_WINDOW_MS, event_types=COALESCED_EVENTS):
+        self.window = window_ms / 1000
+        self.event_types = tuple(event_types)
+        self.pending: Dict[str, CoalescedGroup] = {}
+        self.digests = 0
+        self.singles = 0
+
+    def applies(self, event_type: str, event_data: Dict[str, Any]) -> bool:
+        return self.window > 0 and event_type in self.event_types and bool(event_data.get("booking_id"))
+
+    def join(self, event_type: str, event_data: Dict[str, Any]) -> Tuple[Optional[CoalescedGroup], bool]:
+        """
+        Add an event to its booking's group; returns (group, is_leader)
+        (None, False) when the group already holds an event of this type,
+        e.g. a republished event: it is sent on its own
+        """
+        booking_id = event_data["booking_id"]
+        group = self.pending.get(booking_id)
+        if group is None:
+            group = CoalescedGroup(booking_id)
+            group.events[event_type] = event_data
+            self.pending[booking_id] = group
+            return group, True
+
+        if event_type in group.events:
+            return None, False
+
+        group.events[event_type] = event_data
+        if len(group.events) == len(self.event_types):
+            group.complete.set()
+        return group, False
+
+    async def gather(self, group: CoalescedGroup):
+        """Leader: wait for the rest of the group or the end of the window, then close it"""
+        try:
+            await asyncio.wait_for(group.complete.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # Events arriving from now on start a new group
+            if self.pending.get(group.booking_id) is group:
+                del self.pending[group.booking_id]
+
+        if group.is_digest:
+            self.digests += 1
+        else:
+            self.singles += 1
+
+    def settle(self, group: CoalescedGroup, success: bool):
+        """Leader: publish the send outcome to the events that joined"""
+        if not group.outcome.done():
+            group.outcome.set_result(success)
+
+    async def outcome(self, group: CoalescedGroup) -> bool:
+        """Member: wait for the leader's send"""
+        return await asyncio.shield(group.outcome)
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self.pending), "digests": self.digests, "singles": self.singles}
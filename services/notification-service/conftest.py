@@ -0,0 +1,9 @@
+"""
+Shared pytest setup for Notification Service tests
+"""
+
+import sys
+from pathlib import Path
+
+# The shared package lives in services/, as it does next to the code in the image
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,129 @@
+"""
+Consumer pool for Notification Worker
+Every queue gets its own channels, prefetch window and handler slots, so a
+burst on one queue cannot starve the other.
+
+Handler concurrency per queue is bounded by a fixed number of slots, granted
+by priority class with a weighted-fair scheduler (see priority.py). A message
+waiting for a slot stays unacknowledged and counts against its channel's prefetch window, so
+when SMTP or MongoDB slows down the broker stops delivering instead of the
+worker buffering an unbounded backlog: at most channels * prefetch messages
+per queue are ever held, and at most `concurrency` of them are being handled.
+"""
+
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List
+
+import aio_pika
+
+from priority import WeightedFairScheduler, message_priority, priority_class
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[aio_pika.IncomingMessage], Awaitable[None]]
+
+
+@dataclass
+class LaneConfig:
+    """Channels, prefetch window and handler slots for one queue"""
+    channels: int = 1
+    prefetch: int = 10
+    concurrency: int = 10
+
+
+def lane_config(lane: str) -> LaneConfig:
+    """
+    Lane settings from NOTIFICATION_<LANE>_CHANNELS, _PREFETCH and _CONCURRENCY
+    Prefetch defaults to the concurrency so no message waits unacknowledged
+    for a handler slot
+    """
+    prefix = f"NOTIFICATION_{lane.upper()}"
+    concurrency = int(os.getenv(f"{prefix}_CONCURRENCY", "10"))
+    return LaneConfig(
+        channels=int(os.getenv(f"{prefix}_CHANNELS", "1")),
+        prefetch=int(os.getenv(f"{prefix}_PREFETCH", str(concurrency))),
+        concurrency=concurrency,
+    )
+
+
+@dataclass
+class Lane:
+    """Consumers of one queue and their shared handler slots"""
+    queue_name: str
+    handler: MessageHandler
+    config: LaneConfig
+    slots: WeightedFairScheduler
+    channels: List[Any] = field(default_factory=list)
+    in_flight: int = 0
+    waiting: int = 0
+    handled: int = 0
+    errors: int = 0
+
+    async def dispatch(self, message: aio_pika.IncomingMessage):
+        self.waiting += 1
+        async with self.slots.slot(priority_class(message_priority(message))):
+            self.waiting -= 1
+            self.in_flight += 1
+            try:
+                await self.handler(message)
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.in_flight -= 1
+                self.handled += 1
+
+
+class ConsumerPool:
+    """Consumes several queues over a shared connection with per-queue limits"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lanes: Dict[str, Lane] = {}
+
+    async def consume(self, queue_name: str, handler: MessageHandler, config: LaneConfig) -> Lane:
+        """
+        Open config.channels channels on an already-declared queue and start consuming
+        Each channel has its own prefetch window; all of them share the lane's slots
+        """
+        lane = Lane(queue_name, handler, config, WeightedFairScheduler(config.concurrency))
+        self.lanes[queue_name] = lane
+
+        for _ in range(config.channels):
+            channel = await self.connection.channel()
+            await channel.set_qos(prefetch_count=config.prefetch)
+            queue = await channel.get_queue(queue_name)
+            await queue.consume(lane.dispatch)
+            lane.channels.append(channel)
+
+        logger.info(
+            f"Consuming {queue_name} on {config.channels} channel(s), "
+            f"prefetch {config.prefetch}, concurrency {config.concurrency}"
+        )
+        return lane
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """In-flight, waiting and handled message counts per queue, and slot grants per priority class"""
+        return {
+            name: {
+                "channels": len(lane.channels),
+                "prefetch": lane.config.prefetch,
+                "concurrency": lane.config.concurrency,
+                "in_flight": lane.in_flight,
+                "waiting": lane.waiting,
+                "handled": lane.handled,
+                "errors": lane.errors,
+                "priorities": lane.slots.stats(),
+            }
+            for name, lane in self.lanes.items()
+        }
+
+    async def close(self):
+        """Close the consumer channels; unacknowledged messages return to their queues"""
+        for lane in self.lanes.values():
+            for channel in lane.channels:
+                if not channel.is_closed:
+                    await channel.close()
+            lane.channels.clear()
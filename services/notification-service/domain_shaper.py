@@ -0,0 +1,262 @@
+"""
+Per-recipient-domain rate shaping for outgoing email
+A burst of mail to one provider gets throttled by that provider and then
+slows every send. Each recipient domain gets its own token bucket (sustained
+rate plus burst) and a cap on concurrent sends. A send that would exceed
+either is deferred to the domain's local queue, which a per-domain drainer
+releases as tokens and slots come back, so other domains keep sending at
+full speed.
+
+The local queue of a domain holds at most SMTP_DOMAIN_QUEUE_SIZE sends. Each
+deferred send keeps its worker handler slot busy, so the queue should stay
+below the lane concurrency. Past the cap a send fails fast with
+DomainThrottled, and its event is retried later from a delay queue. A
+provider answer of 421 or 45x pauses the domain for SMTP_DOMAIN_BACKOFF_SECONDS.
+
+Limits default to SMTP_DOMAIN_RATE / _BURST / _CONCURRENCY; SMTP_DOMAIN_LIMITS
+overrides them per domain as "domain=rate:burst:concurrency,...".
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import aiosmtplib
+
+logger = logging.getLogger(__name__)
+
+# Sustained sends per second and burst size per recipient domain
+SMTP_DOMAIN_RATE = float(os.getenv("SMTP_DOMAIN_RATE", "5"))
+SMTP_DOMAIN_BURST = int(os.getenv("SMTP_DOMAIN_BURST", "10"))
+# Concurrent sends per recipient domain
+SMTP_DOMAIN_CONCURRENCY = int(os.getenv("SMTP_DOMAIN_CONCURRENCY", "2"))
+# Per-domain overrides, e.g. "gmail.com=20:40:4,outlook.com=10:20:2"
+SMTP_DOMAIN_LIMITS = os.getenv("SMTP_DOMAIN_LIMITS", "")
+# Deferred sends held per domain before new ones fail fast
+SMTP_DOMAIN_QUEUE_SIZE = int(os.getenv("SMTP_DOMAIN_QUEUE_SIZE", "5"))
+# Pause after the provider answers with a throttling code
+SMTP_DOMAIN_BACKOFF_SECONDS = float(os.getenv("SMTP_DOMAIN_BACKOFF_SECONDS", "30"))
+
+# Temporary failures providers use for rate limiting
+THROTTLE_CODES = (421, 450, 451, 452)
+
+Send = Callable[[], Awaitable[Any]]
+
+
+class DomainThrottled(Exception):
+    """The recipient domain's local queue is full"""
+
+
+@dataclass
+class DomainLimits:
+    rate: float = SMTP_DOMAIN_RATE
+    burst: int = SMTP_DOMAIN_BURST
+    concurrency: int = SMTP_DOMAIN_CONCURRENCY
+
+
+def parse_domain_limits(value: str) -> Dict[str, DomainLimits]:
+    limits = {}
+    for entry in value.split(","):
+        domain, _, spec = entry.partition("=")
+        if not domain.strip() or not spec:
+            continue
+        rate, burst, concurrency = (spec.split(":") + ["", ""])[:3]
+        limits[domain.strip().lower()] = DomainLimits(
+            rate=float(rate),
+            burst=int(burst or SMTP_DOMAIN_BURST),
+            concurrency=int(concurrency or SMTP_DOMAIN_CONCURRENCY),
+        )
+    return limits
+
+
+def recipient_domain(to_email: str) -> str:
+    return to_email.rpartition("@")[2].strip().lower()
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate: float, burst: int, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> bool:
+        if self.clock() < self.paused_until:
+            return False
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Seconds until a token can be taken"""
+        now = self.clock()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else SMTP_DOMAIN_BACKOFF_SECONDS
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+        self.tokens = 0.0
+
+
+@dataclass
+class DomainState:
+    """Limits, local queue and counters of one recipient domain"""
+    domain: str
+    limits: DomainLimits
+    bucket: TokenBucket
+    queue: Deque[Tuple[Send, asyncio.Future]] = field(default_factory=deque)
+    slot_freed: asyncio.Event = field(default_factory=asyncio.Event)
+    drainer: Optional[asyncio.Task] = None
+    in_flight: int = 0
+    sent: int = 0
+    deferred: int = 0
+    rejected: int = 0
+    throttled: int = 0
+
+
+class DomainShaper:
+    """Token buckets, concurrency caps and deferral queues per recipient domain"""
+
+    def __init__(
+        self,
+        defaults: Optional[DomainLimits] = None,
+        overrides: Optional[Dict[str, DomainLimits]] = None,
+        queue_size: int = SMTP_DOMAIN_QUEUE_SIZE,
+        backoff_seconds: float = SMTP_DOMAIN_BACKOFF_SECONDS,
+        clock=time.monotonic,
+    ):
+        self.defaults = defaults or DomainLimits()
+        self.overrides = parse_domain_limits(SMTP_DOMAIN_LIMITS) if overrides is None else overrides
+        self.queue_size = queue_size
+        self.backoff_seconds = backoff_seconds
+        self.clock = clock
+        self.domains: Dict[str, DomainState] = {}
+        self._sending = set()
+
+    def _state(self, domain: str) -> DomainState:
+        state = self.domains.get(domain)
+        if state is None:
+            limits = self.overrides.get(domain, self.defaults)
+            state = DomainState(domain, limits, TokenBucket(limits.rate, limits.burst, self.clock))
+            self.domains[domain] = state
+        return state
+
+    def _ready(self, state: DomainState) -> bool:
+        return state.in_flight < state.limits.concurrency and state.bucket.take()
+
+    async def send(self, to_email: str, send: Send):
+        """Run `send` now if the recipient's domain has capacity, otherwise after its queue"""
+        state = self._state(recipient_domain(to_email))
+
+        # Queued sends keep their order: a newcomer never overtakes them
+        if not state.queue and self._ready(state):
+            return await self._run(state, send)
+
+        if len(state.queue) >= self.queue_size:
+            state.rejected += 1
+            raise DomainThrottled(f"Send queue for {state.domain} is full ({len(state.queue)} deferred)")
+
+        result = asyncio.get_running_loop().create_future()
+        state.queue.append((send, result))
+        state.deferred += 1
+        if state.drainer is None or state.drainer.done():
+            state.drainer = asyncio.create_task(self._drain(state))
+        return await result
+
+    async def _run(self, state: DomainState, send: Send):
+        state.in_flight += 1
+        try:
+            result = await send()
+            state.sent += 1
+            return result
+        except aiosmtplib.SMTPResponseException as e:
+            if e.code in THROTTLE_CODES:
+                state.throttled += 1
+                state.bucket.pause(self.backoff_seconds)
+                logger.warning(f"{state.domain} is throttling ({e.code}); pausing sends for {self.backoff_seconds}s")
+            raise
+        finally:
+            state.in_flight -= 1
+            state.slot_freed.set()
+
+    async def _forward(self, state: DomainState, send: Send, result: asyncio.Future):
+        try:
+            outcome = await self._run(state, send)
+        except Exception as e:
+            if not result.done():
+                result.set_exception(e)
+        else:
+            if not result.done():
+                result.set_result(outcome)
+
+    async def _drain(self, state: DomainState):
+        """Release the domain's deferred sends as tokens and slots allow"""
+        while state.queue:
+            send, result = state.queue[0]
+            if result.done():
+                # The waiting caller was cancelled
+                state.queue.popleft()
+                continue
+            if state.in_flight >= state.limits.concurrency:
+                state.slot_freed.clear()
+                await state.slot_freed.wait()
+                continue
+            if not state.bucket.take():
+                await asyncio.sleep(state.bucket.wait_time())
+                continue
+            state.queue.popleft()
+            task = asyncio.create_task(self._forward(state, send, result))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    def stats(self) -> Dict[str, Any]:
+        """Deferral counts and local queue depth per domain, plus totals"""
+        domains = {
+            name: {
+                "queued": len(state.queue),
+                "in_flight": state.in_flight,
+                "sent": state.sent,
+                "deferred": state.deferred,
+                "rejected": state.rejected,
+                "throttled": state.throttled,
+                "paused_for": round(max(0.0, state.bucket.paused_until - self.clock()), 1),
+            }
+            for name, state in self.domains.items()
+        }
+        return {
+            "queued": sum(domain["queued"] for domain in domains.values()),
+            "deferred": sum(domain["deferred"] for domain in domains.values()),
+            "rejected": sum(domain["rejected"] for domain in domains.values()),
+            "domains": domains,
+        }
+
+    async def close(self):
+        """Stop the drainers; sends still queued fail with DomainThrottled"""
+        for state in self.domains.values():
+            if state.drainer and not state.drainer.done():
+                state.drainer.cancel()
+                try:
+                    await state.drainer
+                except asyncio.CancelledError:
+                    pass
+            while state.queue:
+                _, result = state.queue.popleft()
+                if not result.done():
+                    result.set_exception(DomainThrottled(f"Shutting down with sends for {state.domain} queued"))
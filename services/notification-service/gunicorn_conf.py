@@ -0,0 +1,13 @@
+"""
+Gunicorn configuration for Notification Service HTTP API
+
+    gunicorn -c gunicorn_conf.py api_server:app
+
+Worker, timeout and signal settings are shared with the other services; see
+shared/gunicorn_conf.py.
+"""
+
+from shared.gunicorn_conf import *  # noqa: F401,F403
+from shared.gunicorn_conf import bind_address
+
+bind = bind_address("8084")
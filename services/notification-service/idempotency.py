@@ -0,0 +1,198 @@
+"""
+Redis idempotency store for Notification Worker
+An event is claimed with a single atomic script instead of a GET followed by a
+SETEX, so two consumers can never both start the same event and a claim costs
+one round trip.
+
+Key pattern event:{event_id}:status holds processing, processed or failed.
+A claim succeeds when the key is missing or failed and returns the state it
+replaced; it fails (returning that state) when the event is being or has been
+processed. Completion and failure can be queued on a caller's pipeline so they
+travel with its other writes, and the *_many variants handle a group of
+events in one round trip.
+
+An optional RedeliveryCache (redelivery_cache.py) answers redeliveries of
+events this worker already claimed; every other event goes to Redis.
+"""
+
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_PROCESSING_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_PROCESSING_TTL_SECONDS", "300"))
+IDEMPOTENCY_PROCESSED_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_PROCESSED_TTL_SECONDS", "86400"))
+# A failed event may be claimed again immediately; the marker only records the failure
+IDEMPOTENCY_FAILED_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_FAILED_TTL_SECONDS", "3600"))
+
+PROCESSING = "processing"
+PROCESSED = "processed"
+FAILED = "failed"
+
+# States that block a new claim
+CLAIMED_STATES = (PROCESSING, PROCESSED)
+
+CLAIM_SCRIPT = """
+local prior = redis.call('GET', KEYS[1])
+if prior == 'processing' or prior == 'processed' then
+    return prior
+end
+redis.call('SET', KEYS[1], 'processing', 'EX', ARGV[1])
+return prior
+"""
+
+
+def status_key(event_id: str) -> str:
+    return f"event:{event_id}:status"
+
+
+def _state(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class IdempotencyStore:
+    """Atomic event claims and state transitions in Redis"""
+
+    def __init__(
+        self,
+        redis_client,
+        processing_ttl: int = IDEMPOTENCY_PROCESSING_TTL_SECONDS,
+        processed_ttl: int = IDEMPOTENCY_PROCESSED_TTL_SECONDS,
+        failed_ttl: int = IDEMPOTENCY_FAILED_TTL_SECONDS,
+        recent=None,
+    ):
+        self.redis = redis_client
+        self.processing_ttl = processing_ttl
+        self.processed_ttl = processed_ttl
+        self.failed_ttl = failed_ttl
+        self.recent = recent
+        self.claim_script = redis_client.register_script(CLAIM_SCRIPT)
+
+    def _ttl(self, state: str) -> int:
+        return {PROCESSING: self.processing_ttl, PROCESSED: self.processed_ttl}.get(state, self.failed_ttl)
+
+    def _remember(self, event_id: str, state: str):
+        if self.recent is not None:
+            self.recent.record(event_id, state, self._ttl(state))
+
+    def _known_claim(self, event_id: str) -> Optional[str]:
+        """Processing or processed state this worker recorded, if any"""
+        if self.recent is None:
+            return None
+        state = self.recent.get(event_id)
+        if state in CLAIMED_STATES:
+            self.recent.lru_hits += 1
+            return state
+        return None
+
+    async def claim(self, event_id: str) -> Optional[str]:
+        """
+        Claim an event for processing; returns the state found before the claim
+        None or "failed" means the claim is ours; "processing" or "processed"
+        means another consumer has it. If Redis is unreachable the event is
+        processed without idempotency (None)
+        """
+        known = self._known_claim(event_id)
+        if known:
+            return known
+        try:
+            prior = _state(await self.claim_script(keys=[status_key(event_id)], args=[self.processing_ttl]))
+        except Exception as e:
+            logger.error(f"Error claiming event {event_id} in Redis: {e}")
+            prior = None
+        self._remember(event_id, prior if prior in CLAIMED_STATES else PROCESSING)
+        return prior
+
+    async def claim_many(self, event_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Claim several events in one round trip; prior state per event"""
+        claims = {event_id: self._known_claim(event_id) for event_id in event_ids}
+        unknown = [event_id for event_id, state in claims.items() if state is None]
+        if not unknown:
+            return claims
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for event_id in unknown:
+                await self.claim_script(keys=[status_key(event_id)], args=[self.processing_ttl], client=pipeline)
+            results = await pipeline.execute()
+        except Exception as e:
+            logger.error(f"Error claiming {len(unknown)} events in Redis: {e}")
+            results = [None] * len(unknown)
+        for event_id, result in zip(unknown, results):
+            claims[event_id] = _state(result)
+            self._remember(event_id, claims[event_id] if claims[event_id] in CLAIMED_STATES else PROCESSING)
+        return claims
+
+    def _local_status(self, event_id: str) -> Tuple[bool, Optional[str]]:
+        """(answered, state) from the redelivery cache without Redis"""
+        if self.recent is None:
+            return False, None
+        state = self.recent.get(event_id)
+        if state is not None:
+            self.recent.lru_hits += 1
+            return True, state
+        # Another replica may have claimed an event this worker never saw
+        self.recent.redis_checks += 1
+        return False, None
+
+    async def status(self, event_id: str) -> Optional[str]:
+        answered, state = self._local_status(event_id)
+        if answered:
+            return state
+        return _state(await self.redis.get(status_key(event_id)))
+
+    async def statuses(self, event_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Current state of several events; those the redelivery cache can't answer with one MGET"""
+        result: Dict[str, Optional[str]] = {}
+        remote = []
+        for event_id in event_ids:
+            answered, state = self._local_status(event_id)
+            if answered:
+                result[event_id] = state
+            else:
+                remote.append(event_id)
+        if remote:
+            values = await self.redis.mget([status_key(event_id) for event_id in remote])
+            result.update({event_id: _state(value) for event_id, value in zip(remote, values)})
+        return result
+
+    def _set(self, pipeline, event_ids: Iterable[str], state: str, ttl: int):
+        for event_id in event_ids:
+            pipeline.set(status_key(event_id), state, ex=ttl)
+
+    async def _transition(self, event_ids: List[str], state: str, ttl: int, pipeline=None):
+        if not event_ids:
+            return
+        for event_id in event_ids:
+            self._remember(event_id, state)
+        if pipeline is not None:
+            # The caller executes its pipeline along with its own writes
+            self._set(pipeline, event_ids, state, ttl)
+            return
+        try:
+            if len(event_ids) == 1:
+                await self.redis.set(status_key(event_ids[0]), state, ex=ttl)
+            else:
+                own = self.redis.pipeline(transaction=False)
+                self._set(own, event_ids, state, ttl)
+                await own.execute()
+        except Exception as e:
+            logger.error(f"Error marking {len(event_ids)} event(s) as {state}: {e}")
+
+    async def complete(self, event_id: str, pipeline=None):
+        await self._transition([event_id], PROCESSED, self.processed_ttl, pipeline)
+
+    async def fail(self, event_id: str, pipeline=None):
+        await self._transition([event_id], FAILED, self.failed_ttl, pipeline)
+
+    async def complete_many(self, event_ids: Iterable[str], pipeline=None):
+        await self._transition(list(event_ids), PROCESSED, self.processed_ttl, pipeline)
+
+    async def fail_many(self, event_ids: Iterable[str], pipeline=None):
+        await self._transition(list(event_ids), FAILED, self.failed_ttl, pipeline)
+
+    async def mark_processing(self, event_id: str):
+        """Unconditionally mark an event as processing (use claim to start work)"""
+        await self._transition([event_id], PROCESSING, self.processing_ttl)
@@ -0,0 +1,198 @@
+"""
+Batched notification_logs writer for Notification Worker
+Handlers queue their log documents here instead of calling insert_one; the
+buffer is written with one unordered insert_many when it reaches
+NOTIFICATION_LOG_BATCH_SIZE documents or NOTIFICATION_LOG_FLUSH_MS after its
+first document, whichever comes first.
+
+Every queued document gets a future that resolves once its first write
+attempt is done. The worker awaits those futures before acknowledging the
+RabbitMQ message, but a failed write does not fail the event: the
+notification has already been sent, and retrying the event would send it
+again. The writer retries the log itself after each of
+NOTIFICATION_LOG_RETRY_DELAYS_MS, then hands it to its park callback (the
+worker publishes it to notification.poison). Log ids are derived from the
+event, so a retried batch or a redelivered message does not store the same
+notification twice.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_LOG_BATCH_SIZE = int(os.getenv("NOTIFICATION_LOG_BATCH_SIZE", "100"))
+NOTIFICATION_LOG_FLUSH_MS = float(os.getenv("NOTIFICATION_LOG_FLUSH_MS", "100"))
+# Delay before each retry of a log that could not be stored; then it is parked
+NOTIFICATION_LOG_RETRY_DELAYS_MS = [
+    int(delay) for delay in os.getenv("NOTIFICATION_LOG_RETRY_DELAYS_MS", "1000,5000,30000").split(",") if delay.strip()
+]
+
+# Event fields kept in a log; the full event stays in RabbitMQ and its producer
+LOGGED_EVENT_FIELDS = ("event_type", "booking_id", "user_id", "transaction_id", "timestamp")
+
+DUPLICATE_KEY = 11000
+
+# Futures for logs queued by the message being handled in the current task
+pending_logs: ContextVar[Optional[List[asyncio.Future]]] = ContextVar("pending_logs", default=None)
+
+
+def notification_log_id(event_id: str, notification_type: str, recipient: str, subject: str) -> str:
+    """Same notification of the same event, same id"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"notification:{event_id}:{notification_type}:{recipient}:{subject}"))
+
+
+def notification_log(event_id: str, notification_type: str, recipient: str, subject: str,
+                     status: str, event_data: Dict[str, Any]) -> Dict[str, Any]:
+    """notification_logs document"""
+    now = datetime.utcnow()
+    return {
+        "_id": notification_log_id(event_id, notification_type, recipient, subject),
+        "event_id": event_id,
+        "notification_type": notification_type,
+        "recipient": recipient,
+        "subject": subject,
+        "status": status,
+        "event_data": {field: event_data[field] for field in LOGGED_EVENT_FIELDS if field in event_data},
+        "created_at": now,
+        "sent_at": now if status == "sent" else None,
+    }
+
+
+class NotificationLogWriter:
+    """Buffers notification logs and stores them in batches"""
+
+    def __init__(
+        self,
+        collection,
+        batch_size: int = NOTIFICATION_LOG_BATCH_SIZE,
+        flush_ms: float = NOTIFICATION_LOG_FLUSH_MS,
+        retry_delays_ms: List[int] = NOTIFICATION_LOG_RETRY_DELAYS_MS,
+        park: Optional[Callable[[Dict[str, Any], str], Awaitable[None]]] = None,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.retry_delays = [delay / 1000 for delay in retry_delays_ms]
+        self.park = park
+        # (document, future or None for a retry, attempts so far)
+        self.buffer: List[Tuple[Dict[str, Any], Optional[asyncio.Future], int]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._retries: Dict[asyncio.TimerHandle, Tuple[Dict[str, Any], int]] = {}
+        self._writes = set()
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.retried = 0
+        self.parked = 0
+
+    def add(self, document: Dict[str, Any]) -> asyncio.Future:
+        """Queue a document; the returned future resolves once its first write attempt is done"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue(document, future, 0)
+        return future
+
+    async def write(self, document: Dict[str, Any]):
+        """Queue a document and wait until it is stored"""
+        await self.add(document)
+
+    def _queue(self, document: Dict[str, Any], future: Optional[asyncio.Future], attempts: int):
+        self.buffer.append((document, future, attempts))
+        if len(self.buffer) >= self.batch_size:
+            self._flush_buffer()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._flush_buffer)
+
+    def _flush_buffer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.buffer = self.buffer, []
+        if batch:
+            task = asyncio.ensure_future(self._write_batch(batch))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _write_batch(self, batch: List[Tuple[Dict[str, Any], Optional[asyncio.Future], int]]):
+        errors: Dict[int, Exception] = {}
+        try:
+            await self.collection.insert_many([document for document, _, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            # Duplicates are logs stored by an earlier attempt
+            for write_error in e.details.get("writeErrors", []):
+                if write_error.get("code") != DUPLICATE_KEY:
+                    errors[write_error["index"]] = e
+            if e.details.get("writeConcernErrors"):
+                errors = {index: e for index in range(len(batch))}
+        except Exception as e:
+            errors = {index: e for index in range(len(batch))}
+
+        self.batches += 1
+        self.written += len(batch) - len(errors)
+        self.failed += len(errors)
+        if errors:
+            logger.error(f"Failed to store {len(errors)} of {len(batch)} notification logs: {next(iter(errors.values()))}")
+
+        for index, (document, future, attempts) in enumerate(batch):
+            if index in errors:
+                await self._retry_or_park(document, attempts + 1, errors[index])
+            if future is None or future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
+
+    async def _retry_or_park(self, document: Dict[str, Any], attempts: int, error: Exception):
+        if attempts <= len(self.retry_delays):
+            self.retried += 1
+            loop = asyncio.get_running_loop()
+            handle = loop.call_later(self.retry_delays[attempts - 1], lambda: self._requeue(handle))
+            self._retries[handle] = (document, attempts)
+            return
+
+        self.parked += 1
+        logger.error(f"Notification log {document['_id']} not stored after {attempts} attempts; parking it")
+        try:
+            if self.park is None:
+                raise RuntimeError("no park callback")
+            await self.park(document, str(error))
+        except Exception as e:
+            logger.error(f"Could not park notification log {document['_id']} ({e}): {document}")
+
+    def _requeue(self, handle: asyncio.TimerHandle):
+        document, attempts = self._retries.pop(handle)
+        self._queue(document, None, attempts)
+
+    async def flush(self):
+        """Write everything queued so far and wait for in-flight batches"""
+        self._flush_buffer()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "buffered": len(self.buffer),
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+            "retrying": len(self._retries),
+            "retried": self.retried,
+            "parked": self.parked,
+        }
+
+    async def close(self):
+        """Flush, then give waiting retries one last attempt and park what still fails"""
+        await self.flush()
+        for handle in list(self._retries):
+            handle.cancel()
+            document, _ = self._retries.pop(handle)
+            self.buffer.append((document, None, len(self.retry_delays)))
+        await self.flush()
@@ -0,0 +1,133 @@
+"""
+Notification priorities for Notification Worker
+Booking confirmations and payment failures must not wait behind a backlog of
+refund notices. Priority is applied at two points:
+
+- In RabbitMQ: the work queues are declared with x-max-priority, so a queued
+  confirmation is delivered ahead of queued bulk messages. Publishers tag the
+  AMQP priority property (0-9); untagged messages get their event type's
+  default from shared.event_priorities.
+- In the worker: delivered messages waiting for a handler slot are granted
+  slots by a weighted-fair scheduler over the high, normal and bulk classes.
+  Under contention each class gets slots in proportion to its weight, so
+  high-priority messages overtake without bulk ones starving.
+"""
+
+import asyncio
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from shared.event_priorities import event_priority
+
+# Priority levels of the work queues (0 declares them without x-max-priority)
+NOTIFICATION_MAX_PRIORITY = int(os.getenv("NOTIFICATION_MAX_PRIORITY", "10"))
+
+# Handler slot shares under contention, as class=weight pairs
+NOTIFICATION_PRIORITY_WEIGHTS = os.getenv("NOTIFICATION_PRIORITY_WEIGHTS", "high=8,normal=3,bulk=1")
+
+# Classes in the order they are offered a free slot
+PRIORITY_CLASSES = ("high", "normal", "bulk")
+
+
+def parse_weights(value: str) -> Dict[str, int]:
+    weights = {name: 1 for name in PRIORITY_CLASSES}
+    for pair in value.split(","):
+        name, _, weight = pair.partition("=")
+        if name.strip() in weights and weight.strip():
+            weights[name.strip()] = max(int(weight), 1)
+    return weights
+
+
+def priority_class(priority: int) -> str:
+    if priority >= 7:
+        return "high"
+    if priority >= 4:
+        return "normal"
+    return "bulk"
+
+
+def message_priority(message) -> int:
+    """The publisher's priority tag, else the default for the message's routing key"""
+    priority = getattr(message, "priority", None)
+    if isinstance(priority, int):
+        return priority
+    return event_priority(getattr(message, "routing_key", None))
+
+
+class WeightedFairScheduler:
+    """
+    A fixed number of handler slots granted by weighted round robin
+    A free slot is taken immediately. A freed slot goes to the next waiting
+    class that has credit left in the current round; a round gives each class
+    as many grants as its weight, and a new round starts when every waiting
+    class has spent its credit
+    """
+
+    def __init__(self, slots: int, weights: Optional[Dict[str, int]] = None):
+        self.slots = slots
+        self.free = slots
+        self.weights = weights or parse_weights(NOTIFICATION_PRIORITY_WEIGHTS)
+        self.credits = dict(self.weights)
+        self.waiting: Dict[str, Deque[asyncio.Future]] = {name: deque() for name in self.weights}
+        self.granted = {name: 0 for name in self.weights}
+
+    def _next_class(self) -> Optional[str]:
+        queued = [name for name in PRIORITY_CLASSES if self.waiting.get(name)]
+        if not queued:
+            return None
+        if all(self.credits[name] <= 0 for name in queued):
+            self.credits = dict(self.weights)
+        for name in queued:
+            if self.credits[name] > 0:
+                self.credits[name] -= 1
+                return name
+
+    async def acquire(self, name: str):
+        if self.free > 0 and not any(self.waiting.values()):
+            self.free -= 1
+            self.granted[name] += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiting[name].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as we were cancelled; hand the slot on
+                self.release()
+            elif waiter in self.waiting[name]:
+                self.waiting[name].remove(waiter)
+            raise
+        self.granted[name] += 1
+
+    def release(self):
+        while True:
+            name = self._next_class()
+            if name is None:
+                self.free += 1
+                return
+            waiter = self.waiting[name].popleft()
+            # Skip waiters cancelled before they could clean up
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    @asynccontextmanager
+    async def slot(self, name: str):
+        await self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def locked(self) -> bool:
+        return self.free == 0
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {"waiting": len(self.waiting[name]), "granted": self.granted[name], "weight": self.weights[name]}
+            for name in self.weights
+        }
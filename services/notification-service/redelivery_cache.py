@@ -0,0 +1,62 @@
+"""
+Redelivery cache for the idempotency store
+An LRU of the exact state (processing, processed, failed) of the events this
+worker touched recently, each entry expiring with its Redis key's TTL.
+
+It only helps with redeliveries and republishes of events this same worker
+already claimed: those are answered without asking Redis. It cannot tell
+that an event is new. With several replicas consuming the same queues, an
+event this worker has never seen may have been claimed or processed by
+another one, so every new event is still claimed in Redis.
+
+Memory per worker is bounded by IDEMPOTENCY_LRU_SIZE entries.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Exact recent states (0 disables the cache)
+IDEMPOTENCY_LRU_SIZE = int(os.getenv("IDEMPOTENCY_LRU_SIZE", "10000"))
+
+
+class RedeliveryCache:
+    """Recent-events LRU in front of the Redis idempotency keys"""
+
+    def __init__(self, lru_size: int = IDEMPOTENCY_LRU_SIZE, clock=time.monotonic):
+        self.lru_size = lru_size
+        self.clock = clock
+        self.recent: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.lru_hits = 0
+        self.redis_checks = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["RedeliveryCache"]:
+        return cls() if IDEMPOTENCY_LRU_SIZE > 0 else None
+
+    def get(self, event_id: str) -> Optional[str]:
+        """Exact state recorded by this worker, if still fresh"""
+        entry = self.recent.get(event_id)
+        if entry is None:
+            return None
+        state, expires_at = entry
+        if expires_at <= self.clock():
+            del self.recent[event_id]
+            return None
+        self.recent.move_to_end(event_id)
+        return state
+
+    def record(self, event_id: str, state: str, ttl: float):
+        self.recent[event_id] = (state, self.clock() + ttl)
+        self.recent.move_to_end(event_id)
+        while len(self.recent) > self.lru_size:
+            self.recent.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "lru_entries": len(self.recent),
+            "lru_size": self.lru_size,
+            "lru_hits": self.lru_hits,
+            "redis_checks": self.redis_checks,
+        }
@@ -0,0 +1,130 @@
+"""
+Delayed retries for Notification Worker
+A message whose handler fails is not requeued straight away, which would retry
+it in a tight loop against a failing SMTP server. It is republished to a delay
+queue and acknowledged. Each delay queue has a per-queue TTL and dead-letters
+expired messages back to their work queue, so waiting retries live in RabbitMQ
+and take no worker capacity:
+
+    notification.booking_events --fail--> notification.booking_events.retry.5000ms
+        ^                                           | TTL expires
+        +-------------------------------------------+
+
+The attempt count travels in the x-retry-count header. Retry n waits
+NOTIFICATION_RETRY_DELAYS_MS[n] (the last delay repeats). After
+NOTIFICATION_MAX_ATTEMPTS attempts the message is parked in
+notification.poison with its origin and last error, for inspection or replay.
+"""
+
+import logging
+import os
+from typing import Any, Dict, Iterable, List
+
+import aio_pika
+
+logger = logging.getLogger(__name__)
+
+# Delay before each retry; a per-queue TTL keeps expiry in order
+NOTIFICATION_RETRY_DELAYS_MS = [
+    int(delay) for delay in os.getenv("NOTIFICATION_RETRY_DELAYS_MS", "5000,30000,120000").split(",") if delay.strip()
+]
+# Deliveries before a message is parked (first attempt included)
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "4"))
+
+POISON_QUEUE = "notification.poison"
+RETRY_COUNT_HEADER = "x-retry-count"
+ORIGINAL_QUEUE_HEADER = "x-original-queue"
+ERROR_HEADER = "x-last-error"
+
+
+def retry_queue_name(queue_name: str, delay_ms: int) -> str:
+    return f"{queue_name}.retry.{delay_ms}ms"
+
+
+def retry_count(message) -> int:
+    headers = message.headers or {}
+    try:
+        return int(headers.get(RETRY_COUNT_HEADER, 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+class RetryTopology:
+    """Declares the delay and poison queues and routes failed messages into them"""
+
+    def __init__(
+        self,
+        channel,
+        delays_ms: List[int] = NOTIFICATION_RETRY_DELAYS_MS,
+        max_attempts: int = NOTIFICATION_MAX_ATTEMPTS,
+    ):
+        self.channel = channel
+        self.delays_ms = list(delays_ms) or [5000]
+        self.max_attempts = max_attempts
+        self.retried = 0
+        self.parked = 0
+
+    async def declare(self, queue_names: Iterable[str]):
+        """Delay queues for every work queue, plus the poison queue"""
+        for queue_name in queue_names:
+            for delay_ms in sorted(set(self.delays_ms)):
+                await self.channel.declare_queue(
+                    retry_queue_name(queue_name, delay_ms),
+                    durable=True,
+                    arguments={
+                        "x-message-ttl": delay_ms,
+                        # Expired messages go back to the work queue via the default exchange
+                        "x-dead-letter-exchange": "",
+                        "x-dead-letter-routing-key": queue_name,
+                    },
+                )
+        await self.channel.declare_queue(POISON_QUEUE, durable=True)
+
+    def delay_for(self, retries: int) -> int:
+        return self.delays_ms[min(retries, len(self.delays_ms) - 1)]
+
+    def _copy(self, message, headers: Dict[str, Any]) -> aio_pika.Message:
+        return aio_pika.Message(
+            body=message.body,
+            headers={**(message.headers or {}), **headers},
+            content_type=message.content_type,
+            message_id=message.message_id,
+            priority=message.priority,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        )
+
+    async def schedule(self, message, queue_name: str, error: str) -> str:
+        """
+        Publish a failed message to its next delay queue, or park it
+        The caller acknowledges the original once this returns (publisher
+        confirms make the copy durable first); returns the queue used
+        """
+        retries = retry_count(message)
+        if retries + 1 >= self.max_attempts:
+            target = POISON_QUEUE
+            headers = {RETRY_COUNT_HEADER: retries, ORIGINAL_QUEUE_HEADER: queue_name, ERROR_HEADER: error[:500]}
+            self.parked += 1
+            logger.error(f"Message {message.message_id} from {queue_name} failed {retries + 1} times; parked in {target}")
+        else:
+            delay_ms = self.delay_for(retries)
+            target = retry_queue_name(queue_name, delay_ms)
+            headers = {RETRY_COUNT_HEADER: retries + 1, ERROR_HEADER: error[:500]}
+            self.retried += 1
+            logger.warning(f"Retrying message from {queue_name} in {delay_ms}ms (retry {retries + 1})")
+
+        await self.channel.default_exchange.publish(self._copy(message, headers), routing_key=target)
+        return target
+
+    async def park(self, body: bytes, origin: str, error: str):
+        """Park a document that is not a delivered message (e.g. an unstored notification log)"""
+        message = aio_pika.Message(
+            body=body,
+            headers={ORIGINAL_QUEUE_HEADER: origin, ERROR_HEADER: error[:500]},
+            content_type="application/json",
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        )
+        await self.channel.default_exchange.publish(message, routing_key=POISON_QUEUE)
+        self.parked += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"retried": self.retried, "parked": self.parked}
@@ -0,0 +1,215 @@
+"""
+SMTP connection pool for Notification Service
+Keeps authenticated SMTP sessions open between emails so each message costs a
+MAIL/RCPT/DATA exchange instead of TCP connect, STARTTLS and AUTH.
+
+A session idle for longer than SMTP_POOL_HEALTH_CHECK_SECONDS is checked with
+NOOP before reuse. Sessions are retired after SMTP_POOL_MAX_MESSAGES messages
+(providers cap messages per connection) and closed after SMTP_POOL_IDLE_SECONDS
+without use. A message that fails because a reused session went away is
+retried once on a fresh session.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import aiosmtplib
+
+logger = logging.getLogger(__name__)
+
+# Open sessions per worker process (0 disables pooling: one session per email)
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+SMTP_POOL_MAX_MESSAGES = int(os.getenv("SMTP_POOL_MAX_MESSAGES", "100"))
+SMTP_POOL_IDLE_SECONDS = float(os.getenv("SMTP_POOL_IDLE_SECONDS", "60"))
+SMTP_POOL_HEALTH_CHECK_SECONDS = float(os.getenv("SMTP_POOL_HEALTH_CHECK_SECONDS", "15"))
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+
+
+class PooledConnection:
+    """An authenticated SMTP session and its usage"""
+
+    def __init__(self, smtp, now: float):
+        self.smtp = smtp
+        self.created_at = now
+        self.last_used = now
+        self.messages = 0
+
+
+class SMTPConnectionPool:
+    """Bounded pool of long-lived, authenticated SMTP sessions"""
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: str,
+        password: str,
+        size: int = SMTP_POOL_SIZE,
+        max_messages: int = SMTP_POOL_MAX_MESSAGES,
+        idle_seconds: float = SMTP_POOL_IDLE_SECONDS,
+        health_check_seconds: float = SMTP_POOL_HEALTH_CHECK_SECONDS,
+        timeout: float = SMTP_TIMEOUT_SECONDS,
+        connection_factory: Optional[Callable[[], Any]] = None,
+        clock=time.monotonic,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.max_messages = max_messages
+        self.idle_seconds = idle_seconds
+        self.health_check_seconds = health_check_seconds
+        self.timeout = timeout
+        self.connection_factory = connection_factory or self._new_smtp
+        self.clock = clock
+
+        self.idle: List[PooledConnection] = []
+        self.semaphore = asyncio.Semaphore(max(size, 1))
+        self.opened = 0
+        self.reused = 0
+        self.retired = 0
+        self._reaper: Optional[asyncio.Task] = None
+
+    def _new_smtp(self):
+        return aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            start_tls=True,
+            username=self.username,
+            password=self.password,
+            timeout=self.timeout,
+        )
+
+    async def _open(self) -> PooledConnection:
+        smtp = self.connection_factory()
+        # connect() also runs STARTTLS and AUTH when credentials are set
+        await smtp.connect()
+        self.opened += 1
+        return PooledConnection(smtp, self.clock())
+
+    async def _discard(self, connection: PooledConnection):
+        self.retired += 1
+        try:
+            if connection.smtp.is_connected:
+                await connection.smtp.quit()
+        except Exception:
+            connection.smtp.close()
+
+    async def _healthy(self, connection: PooledConnection) -> bool:
+        if not connection.smtp.is_connected:
+            return False
+        if self.clock() - connection.last_used < self.health_check_seconds:
+            return True
+        try:
+            await connection.smtp.noop()
+            return True
+        except Exception as e:
+            logger.info(f"Pooled SMTP session failed health check: {e}")
+            return False
+
+    async def _checkout(self) -> PooledConnection:
+        """Most recently used healthy idle session, or a new one"""
+        while self.idle:
+            connection = self.idle.pop()
+            if self.clock() - connection.last_used > self.idle_seconds or not await self._healthy(connection):
+                await self._discard(connection)
+                continue
+            self.reused += 1
+            return connection
+        return await self._open()
+
+    async def _checkin(self, connection: PooledConnection):
+        connection.last_used = self.clock()
+        if connection.messages >= self.max_messages or not connection.smtp.is_connected:
+            await self._discard(connection)
+        else:
+            self.idle.append(connection)
+            self._start_reaper()
+
+    @asynccontextmanager
+    async def connection(self):
+        """Borrow a session; it is returned on success and discarded on error"""
+        async with self.semaphore:
+            connection = await self._checkout()
+            try:
+                yield connection
+            except (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused):
+                # The server answered (e.g. recipient refused): the session is still usable
+                await self._checkin(connection)
+                raise
+            except BaseException:
+                await self._discard(connection)
+                raise
+            else:
+                await self._checkin(connection)
+
+    async def send_message(self, message) -> Any:
+        """Send an EmailMessage over a pooled session"""
+        if self.size <= 0:
+            return await aiosmtplib.send(
+                message,
+                hostname=self.hostname,
+                port=self.port,
+                start_tls=True,
+                username=self.username,
+                password=self.password,
+                timeout=self.timeout,
+            )
+
+        for attempt in range(2):
+            reused = False
+            try:
+                async with self.connection() as connection:
+                    reused = connection.messages > 0
+                    connection.messages += 1
+                    return await connection.smtp.send_message(message)
+            except (aiosmtplib.SMTPServerDisconnected, ConnectionError) as e:
+                if not reused or attempt:
+                    raise
+                # A reused session went away between the health check and the send
+                logger.info(f"Pooled SMTP session dropped, retrying on a new one: {e}")
+
+    async def evict_idle(self):
+        """Close sessions idle longer than idle_seconds"""
+        now = self.clock()
+        expired = [connection for connection in self.idle if now - connection.last_used > self.idle_seconds]
+        self.idle = [connection for connection in self.idle if connection not in expired]
+        for connection in expired:
+            await self._discard(connection)
+
+    def _start_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(max(self.idle_seconds / 2, 1))
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Error evicting idle SMTP sessions: {e}")
+            if not self.idle:
+                return
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self.size,
+            "idle": len(self.idle),
+            "opened": self.opened,
+            "reused": self.reused,
+            "retired": self.retired,
+        }
+
+    async def close(self):
+        """Quit every idle session"""
+        if self._reaper and not self._reaper.done():
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+        idle, self.idle = self.idle, []
+        for connection in idle:
+            await self._discard(connection)
@@ -0,0 +1,201 @@
+"""
+Email template registry for Notification Service
+Loads the HTML templates in templates/ once at startup, inlines their static
+CSS and compiles them, so rendering a notification is a single call into
+already-compiled code.
+
+Compiled templates are kept in a Jinja bytecode cache under
+TEMPLATE_CACHE_DIR: later processes skip parsing and compiling and start
+faster. The cache key includes the (CSS-inlined) source, so editing a template
+invalidates its entry; running processes pick up edits on restart.
+
+CSS is inlined because many mail clients drop <style> blocks. Rules with a tag,
+.class or tag.class selector are copied into the style attribute of every
+matching element; anything else stays in the <style> block.
+"""
+
+import logging
+import os
+import re
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template, TemplateNotFound
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.getenv("TEMPLATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates"))
+# Persistent compiled-template cache (empty disables it)
+TEMPLATE_CACHE_DIR = os.getenv(
+    "TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "notification-template-cache")
+)
+
+STYLE_BLOCK = re.compile(r"\s*<style[^>]*>(.*?)</style>", re.S | re.I)
+CSS_RULE = re.compile(r"([^{}]+)\{([^{}]*)\}")
+SIMPLE_SELECTOR = re.compile(r"[a-zA-Z][a-zA-Z0-9]*|[a-zA-Z0-9]*\.[a-zA-Z_-][a-zA-Z0-9_-]*")
+OPENING_TAG = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)(\s[^<>]*?)?(\s*/?)>")
+CLASS_ATTR = re.compile(r'\sclass="([^"]*)"')
+STYLE_ATTR = re.compile(r'\sstyle="([^"]*)"')
+
+# Representative data for render benchmarks
+SAMPLE_DATA: Dict[str, Dict[str, Any]] = {
+    "booking_confirmation": {
+        "booking_id": "booking_123", "movie_title": "Inception", "showtime": "2024-12-15 19:30",
+        "seats": ["A1", "A2", "A3"], "total_amount": 45.0,
+    },
+    "booking_receipt": {
+        "booking_id": "booking_123", "movie_title": "Inception", "showtime": "2024-12-15 19:30",
+        "seats": ["A1", "A2", "A3"], "total_amount": 45.0,
+        "transaction_id": "txn_123", "amount": 45.0, "payment_method": "credit_card",
+    },
+    "booking_cancellation": {"booking_id": "booking_123", "cancellation_reason": "User request"},
+    "payment_success": {
+        "booking_id": "booking_123", "transaction_id": "txn_123", "amount": 45.0, "payment_method": "credit_card",
+    },
+    "payment_failed": {
+        "booking_id": "booking_123", "transaction_id": "txn_123", "amount": 45.0,
+        "payment_method": "credit_card", "failure_reason": "Insufficient funds",
+    },
+    "payment_refund": {
+        "booking_id": "booking_123", "original_transaction_id": "txn_123",
+        "refund_transaction_id": "refund_456", "refund_amount": 45.0,
+    },
+    "smtp_test": {"service_name": "Movie Ticket Booking System", "test_time": "now", "status": "operational"},
+}
+
+
+def _declarations(body: str) -> List[str]:
+    return [declaration.strip() for declaration in body.split(";") if declaration.strip()]
+
+
+def inline_css(source: str) -> str:
+    """Copy simple <style> rules into style attributes; leave the rest in place"""
+    blocks = STYLE_BLOCK.findall(source)
+    if not blocks:
+        return source
+
+    rules: Dict[str, List[str]] = {}
+    leftover: List[str] = []
+    for block in blocks:
+        for selectors, body in CSS_RULE.findall(block):
+            for selector in (part.strip() for part in selectors.split(",")):
+                if SIMPLE_SELECTOR.fullmatch(selector):
+                    rules.setdefault(selector.lower(), []).extend(_declarations(body))
+                else:
+                    leftover.append(f"{selector} {{ {body.strip()} }}")
+
+    def inline(match: re.Match) -> str:
+        tag, attributes, closing = match.group(1).lower(), match.group(2) or "", match.group(3)
+        class_attr = CLASS_ATTR.search(attributes)
+        classes = class_attr.group(1).split() if class_attr else []
+
+        # Tag rules, then class rules, then the element's own style (highest precedence)
+        declarations = list(rules.get(tag, []))
+        for name in classes:
+            declarations += rules.get(f".{name.lower()}", []) + rules.get(f"{tag}.{name.lower()}", [])
+        if not declarations:
+            return match.group(0)
+
+        own_style = STYLE_ATTR.search(attributes)
+        if own_style:
+            declarations += _declarations(own_style.group(1))
+            attributes = STYLE_ATTR.sub("", attributes)
+        return f'<{match.group(1)}{attributes} style="{"; ".join(declarations)}"{closing}>'
+
+    # The first <style> block keeps the rules that could not be inlined
+    remaining = ["\n<style>\n" + "\n".join(leftover) + "\n</style>" if leftover else ""]
+    source = STYLE_BLOCK.sub(lambda match: remaining.pop() if remaining else "", source)
+    head, separator, body = source.partition("<body")
+    if not separator:
+        return OPENING_TAG.sub(inline, source)
+    return head + OPENING_TAG.sub(inline, separator + body)
+
+
+class InliningLoader(FileSystemLoader):
+    """FileSystemLoader that hands Jinja the CSS-inlined source"""
+
+    def get_source(self, environment: Environment, template: str) -> Tuple[str, Optional[str], Any]:
+        source, filename, uptodate = super().get_source(environment, template)
+        return inline_css(source), filename, uptodate
+
+
+class TemplateRegistry:
+    """Precompiled email templates by name"""
+
+    def __init__(self, directory: str = TEMPLATE_DIR, cache_dir: Optional[str] = TEMPLATE_CACHE_DIR):
+        bytecode_cache = None
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                bytecode_cache = FileSystemBytecodeCache(cache_dir)
+            except OSError as e:
+                logger.warning(f"Template bytecode cache disabled, {cache_dir} is not writable: {e}")
+
+        self.environment = Environment(
+            loader=InliningLoader(directory),
+            bytecode_cache=bytecode_cache,
+            # Templates are compiled once; don't stat the files on every render
+            auto_reload=False,
+        )
+        self.templates: Dict[str, Template] = {}
+        self.load()
+
+    def load(self):
+        """Compile every template in the directory"""
+        started = time.perf_counter()
+        self.templates = {
+            name.rsplit(".", 1)[0]: self.environment.get_template(name)
+            for name in self.environment.list_templates(extensions=["html"])
+        }
+        logger.info(
+            f"Loaded {len(self.templates)} email templates in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+
+    def names(self) -> List[str]:
+        return sorted(self.templates)
+
+    def get(self, name: str) -> Template:
+        try:
+            return self.templates[name]
+        except KeyError:
+            raise TemplateNotFound(name) from None
+
+    def render(self, name: str, data: Dict[str, Any]) -> str:
+        return self.get(name).render(**data)
+
+    def benchmark(self, iterations: int = 1000, data: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, float]]:
+        """Render every template `iterations` times; per-template latency in microseconds"""
+        data = data or SAMPLE_DATA
+        results = {}
+        for name in self.names():
+            template, context = self.templates[name], data.get(name, {})
+            timings = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                html = template.render(**context)
+                timings.append((time.perf_counter() - started) * 1_000_000)
+            timings.sort()
+            results[name] = {
+                "mean_us": round(statistics.fmean(timings), 1),
+                "p50_us": round(timings[len(timings) // 2], 1),
+                "p99_us": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 1),
+                "bytes": len(html.encode()),
+            }
+        return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Benchmark email template rendering")
+    parser.add_argument("--iterations", type=int, default=1000, help="Renders per template")
+    args = parser.parse_args()
+
+    results = TemplateRegistry().benchmark(args.iterations)
+    print(f"{'template':<24}{'mean_us':>10}{'p50_us':>10}{'p99_us':>10}{'bytes':>8}")
+    for name, result in results.items():
+        print(f"{name:<24}{result['mean_us']:>10}{result['p50_us']:>10}{result['p99_us']:>10}{result['bytes']:>8}")
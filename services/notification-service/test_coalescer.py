@@ -0,0 +1,111 @@
+"""
+Unit tests for notification coalescing
+Tests digest emails for related events, pass-through and shared outcomes
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+
+from coalescer import NotificationCoalescer
+from worker import BOOKING_DIGEST_SUBJECT, NotificationWorker
+
+
+def make_worker(window_ms: float = 200) -> NotificationWorker:
+    worker = NotificationWorker()
+    worker.coalescer = NotificationCoalescer(window_ms=window_ms)
+    worker.send_email_notification = AsyncMock()
+    worker.log_notification = AsyncMock()
+    return worker
+
+
+def booking_confirmed(booking_id: str = "booking_1") -> dict:
+    return {
+        "event_id": f"evt_booking_{booking_id}",
+        "event_type": "booking.confirmed",
+        "booking_id": booking_id,
+        "user_id": "user_1",
+        "seats": ["A1", "A2"],
+        "total_amount": 30.0,
+    }
+
+
+def payment_success(booking_id: str = "booking_1") -> dict:
+    return {
+        "event_id": f"evt_payment_{booking_id}",
+        "event_type": "payment.success",
+        "booking_id": booking_id,
+        "user_id": "user_1",
+        "transaction_id": "txn_1",
+        "amount": 30.0,
+        "payment_method": "credit_card",
+    }
+
+
+class TestCoalescing:
+    """Test cases for merging related events into one email"""
+
+    @pytest.mark.asyncio
+    async def test_related_events_send_one_digest(self):
+        worker = make_worker(window_ms=5000)
+
+        results = await asyncio.wait_for(asyncio.gather(
+            worker.handle_event("booking.confirmed", booking_confirmed()),
+            worker.handle_payment_event("payment.success", payment_success()),
+        ), timeout=1)
+
+        assert results == [True, True]
+        worker.send_email_notification.assert_awaited_once()
+        email = worker.send_email_notification.call_args[1]
+        assert email["template"] == "booking_receipt"
+        assert email["data"]["seats"] == ["A1", "A2"] and email["data"]["transaction_id"] == "txn_1"
+
+        logged = sorted(call[1]["event_id"] for call in worker.log_notification.call_args_list)
+        assert logged == ["evt_booking_booking_1", "evt_payment_booking_1"]
+        assert {call[1]["subject"] for call in worker.log_notification.call_args_list} == {BOOKING_DIGEST_SUBJECT}
+        assert worker.coalescer.stats() == {"pending": 0, "digests": 1, "singles": 0}
+
+    @pytest.mark.asyncio
+    async def test_lone_event_sent_after_window(self):
+        worker = make_worker(window_ms=20)
+
+        assert await worker.handle_event("booking.confirmed", booking_confirmed()) is True
+
+        assert worker.send_email_notification.call_args[1]["template"] == "booking_confirmation"
+        assert worker.coalescer.stats()["singles"] == 1
+
+    @pytest.mark.asyncio
+    async def test_other_events_pass_straight_through(self):
+        worker = make_worker(window_ms=5000)
+        event = {"event_id": "evt_2", "booking_id": "booking_1", "user_id": "user_1"}
+
+        await asyncio.wait_for(worker.handle_event("booking.cancelled", event), timeout=0.1)
+
+        assert worker.send_email_notification.call_args[1]["template"] == "booking_cancellation"
+        assert worker.coalescer.pending == {}
+
+    @pytest.mark.asyncio
+    async def test_republished_event_is_not_merged(self):
+        worker = make_worker(window_ms=50)
+
+        results = await asyncio.gather(
+            worker.handle_event("booking.confirmed", booking_confirmed()),
+            worker.handle_event("booking.confirmed", booking_confirmed()),
+        )
+
+        assert results == [True, True]
+        templates = [call[1]["template"] for call in worker.send_email_notification.call_args_list]
+        assert templates == ["booking_confirmation", "booking_confirmation"]
+
+    @pytest.mark.asyncio
+    async def test_failed_digest_fails_every_event(self):
+        worker = make_worker(window_ms=5000)
+        worker.send_booking_digest = AsyncMock(side_effect=ConnectionError("smtp down"))
+
+        results = await asyncio.gather(
+            worker.handle_event("booking.confirmed", booking_confirmed()),
+            worker.handle_payment_event("payment.success", payment_success()),
+        )
+
+        assert results == [False, False]
+        worker.log_notification.assert_not_awaited()
@@ -0,0 +1,122 @@
+"""
+Unit tests for the notification consumer pool
+Tests lane configuration, channel setup and bounded handler concurrency
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from consumer_pool import ConsumerPool, LaneConfig, lane_config
+
+
+def make_connection():
+    connection = MagicMock()
+    channels = []
+
+    async def open_channel():
+        channel = MagicMock()
+        channel.set_qos = AsyncMock()
+        channel.close = AsyncMock()
+        channel.is_closed = False
+        channel.get_queue = AsyncMock(return_value=MagicMock(consume=AsyncMock()))
+        channels.append(channel)
+        return channel
+
+    connection.channel = AsyncMock(side_effect=open_channel)
+    return connection, channels
+
+
+class BlockingHandler:
+    """Handler that holds every message until released"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = 0
+
+    async def __call__(self, message):
+        self.started += 1
+        await self.release.wait()
+
+
+class TestLaneConfig:
+    """Test cases for per-queue settings"""
+
+    def test_prefetch_defaults_to_concurrency(self, monkeypatch):
+        monkeypatch.setenv("NOTIFICATION_BOOKING_CONCURRENCY", "4")
+        monkeypatch.setenv("NOTIFICATION_BOOKING_CHANNELS", "2")
+        monkeypatch.delenv("NOTIFICATION_BOOKING_PREFETCH", raising=False)
+
+        assert lane_config("booking") == LaneConfig(channels=2, prefetch=4, concurrency=4)
+
+    def test_prefetch_override(self, monkeypatch):
+        monkeypatch.setenv("NOTIFICATION_PAYMENT_PREFETCH", "25")
+
+        assert lane_config("payment").prefetch == 25
+
+
+class TestConsumerPool:
+    """Test cases for channels and bounded handler slots"""
+
+    @pytest.mark.asyncio
+    async def test_each_channel_has_its_own_prefetch(self):
+        connection, channels = make_connection()
+        pool = ConsumerPool(connection)
+
+        await pool.consume("notification.payment_events", AsyncMock(), LaneConfig(channels=3, prefetch=5))
+
+        assert len(channels) == 3
+        for channel in channels:
+            channel.set_qos.assert_awaited_once_with(prefetch_count=5)
+            channel.get_queue.assert_awaited_once_with("notification.payment_events")
+        assert pool.stats()["notification.payment_events"]["channels"] == 3
+
+        await pool.close()
+        assert all(channel.close.await_count == 1 for channel in channels)
+
+    @pytest.mark.asyncio
+    async def test_concurrency_is_bounded(self):
+        connection, _ = make_connection()
+        handler = BlockingHandler()
+        pool = ConsumerPool(connection)
+        lane = await pool.consume("notification.booking_events", handler, LaneConfig(prefetch=5, concurrency=2))
+
+        tasks = [asyncio.ensure_future(lane.dispatch(MagicMock())) for _ in range(5)]
+        await asyncio.sleep(0)
+
+        assert handler.started == 2
+        assert (lane.in_flight, lane.waiting) == (2, 3)
+
+        handler.release.set()
+        await asyncio.gather(*tasks)
+        assert lane.handled == 5 and lane.in_flight == 0 and lane.waiting == 0
+
+    @pytest.mark.asyncio
+    async def test_saturated_lane_does_not_block_another(self):
+        connection, _ = make_connection()
+        slow = BlockingHandler()
+        fast = AsyncMock()
+        pool = ConsumerPool(connection)
+        payments = await pool.consume("notification.payment_events", slow, LaneConfig(concurrency=1))
+        bookings = await pool.consume("notification.booking_events", fast, LaneConfig(concurrency=1))
+
+        burst = [asyncio.ensure_future(payments.dispatch(MagicMock())) for _ in range(10)]
+        await asyncio.wait_for(bookings.dispatch(MagicMock()), timeout=1)
+
+        fast.assert_awaited_once()
+        assert payments.waiting == 9
+
+        slow.release.set()
+        await asyncio.gather(*burst)
+
+    @pytest.mark.asyncio
+    async def test_handler_errors_propagate_and_free_the_slot(self):
+        connection, _ = make_connection()
+        pool = ConsumerPool(connection)
+        lane = await pool.consume("q", AsyncMock(side_effect=RuntimeError("smtp down")), LaneConfig(concurrency=1))
+
+        with pytest.raises(RuntimeError):
+            await lane.dispatch(MagicMock())
+
+        assert lane.errors == 1 and lane.in_flight == 0
+        assert not lane.slots.locked()
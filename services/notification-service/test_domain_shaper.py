@@ -0,0 +1,147 @@
+"""
+Unit tests for per-domain email rate shaping
+Tests token buckets, deferral to the local queue, fail-fast, provider throttling and failed events
+"""
+
+import asyncio
+import pytest
+import aiosmtplib
+from unittest.mock import AsyncMock
+
+from domain_shaper import (
+    DomainLimits, DomainShaper, DomainThrottled, TokenBucket, parse_domain_limits,
+)
+from worker import NotificationWorker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket:
+    """Test cases for burst and refill"""
+
+    def test_burst_then_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=3, clock=clock)
+
+        assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+        assert bucket.wait_time() == pytest.approx(0.5)
+        clock.now += 0.5
+        assert bucket.take()
+
+    def test_limits_from_env_format(self):
+        limits = parse_domain_limits("gmail.com=20:40:4, Example.org=1")
+        assert limits["gmail.com"] == DomainLimits(rate=20, burst=40, concurrency=4)
+        assert limits["example.org"].rate == 1
+
+
+class TestDomainShaper:
+    """Test cases for deferral and fail-fast per domain"""
+
+    @pytest.mark.asyncio
+    async def test_throttled_domain_defers_while_others_send(self):
+        shaper = DomainShaper(DomainLimits(rate=50, burst=1, concurrency=5), overrides={}, queue_size=5)
+        sent = []
+
+        def send(name):
+            async def deliver():
+                sent.append(name)
+            return deliver
+
+        await shaper.send("a@gmail.com", send("gmail-1"))
+        deferred = asyncio.ensure_future(shaper.send("b@gmail.com", send("gmail-2")))
+        await asyncio.sleep(0)
+        await shaper.send("c@outlook.com", send("outlook-1"))
+
+        assert sent == ["gmail-1", "outlook-1"]
+        assert shaper.stats()["domains"]["gmail.com"]["queued"] == 1
+
+        await asyncio.wait_for(deferred, timeout=1)
+        assert sent[-1] == "gmail-2"
+        assert shaper.stats()["deferred"] == 1 and shaper.stats()["queued"] == 0
+
+    @pytest.mark.asyncio
+    async def test_full_queue_fails_fast(self):
+        shaper = DomainShaper(DomainLimits(rate=0.001, burst=1, concurrency=1), overrides={}, queue_size=1)
+        await shaper.send("a@gmail.com", AsyncMock())
+        waiting = asyncio.ensure_future(shaper.send("b@gmail.com", AsyncMock()))
+        await asyncio.sleep(0)
+
+        with pytest.raises(DomainThrottled):
+            await shaper.send("c@gmail.com", AsyncMock())
+
+        assert shaper.stats()["rejected"] == 1
+        await shaper.close()
+        with pytest.raises(DomainThrottled):
+            await waiting
+
+    @pytest.mark.asyncio
+    async def test_concurrency_cap_per_domain(self):
+        shaper = DomainShaper(DomainLimits(rate=1000, burst=100, concurrency=1), overrides={})
+        release = asyncio.Event()
+        active = []
+
+        async def slow():
+            active.append(1)
+            await release.wait()
+
+        first = asyncio.ensure_future(shaper.send("a@gmail.com", slow))
+        second = asyncio.ensure_future(shaper.send("b@gmail.com", slow))
+        await asyncio.sleep(0.01)
+        assert len(active) == 1
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(first, second), timeout=1)
+        assert len(active) == 2
+
+    @pytest.mark.asyncio
+    async def test_provider_throttling_pauses_the_domain(self):
+        clock = FakeClock()
+        shaper = DomainShaper(DomainLimits(rate=10, burst=10), overrides={}, backoff_seconds=30, clock=clock)
+        throttled = AsyncMock(side_effect=aiosmtplib.SMTPResponseException(421, "Try again later"))
+
+        with pytest.raises(aiosmtplib.SMTPResponseException):
+            await shaper.send("a@gmail.com", throttled)
+
+        gmail = shaper.domains["gmail.com"]
+        assert not gmail.bucket.take()
+        assert shaper.stats()["domains"]["gmail.com"]["paused_for"] == 30
+        clock.now += 31
+        assert gmail.bucket.take()
+
+
+class TestWorkerThrottledSends:
+    """Test cases for sends rejected by the shaper failing their events"""
+
+    @pytest.mark.asyncio
+    async def test_rejected_sends_are_not_logged_as_sent(self):
+        worker = NotificationWorker()
+        email_service = worker.email_service
+        email_service.smtp_username = email_service.smtp_password = "secret"
+        email_service.test_configuration = lambda: True
+        email_service.shaper = DomainShaper(DomainLimits(rate=1000, burst=100, concurrency=1), overrides={}, queue_size=1)
+        release = asyncio.Event()
+
+        async def slow_send(message):
+            await release.wait()
+
+        email_service.pool.send_message = slow_send
+        worker.log_notification = AsyncMock()
+
+        # Every fallback recipient is @example.com, so all four share one domain
+        events = [
+            {"event_id": f"evt_{index}", "event_type": "booking.cancelled", "booking_id": "b1", "user_id": f"u{index}"}
+            for index in range(4)
+        ]
+        handlers = [asyncio.ensure_future(worker.handle_event("booking.cancelled", event)) for event in events]
+        await asyncio.sleep(0.01)
+        release.set()
+
+        assert await asyncio.gather(*handlers) == [True, True, False, False]
+        assert worker.log_notification.await_count == 2
+        assert email_service.shaper.stats()["rejected"] == 2
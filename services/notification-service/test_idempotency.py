@@ -0,0 +1,146 @@
+"""
+Unit tests for atomic idempotency claims
+Tests single and batched claims, pipelined transitions and the worker's use of them
+"""
+
+import asyncio
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from idempotency import IdempotencyStore, status_key
+from worker import NotificationWorker
+
+
+class FakePipeline:
+    """Queues commands and runs them against FakeRedis on execute"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append(lambda: self.redis.store.__setitem__(key, value.encode()) or True)
+        return self
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        results = [command() for command in self.commands]
+        self.commands = []
+        return results
+
+
+class FakeRedis:
+    """In-memory Redis running the claim script's logic atomically"""
+
+    def __init__(self):
+        self.store = {}
+        self.round_trips = 0
+
+    def register_script(self, script):
+        async def run(keys, args, client=None):
+            command = lambda: self._claim(keys[0])
+            if isinstance(client, FakePipeline):
+                client.commands.append(command)
+                return client
+            self.round_trips += 1
+            return command()
+        return run
+
+    def _claim(self, key):
+        prior = self.store.get(key)
+        if prior in (b"processing", b"processed"):
+            return prior
+        self.store[key] = b"processing"
+        return prior
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def get(self, key):
+        self.round_trips += 1
+        return self.store.get(key)
+
+    async def mget(self, keys):
+        self.round_trips += 1
+        return [self.store.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None):
+        self.round_trips += 1
+        self.store[key] = value.encode()
+
+
+class TestIdempotencyStore:
+    """Test cases for claims and transitions"""
+
+    @pytest.mark.asyncio
+    async def test_only_one_claim_wins(self):
+        store = IdempotencyStore(FakeRedis())
+
+        results = await asyncio.gather(store.claim("evt_1"), store.claim("evt_1"))
+
+        assert sorted(results, key=str) == [None, "processing"]
+
+    @pytest.mark.asyncio
+    async def test_failed_events_can_be_reclaimed(self):
+        redis = FakeRedis()
+        store = IdempotencyStore(redis)
+        await store.claim("evt_1")
+        await store.fail("evt_1")
+
+        assert await store.claim("evt_1") == "failed"
+        await store.complete("evt_1")
+        assert await store.claim("evt_1") == "processed"
+
+    @pytest.mark.asyncio
+    async def test_batched_claims_use_one_round_trip(self):
+        redis = FakeRedis()
+        redis.store[status_key("evt_2")] = b"processed"
+        store = IdempotencyStore(redis)
+
+        claims = await store.claim_many(["evt_1", "evt_2", "evt_3"])
+
+        assert claims == {"evt_1": None, "evt_2": "processed", "evt_3": None}
+        assert redis.round_trips == 1
+        assert await store.statuses(["evt_1", "evt_3"]) == {"evt_1": "processing", "evt_3": "processing"}
+
+    @pytest.mark.asyncio
+    async def test_transitions_join_the_callers_pipeline(self):
+        redis = FakeRedis()
+        store = IdempotencyStore(redis)
+        pipeline = redis.pipeline()
+
+        await store.complete_many(["evt_1", "evt_2"], pipeline=pipeline)
+        assert redis.store == {}
+
+        await pipeline.execute()
+        assert redis.store[status_key("evt_2")] == b"processed"
+        assert redis.round_trips == 1
+
+    @pytest.mark.asyncio
+    async def test_redis_outage_does_not_block_processing(self):
+        redis = MagicMock()
+        redis.register_script.return_value = AsyncMock(side_effect=ConnectionError("redis down"))
+
+        assert await IdempotencyStore(redis).claim("evt_1") is None
+
+
+class TestWorkerClaims:
+    """Test cases for claiming events before handling them"""
+
+    @pytest.mark.asyncio
+    async def test_duplicate_delivery_is_skipped(self):
+        worker = NotificationWorker()
+        worker.redis_client = FakeRedis()
+        worker.handle_event = AsyncMock(return_value=True)
+        worker.log_writer = MagicMock()
+
+        body = json.dumps({"event_id": "evt_1", "event_type": "booking.confirmed"}).encode()
+        for _ in range(2):
+            message = MagicMock(body=body)
+            message.process.return_value.__aenter__ = AsyncMock()
+            message.process.return_value.__aexit__ = AsyncMock(return_value=False)
+            await worker.process_message(message)
+
+        worker.handle_event.assert_awaited_once()
+        assert worker.redis_client.store[status_key("evt_1")] == b"processed"
@@ -0,0 +1,120 @@
+"""
+Unit tests for batched notification logging
+Tests size and time flushes, duplicate handling and waiting for logs before the ack
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from pymongo.errors import BulkWriteError
+
+from coalescer import NotificationCoalescer
+from notification_log import NotificationLogWriter, notification_log
+from worker import NotificationWorker
+
+
+def make_log(event_id: str = "evt_1", **event_data) -> dict:
+    event_data.setdefault("booking_id", "booking_1")
+    return notification_log(event_id, "email", "user@example.com", "Booking Confirmed", "sent", event_data)
+
+
+class TestNotificationLogWriter:
+    """Test cases for buffering and batch writes"""
+
+    @pytest.mark.asyncio
+    async def test_flushes_when_batch_is_full(self):
+        collection = MagicMock(insert_many=AsyncMock())
+        writer = NotificationLogWriter(collection, batch_size=3, flush_ms=10_000)
+
+        stored = [writer.add(make_log(f"evt_{index}")) for index in range(3)]
+        await asyncio.gather(*stored)
+
+        collection.insert_many.assert_awaited_once()
+        documents = collection.insert_many.call_args[0][0]
+        assert [document["event_id"] for document in documents] == ["evt_0", "evt_1", "evt_2"]
+        assert collection.insert_many.call_args[1] == {"ordered": False}
+
+    @pytest.mark.asyncio
+    async def test_flushes_after_interval(self):
+        collection = MagicMock(insert_many=AsyncMock())
+        writer = NotificationLogWriter(collection, batch_size=100, flush_ms=10)
+
+        await asyncio.wait_for(writer.write(make_log()), timeout=1)
+
+        assert writer.stats() == {
+            "buffered": 0, "batches": 1, "written": 1, "failed": 0, "retrying": 0, "retried": 0, "parked": 0,
+        }
+
+    @pytest.mark.asyncio
+    async def test_duplicates_count_as_stored(self):
+        error = BulkWriteError({"writeErrors": [
+            {"index": 0, "code": 11000, "errmsg": "duplicate"},
+            {"index": 1, "code": 121, "errmsg": "validation"},
+        ]})
+        collection = MagicMock(insert_many=AsyncMock(side_effect=error))
+        writer = NotificationLogWriter(collection, batch_size=2, retry_delays_ms=[])
+
+        duplicate, invalid = writer.add(make_log("evt_0")), writer.add(make_log("evt_1"))
+
+        await duplicate
+        with pytest.raises(BulkWriteError):
+            await invalid
+
+    def test_log_is_compact_and_idempotent(self):
+        event = {"event_type": "booking.confirmed", "booking_id": "b1", "seats": ["A1"] * 50}
+        first, second = make_log(**event), make_log(**event)
+
+        assert first["_id"] == second["_id"]
+        assert first["event_data"] == {"event_type": "booking.confirmed", "booking_id": "b1"}
+
+
+class TestAckAfterLogs:
+    """Test cases for tying log writes to message acknowledgement"""
+
+    @pytest.mark.asyncio
+    async def test_event_succeeds_once_logs_are_stored(self):
+        collection = MagicMock(insert_many=AsyncMock())
+        worker = NotificationWorker()
+        worker.log_writer = NotificationLogWriter(collection, flush_ms=10)
+        worker.send_email_notification = AsyncMock()
+        worker.coalescer = NotificationCoalescer(window_ms=0)
+
+        event = {"event_id": "evt_1", "event_type": "booking.confirmed", "booking_id": "b1", "user_id": "u1"}
+        success = await worker.handle_with_logs(worker.handle_event, "booking.confirmed", event)
+
+        assert success is True
+        collection.insert_many.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_unstored_log_does_not_fail_the_event(self):
+        collection = MagicMock(insert_many=AsyncMock(side_effect=[ConnectionError("mongo down"), None]))
+        worker = NotificationWorker()
+        worker.log_writer = NotificationLogWriter(collection, flush_ms=10, retry_delays_ms=[10])
+        worker.send_email_notification = AsyncMock()
+        processed = AsyncMock()
+
+        event = {"event_id": "evt_2", "event_type": "booking.cancelled", "booking_id": "b1", "user_id": "u1"}
+        success = await worker.handle_with_logs(worker.handle_event, "booking.cancelled", event, on_success=processed)
+
+        # The email went out and the event is complete; only the log is retried
+        assert success is True
+        processed.assert_awaited_once()
+        worker.send_email_notification.assert_awaited_once()
+        await asyncio.sleep(0.1)
+        assert collection.insert_many.await_count == 2
+        assert worker.log_writer.stats()["retried"] == 1
+
+    @pytest.mark.asyncio
+    async def test_log_is_parked_after_its_retries(self):
+        collection = MagicMock(insert_many=AsyncMock(side_effect=ConnectionError("mongo down")))
+        park = AsyncMock()
+        writer = NotificationLogWriter(collection, flush_ms=1, retry_delays_ms=[1], park=park)
+
+        with pytest.raises(ConnectionError):
+            await writer.add(make_log("evt_3"))
+        await asyncio.sleep(0.1)
+
+        assert collection.insert_many.await_count == 2
+        park.assert_awaited_once()
+        assert park.call_args[0][0]["event_id"] == "evt_3"
+        assert writer.stats()["parked"] == 1
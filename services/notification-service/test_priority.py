@@ -0,0 +1,97 @@
+"""
+Unit tests for notification priorities
+Tests priority tags, weighted-fair slot grants and confirmations overtaking bulk notices
+"""
+
+import asyncio
+import pytest
+from unittest.mock import MagicMock
+
+from consumer_pool import ConsumerPool, LaneConfig
+from priority import WeightedFairScheduler, message_priority, parse_weights, priority_class
+
+
+def make_message(routing_key: str, priority=None):
+    message = MagicMock()
+    message.routing_key = routing_key
+    message.priority = priority
+    return message
+
+
+class TestPriorityTags:
+    """Test cases for reading a message's priority"""
+
+    def test_publisher_tag_wins_over_event_default(self):
+        assert priority_class(message_priority(make_message("booking.confirmed"))) == "high"
+        assert priority_class(message_priority(make_message("payment.refunded"))) == "bulk"
+        assert priority_class(message_priority(make_message("payment.refunded", priority=8))) == "high"
+        assert priority_class(message_priority(make_message("unknown.event"))) == "normal"
+
+    def test_weights_from_env_format(self):
+        assert parse_weights("high=5,bulk=2,junk=9") == {"high": 5, "normal": 1, "bulk": 2}
+
+
+class TestWeightedFairScheduler:
+    """Test cases for granting handler slots by class weight"""
+
+    @pytest.mark.asyncio
+    async def test_grants_follow_weights_without_starving_bulk(self):
+        scheduler = WeightedFairScheduler(1, {"high": 3, "normal": 1, "bulk": 1})
+        await scheduler.acquire("bulk")
+
+        order = []
+
+        async def wait(name):
+            await scheduler.acquire(name)
+            order.append(name)
+
+        waiters = [asyncio.ensure_future(wait(name)) for name in ["bulk"] * 4 + ["high"] * 6]
+        await asyncio.sleep(0)
+        for _ in waiters:
+            scheduler.release()
+            await asyncio.sleep(0)
+
+        assert order[:4] == ["high", "high", "high", "bulk"]
+        assert order.count("bulk") == 4
+        await asyncio.gather(*waiters)
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        scheduler = WeightedFairScheduler(1)
+        await scheduler.acquire("bulk")
+        waiter = asyncio.ensure_future(scheduler.acquire("bulk"))
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        await asyncio.sleep(0)
+        scheduler.release()
+
+        assert scheduler.free == 1
+        assert scheduler.stats()["bulk"]["waiting"] == 0
+
+
+class TestPriorityLane:
+    """Test cases for confirmations overtaking a bulk backlog in one lane"""
+
+    @pytest.mark.asyncio
+    async def test_confirmation_overtakes_waiting_refunds(self):
+        connection = MagicMock()
+        pool = ConsumerPool(connection)
+        handled = []
+        release = asyncio.Event()
+
+        async def handler(message):
+            await release.wait()
+            handled.append(message.routing_key)
+
+        lane = await pool.consume("notification.booking_events", handler, LaneConfig(channels=0, concurrency=1))
+        refunds = [asyncio.ensure_future(lane.dispatch(make_message("booking.refunded"))) for _ in range(5)]
+        await asyncio.sleep(0)
+        confirmation = asyncio.ensure_future(lane.dispatch(make_message("booking.confirmed")))
+        await asyncio.sleep(0)
+
+        release.set()
+        await asyncio.gather(confirmation, *refunds)
+
+        assert handled[:2] == ["booking.refunded", "booking.confirmed"]
+        assert pool.stats()["notification.booking_events"]["priorities"]["high"]["granted"] == 1
@@ -0,0 +1,90 @@
+"""
+Unit tests for the redelivery cache
+Tests the bounded LRU, redeliveries answered locally and new events still claimed in Redis
+"""
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from redelivery_cache import RedeliveryCache
+from idempotency import IdempotencyStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_redis(prior=None):
+    redis = MagicMock()
+    redis.claim = AsyncMock(return_value=prior)
+    redis.register_script.return_value = redis.claim
+    redis.get = AsyncMock(return_value=None)
+    redis.set = AsyncMock()
+    return redis
+
+
+def make_cache(clock=None, **options):
+    return RedeliveryCache(clock=clock or FakeClock(), **options)
+
+
+class TestRedeliveryCache:
+    """Test cases for the bounded recent-events LRU"""
+
+    def test_lru_is_bounded_and_entries_expire(self):
+        clock = FakeClock()
+        cache = make_cache(clock, lru_size=2)
+        cache.record("evt_1", "processed", ttl=60)
+        cache.record("evt_2", "processed", ttl=60)
+        cache.get("evt_1")
+        cache.record("evt_3", "processing", ttl=5)
+
+        assert cache.get("evt_2") is None
+        assert cache.get("evt_1") == "processed"
+        clock.now += 6
+        assert cache.get("evt_3") is None
+        assert cache.stats()["lru_entries"] == 1
+
+
+class TestCachedStore:
+    """Test cases for which checks are answered locally and which reach Redis"""
+
+    @pytest.mark.asyncio
+    async def test_redelivery_answered_locally(self):
+        redis = make_redis()
+        store = IdempotencyStore(redis, recent=make_cache())
+
+        assert await store.claim("evt_1") is None
+        await store.complete("evt_1")
+        assert await store.claim("evt_1") == "processed"
+
+        assert redis.claim.await_count == 1
+        assert store.recent.stats()["lru_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_claims_of_unknown_events_still_reach_redis(self):
+        redis = make_redis(prior=b"processed")
+        store = IdempotencyStore(redis, recent=make_cache())
+
+        assert await store.claim("evt_elsewhere") == "processed"
+        assert await store.claim("evt_elsewhere") == "processed"
+        assert redis.claim.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_status_of_events_unknown_here_comes_from_redis(self):
+        redis = make_redis()
+        cache = make_cache(lru_size=1)
+        store = IdempotencyStore(redis, recent=cache)
+
+        # Another replica processed it: this worker never saw the event
+        redis.get.return_value = b"processed"
+        assert await store.status("evt_elsewhere") == "processed"
+
+        await store.claim("evt_1")
+        redis.get.reset_mock()
+        assert await store.status("evt_1") == "processing"
+        redis.get.assert_not_awaited()
+        assert cache.stats()["redis_checks"] == 1
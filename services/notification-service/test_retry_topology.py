@@ -0,0 +1,132 @@
+"""
+Unit tests for delayed retries
+Tests the delay queue declarations, retry tiers, parking and the worker's failure path
+"""
+
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from domain_shaper import DomainThrottled
+from retry_topology import POISON_QUEUE, RetryTopology, retry_count
+from worker import NotificationWorker
+
+
+def make_channel():
+    channel = MagicMock()
+    channel.declare_queue = AsyncMock()
+    channel.default_exchange.publish = AsyncMock()
+    return channel
+
+
+def make_message(headers=None, body=None):
+    message = MagicMock()
+    message.body = body or json.dumps({"event_id": "evt_1", "event_type": "booking.cancelled"}).encode()
+    message.headers = headers
+    message.content_type = "application/json"
+    message.message_id = "msg_1"
+    message.priority = None
+    message.process = MagicMock()
+    message.process.return_value.__aenter__ = AsyncMock()
+    message.process.return_value.__aexit__ = AsyncMock(return_value=False)
+    return message
+
+
+def published(channel):
+    outgoing, = channel.default_exchange.publish.call_args[0]
+    return outgoing, channel.default_exchange.publish.call_args[1]["routing_key"]
+
+
+class TestRetryTopology:
+    """Test cases for delay queues and poison parking"""
+
+    @pytest.mark.asyncio
+    async def test_declares_delay_queues_dead_lettering_to_work_queue(self):
+        channel = make_channel()
+        retries = RetryTopology(channel, delays_ms=[1000, 5000])
+
+        await retries.declare(["notification.booking_events"])
+
+        declared = {call[0][0]: call[1]["arguments"] for call in channel.declare_queue.call_args_list if "arguments" in call[1]}
+        assert declared["notification.booking_events.retry.5000ms"] == {
+            "x-message-ttl": 5000,
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": "notification.booking_events",
+        }
+        assert channel.declare_queue.call_args_list[-1][0][0] == POISON_QUEUE
+
+    @pytest.mark.asyncio
+    async def test_retries_walk_the_delay_tiers(self):
+        channel = make_channel()
+        retries = RetryTopology(channel, delays_ms=[1000, 5000], max_attempts=5)
+
+        targets = []
+        headers = None
+        for _ in range(3):
+            targets.append(await retries.schedule(make_message(headers), "notification.payment_events", "smtp down"))
+            outgoing, _ = published(channel)
+            headers = outgoing.headers
+
+        assert targets == [
+            "notification.payment_events.retry.1000ms",
+            "notification.payment_events.retry.5000ms",
+            "notification.payment_events.retry.5000ms",
+        ]
+        assert headers["x-retry-count"] == 3
+        assert outgoing.body == make_message().body
+
+    @pytest.mark.asyncio
+    async def test_parks_after_max_attempts(self):
+        channel = make_channel()
+        retries = RetryTopology(channel, delays_ms=[1000], max_attempts=3)
+
+        target = await retries.schedule(make_message({"x-retry-count": 2}), "notification.booking_events", "boom")
+
+        outgoing, routing_key = published(channel)
+        assert target == routing_key == POISON_QUEUE
+        assert outgoing.headers["x-original-queue"] == "notification.booking_events"
+        assert outgoing.headers["x-last-error"] == "boom"
+        assert retries.stats() == {"retried": 0, "parked": 1}
+
+    def test_missing_or_bad_header_counts_as_first_attempt(self):
+        assert retry_count(make_message()) == 0
+        assert retry_count(make_message({"x-retry-count": "junk"})) == 0
+
+
+class TestWorkerFailurePath:
+    """Test cases for failed handlers going to the delay queues"""
+
+    @pytest.mark.asyncio
+    async def test_failed_event_is_delayed_not_requeued(self):
+        worker = NotificationWorker()
+        worker.retries = RetryTopology(make_channel(), delays_ms=[1000])
+        worker._idempotency = MagicMock(claim=AsyncMock(return_value=None), fail=AsyncMock())
+        worker.redis_client = worker._idempotency.redis
+        worker.handle_with_logs = AsyncMock(return_value=False)
+        message = make_message()
+
+        await worker.process_message(message)
+
+        _, routing_key = published(worker.retries.channel)
+        assert routing_key == "notification.booking_events.retry.1000ms"
+        worker._idempotency.fail.assert_awaited_once_with("evt_1")
+        # Leaving the process() block without an exception acknowledges the original
+        assert message.process.return_value.__aexit__.call_args[0][0] is None
+
+    @pytest.mark.asyncio
+    async def test_throttled_send_is_delayed(self):
+        worker = NotificationWorker()
+        worker.retries = RetryTopology(make_channel(), delays_ms=[1000])
+        worker._idempotency = MagicMock(claim=AsyncMock(return_value=None), fail=AsyncMock(), complete=AsyncMock())
+        worker.redis_client = worker._idempotency.redis
+        worker.email_service.test_configuration = lambda: True
+        worker.email_service.send_email = AsyncMock(side_effect=DomainThrottled("Send queue for example.com is full"))
+        worker.log_notification = AsyncMock()
+        body = {"event_id": "evt_1", "event_type": "booking.cancelled", "booking_id": "b1", "user_id": "u1"}
+
+        await worker.process_message(make_message(body=json.dumps(body).encode()))
+
+        _, routing_key = published(worker.retries.channel)
+        assert routing_key == "notification.booking_events.retry.1000ms"
+        worker._idempotency.complete.assert_not_awaited()
+        worker.log_notification.assert_not_awaited()
@@ -0,0 +1,142 @@
+"""
+Unit tests for the SMTP connection pool
+Tests session reuse, health checks, message caps, idle eviction and reconnects
+"""
+
+import pytest
+from email.message import EmailMessage
+from unittest.mock import AsyncMock, MagicMock
+
+import aiosmtplib
+
+from smtp_pool import SMTPConnectionPool
+
+
+class FakeSMTP:
+    """SMTP session recording what it was asked to do"""
+
+    def __init__(self, fail_send=None):
+        self.is_connected = False
+        self.sent = []
+        self.fail_send = fail_send
+        self.connect = AsyncMock(side_effect=self._connect)
+        self.noop = AsyncMock()
+        self.quit = AsyncMock(side_effect=self._quit)
+        self.close = MagicMock()
+
+    async def _connect(self):
+        self.is_connected = True
+
+    async def _quit(self):
+        self.is_connected = False
+
+    async def send_message(self, message):
+        if self.fail_send:
+            error, self.fail_send = self.fail_send, None
+            self.is_connected = False
+            raise error
+        self.sent.append(message["To"])
+        return {}, "OK"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_message(to: str = "user@example.com") -> EmailMessage:
+    message = EmailMessage()
+    message["To"] = to
+    message.set_content("hello")
+    return message
+
+
+def make_pool(sessions, **options):
+    return SMTPConnectionPool(
+        "smtp.test", 587, "user", "secret",
+        connection_factory=lambda: sessions.append(FakeSMTP()) or sessions[-1],
+        **options,
+    )
+
+
+class TestSMTPConnectionPool:
+    """Test cases for pooled SMTP sessions"""
+
+    @pytest.mark.asyncio
+    async def test_session_is_reused(self):
+        sessions = []
+        pool = make_pool(sessions, size=2)
+
+        for index in range(3):
+            await pool.send_message(make_message(f"user{index}@example.com"))
+
+        assert len(sessions) == 1
+        sessions[0].connect.assert_awaited_once()
+        assert sessions[0].sent == ["user0@example.com", "user1@example.com", "user2@example.com"]
+        assert pool.stats()["reused"] == 2
+        await pool.close()
+        sessions[0].quit.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_session_retired_after_message_cap(self):
+        sessions = []
+        pool = make_pool(sessions, max_messages=2)
+
+        for _ in range(3):
+            await pool.send_message(make_message())
+
+        assert [len(session.sent) for session in sessions] == [2, 1]
+        sessions[0].quit.assert_awaited_once()
+        await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_health_check_and_idle_eviction(self):
+        clock = FakeClock()
+        sessions = []
+        pool = make_pool(sessions, clock=clock, health_check_seconds=10, idle_seconds=60)
+
+        await pool.send_message(make_message())
+        clock.now += 5
+        await pool.send_message(make_message())
+        sessions[0].noop.assert_not_awaited()
+
+        clock.now += 20
+        await pool.send_message(make_message())
+        sessions[0].noop.assert_awaited_once()
+
+        clock.now += 61
+        await pool.evict_idle()
+        assert pool.stats()["idle"] == 0
+        assert not sessions[0].is_connected
+        await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_dropped_session_is_replaced_and_message_retried(self):
+        sessions = []
+        pool = make_pool(sessions)
+        await pool.send_message(make_message())
+        sessions[0].fail_send = aiosmtplib.SMTPServerDisconnected("gone")
+
+        await pool.send_message(make_message("retry@example.com"))
+
+        assert len(sessions) == 2
+        assert sessions[1].sent == ["retry@example.com"]
+        assert pool.stats()["retired"] == 1
+        await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_refused_recipient_keeps_the_session(self):
+        sessions = []
+        pool = make_pool(sessions)
+        await pool.send_message(make_message())
+        session = sessions[0]
+        session.send_message = AsyncMock(side_effect=aiosmtplib.SMTPRecipientsRefused([]))
+
+        with pytest.raises(aiosmtplib.SMTPRecipientsRefused):
+            await pool.send_message(make_message("nobody@example.com"))
+
+        assert pool.idle[0].smtp is session
+        await pool.close()
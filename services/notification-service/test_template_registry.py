@@ -0,0 +1,73 @@
+"""
+Unit tests for the email template registry
+Tests CSS inlining, precompilation, the bytecode cache and render benchmarks
+"""
+
+import os
+import pytest
+from jinja2 import TemplateNotFound
+
+from template_registry import SAMPLE_DATA, TemplateRegistry, inline_css
+
+
+class TestInlineCss:
+    """Test cases for moving <style> rules into style attributes"""
+
+    def test_tag_and_class_rules_are_inlined(self):
+        html = inline_css(
+            "<html><head><style>body { color: #333; } .header { padding: 20px; }</style></head>"
+            '<body><div class="header">{{ title }}</div></body></html>'
+        )
+
+        assert "<style>" not in html
+        assert '<body style="color: #333">' in html
+        assert '<div class="header" style="padding: 20px">{{ title }}</div>' in html
+
+    def test_own_style_wins_and_complex_rules_stay(self):
+        html = inline_css(
+            "<style>p { margin: 0; } a:hover { color: red; }</style>"
+            '<body><p style="color: blue">x</p></body>'
+        )
+
+        assert '<p style="margin: 0; color: blue">' in html
+        assert "a:hover { color: red; }" in html
+
+    def test_head_elements_are_untouched(self):
+        html = inline_css("<head><title>t</title><style>title { color: red; }</style></head><body></body>")
+
+        assert "<title>t</title>" in html
+
+
+class TestTemplateRegistry:
+    """Test cases for loading and rendering templates"""
+
+    def test_all_templates_precompiled(self, tmp_path):
+        registry = TemplateRegistry(cache_dir=str(tmp_path))
+
+        assert set(SAMPLE_DATA) <= set(registry.names())
+        html = registry.render("payment_success", SAMPLE_DATA["payment_success"])
+        assert "txn_123" in html and "Credit_card" in html
+        assert "<style>" not in html
+        assert 'class="header" style="background: #27ae60' in html
+
+    def test_bytecode_cache_is_persistent(self, tmp_path):
+        TemplateRegistry(cache_dir=str(tmp_path))
+        cached = sorted(os.listdir(tmp_path))
+        assert len(cached) == len(SAMPLE_DATA)
+
+        # A second process loads from the cache without rewriting it
+        mtimes = {name: os.path.getmtime(tmp_path / name) for name in cached}
+        TemplateRegistry(cache_dir=str(tmp_path))
+        assert {name: os.path.getmtime(tmp_path / name) for name in cached} == mtimes
+
+    def test_unknown_template(self, tmp_path):
+        with pytest.raises(TemplateNotFound):
+            TemplateRegistry(cache_dir=str(tmp_path)).render("newsletter", {})
+
+    def test_benchmark_reports_every_template(self, tmp_path):
+        results = TemplateRegistry(cache_dir=str(tmp_path)).benchmark(iterations=5)
+
+        assert set(results) == set(SAMPLE_DATA)
+        for result in results.values():
+            assert result["bytes"] > 0
+            assert 0 < result["p50_us"] <= result["p99_us"]
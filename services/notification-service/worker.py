@@ -7,14 +7,22 @@ import asyncio
 import json
 import logging
 import os
-import uuid
-from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Any, Awaitable, Callable, Dict, Optional
 
 import aio_pika
 import redis.asyncio as redis
+from jinja2 import TemplateError
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from coalescer import NotificationCoalescer
+from consumer_pool import ConsumerPool, lane_config
+from redelivery_cache import RedeliveryCache
+from idempotency import CLAIMED_STATES, IdempotencyStore
+from notification_log import NotificationLogWriter, notification_log, pending_logs
+from priority import NOTIFICATION_MAX_PRIORITY
+from retry_topology import RetryTopology
+from shared.mongo_config import mongo_client_kwargs, warm_up_pool, write_concern
+
 # Import SMTP email service
 from smtp_service import SMTPEmailService
 
@@ -22,6 +30,12 @@ from smtp_service import SMTPEmailService
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+BOOKING_DIGEST_SUBJECT = "Booking Confirmed - Payment Receipt"
+
+
+class EmailDeliveryError(Exception):
+    """An email could not be sent; the event is retried"""
+
 
 class NotificationWorker:
     def __init__(self):
@@ -33,17 +47,31 @@ class NotificationWorker:
         # Redis for idempotency checking
         self.redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
         self.redis_client = None
+        self._idempotency = None
+        # Redeliveries of events this worker already claimed skip Redis
+        self.redelivery_cache = RedeliveryCache.from_env()
         
         # MongoDB for logging
         self.mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
         self.mongo_client = None
         self.db = None
+        self.log_writer = None
         
         # Connection objects
         self.connection = None
         self.channel = None
         self.exchange = None
         self.queue = None
+        self.consumer_pool = None
+        # Delay queues for failed messages and the poison queue
+        self.retries = None
+        
+        # Channels, prefetch and handler slots per queue
+        self.booking_lane = lane_config("booking")
+        self.payment_lane = lane_config("payment")
+        
+        # Merges booking.confirmed and payment.success of a booking into one email
+        self.coalescer = NotificationCoalescer()
         
         # Initialize SMTP email service
         self.email_service = SMTPEmailService()
@@ -52,8 +80,8 @@ class NotificationWorker:
         """Initialize all connections"""
         # Connect to RabbitMQ
         self.connection = await aio_pika.connect_robust(self.rabbitmq_url)
+        # This channel only declares the topology; consumers get their own channels
         self.channel = await self.connection.channel()
-        await self.channel.set_qos(prefetch_count=10)  # Process 10 messages concurrently
         
         # Declare exchange and queue
         self.exchange = await self.channel.declare_exchange(
@@ -65,7 +93,7 @@ class NotificationWorker:
         self.queue = await self.channel.declare_queue(
             self.queue_name,
             durable=True,
-            arguments={"x-dead-letter-exchange": f"{self.exchange_name}.dlx"}
+            arguments=self.work_queue_arguments()
         )
         
         # Bind queue to routing keys for booking events
@@ -77,29 +105,56 @@ class NotificationWorker:
         self.payment_queue = await self.channel.declare_queue(
             "notification.payment_events",
             durable=True,
-            arguments={"x-dead-letter-exchange": f"{self.exchange_name}.dlx"}
+            arguments=self.work_queue_arguments()
         )
         
         # Bind payment queue to payment routing keys
         await self.payment_queue.bind(self.exchange, "payment.success")
         await self.payment_queue.bind(self.exchange, "payment.failed")
+        await self.payment_queue.bind(self.exchange, "payment.refunded")
+        # Refunds published before the payment service switched to payment.refunded
         await self.payment_queue.bind(self.exchange, "payment.refund")
         
+        # Failed messages wait in TTL queues that dead-letter back to these work queues
+        self.retries = RetryTopology(self.channel)
+        await self.retries.declare([self.queue_name, "notification.payment_events"])
+        
+        self.consumer_pool = ConsumerPool(self.connection)
+        
         # Connect to Redis
         self.redis_client = redis.from_url(self.redis_url)
         
         # Connect to MongoDB
-        self.mongo_client = AsyncIOMotorClient(self.mongodb_uri)
-        self.db = self.mongo_client.movie_booking
+        self.mongo_client = AsyncIOMotorClient(self.mongodb_uri, **mongo_client_kwargs())
+        # notification_logs is an audit trail; a single acknowledgement is enough
+        self.db = self.mongo_client.get_database("movie_booking", write_concern=write_concern("logs"))
+        await warm_up_pool(self.mongo_client)
+        self.log_writer = NotificationLogWriter(self.db.notification_logs, park=self.park_log)
         
         logger.info("Notification worker initialized successfully")
 
+    def work_queue_arguments(self) -> Dict[str, Any]:
+        """
+        Arguments of the notification work queues
+        Queue arguments cannot change once declared: queues created before
+        priorities were enabled must be drained and deleted, or the worker run
+        with NOTIFICATION_MAX_PRIORITY=0
+        """
+        arguments = {"x-dead-letter-exchange": f"{self.exchange_name}.dlx"}
+        if NOTIFICATION_MAX_PRIORITY > 0:
+            # Queued confirmations are delivered ahead of queued bulk notices
+            arguments["x-max-priority"] = NOTIFICATION_MAX_PRIORITY
+        return arguments
+
     async def start_consuming(self):
         """Start consuming messages from RabbitMQ"""
         logger.info("Starting to consume messages...")
-        # Start consuming from both booking and payment queues
-        await self.queue.consume(self.process_message)
-        await self.payment_queue.consume(self.process_payment_message)
+        # Booking and payment queues are consumed independently so a burst on
+        # one cannot take the other's prefetch window or handler slots
+        await self.consumer_pool.consume(self.queue_name, self.process_message, self.booking_lane)
+        await self.consumer_pool.consume(
+            "notification.payment_events", self.process_payment_message, self.payment_lane
+        )
 
     async def process_message(self, message: aio_pika.IncomingMessage):
         """
@@ -119,24 +174,21 @@ class NotificationWorker:
                 
                 logger.info(f"Processing event: {event_type} with ID: {event_id}")
 
-                # CRITICAL: Check idempotency using Redis
-                # This ensures we don't process the same event multiple times
-                if await self.is_already_processed(event_id):
+                # CRITICAL: Claim the event atomically in Redis
+                # One round trip; of two consumers racing for an event only one wins
+                if await self.idempotency.claim(event_id) in CLAIMED_STATES:
                     logger.info(f"Event {event_id} already processed, skipping")
                     return
 
-                # Mark event as being processed
-                await self.mark_as_processing(event_id)
-
-                # Process the event based on type
-                success = await self.handle_event(event_type, body)
+                # Process the event based on type; it is marked processed before its logs are written
+                success = await self.handle_with_logs(
+                    self.handle_event, event_type, body, on_success=lambda: self.mark_as_processed(event_id)
+                )
 
                 if success:
-                    # Mark as successfully processed
-                    await self.mark_as_processed(event_id)
                     logger.info(f"Successfully processed event {event_id}")
                 else:
-                    # Mark as failed (will be retried)
+                    # Mark as failed (will be retried from a delay queue)
                     await self.mark_as_failed(event_id)
                     logger.error(f"Failed to process event {event_id}")
                     raise Exception("Event processing failed")
@@ -148,8 +200,8 @@ class NotificationWorker:
                 
             except Exception as e:
                 logger.error(f"Error processing message: {e}")
-                # This will cause the message to be requeued for retry
-                raise
+                # Retried after a delay instead of requeued straight back
+                await self.retry_later(message, self.queue_name, str(e))
 
     async def process_payment_message(self, message: aio_pika.IncomingMessage):
         """Process incoming payment events from RabbitMQ"""
@@ -162,19 +214,17 @@ class NotificationWorker:
                 
                 logger.info(f"Processing payment event: {event_type} with ID: {event_id}")
                 
-                # Check for idempotency
-                if await self.is_already_processed(event_id):
+                # Claim the event atomically (idempotency check and mark in one step)
+                if await self.idempotency.claim(event_id) in CLAIMED_STATES:
                     logger.info(f"Payment event {event_id} already processed, skipping")
                     return
                 
-                # Mark as processing
-                await self.mark_as_processing(event_id)
-                
-                # Handle the payment event
-                success = await self.handle_payment_event(event_type, body)
+                # Handle the payment event; it is marked processed before its logs are written
+                success = await self.handle_with_logs(
+                    self.handle_payment_event, event_type, body, on_success=lambda: self.mark_as_processed(event_id)
+                )
                 
                 if success:
-                    await self.mark_as_processed(event_id)
                     logger.info(f"Payment event {event_id} processed successfully")
                 else:
                     await self.mark_as_failed(event_id)
@@ -187,54 +237,81 @@ class NotificationWorker:
                 
             except Exception as e:
                 logger.error(f"Error processing payment message: {e}")
-                raise
+                await self.retry_later(message, "notification.payment_events", str(e))
+
+    async def retry_later(self, message: aio_pika.IncomingMessage, queue_name: str, error: str):
+        """
+        Move a failed message to its next delay queue, or to the poison queue
+        after NOTIFICATION_MAX_ATTEMPTS; the original is then acknowledged.
+        If the copy cannot be published the message is rejected to the DLX
+        """
+        if self.retries is None:
+            raise RuntimeError(error)
+        await self.retries.schedule(message, queue_name, error)
+
+    async def handle_with_logs(self, handler, event_type: str, event_data: Dict[str, Any],
+                               on_success: Optional[Callable[[], Awaitable[None]]] = None) -> bool:
+        """
+        Run an event handler, record its success, then wait for the notification logs it queued
+        on_success (marking the event processed) runs before the logs are awaited. A log
+        that could not be stored does not fail the event, whose notification is already
+        sent; the log writer retries it and parks it in the poison queue if it keeps failing
+        """
+        queued_logs = []
+        token = pending_logs.set(queued_logs)
+        try:
+            success = await handler(event_type, event_data)
+        finally:
+            pending_logs.reset(token)
+
+        if success and on_success is not None:
+            await on_success()
+
+        results = await asyncio.gather(*queued_logs, return_exceptions=True)
+        unstored = sum(isinstance(result, Exception) for result in results)
+        if unstored:
+            logger.warning(f"{unstored} notification logs for {event_type} not stored yet; the log writer retries them")
+        return success
+
+    async def park_log(self, document: Dict[str, Any], error: str):
+        """Park a notification log that could not be stored in the poison queue"""
+        if self.retries is None:
+            raise RuntimeError(error)
+        await self.retries.park(json.dumps(document, default=str).encode(), "notification_logs", error)
+
+    @property
+    def idempotency(self) -> IdempotencyStore:
+        """Idempotency store bound to the current Redis client"""
+        if self._idempotency is None or self._idempotency.redis is not self.redis_client:
+            self._idempotency = IdempotencyStore(self.redis_client, recent=self.redelivery_cache)
+        return self._idempotency
 
     async def is_already_processed(self, event_id: str) -> bool:
         """Check if event has already been processed using Redis"""
         try:
-            status = await self.redis_client.get(f"event:{event_id}:status")
-            return status is not None and status.decode() in ["processed", "processing"]
+            return await self.idempotency.status(event_id) in CLAIMED_STATES
         except Exception as e:
             logger.error(f"Error checking event status in Redis: {e}")
             return False
 
     async def mark_as_processing(self, event_id: str):
         """Mark event as currently being processed"""
-        try:
-            await self.redis_client.setex(
-                f"event:{event_id}:status", 
-                300,  # 5 minutes TTL
-                "processing"
-            )
-        except Exception as e:
-            logger.error(f"Error marking event as processing: {e}")
+        await self.idempotency.mark_processing(event_id)
 
     async def mark_as_processed(self, event_id: str):
         """Mark event as successfully processed"""
-        try:
-            await self.redis_client.setex(
-                f"event:{event_id}:status", 
-                86400,  # 24 hours TTL
-                "processed"
-            )
-        except Exception as e:
-            logger.error(f"Error marking event as processed: {e}")
+        await self.idempotency.complete(event_id)
 
     async def mark_as_failed(self, event_id: str):
         """Mark event as failed"""
-        try:
-            await self.redis_client.setex(
-                f"event:{event_id}:status", 
-                3600,  # 1 hour TTL for retry
-                "failed"
-            )
-        except Exception as e:
-            logger.error(f"Error marking event as failed: {e}")
+        await self.idempotency.fail(event_id)
 
     async def handle_event(self, event_type: str, event_data: Dict[str, Any]) -> bool:
         """Handle different types of events"""
         try:
-            if event_type == "booking.confirmed":
+            if self.coalescer.applies(event_type, event_data):
+                return await self.handle_coalesced(event_type, event_data)
+            elif event_type == "booking.confirmed":
                 return await self.handle_booking_confirmed(event_data)
             elif event_type == "booking.cancelled":
                 return await self.handle_booking_cancelled(event_data)
@@ -251,11 +328,13 @@ class NotificationWorker:
     async def handle_payment_event(self, event_type: str, event_data: Dict[str, Any]) -> bool:
         """Handle different types of payment events"""
         try:
-            if event_type == "payment.success":
+            if self.coalescer.applies(event_type, event_data):
+                return await self.handle_coalesced(event_type, event_data)
+            elif event_type == "payment.success":
                 return await self.handle_payment_success(event_data)
             elif event_type == "payment.failed":
                 return await self.handle_payment_failed(event_data)
-            elif event_type == "payment.refund":
+            elif event_type in ("payment.refunded", "payment.refund"):
                 return await self.handle_payment_refund(event_data)
             else:
                 logger.warning(f"Unknown payment event type: {event_type}")
@@ -265,6 +344,76 @@ class NotificationWorker:
             logger.error(f"Error handling payment event {event_type}: {e}")
             return False
 
+    async def handle_coalesced(self, event_type: str, event_data: Dict[str, Any]) -> bool:
+        """
+        Answer booking.confirmed and payment.success of one booking with a single digest
+        The first event of the booking waits for the other; see coalescer.py
+        """
+        single_handlers = {
+            "booking.confirmed": self.handle_booking_confirmed,
+            "payment.success": self.handle_payment_success,
+        }
+        group, leader = self.coalescer.join(event_type, event_data)
+        if group is None:
+            return await single_handlers[event_type](event_data)
+
+        if not leader:
+            success = await self.coalescer.outcome(group)
+            if success:
+                await self.log_booking_digest(group, event_data)
+            return success
+
+        success = False
+        try:
+            await self.coalescer.gather(group)
+            if group.is_digest:
+                success = await self.send_booking_digest(group)
+                if success:
+                    await self.log_booking_digest(group, event_data)
+            else:
+                success = await single_handlers[event_type](event_data)
+        finally:
+            self.coalescer.settle(group, success)
+        return success
+
+    def digest_recipient(self, group) -> str:
+        confirmed = group.events.get("booking.confirmed", {})
+        payment = group.events.get("payment.success", {})
+        user_id = confirmed.get("user_id") or payment.get("user_id", "unknown")
+        return confirmed.get("user_email") or payment.get("user_email") or f"user_{user_id}@example.com"
+
+    async def send_booking_digest(self, group) -> bool:
+        """Send one email confirming the booking and its payment"""
+        confirmed = group.events.get("booking.confirmed", {})
+        payment = group.events.get("payment.success", {})
+        
+        await self.send_email_notification(
+            to_email=self.digest_recipient(group),
+            subject=BOOKING_DIGEST_SUBJECT,
+            template="booking_receipt",
+            data={
+                "booking_id": group.booking_id,
+                "showtime_id": confirmed.get("showtime_id"),
+                "seats": confirmed.get("seats", []),
+                "total_amount": confirmed.get("total_amount", payment.get("amount", 0)),
+                "transaction_id": payment.get("transaction_id"),
+                "amount": payment.get("amount"),
+                "payment_method": payment.get("payment_method", "unknown")
+            }
+        )
+        return True
+
+    async def log_booking_digest(self, group, event_data: Dict[str, Any]):
+        """Log the digest against one of the events it answered"""
+        await self.log_notification(
+            event_id=event_data["event_id"],
+            notification_type="email",
+            recipient=self.digest_recipient(group),
+            subject=BOOKING_DIGEST_SUBJECT,
+            status="sent",
+            event_data=event_data
+        )
+
     async def handle_booking_confirmed(self, event_data: Dict[str, Any]) -> bool:
         """Handle booking confirmation notification"""
         try:
@@ -486,36 +635,35 @@ class NotificationWorker:
                                     template: str, data: Dict[str, Any]):
         """
         Send email notification using SMTP service with templates
+        A failed send raises, so the handler returns False and the event is
+        retried from a delay queue instead of being logged as sent. Template
+        errors are logged and the notification skipped: a retry cannot fix them
         """
+        logger.info(f"📧 Sending email to {to_email} using template: {template}")
+        
+        # Validate email service configuration
+        if not self.email_service.test_configuration():
+            logger.warning("SMTP not configured, falling back to simulation")
+            logger.info(f"📧 [SIMULATED] Email to {to_email} - Subject: {subject}")
+            logger.info(f"📧 [SIMULATED] Template: {template}, Data: {data}")
+            return
+        
         try:
-            logger.info(f"📧 Sending email to {to_email} using template: {template}")
-            
-            # Validate email service configuration
-            if not self.email_service.test_configuration():
-                logger.warning("SMTP not configured, falling back to simulation")
-                logger.info(f"📧 [SIMULATED] Email to {to_email} - Subject: {subject}")
-                logger.info(f"📧 [SIMULATED] Template: {template}, Data: {data}")
-                return
-            
             # Send real email using SMTP
             success = await self.email_service.send_email(
                 to_email=to_email,
                 subject=subject,
                 template_name=template,
-                template_data=data
+                template_data=data,
+                raise_errors=True
             )
-            
-            if success:
-                logger.info(f"✅ Email sent successfully to {to_email}")
-            else:
-                logger.error(f"❌ Failed to send email to {to_email}")
-                # Fallback to simulation for debugging
-                logger.info(f"📧 [FALLBACK] Email to {to_email} - Subject: {subject}")
-                
-        except Exception as e:
-            logger.error(f"Error sending email notification: {e}")
-            # Fallback to simulation on error
-            logger.info(f"📧 [ERROR FALLBACK] Email to {to_email} - Subject: {subject}")
+        except TemplateError as e:
+            logger.error(f"Template {template} failed for {to_email}, skipping notification: {e}")
+            return
+        
+        if not success:
+            raise EmailDeliveryError(f"Email to {to_email} was not sent")
+        logger.info(f"✅ Email sent successfully to {to_email}")
 
     async def send_sms_notification(self, phone_number: str, message: str):
         """
@@ -533,28 +681,39 @@ class NotificationWorker:
     async def log_notification(self, event_id: str, notification_type: str, 
                              recipient: str, subject: str, status: str, 
                              event_data: Dict[str, Any]):
-        """Log notification details to MongoDB"""
+        """
+        Queue notification details for the batched MongoDB writer
+        While a message is being handled the write is awaited before its ack
+        (see handle_with_logs); direct calls wait for the write here
+        """
         try:
-            notification_log = {
-                "_id": str(uuid.uuid4()),
-                "event_id": event_id,
-                "notification_type": notification_type,
-                "recipient": recipient,
-                "subject": subject,
-                "status": status,
-                "event_data": event_data,
-                "created_at": datetime.utcnow(),
-                "sent_at": datetime.utcnow() if status == "sent" else None
-            }
+            document = notification_log(event_id, notification_type, recipient, subject, status, event_data)
             
-            await self.db.notification_logs.insert_one(notification_log)
-            logger.info(f"Notification logged: {notification_log['_id']}")
+            if self.log_writer is None:
+                await self.db.notification_logs.insert_one(document)
+            else:
+                stored = self.log_writer.add(document)
+                queued_logs = pending_logs.get()
+                if queued_logs is None:
+                    await stored
+                else:
+                    queued_logs.append(stored)
+            logger.info(f"Notification logged: {document['_id']}")
             
         except Exception as e:
             logger.error(f"Error logging notification: {e}")
 
     async def cleanup(self):
         """Cleanup connections"""
+        if self.consumer_pool:
+            # Stop taking deliveries first; unacknowledged messages are requeued
+            await self.consumer_pool.close()
+        
+        await self.email_service.close()
+        
+        if self.log_writer:
+            await self.log_writer.close()
+        
         if self.redis_client:
             await self.redis_client.close()
         
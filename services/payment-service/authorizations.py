@@ -0,0 +1,147 @@
+"""
+Two-phase payments for Payment Service
+An authorization reserves funds at the gateway and is stored as an
+"authorized" transaction. Capture settles it (status "success") and void
+releases it (status "voided"); authorizations nobody captured within
+AUTHORIZATION_TTL_SECONDS are voided by a background sweep.
+
+Every transition is an update conditioned on the document still being
+"authorized", so a capture racing a void, or two workers sweeping the same
+stale authorization, change a transaction at most once.
+"""
+
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from transaction_codec import iter_transactions, transaction_update_one, update_transaction
+
+logger = logging.getLogger(__name__)
+
+AUTHORIZED = "authorized"
+CAPTURED = "success"
+VOIDED = "voided"
+
+# Uncaptured authorizations older than this are voided (must exceed the
+# booking service's capture interval with plenty of room for retries)
+AUTHORIZATION_TTL_SECONDS = int(os.getenv("AUTHORIZATION_TTL_SECONDS", "900"))
+# How often the stale-authorization sweep runs (0 disables the sweep). Only the
+# worker holding the AUTHORIZATION_SWEEP_LEASE sweeps, whatever the worker count
+AUTHORIZATION_SWEEP_SECONDS = int(os.getenv("AUTHORIZATION_SWEEP_SECONDS", "60"))
+AUTHORIZATION_SWEEP_LEASE = "authorization-sweeper"
+AUTHORIZATION_SWEEP_BATCH_SIZE = int(os.getenv("AUTHORIZATION_SWEEP_BATCH_SIZE", "500"))
+
+CAPTURE_BATCH_MAX_ITEMS = int(os.getenv("CAPTURE_BATCH_MAX_ITEMS", "1000"))
+
+# (authorized transaction, gateway_response fields to add)
+Transition = Tuple[Dict[str, Any], Dict[str, Any]]
+
+
+def transitioned(transaction: Dict[str, Any], status: str, gateway_fields: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields an authorized transaction gets when it is captured or voided"""
+    return {
+        "status": status,
+        "gateway_response": {**(transaction.get("gateway_response") or {}), **gateway_fields},
+        "updated_at": datetime.now(timezone.utc),
+    }
+
+
+async def transition_authorization(
+    collection, transaction: Dict[str, Any], status: str, gateway_fields: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """Capture or void one authorization; None if it already left "authorized" """
+    fields = transitioned(transaction, status, gateway_fields)
+    result = await update_transaction(collection, transaction, fields, expected={"status": AUTHORIZED})
+    if result.modified_count != 1:
+        return None
+    return {**transaction, **fields}
+
+
+async def transition_authorizations(
+    collection, transitions: List[Transition], status: str
+) -> List[Dict[str, Any]]:
+    """
+    Capture or void many authorizations with one bulk write
+    Returns the updated transactions this call actually moved. When some
+    updates lost a race, the batch id stamped into gateway_response tells
+    ours apart from a concurrent caller's.
+    """
+    if not transitions:
+        return []
+
+    batch_id = uuid.uuid4().hex
+    updated = []
+    operations = []
+    changes = []
+    for transaction, gateway_fields in transitions:
+        fields = transitioned(transaction, status, {**gateway_fields, "batch_id": batch_id})
+        changes.append((transaction, fields))
+        updated.append({**transaction, **fields})
+        operations.append(transaction_update_one(transaction, fields, expected={"status": AUTHORIZED}))
+
+    result = await collection.bulk_write(operations, ordered=False)
+    if result.modified_count == len(operations):
+        return updated
+
+    moved = set()
+    still_authorized = set()
+    transaction_ids = [transaction["transaction_id"] for transaction, _ in transitions]
+    async for current in iter_transactions(collection, {"transaction_id": {"$in": transaction_ids}}):
+        if (current.get("gateway_response") or {}).get("batch_id") == batch_id:
+            moved.add(current["transaction_id"])
+        elif current["status"] == AUTHORIZED:
+            still_authorized.add(current["transaction_id"])
+
+    # Legacy reads the migration rewrote in the meantime: retry in the compact shape
+    for transaction, fields in changes:
+        if transaction["transaction_id"] in still_authorized:
+            result = await update_transaction(collection, transaction, fields, expected={"status": AUTHORIZED})
+            if result.modified_count == 1:
+                moved.add(transaction["transaction_id"])
+
+    logger.info(f"{len(operations) - len(moved)} of {len(operations)} authorizations changed concurrently")
+    return [transaction for transaction in updated if transaction["transaction_id"] in moved]
+
+
+async def expired_authorizations(
+    collection,
+    ttl_seconds: int = AUTHORIZATION_TTL_SECONDS,
+    limit: int = AUTHORIZATION_SWEEP_BATCH_SIZE,
+    now: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """Oldest authorizations created more than ttl_seconds ago"""
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(seconds=ttl_seconds)
+    stale = []
+    async for transaction in iter_transactions(
+        collection,
+        {"status": AUTHORIZED, "created_at": {"$lt": cutoff}},
+        sort_field="created_at",
+        with_version=True,
+    ):
+        stale.append(transaction)
+        if len(stale) >= limit:
+            break
+    return stale
+
+
+def void_fields(reason: str) -> Dict[str, Any]:
+    """gateway_response fields recorded when an authorization is released"""
+    return {"void_reference": f"void_{uuid.uuid4().hex[:12]}", "reason": reason}
+
+
+async def void_expired_authorizations(
+    collection,
+    ttl_seconds: int = AUTHORIZATION_TTL_SECONDS,
+    limit: int = AUTHORIZATION_SWEEP_BATCH_SIZE,
+    now: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """Void one batch of stale authorizations, returning the ones this call voided"""
+    stale = await expired_authorizations(collection, ttl_seconds, limit, now)
+    voided = await transition_authorizations(
+        collection, [(transaction, void_fields("Authorization expired")) for transaction in stale], VOIDED
+    )
+    if voided:
+        logger.info(f"Voided {len(voided)} expired authorizations")
+    return voided
@@ -0,0 +1,33 @@
+"""
+Shared pytest fixtures for Payment Service tests
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# The shared package lives in services/, as it does next to the code in the image
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(autouse=True)
+def reset_request_limits():
+    """Tests reuse the same users and test cards, so start every test with empty limiter state"""
+    from main import rate_limiter, velocity_checker
+
+    velocity_checker.reset()
+    rate_limiter.local.clear()
+    yield
+    velocity_checker.reset()
+    rate_limiter.local.clear()
+
+
+@pytest.fixture(autouse=True)
+def compact_storage():
+    """Write the compact schema, as a database migrated with --apply-schema does"""
+    from transaction_codec import COMPACT_VERSION, TRANSACTION_STORAGE_VERSION, use_write_version
+
+    use_write_version(COMPACT_VERSION)
+    yield
+    use_write_version(TRANSACTION_STORAGE_VERSION)
@@ -8,10 +8,12 @@ import json
 import logging
 import uuid
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 import aio_pika
 import os
 
+from shared.event_priorities import event_priority
+
 logger = logging.getLogger(__name__)
 
 
@@ -46,87 +48,107 @@ class PaymentEventPublisher:
             logger.error(f"Failed to initialize event publisher: {e}")
             self._initialized = False
 
-    async def publish_payment_success_event(self, transaction_data: Dict[str, Any]):
-        """Publish payment success event"""
-        if not self._initialized:
-            await self.initialize()
-        
-        if not self._initialized:
-            logger.error("Cannot publish event - publisher not initialized")
-            return
-        
+    def build_event(self, event_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Shape the message body for a payment event"""
         event = {
-            "event_id": str(uuid.uuid4()),
-            "event_type": "payment.success",
+            # Deterministic ids from the caller let consumers drop redeliveries
+            "event_id": data.get("event_id") or str(uuid.uuid4()),
+            "event_type": event_type,
             "timestamp": datetime.utcnow().isoformat(),
-            "booking_id": transaction_data.get("booking_id"),
-            "transaction_id": transaction_data.get("transaction_id"),
-            "amount": transaction_data.get("amount"),
-            "payment_method": transaction_data.get("payment_method"),
-            "user_id": transaction_data.get("user_id"),  # Would come from booking context
-            "gateway_response": transaction_data.get("gateway_response", {})
+            "booking_id": data.get("booking_id"),
+            "user_id": data.get("user_id"),
         }
-        
-        await self._publish_event("payment.success", event)
 
-    async def publish_payment_failure_event(self, transaction_data: Dict[str, Any]):
-        """Publish payment failure event"""
+        if event_type == "payment.refunded":
+            event.update({
+                "original_transaction_id": data.get("original_transaction_id"),
+                "refund_transaction_id": data.get("refund_transaction_id"),
+                "refund_amount": data.get("refund_amount"),
+                "reason": data.get("reason")
+            })
+            return event
+
+        if event_type == "payment.voided":
+            event.update({
+                "transaction_id": data.get("transaction_id"),
+                "amount": data.get("amount"),
+                "payment_method": data.get("payment_method"),
+                "reason": data.get("reason")
+            })
+            return event
+
+        event.update({
+            "transaction_id": data.get("transaction_id"),
+            "amount": data.get("amount"),
+            "payment_method": data.get("payment_method"),
+            "gateway_response": data.get("gateway_response", {})
+        })
+        if event_type == "payment.failed":
+            event["failure_reason"] = data.get("failure_reason")
+        return event
+
+    def build_message(self, event_type: str, data: Dict[str, Any]) -> aio_pika.Message:
+        """
+        Persistent JSON message for a payment event, tagged with its priority
+        Callers can override the event type's default with a "priority" key
+        """
+        event = self.build_event(event_type, data)
+        priority = data.get("priority")
+        return aio_pika.Message(
+            json.dumps(event).encode(),
+            message_id=event["event_id"],
+            content_type="application/json",
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            priority=priority if priority is not None else event_priority(event_type)
+        )
+
+    async def _ensure_initialized(self) -> bool:
         if not self._initialized:
             await self.initialize()
-        
+
         if not self._initialized:
             logger.error("Cannot publish event - publisher not initialized")
-            return
-        
-        event = {
-            "event_id": str(uuid.uuid4()),
-            "event_type": "payment.failed",
-            "timestamp": datetime.utcnow().isoformat(),
-            "booking_id": transaction_data.get("booking_id"),
-            "transaction_id": transaction_data.get("transaction_id"),
-            "amount": transaction_data.get("amount"),
-            "payment_method": transaction_data.get("payment_method"),
-            "user_id": transaction_data.get("user_id"),
-            "failure_reason": transaction_data.get("failure_reason"),
-            "gateway_response": transaction_data.get("gateway_response", {})
-        }
-        
-        await self._publish_event("payment.failed", event)
+        return self._initialized
+
+    async def publish_payment_success_event(self, transaction_data: Dict[str, Any]):
+        """Publish payment success event"""
+        if await self._ensure_initialized():
+            await self._publish_event("payment.success", self.build_message("payment.success", transaction_data))
+
+    async def publish_payment_failure_event(self, transaction_data: Dict[str, Any]):
+        """Publish payment failure event"""
+        if await self._ensure_initialized():
+            await self._publish_event("payment.failed", self.build_message("payment.failed", transaction_data))
 
     async def publish_refund_processed_event(self, refund_data: Dict[str, Any]):
         """Publish refund processed event"""
-        if not self._initialized:
-            await self.initialize()
-        
-        if not self._initialized:
-            logger.error("Cannot publish event - publisher not initialized")
-            return
-        
-        event = {
-            "event_id": str(uuid.uuid4()),
-            "event_type": "payment.refunded",
-            "timestamp": datetime.utcnow().isoformat(),
-            "booking_id": refund_data.get("booking_id"),
-            "original_transaction_id": refund_data.get("original_transaction_id"),
-            "refund_transaction_id": refund_data.get("refund_transaction_id"),
-            "refund_amount": refund_data.get("refund_amount"),
-            "user_id": refund_data.get("user_id"),
-            "reason": refund_data.get("reason")
-        }
-        
-        await self._publish_event("payment.refunded", event)
-
-    async def _publish_event(self, routing_key: str, event_data: Dict[str, Any]):
+        if await self._ensure_initialized():
+            await self._publish_event("payment.refunded", self.build_message("payment.refunded", refund_data))
+
+    async def publish_void_event(self, transaction_data: Dict[str, Any]):
+        """Publish authorization voided event"""
+        if await self._ensure_initialized():
+            await self._publish_event("payment.voided", self.build_message("payment.voided", transaction_data))
+
+    async def publish_batch_confirmed(self, events: List[Tuple[str, Dict[str, Any]]]):
+        """
+        Publish a batch and raise unless the broker confirmed every message
+        Used by the change-stream tailer, which must not checkpoint past a lost event
+        """
+        if not await self._ensure_initialized():
+            raise RuntimeError("Event publisher not initialized")
+
+        await asyncio.gather(*[
+            self.exchange.publish(self.build_message(event_type, data), routing_key=event_type)
+            for event_type, data in events
+        ])
+        logger.info(f"Published confirmed batch of {len(events)} payment events")
+
+    async def _publish_event(self, routing_key: str, message: aio_pika.Message):
         """Internal method to publish events to RabbitMQ"""
         try:
-            message = aio_pika.Message(
-                json.dumps(event_data).encode(),
-                content_type="application/json",
-                delivery_mode=aio_pika.DeliveryMode.PERSISTENT
-            )
-            
             await self.exchange.publish(message, routing_key=routing_key)
-            logger.info(f"Published event: {routing_key} - {event_data['event_id']}")
+            logger.info(f"Published event: {routing_key} - {message.message_id}")
             
         except Exception as e:
             logger.error(f"Failed to publish event {routing_key}: {e}")
@@ -155,12 +177,42 @@ async def publish_payment_event(event_type: str, transaction_data: Dict[str, Any
             await payment_event_publisher.publish_payment_failure_event(transaction_data)
         elif event_type == "payment.refunded":
             await payment_event_publisher.publish_refund_processed_event(transaction_data)
+        elif event_type == "payment.voided":
+            await payment_event_publisher.publish_void_event(transaction_data)
         else:
             logger.warning(f"Unknown event type: {event_type}")
     except Exception as e:
         logger.error(f"Error publishing payment event: {e}")
 
 
+async def publish_payment_events(events: List[Tuple[str, Dict[str, Any]]]):
+    """
+    Publish a batch of (event_type, data) pairs
+    Publishes share one channel and run concurrently so broker confirms overlap
+    instead of costing a round trip each
+    """
+    if not events:
+        return
+
+    try:
+        if not payment_event_publisher._initialized:
+            await payment_event_publisher.initialize()
+
+        await asyncio.gather(*[
+            publish_payment_event(event_type, transaction_data)
+            for event_type, transaction_data in events
+        ])
+        logger.info(f"Published batch of {len(events)} payment events")
+    except Exception as e:
+        logger.error(f"Error publishing payment event batch: {e}")
+
+
+async def publish_payment_events_confirmed(events: List[Tuple[str, Dict[str, Any]]]):
+    """Publish a batch of (event_type, data) pairs, raising if any publish fails"""
+    if events:
+        await payment_event_publisher.publish_batch_confirmed(events)
+
+
 # Cleanup function for FastAPI shutdown
 async def cleanup_event_publisher():
     """Cleanup function to be called on app shutdown"""
@@ -0,0 +1,344 @@
+"""
+Latency-aware gateway routing for Payment Service
+Each payment method can be served by several gateways. The router keeps an
+exponentially weighted moving average (EWMA) of every gateway's latency and
+error rate, sends each payment to the best-scoring gateway for its method and
+fails over to the next one when a gateway fails.
+
+Failover must never charge a customer twice. Only a GatewayError, which means
+the gateway refused the request before charging, moves on to the next
+gateway. A timeout leaves the outcome unknown: the router first voids the
+attempt at that gateway by its idempotency key and only fails over once the
+void is confirmed, otherwise it raises GatewayOutcomeUnknown naming the
+gateway and key, which the service stores for reconcile() to void later.
+
+A decline is an answer, not an error: only timeouts and gateway failures count
+against a gateway. A gateway whose error rate crosses GATEWAY_ERROR_THRESHOLD
+is moved to the back of the line for GATEWAY_COOLDOWN_SECONDS.
+
+With GATEWAY_HEDGE_AFTER_MS set, a payment still unanswered after that budget
+is also sent to the next gateway and the first answer wins. The two gateways
+do not share an idempotency domain, so the losing call is not cancelled (that
+would only stop waiting for it): it runs to completion in the background and
+an approval it returns is voided. settle() waits for those calls.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in the latency and error-rate averages
+GATEWAY_EWMA_ALPHA = float(os.getenv("GATEWAY_EWMA_ALPHA", "0.2"))
+# Give up on a gateway call after this long and fail over
+GATEWAY_TIMEOUT_MS = float(os.getenv("GATEWAY_TIMEOUT_MS", "5000"))
+# Also send the payment to the next gateway after this long (0 disables hedging)
+GATEWAY_HEDGE_AFTER_MS = float(os.getenv("GATEWAY_HEDGE_AFTER_MS", "0"))
+GATEWAY_ERROR_THRESHOLD = float(os.getenv("GATEWAY_ERROR_THRESHOLD", "0.5"))
+GATEWAY_COOLDOWN_SECONDS = float(os.getenv("GATEWAY_COOLDOWN_SECONDS", "30"))
+# Score multiplier per unit of error rate: latency * (1 + penalty * error_rate)
+GATEWAY_ERROR_PENALTY = float(os.getenv("GATEWAY_ERROR_PENALTY", "10"))
+# Share of payments sent to a random healthy gateway so stale averages recover
+GATEWAY_EXPLORE_RATE = float(os.getenv("GATEWAY_EXPLORE_RATE", "0.05"))
+# Comma-separated subset of SIMULATED_GATEWAYS to enable (default: all)
+PAYMENT_GATEWAYS = os.getenv("PAYMENT_GATEWAYS", "")
+
+# Minimum samples before the error rate can trip the cooldown
+MIN_SAMPLES = 5
+
+# Approval rates of the simulated issuers, per payment method
+SUCCESS_RATES = {
+    "credit_card": 0.95,
+    "debit_card": 0.90,
+    "digital_wallet": 0.98,
+    "net_banking": 0.85,
+}
+
+# name -> (payment methods, latency range in seconds, gateway error rate)
+SIMULATED_GATEWAYS: Dict[str, Tuple[Tuple[str, ...], Tuple[float, float], float]] = {
+    "gateway_a": (("credit_card", "debit_card", "net_banking"), (0.5, 2.0), 0.01),
+    "gateway_b": (("credit_card", "debit_card", "digital_wallet"), (0.3, 1.5), 0.02),
+    "wallet_gateway": (("digital_wallet",), (0.2, 0.8), 0.01),
+}
+
+
+class GatewayError(Exception):
+    """The gateway refused the request before charging (as opposed to declining the payment)"""
+
+
+class GatewayOutcomeUnknown(Exception):
+    """The gateway may have charged the payment and the attempt could not be voided"""
+
+    def __init__(self, message: str, gateway: Optional[str] = None, idempotency_key: Optional[str] = None):
+        super().__init__(message)
+        self.gateway = gateway
+        self.idempotency_key = idempotency_key
+
+
+class GatewayUnavailable(Exception):
+    """No gateway for the payment method answered"""
+
+
+@dataclass
+class GatewayResult:
+    """A gateway's answer; truthy when the payment was approved"""
+    approved: bool
+    gateway: str
+    latency_ms: float
+    hedged: bool = False
+
+    def __bool__(self) -> bool:
+        return self.approved
+
+
+class SimulatedGateway:
+    """
+    Simulated payment gateway
+    In production this would call the provider's API with idempotency_key
+    """
+
+    def __init__(self, name: str, methods, latency: Tuple[float, float], error_rate: float):
+        self.name = name
+        self.methods = set(methods)
+        self.latency = latency
+        self.error_rate = error_rate
+
+    async def charge(
+        self, payment_method: str, amount: float, payment_details: dict, idempotency_key: Optional[str] = None
+    ) -> bool:
+        await asyncio.sleep(random.uniform(*self.latency))
+
+        if random.random() < self.error_rate:
+            raise GatewayError(f"{self.name} returned an error")
+
+        success_rate = SUCCESS_RATES.get(payment_method, 0.90)
+
+        # Higher chance of failure for large amounts (simulate risk management)
+        if amount > 5000:
+            success_rate *= 0.8
+
+        return random.random() < success_rate
+
+    async def void(self, idempotency_key: Optional[str]) -> bool:
+        """Release whatever the charge with idempotency_key holds; True once nothing is held"""
+        await asyncio.sleep(random.uniform(0.01, 0.05))
+        return idempotency_key is not None
+
+
+def simulated_gateways(names: str = PAYMENT_GATEWAYS) -> List[SimulatedGateway]:
+    enabled = [name.strip() for name in names.split(",") if name.strip()] or list(SIMULATED_GATEWAYS)
+    return [SimulatedGateway(name, *SIMULATED_GATEWAYS[name]) for name in enabled]
+
+
+class GatewayStats:
+    """EWMA latency and error rate of one gateway"""
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.samples = 0
+        self.cooldown_until = 0.0
+
+    def observe(self, seconds: float, error: bool):
+        if self.samples == 0:
+            self.latency = seconds
+            self.error_rate = 1.0 if error else 0.0
+        else:
+            self.latency += self.alpha * (seconds - self.latency)
+            self.error_rate += self.alpha * ((1.0 if error else 0.0) - self.error_rate)
+        self.samples += 1
+
+    def score(self, penalty: float) -> float:
+        """Lower is better; gateways without samples score 0 so they get measured"""
+        return self.latency * (1 + penalty * self.error_rate)
+
+
+class GatewayRouter:
+    """Routes payments to the best gateway for their method, with failover and hedging"""
+
+    def __init__(
+        self,
+        gateways: List[Any],
+        alpha: float = GATEWAY_EWMA_ALPHA,
+        timeout_ms: float = GATEWAY_TIMEOUT_MS,
+        hedge_after_ms: float = GATEWAY_HEDGE_AFTER_MS,
+        error_threshold: float = GATEWAY_ERROR_THRESHOLD,
+        cooldown_seconds: float = GATEWAY_COOLDOWN_SECONDS,
+        error_penalty: float = GATEWAY_ERROR_PENALTY,
+        explore_rate: float = GATEWAY_EXPLORE_RATE,
+        clock=time.monotonic,
+    ):
+        self.gateways = gateways
+        self.stats = {gateway.name: GatewayStats(alpha) for gateway in gateways}
+        self.timeout = timeout_ms / 1000
+        self.hedge_after = hedge_after_ms / 1000
+        self.error_threshold = error_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.error_penalty = error_penalty
+        self.explore_rate = explore_rate
+        self.clock = clock
+        self._settling = set()
+
+    def rank(self, payment_method: str) -> List[Any]:
+        """Gateways supporting the method, best first; cooling-down ones last"""
+        now = self.clock()
+        candidates = [gateway for gateway in self.gateways if payment_method in gateway.methods]
+        healthy = [gateway for gateway in candidates if self.stats[gateway.name].cooldown_until <= now]
+        cooling = [gateway for gateway in candidates if self.stats[gateway.name].cooldown_until > now]
+
+        healthy.sort(key=lambda gateway: self.stats[gateway.name].score(self.error_penalty))
+        cooling.sort(key=lambda gateway: self.stats[gateway.name].cooldown_until)
+
+        if len(healthy) > 1 and random.random() < self.explore_rate:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+
+        return healthy + cooling
+
+    def _observe(self, gateway, seconds: float, error: bool):
+        stats = self.stats[gateway.name]
+        stats.observe(seconds, error)
+        if error and stats.samples >= MIN_SAMPLES and stats.error_rate >= self.error_threshold:
+            stats.cooldown_until = self.clock() + self.cooldown_seconds
+            logger.warning(
+                f"Gateway {gateway.name} error rate {stats.error_rate:.2f}; "
+                f"deprioritized for {self.cooldown_seconds}s"
+            )
+
+    async def _call(self, gateway, payment_method: str, amount: float, payment_details: dict,
+                    idempotency_key: Optional[str], hedged: bool) -> GatewayResult:
+        started = time.perf_counter()
+        try:
+            approved = await asyncio.wait_for(
+                gateway.charge(payment_method, amount, payment_details, idempotency_key), self.timeout
+            )
+        except GatewayError as e:
+            self._observe(gateway, time.perf_counter() - started, error=True)
+            raise GatewayError(f"{gateway.name}: {e}") from e
+        except asyncio.TimeoutError as e:
+            self._observe(gateway, time.perf_counter() - started, error=True)
+            if await self._void(gateway, idempotency_key):
+                raise GatewayError(f"{gateway.name}: timed out, attempt voided") from e
+            raise GatewayOutcomeUnknown(
+                f"{gateway.name}: timed out and the attempt could not be voided", gateway.name, idempotency_key
+            ) from e
+
+        elapsed = time.perf_counter() - started
+        self._observe(gateway, elapsed, error=False)
+        return GatewayResult(approved=approved, gateway=gateway.name, latency_ms=elapsed * 1000, hedged=hedged)
+
+    async def _void(self, gateway, idempotency_key: Optional[str]) -> bool:
+        """Void an attempt at one gateway; False when it may still hold a charge"""
+        if idempotency_key is None:
+            return False
+        try:
+            return bool(await asyncio.wait_for(gateway.void(idempotency_key), self.timeout))
+        except Exception as e:
+            logger.error(f"Voiding {idempotency_key} at {gateway.name} failed: {e}")
+            return False
+
+    async def _release_loser(self, task: asyncio.Task, gateway, idempotency_key: Optional[str]):
+        """Let a hedge's losing call finish and void it if it was approved"""
+        try:
+            result = await task
+        except (GatewayError, GatewayOutcomeUnknown) as e:
+            logger.info(f"Losing hedge at {gateway.name} did not charge: {e}")
+            return
+        if result and not await self._void(gateway, idempotency_key):
+            logger.error(f"Losing hedge {idempotency_key} was approved at {gateway.name} and could not be voided")
+
+    async def _attempt(self, primary, remaining: List[Any], *args) -> GatewayResult:
+        """Call primary; past the hedge budget, race it against the next gateway"""
+        first = asyncio.ensure_future(self._call(primary, *args, False))
+        if not self.hedge_after or not remaining:
+            return await first
+
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        backup = remaining.pop(0)
+        logger.info(f"Hedging payment from {primary.name} to {backup.name}")
+        calls = {first: primary, asyncio.ensure_future(self._call(backup, *args, True)): backup}
+        pending = set(calls)
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    if isinstance(task.exception(), GatewayOutcomeUnknown):
+                        logger.error(f"Hedged payment needs reconciliation: {task.exception()}")
+                    # A possible charge must stop failover, so it outranks a refusal
+                    if not isinstance(error, GatewayOutcomeUnknown):
+                        error = task.exception()
+            raise error
+        finally:
+            idempotency_key = args[-1]
+            for task in pending:
+                settling = asyncio.ensure_future(self._release_loser(task, calls[task], idempotency_key))
+                self._settling.add(settling)
+                settling.add_done_callback(self._settling.discard)
+
+    async def settle(self):
+        """Wait for losing hedge calls still running in the background"""
+        if self._settling:
+            await asyncio.gather(*self._settling, return_exceptions=True)
+
+    async def process(
+        self, payment_method: str, amount: float, payment_details: dict, idempotency_key: Optional[str] = None
+    ) -> GatewayResult:
+        """
+        Send a payment to the best gateway, failing over while gateways refuse it
+        Raises GatewayOutcomeUnknown instead of failing over when a gateway may
+        have charged the payment.
+        """
+        remaining = self.rank(payment_method)
+        if not remaining:
+            raise GatewayUnavailable(f"No gateway supports {payment_method}")
+
+        errors = []
+        while remaining:
+            gateway = remaining.pop(0)
+            try:
+                return await self._attempt(
+                    gateway, remaining, payment_method, amount, payment_details, idempotency_key
+                )
+            except GatewayError as e:
+                errors.append(str(e))
+                logger.warning(f"Gateway failed, trying next: {e}")
+
+        raise GatewayUnavailable(f"All gateways failed: {'; '.join(errors)}")
+
+    async def reconcile(self, gateway_name: str, idempotency_key: str) -> bool:
+        """
+        Void an attempt whose outcome was unknown; True once nothing is held
+        The simulated gateways have no status lookup, so an unknown attempt is
+        always released rather than confirmed
+        """
+        for gateway in self.gateways:
+            if gateway.name == gateway_name:
+                return await self._void(gateway, idempotency_key)
+        logger.error(f"Cannot reconcile {idempotency_key}: gateway {gateway_name} is not configured")
+        return False
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Current routing state per gateway"""
+        now = self.clock()
+        return [
+            {
+                "gateway": gateway.name,
+                "payment_methods": sorted(gateway.methods),
+                "latency_ms": round(self.stats[gateway.name].latency * 1000, 1),
+                "error_rate": round(self.stats[gateway.name].error_rate, 4),
+                "samples": self.stats[gateway.name].samples,
+                "cooling_down": self.stats[gateway.name].cooldown_until > now,
+            }
+            for gateway in self.gateways
+        ]
@@ -0,0 +1,24 @@
+"""
+Gunicorn configuration for Payment Service
+
+    gunicorn -c gunicorn_conf.py main:app
+
+Worker, timeout and signal settings are shared with the other services; see
+shared/gunicorn_conf.py.
+"""
+
+import glob
+import os
+
+from shared.gunicorn_conf import *  # noqa: F401,F403
+from shared.gunicorn_conf import bind_address
+
+bind = bind_address("8003")
+
+
+def on_starting(server):
+    # Per-worker metric snapshots from a previous run would be merged into /metrics
+    metrics_dir = os.getenv("METRICS_DIR")
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, "worker-*.json")):
+            os.remove(path)
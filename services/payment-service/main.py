@@ -4,24 +4,92 @@ Handles payment processing simulation and transaction logging
 """
 
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional, Tuple
 import uuid
 import asyncio
-from datetime import datetime, timezone
+from datetime import date, datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 from enum import Enum
 import random
 import logging
 
+from transaction_export import (
+    ExportFormat,
+    EXPORT_MEDIA_TYPES,
+    build_export_filter,
+    open_export_cursor,
+    stream_export,
+)
+from settlement import (
+    ROLLUP_COLLECTION,
+    BackfillInProgress,
+    backfill_rollups,
+    record_status_change,
+    record_status_changes,
+    record_transaction,
+    record_transactions,
+    settlement_report,
+)
+from authorizations import (
+    AUTHORIZATION_SWEEP_LEASE,
+    AUTHORIZATION_SWEEP_SECONDS,
+    CAPTURE_BATCH_MAX_ITEMS,
+    transition_authorization,
+    transition_authorizations,
+    void_expired_authorizations,
+    void_fields,
+)
+from gateway_router import GatewayOutcomeUnknown, GatewayResult, GatewayRouter, simulated_gateways
+from migrate_transactions import guard_write_version
+from rate_limiter import (
+    RateLimitMiddleware,
+    RateLimitPolicy,
+    RateLimiter,
+    body_field_key,
+    body_items_key,
+    client_key,
+    trusted_proxies,
+)
+from reconciliation import (
+    PAYMENT_RECONCILE_LEASE,
+    PAYMENT_RECONCILE_SECONDS,
+    reconcile_unknown_outcomes,
+    unknown_outcome_fields,
+)
+from redis_client import close_redis
+from request_timing import RequestMetrics, ServerTimingMiddleware, mark_phase, request_phase
+from shared.leases import LEASES_COLLECTION, lease_owner, take_lease
+from shared.mongo_config import mongo_client_kwargs, warm_up_pool, write_concern
+from transaction_archive import RESTORED_FIELD, ArchiveStore, archive_expired, hot_transaction_ids, merge_documents
+from transaction_cache import TransactionCache
+from transaction_codec import (
+    decode_transaction,
+    encode_transaction,
+    find_transaction,
+    iter_transactions,
+    transaction_filter,
+    update_transaction,
+)
+from transaction_events import (
+    TransactionEventTailer,
+    event_id_for,
+    inline_publishing,
+    resolve_publishing_mode,
+    transaction_event,
+)
+from velocity import VelocityChecker, velocity_keys
+
 # Configure logging first
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Try to import event publisher, but handle gracefully if RabbitMQ is not available
 try:
-    from event_publisher import publish_payment_event, cleanup_event_publisher
+    from event_publisher import publish_payment_event, publish_payment_events, cleanup_event_publisher
     EVENT_PUBLISHER_AVAILABLE = True
     logger.info("Event publisher loaded successfully")
 except Exception as e:
@@ -32,6 +100,10 @@ except Exception as e:
     async def publish_payment_event(event_type, data):
         logger.info(f"Would publish event: {event_type} with data: {data}")
     
+    async def publish_payment_events(events):
+        for event_type, data in events:
+            await publish_payment_event(event_type, data)
+    
     async def cleanup_event_publisher():
         logger.info("No event publisher to cleanup")
 logging.basicConfig(level=logging.INFO)
@@ -39,10 +111,70 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Payment Service", version="1.0.0")
 
-# MongoDB connection
+# MongoDB connection, opened on startup so every worker process gets its own pool
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-client = AsyncIOMotorClient(MONGODB_URI)
-db = client.movie_booking
+client: Optional[AsyncIOMotorClient] = None
+db = None
+
+# Read-through cache for GET /payments/{transaction_id}
+transaction_cache = TransactionCache()
+
+# Monthly archive partitions for transactions older than the hot window
+archive_store = ArchiveStore()
+
+# Pre-gateway velocity limits per user, card and booking
+velocity_checker = VelocityChecker()
+velocity_sync_task: Optional[asyncio.Task] = None
+
+# Change-stream publisher, running in change_stream mode (see resolve_publishing_mode)
+event_tailer_task: Optional[asyncio.Task] = None
+
+# Voids authorizations nobody captured in time
+authorization_sweep_task: Optional[asyncio.Task] = None
+reconcile_task: Optional[asyncio.Task] = None
+
+# Re-resolves trusted proxy hostnames in the background
+trusted_proxies_task: Optional[asyncio.Task] = None
+
+# Token-bucket request limits per route, as '<requests>/<seconds>'
+payments_client_policy = RateLimitPolicy.from_spec(
+    "payments-client", os.getenv("RATE_LIMIT_PAYMENTS_CLIENT", "300/60"), client_key
+)
+payments_user_policy = RateLimitPolicy.from_spec(
+    "payments-user", os.getenv("RATE_LIMIT_PAYMENTS_USER", "30/60"), body_field_key("user_id"), needs_body=True
+)
+# Same per-user buckets, one token per payment in the batch
+payments_batch_user_policy = RateLimitPolicy.from_spec(
+    "payments-user", os.getenv("RATE_LIMIT_PAYMENTS_USER", "30/60"), body_items_key("payments", "user_id"),
+    needs_body=True
+)
+refunds_client_policy = RateLimitPolicy.from_spec(
+    "refunds-client", os.getenv("RATE_LIMIT_REFUNDS_CLIENT", "30/60"), client_key
+)
+rate_limiter = RateLimiter()
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    routes={
+        ("POST", "/payments"): [payments_client_policy, payments_user_policy],
+        ("POST", "/payments/authorize"): [payments_client_policy, payments_user_policy],
+        ("POST", "/payments/batch"): [payments_client_policy, payments_batch_user_policy],
+        ("POST", "/payments/capture/batch"): [payments_client_policy],
+        ("POST", "/refunds"): [refunds_client_policy],
+    },
+)
+
+# Per-phase timings: Server-Timing headers, /metrics histograms and the slow log.
+# Added last so it is the outermost middleware and its total covers rate limiting.
+request_metrics = RequestMetrics()
+app.add_middleware(ServerTimingMiddleware, metrics=request_metrics)
+
+# Routes each payment method to its fastest healthy gateway
+gateway_router = GatewayRouter(simulated_gateways())
+
+# Batch payment limits
+PAYMENT_BATCH_MAX_ITEMS = int(os.getenv("PAYMENT_BATCH_MAX_ITEMS", "1000"))
+PAYMENT_BATCH_CONCURRENCY = int(os.getenv("PAYMENT_BATCH_CONCURRENCY", "200"))
 
 
 class PaymentMethod(str, Enum):
@@ -57,6 +189,8 @@ class PaymentStatus(str, Enum):
     SUCCESS = "success"
     FAILED = "failed"
     REFUNDED = "refunded"
+    AUTHORIZED = "authorized"
+    VOIDED = "voided"
 
 
 class PaymentRequest(BaseModel):
@@ -77,6 +211,7 @@ class PaymentResponse(BaseModel):
 class TransactionLog(BaseModel):
     transaction_id: str
     booking_id: str
+    user_id: Optional[str] = None
     amount: float
     payment_method: PaymentMethod
     status: PaymentStatus
@@ -87,105 +222,256 @@ class TransactionLog(BaseModel):
     failure_reason: Optional[str] = None
 
 
-@app.post("/payments", response_model=PaymentResponse)
-async def process_payment(payment_request: PaymentRequest):
+class BatchPaymentRequest(BaseModel):
+    payments: List[PaymentRequest]
+
+
+class BatchPaymentItemResult(PaymentResponse):
+    index: int
+    booking_id: str
+
+
+class BatchPaymentResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    results: List[BatchPaymentItemResult]
+
+
+class CaptureBatchRequest(BaseModel):
+    transaction_ids: List[str]
+
+
+class CaptureItemResult(BaseModel):
+    transaction_id: str
+    success: bool
+    message: str
+    status: Optional[PaymentStatus] = None
+
+
+class CaptureBatchResponse(BaseModel):
+    total: int
+    captured: int
+    failed: int
+    results: List[CaptureItemResult]
+
+
+def validate_payment_amount(amount: float):
+    """Reject amounts outside the accepted range"""
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Invalid payment amount")
+
+    if amount > 10000:  # Example limit
+        raise HTTPException(status_code=400, detail="Payment amount exceeds limit")
+
+
+def build_payment_event(
+    payment_request: PaymentRequest,
+    transaction_id: str,
+    payment_success: bool,
+    gateway_response: dict,
+    failure_reason: str
+) -> Tuple[str, dict]:
+    """Build the payment.success / payment.failed event for a processed payment"""
+    event_type = "payment.success" if payment_success else "payment.failed"
+    event = {
+        "event_id": event_id_for(transaction_id, event_type),
+        "event_type": event_type,
+        "booking_id": payment_request.booking_id,
+        "transaction_id": transaction_id,
+        "amount": payment_request.amount,
+        "payment_method": payment_request.payment_method.value,
+        "gateway_response": gateway_response,
+        "user_id": payment_request.user_id,  # Ensure user_id is included
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+    if not payment_success:
+        event["failure_reason"] = failure_reason
+
+    return event_type, event
+
+
+def enforce_velocity(payment_request: PaymentRequest):
+    """Reject the attempt with 429 when any velocity window is full"""
+    violation = velocity_checker.check(velocity_keys(
+        payment_request.user_id, payment_request.booking_id, payment_request.payment_details
+    ))
+    if violation:
+        logger.warning(
+            f"Velocity limit hit on {violation.dimension} for booking {payment_request.booking_id}"
+        )
+        raise HTTPException(
+            status_code=429,
+            detail=violation.message,
+            headers={"Retry-After": str(violation.retry_after)}
+        )
+
+
+async def execute_payment(
+    payment_request: PaymentRequest,
+    transaction_id: str,
+    authorize_only: bool = False
+) -> Tuple[TransactionLog, PaymentResponse, Optional[Tuple[str, dict]]]:
     """
-    CRITICAL PAYMENT PROCESSING ENDPOINT
-    This function simulates payment processing and logs all transactions to MongoDB.
-    In production, this would integrate with actual payment gateways.
+    Run a payment through the gateway and build its transaction log, API response
+    and event. Nothing is persisted or published here so callers can batch both.
+    With authorize_only an approved payment is only authorized: it has no event
+    until it is captured. A payment the gateway may have charged without
+    answering is "pending" with no event until reconciliation settles it.
     """
-    
-    transaction_id = str(uuid.uuid4())
-    
+    # Simulate payment processing with random success/failure
+    # In production, this would call actual payment gateway APIs
     try:
-        # Validate payment request
-        if payment_request.amount <= 0:
-            raise HTTPException(status_code=400, detail="Invalid payment amount")
-        
-        if payment_request.amount > 10000:  # Example limit
-            raise HTTPException(status_code=400, detail="Payment amount exceeds limit")
-
-        # Simulate payment processing with random success/failure
-        # In production, this would call actual payment gateway APIs
-        payment_success = await simulate_payment_processing(
+        outcome = await simulate_payment_processing(
             payment_request.payment_method,
             payment_request.amount,
-            payment_request.payment_details
+            payment_request.payment_details,
+            transaction_id
         )
+    except GatewayOutcomeUnknown as e:
+        logger.error(f"Payment {transaction_id} needs reconciliation: {e}")
+        outcome = e
+    payment_success = bool(outcome) and not isinstance(outcome, GatewayOutcomeUnknown)
 
-        # Determine payment status and message
-        if payment_success:
-            status = PaymentStatus.SUCCESS
-            message = "Payment processed successfully"
-            gateway_response = {
-                "gateway_transaction_id": f"gtw_{uuid.uuid4().hex[:12]}",
-                "authorization_code": f"auth_{uuid.uuid4().hex[:8]}",
-                "gateway_status": "APPROVED",
-                "processing_time_ms": random.randint(500, 2000)
-            }
-            failure_reason = ""  # Empty string instead of None
-        else:
-            status = PaymentStatus.FAILED
-            message = "Payment processing failed"
-            gateway_response = {
-                "gateway_transaction_id": f"gtw_{uuid.uuid4().hex[:12]}",
-                "error_code": "DECLINED",
-                "gateway_status": "DECLINED",
-                "processing_time_ms": random.randint(200, 1000)
-            }
-            failure_reason = "Insufficient funds or card declined"
-
-        # CRITICAL: Log transaction to MongoDB for audit trail
-        transaction_log = TransactionLog(
-            transaction_id=transaction_id,
-            booking_id=payment_request.booking_id,
-            amount=payment_request.amount,
-            payment_method=payment_request.payment_method,
-            status=status,
-            payment_details=sanitize_payment_details(payment_request.payment_details),
-            created_at=datetime.now(timezone.utc),
-            updated_at=datetime.now(timezone.utc),
-            gateway_response=gateway_response,
-            failure_reason=failure_reason
+    # Determine payment status and message
+    if isinstance(outcome, GatewayOutcomeUnknown):
+        # Neither approved nor declined: reconciliation voids it and only then fails it
+        status = PaymentStatus.PENDING
+        message = "Payment outcome unknown; it is being confirmed with the gateway"
+        gateway_response = unknown_outcome_fields(outcome.gateway)
+        failure_reason = ""
+    elif payment_success and authorize_only:
+        status = PaymentStatus.AUTHORIZED
+        message = "Payment authorized"
+        gateway_response = {
+            "gateway_transaction_id": f"gtw_{uuid.uuid4().hex[:12]}",
+            "authorization_code": f"auth_{uuid.uuid4().hex[:8]}",
+            "gateway_status": "AUTHORIZED",
+            "processing_time_ms": random.randint(500, 2000)
+        }
+        failure_reason = ""
+    elif payment_success:
+        status = PaymentStatus.SUCCESS
+        message = "Payment processed successfully"
+        gateway_response = {
+            "gateway_transaction_id": f"gtw_{uuid.uuid4().hex[:12]}",
+            "authorization_code": f"auth_{uuid.uuid4().hex[:8]}",
+            "gateway_status": "APPROVED",
+            "processing_time_ms": random.randint(500, 2000)
+        }
+        failure_reason = ""  # Empty string instead of None
+    else:
+        status = PaymentStatus.FAILED
+        message = "Payment processing failed"
+        gateway_response = {
+            "gateway_transaction_id": f"gtw_{uuid.uuid4().hex[:12]}",
+            "error_code": "DECLINED",
+            "gateway_status": "DECLINED",
+            "processing_time_ms": random.randint(200, 1000)
+        }
+        failure_reason = "Insufficient funds or card declined"
+
+    # Record which gateway answered and how long it took
+    if isinstance(outcome, GatewayResult):
+        gateway_response["gateway"] = outcome.gateway
+        gateway_response["processing_time_ms"] = round(outcome.latency_ms)
+        if outcome.hedged:
+            gateway_response["hedged"] = True
+
+    # CRITICAL: Log transaction to MongoDB for audit trail
+    transaction_log = TransactionLog(
+        transaction_id=transaction_id,
+        booking_id=payment_request.booking_id,
+        user_id=payment_request.user_id,
+        amount=payment_request.amount,
+        payment_method=payment_request.payment_method,
+        status=status,
+        payment_details=sanitize_payment_details(payment_request.payment_details),
+        created_at=datetime.now(timezone.utc),
+        updated_at=datetime.now(timezone.utc),
+        gateway_response=gateway_response,
+        failure_reason=failure_reason
+    )
+
+    response = PaymentResponse(
+        success=payment_success,
+        transaction_id=transaction_id if payment_success or status == PaymentStatus.PENDING else None,
+        message=message,
+        status=status
+    )
+
+    event = None
+    if status not in (PaymentStatus.AUTHORIZED, PaymentStatus.PENDING):
+        event = build_payment_event(
+            payment_request, transaction_id, payment_success, gateway_response, failure_reason
         )
 
+    return transaction_log, response, event
+
+
+def build_error_transaction(
+    payment_request: PaymentRequest,
+    transaction_id: str,
+    error: Exception
+) -> Tuple[TransactionLog, PaymentResponse]:
+    """Build the failed transaction log and response for a system error"""
+    error_message = f"Payment processing error: {str(error)}"
+
+    error_transaction = TransactionLog(
+        transaction_id=transaction_id,
+        booking_id=payment_request.booking_id,
+        user_id=payment_request.user_id,
+        amount=payment_request.amount,
+        payment_method=payment_request.payment_method,
+        status=PaymentStatus.FAILED,
+        payment_details=sanitize_payment_details(payment_request.payment_details),
+        created_at=datetime.now(timezone.utc),
+        updated_at=datetime.now(timezone.utc),
+        gateway_response={"error": "system_error", "message": str(error)},
+        failure_reason=error_message
+    )
+
+    response = PaymentResponse(
+        success=False,
+        transaction_id=None,
+        message=error_message,
+        status=PaymentStatus.FAILED
+    )
+
+    return error_transaction, response
+
+
+async def handle_payment(payment_request: PaymentRequest, authorize_only: bool = False) -> PaymentResponse:
+    """Validate, run, log and announce one payment or authorization"""
+    # Routing, rate limiting and request body validation
+    mark_phase("parse")
+
+    transaction_id = str(uuid.uuid4())
+    
+    try:
+        # Validate payment request
+        with request_phase("validation"):
+            validate_payment_amount(payment_request.amount)
+            enforce_velocity(payment_request)
+
+        with request_phase("gateway"):
+            transaction_log, response, event = await execute_payment(
+                payment_request, transaction_id, authorize_only
+            )
+
         # Save transaction log to MongoDB
-        await db.transaction_logs.insert_one(transaction_log.model_dump())
+        transaction_document = transaction_log.model_dump()
+        with request_phase("mongo"):
+            await db.transaction_logs.insert_one(encode_transaction(transaction_document))
+        with request_phase("rollup"):
+            await record_transaction(db[ROLLUP_COLLECTION], transaction_document)
 
         # CRITICAL: Publish payment event for notification service
-        if payment_success:
-            await publish_payment_event("payment.success", {
-                "event_id": str(uuid.uuid4()),
-                "event_type": "payment.success",
-                "booking_id": payment_request.booking_id,
-                "transaction_id": transaction_id,
-                "amount": payment_request.amount,
-                "payment_method": payment_request.payment_method.value,
-                "gateway_response": gateway_response,
-                "user_id": payment_request.user_id,  # Ensure user_id is included
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
-        else:
-            await publish_payment_event("payment.failed", {
-                "event_id": str(uuid.uuid4()),
-                "event_type": "payment.failed",
-                "booking_id": payment_request.booking_id,
-                "transaction_id": transaction_id,
-                "amount": payment_request.amount,
-                "payment_method": payment_request.payment_method.value,
-                "failure_reason": failure_reason,
-                "gateway_response": gateway_response,
-                "user_id": payment_request.user_id,  # Ensure user_id is included
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
-
-        # Prepare response
-        response = PaymentResponse(
-            success=payment_success,
-            transaction_id=transaction_id if payment_success else None,
-            message=message,
-            status=status
-        )
+        # (in change_stream mode the tailer publishes it from the committed insert)
+        if event is not None and inline_publishing():
+            with request_phase("publish"):
+                await publish_payment_event(*event)
 
         return response
 
@@ -193,59 +479,401 @@ async def process_payment(payment_request: PaymentRequest):
         raise
     except Exception as e:
         # Log error and save failed transaction
-        error_message = f"Payment processing error: {str(e)}"
-        
-        error_transaction = TransactionLog(
-            transaction_id=transaction_id,
-            booking_id=payment_request.booking_id,
-            amount=payment_request.amount,
-            payment_method=payment_request.payment_method,
-            status=PaymentStatus.FAILED,
-            payment_details=sanitize_payment_details(payment_request.payment_details),
-            created_at=datetime.now(timezone.utc),
-            updated_at=datetime.now(timezone.utc),
-            gateway_response={"error": "system_error", "message": str(e)},
-            failure_reason=error_message
-        )
+        error_transaction, response = build_error_transaction(payment_request, transaction_id, e)
         
-        await db.transaction_logs.insert_one(error_transaction.model_dump())
+        error_document = error_transaction.model_dump()
+        with request_phase("mongo"):
+            await db.transaction_logs.insert_one(encode_transaction(error_document))
+        with request_phase("rollup"):
+            await record_transaction(db[ROLLUP_COLLECTION], error_document)
         
-        return PaymentResponse(
-            success=False,
-            transaction_id=None,
-            message=error_message,
-            status=PaymentStatus.FAILED
+        return response
+
+
+@app.post("/payments", response_model=PaymentResponse)
+async def process_payment(payment_request: PaymentRequest):
+    """
+    CRITICAL PAYMENT PROCESSING ENDPOINT
+    This function simulates payment processing and logs all transactions to MongoDB.
+    In production, this would integrate with actual payment gateways.
+    """
+    return await handle_payment(payment_request)
+
+
+@app.post("/payments/authorize", response_model=PaymentResponse)
+async def authorize_payment(payment_request: PaymentRequest):
+    """
+    Authorize a payment without capturing it
+    Funds are reserved at the gateway and the transaction stays "authorized"
+    until it is captured or voided (or voided by the stale-authorization sweep).
+    """
+    return await handle_payment(payment_request, authorize_only=True)
+
+
+@app.post("/payments/batch", response_model=BatchPaymentResponse)
+async def process_payment_batch(batch_request: BatchPaymentRequest):
+    """
+    Process many payments in one call
+    Gateway calls run concurrently under a semaphore; all transaction logs are
+    written with one unordered insert_many and all events published as one batch.
+    """
+    mark_phase("parse")
+
+    if not batch_request.payments:
+        raise HTTPException(status_code=400, detail="Batch contains no payments")
+
+    if len(batch_request.payments) > PAYMENT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch exceeds maximum of {PAYMENT_BATCH_MAX_ITEMS} payments"
         )
 
+    semaphore = asyncio.Semaphore(PAYMENT_BATCH_CONCURRENCY)
+
+    async def run_item(payment_request: PaymentRequest):
+        transaction_id = str(uuid.uuid4())
+
+        try:
+            validate_payment_amount(payment_request.amount)
+            enforce_velocity(payment_request)
+        except HTTPException as e:
+            # Rejected before the gateway: nothing to log, same as the single endpoint
+            return None, PaymentResponse(
+                success=False, transaction_id=None, message=e.detail, status=PaymentStatus.FAILED
+            ), None
+
+        try:
+            async with semaphore:
+                return await execute_payment(payment_request, transaction_id)
+        except Exception as e:
+            error_transaction, response = build_error_transaction(payment_request, transaction_id, e)
+            return error_transaction, response, None
+
+    # Items validate and call the gateway concurrently; timed as one phase
+    with request_phase("gateway"):
+        outcomes = await asyncio.gather(*[
+            run_item(payment_request) for payment_request in batch_request.payments
+        ])
+
+    # Persist every transaction log in a single round trip
+    logged = [(index, outcome) for index, outcome in enumerate(outcomes) if outcome[0] is not None]
+    documents = [outcome[0].model_dump() for _, outcome in logged]
+    failed_indexes = set()
+
+    if documents:
+        try:
+            with request_phase("mongo"):
+                await db.transaction_logs.insert_many(
+                    [encode_transaction(document) for document in documents], ordered=False
+                )
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed_indexes.add(logged[write_error["index"]][0])
+            logger.error(f"Batch insert failed for {len(failed_indexes)} payments: {e}")
+        except Exception as e:
+            failed_indexes.update(index for index, _ in logged)
+            logger.error(f"Batch insert failed: {e}")
+
+    persisted = [
+        document for (index, _), document in zip(logged, documents)
+        if index not in failed_indexes
+    ]
+    with request_phase("rollup"):
+        await record_transactions(db[ROLLUP_COLLECTION], persisted)
+
+    # Publish events only for payments whose logs were written
+    events = [
+        outcome[2] for index, outcome in enumerate(outcomes)
+        if outcome[2] is not None and index not in failed_indexes
+    ]
+    if inline_publishing():
+        with request_phase("publish"):
+            await publish_payment_events(events)
+
+    results = []
+    for index, (payment_request, (_, response, _)) in enumerate(zip(batch_request.payments, outcomes)):
+        if index in failed_indexes:
+            response = PaymentResponse(
+                success=False,
+                transaction_id=None,
+                message="Payment processing error: failed to record transaction",
+                status=PaymentStatus.FAILED
+            )
+
+        results.append(BatchPaymentItemResult(
+            index=index,
+            booking_id=payment_request.booking_id,
+            **response.model_dump()
+        ))
+
+    succeeded = sum(1 for result in results if result.success)
+    return BatchPaymentResponse(
+        total=len(results),
+        succeeded=succeeded,
+        failed=len(results) - succeeded,
+        results=results
+    )
+
+TRANSITION_ACTIONS = {
+    PaymentStatus.SUCCESS: ("capture", "captured"),
+    PaymentStatus.VOIDED: ("void", "voided"),
+}
+
+
+def settled_outcome(transaction: dict, target: PaymentStatus) -> Tuple[bool, str]:
+    """Outcome of capturing or voiding a transaction that is no longer authorized"""
+    action, done = TRANSITION_ACTIONS[target]
+    if transaction["status"] == target:
+        # Retried captures and voids succeed without doing anything twice
+        return True, f"Payment already {done}"
+    return False, f"Cannot {action} a {transaction['status']} payment"
+
+
+async def finish_authorization_transitions(
+    transactions: List[dict], target: PaymentStatus, source: PaymentStatus = PaymentStatus.AUTHORIZED
+):
+    """Rollups, cache invalidation and events for captured or voided authorizations (or reconciled payments)"""
+    if not transactions:
+        return
+
+    with request_phase("rollup"):
+        await record_status_changes(db[ROLLUP_COLLECTION], transactions, source, target)
+    with request_phase("cache"):
+        for transaction in transactions:
+            await transaction_cache.invalidate(transaction["transaction_id"])
+    if inline_publishing():
+        with request_phase("publish"):
+            await publish_payment_events([transaction_event(transaction) for transaction in transactions])
+
+
+async def settle_authorization(transaction_id: str, target: PaymentStatus, gateway_fields: dict) -> PaymentResponse:
+    """Capture or void one authorization, answering retries idempotently"""
+    done = TRANSITION_ACTIONS[target][1]
+
+    with request_phase("mongo"):
+        transaction = await find_transaction(db.transaction_logs, {"transaction_id": transaction_id})
+
+    if not transaction:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+
+    if transaction["status"] == PaymentStatus.AUTHORIZED:
+        if target == PaymentStatus.SUCCESS:
+            with request_phase("gateway"):
+                gateway_fields = (await simulate_capture_processing([transaction]))[transaction_id]
+
+        with request_phase("mongo"):
+            settled = await transition_authorization(
+                db.transaction_logs, transaction, target.value, gateway_fields
+            )
+
+        if settled:
+            await finish_authorization_transitions([settled], target)
+            return PaymentResponse(
+                success=True, transaction_id=transaction_id, message=f"Payment {done}", status=target
+            )
+
+        # A concurrent capture or void got there first; answer from where it ended up
+        with request_phase("mongo"):
+            transaction = await find_transaction(db.transaction_logs, {"transaction_id": transaction_id})
+
+    success, message = settled_outcome(transaction, target)
+    if not success:
+        raise HTTPException(status_code=409, detail=message)
+    return PaymentResponse(success=True, transaction_id=transaction_id, message=message, status=target)
+
+
+@app.post("/payments/{transaction_id}/capture", response_model=PaymentResponse)
+async def capture_payment(transaction_id: str):
+    """Capture an authorized payment"""
+    mark_phase("parse")
+    return await settle_authorization(transaction_id, PaymentStatus.SUCCESS, {})
+
+
+@app.post("/payments/{transaction_id}/void", response_model=PaymentResponse)
+async def void_payment(transaction_id: str, reason: str = "Voided by client"):
+    """Release an authorized payment's reserved funds without charging them"""
+    mark_phase("parse")
+    return await settle_authorization(transaction_id, PaymentStatus.VOIDED, void_fields(reason))
+
+
+@app.post("/payments/capture/batch", response_model=CaptureBatchResponse)
+async def capture_payment_batch(batch_request: CaptureBatchRequest):
+    """
+    Capture many authorizations in one call
+    One read for all transactions, one gateway capture call and one unordered
+    bulk write; payments that are already captured count as captured.
+    """
+    mark_phase("parse")
+
+    transaction_ids = list(dict.fromkeys(batch_request.transaction_ids))
+    if not transaction_ids:
+        raise HTTPException(status_code=400, detail="Batch contains no transactions")
+
+    if len(transaction_ids) > CAPTURE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch exceeds maximum of {CAPTURE_BATCH_MAX_ITEMS} captures"
+        )
+
+    query = {"transaction_id": {"$in": transaction_ids}}
+    with request_phase("mongo"):
+        transactions = {
+            transaction["transaction_id"]: transaction
+            async for transaction in iter_transactions(db.transaction_logs, query, with_version=True)
+        }
+
+    authorized = [
+        transaction for transaction in transactions.values()
+        if transaction["status"] == PaymentStatus.AUTHORIZED
+    ]
+
+    captured = []
+    if authorized:
+        with request_phase("gateway"):
+            capture_fields = await simulate_capture_processing(authorized)
+        with request_phase("mongo"):
+            captured = await transition_authorizations(
+                db.transaction_logs,
+                [(transaction, capture_fields[transaction["transaction_id"]]) for transaction in authorized],
+                PaymentStatus.SUCCESS.value
+            )
+        await finish_authorization_transitions(captured, PaymentStatus.SUCCESS)
+
+    captured_ids = {transaction["transaction_id"] for transaction in captured}
+    if len(captured_ids) < len(authorized):
+        # Some were captured or voided concurrently; report their current state
+        raced = [
+            transaction["transaction_id"] for transaction in authorized
+            if transaction["transaction_id"] not in captured_ids
+        ]
+        with request_phase("mongo"):
+            async for transaction in iter_transactions(db.transaction_logs, {"transaction_id": {"$in": raced}}):
+                transactions[transaction["transaction_id"]] = transaction
+
+    results = []
+    for transaction_id in transaction_ids:
+        if transaction_id in captured_ids:
+            results.append(CaptureItemResult(
+                transaction_id=transaction_id, success=True,
+                message="Payment captured", status=PaymentStatus.SUCCESS
+            ))
+        elif transaction_id not in transactions:
+            results.append(CaptureItemResult(
+                transaction_id=transaction_id, success=False, message="Transaction not found"
+            ))
+        else:
+            transaction = transactions[transaction_id]
+            success, message = settled_outcome(transaction, PaymentStatus.SUCCESS)
+            results.append(CaptureItemResult(
+                transaction_id=transaction_id, success=success,
+                message=message, status=transaction["status"]
+            ))
+
+    succeeded = sum(1 for result in results if result.success)
+    return CaptureBatchResponse(
+        total=len(results),
+        captured=succeeded,
+        failed=len(results) - succeeded,
+        results=results
+    )
+
+
+async def void_stale_authorizations() -> List[dict]:
+    """Void one batch of expired authorizations and apply the side effects"""
+    voided = await void_expired_authorizations(db.transaction_logs)
+    await finish_authorization_transitions(voided, PaymentStatus.VOIDED)
+    return voided
+
+
+async def run_authorization_sweeper():
+    """
+    Void stale authorizations every AUTHORIZATION_SWEEP_SECONDS
+    Every worker runs this loop, but only the one holding the sweeper lease
+    sweeps; another takes over once the holder misses a few renewals.
+    """
+    owner = lease_owner()
+    lease = timedelta(seconds=AUTHORIZATION_SWEEP_SECONDS * 3)
+    while True:
+        await asyncio.sleep(AUTHORIZATION_SWEEP_SECONDS)
+        try:
+            if await take_lease(db[LEASES_COLLECTION], AUTHORIZATION_SWEEP_LEASE, owner, lease):
+                await void_stale_authorizations()
+        except Exception as e:
+            logger.error(f"Authorization sweep failed: {e}")
+
+
+@app.post("/authorizations/void-expired")
+async def run_authorization_sweep():
+    """Void expired authorizations now instead of waiting for the next sweep"""
+    voided = await void_stale_authorizations()
+    return {
+        "voided": len(voided),
+        "transaction_ids": [transaction["transaction_id"] for transaction in voided]
+    }
+
+
+async def reconcile_payments() -> List[dict]:
+    """Void one batch of payments with an unknown gateway outcome and apply the side effects"""
+    reconciled = await reconcile_unknown_outcomes(db.transaction_logs, gateway_router)
+    await finish_authorization_transitions(reconciled, PaymentStatus.FAILED, source=PaymentStatus.PENDING)
+    return reconciled
+
+
+async def run_payment_reconciler():
+    """
+    Reconcile unknown gateway outcomes every PAYMENT_RECONCILE_SECONDS
+    Only the worker holding the reconciler lease voids them
+    """
+    owner = lease_owner()
+    lease = timedelta(seconds=PAYMENT_RECONCILE_SECONDS * 3)
+    while True:
+        await asyncio.sleep(PAYMENT_RECONCILE_SECONDS)
+        try:
+            if await take_lease(db[LEASES_COLLECTION], PAYMENT_RECONCILE_LEASE, owner, lease):
+                await reconcile_payments()
+        except Exception as e:
+            logger.error(f"Payment reconciliation failed: {e}")
+
+
+@app.post("/payments/reconcile")
+async def run_payment_reconciliation():
+    """Reconcile pending payments now instead of waiting for the next pass"""
+    reconciled = await reconcile_payments()
+    return {
+        "reconciled": len(reconciled),
+        "transaction_ids": [transaction["transaction_id"] for transaction in reconciled]
+    }
+
 
 async def simulate_payment_processing(
     payment_method: PaymentMethod, 
     amount: float, 
-    payment_details: dict
-) -> bool:
+    payment_details: dict,
+    idempotency_key: Optional[str] = None
+) -> GatewayResult:
     """
-    Simulate payment gateway processing
-    In production, this would make actual API calls to payment gateways
+    Send the payment to the best gateway for its method (see gateway_router)
+    The gateways are simulated; in production they would call the providers' APIs.
+    The result is truthy when the payment was approved.
     """
-    
-    # Simulate processing delay
-    await asyncio.sleep(random.uniform(0.5, 2.0))
-    
-    # Simulate different success rates based on payment method
-    success_rates = {
-        PaymentMethod.CREDIT_CARD: 0.95,
-        PaymentMethod.DEBIT_CARD: 0.90,
-        PaymentMethod.DIGITAL_WALLET: 0.98,
-        PaymentMethod.NET_BANKING: 0.85
+    return await gateway_router.process(payment_method.value, amount, payment_details, idempotency_key)
+
+
+async def simulate_capture_processing(transactions: List[dict]) -> dict:
+    """
+    Simulate capturing authorizations at the gateway
+    Funds are already reserved, so capture is one short call per batch that
+    does not decline; returns the gateway_response fields per transaction.
+    """
+    await asyncio.sleep(random.uniform(0.01, 0.05))
+
+    return {
+        transaction["transaction_id"]: {
+            "capture_reference": f"cap_{uuid.uuid4().hex[:12]}",
+            "gateway_status": "CAPTURED"
+        }
+        for transaction in transactions
     }
-    
-    success_rate = success_rates.get(payment_method, 0.90)
-    
-    # Higher chance of failure for large amounts (simulate risk management)
-    if amount > 5000:
-        success_rate *= 0.8
-    
-    return random.random() < success_rate
 
 
 def sanitize_payment_details(payment_details: dict) -> dict:
@@ -273,36 +901,103 @@ def sanitize_payment_details(payment_details: dict) -> dict:
     return sanitized
 
 
-@app.get("/payments/{transaction_id}")
-async def get_transaction(transaction_id: str):
-    """Get transaction details by ID"""
-    transaction = await db.transaction_logs.find_one({"transaction_id": transaction_id})
-    
+@app.get("/payments/export")
+async def export_transactions(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    status: Optional[PaymentStatus] = None,
+    payment_method: Optional[PaymentMethod] = None,
+    format: ExportFormat = ExportFormat.NDJSON
+):
+    """
+    Stream transactions for reconciliation as NDJSON or CSV
+    Uses a server-side cursor so memory stays constant regardless of result size
+    """
+    query = build_export_filter(
+        start=start,
+        end=end,
+        status=status.value if status else None,
+        payment_method=payment_method.value if payment_method else None
+    )
+    documents = open_export_cursor(db.transaction_logs, query)
+
+    # Older months live in archive files; merge them in created_at order, and
+    # skip archived copies of transactions that are hot again (resumed or restored)
+    if archive_store.covers(start):
+        hot_ids = await hot_transaction_ids(db.transaction_logs, query, archive_store.archived_until())
+        documents = merge_documents(archive_store.iter_documents(query, exclude=hot_ids), documents)
+
+    filename = f"transactions.{format.value}"
+    return StreamingResponse(
+        stream_export(documents, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+async def load_transaction_json(transaction_id: str) -> Optional[bytes]:
+    """
+    Fetch a transaction from MongoDB and serialize it through the response model
+    Transactions that aged out of the hot window are read from the archive.
+    """
+    transaction = await find_transaction(db.transaction_logs, {"transaction_id": transaction_id})
+    if not transaction:
+        transaction = await archive_store.find(transaction_id)
+
     if not transaction:
+        return None
+
+    return TransactionLog.model_validate(transaction).model_dump_json().encode()
+
+
+@app.get("/payments/{transaction_id}", response_model=TransactionLog)
+async def get_transaction(transaction_id: str):
+    """Get transaction details by ID (served from the read-through cache)"""
+    payload = await transaction_cache.get_or_load(transaction_id, load_transaction_json)
+
+    if payload is None:
         raise HTTPException(status_code=404, detail="Transaction not found")
-    
-    # Convert ObjectId to string for JSON serialization
-    if "_id" in transaction:
-        transaction["_id"] = str(transaction["_id"])
-    
-    return transaction
+
+    # Cached bytes are already serialized by TransactionLog; skip re-encoding
+    return Response(content=payload, media_type="application/json")
 
 
 @app.get("/payments/booking/{booking_id}")
 async def get_booking_transactions(booking_id: str):
     """Get all transactions for a booking"""
-    transactions_cursor = db.transaction_logs.find({"booking_id": booking_id})
+    transactions_cursor = db.transaction_logs.find(transaction_filter({"booking_id": booking_id}), {"_id": 0})
     transactions = await transactions_cursor.to_list(length=100)
     
-    return transactions
+    return [decode_transaction(transaction) for transaction in transactions]
+
+
+async def restore_archived_transaction(transaction_id: str) -> Optional[dict]:
+    """
+    Copy an archived transaction back into transaction_logs so it can be updated
+    The archiver re-seals its month with the new state on its next run.
+    """
+    archived = await archive_store.find(transaction_id)
+    if not archived:
+        return None
+
+    try:
+        restored = {**archived, RESTORED_FIELD: datetime.now(timezone.utc)}
+        await db.transaction_logs.insert_one(encode_transaction(restored))
+    except DuplicateKeyError:
+        pass  # A concurrent request restored it first
+    return await find_transaction(db.transaction_logs, {"transaction_id": transaction_id})
 
 
 @app.post("/refunds")
 async def process_refund(transaction_id: str, reason: str):
     """Process refund for a transaction"""
+    mark_phase("parse")
     
     # Find original transaction
-    original_transaction = await db.transaction_logs.find_one({"transaction_id": transaction_id})
+    with request_phase("mongo"):
+        original_transaction = await find_transaction(db.transaction_logs, {"transaction_id": transaction_id})
+        if not original_transaction:
+            original_transaction = await restore_archived_transaction(transaction_id)
     
     if not original_transaction:
         raise HTTPException(status_code=404, detail="Original transaction not found")
@@ -315,6 +1010,7 @@ async def process_refund(transaction_id: str, reason: str):
     refund_transaction = TransactionLog(
         transaction_id=refund_transaction_id,
         booking_id=original_transaction["booking_id"],
+        user_id=original_transaction.get("user_id"),
         amount=-original_transaction["amount"],  # Negative amount for refund
         payment_method=original_transaction["payment_method"],
         status=PaymentStatus.REFUNDED,
@@ -328,27 +1024,40 @@ async def process_refund(transaction_id: str, reason: str):
         }
     )
     
-    await db.transaction_logs.insert_one(refund_transaction.model_dump())
-    
-    # Update original transaction status
-    await db.transaction_logs.update_one(
-        {"transaction_id": transaction_id},
-        {
-            "$set": {
-                "status": PaymentStatus.REFUNDED,
-                "updated_at": datetime.now(timezone.utc)
-            }
-        }
-    )
+    refund_document = refund_transaction.model_dump()
+    with request_phase("mongo"):
+        # Claim the original first: only the request that moves it off "success" refunds it
+        result = await update_transaction(db.transaction_logs, original_transaction, {
+            "status": PaymentStatus.REFUNDED,
+            "updated_at": datetime.now(timezone.utc)
+        }, expected={"status": PaymentStatus.SUCCESS})
+        if result.matched_count != 1:
+            raise HTTPException(status_code=409, detail="Transaction changed concurrently; it is no longer refundable")
+
+        await db.transaction_logs.insert_one(encode_transaction(refund_document))
+    with request_phase("rollup"):
+        # Rollups are gross: the payment moves to "refunded", the refund record is not counted
+        await record_status_change(
+            db[ROLLUP_COLLECTION],
+            original_transaction,
+            original_transaction["status"],
+            PaymentStatus.REFUNDED
+        )
+    with request_phase("cache"):
+        await transaction_cache.invalidate(transaction_id)
     
     # Publish refund event
-    await publish_payment_event("payment.refunded", {
-        "booking_id": original_transaction["booking_id"],
-        "original_transaction_id": transaction_id,
-        "refund_transaction_id": refund_transaction_id,
-        "refund_amount": original_transaction["amount"],
-        "reason": reason
-    })
+    if inline_publishing():
+        with request_phase("publish"):
+            await publish_payment_event("payment.refunded", {
+                "event_id": event_id_for(refund_transaction_id, "payment.refunded"),
+                "booking_id": original_transaction["booking_id"],
+                "user_id": original_transaction.get("user_id"),
+                "original_transaction_id": transaction_id,
+                "refund_transaction_id": refund_transaction_id,
+                "refund_amount": original_transaction["amount"],
+                "reason": reason
+            })
     
     return {
         "success": True,
@@ -357,6 +1066,68 @@ async def process_refund(transaction_id: str, reason: str):
     }
 
 
+@app.get("/settlements/report")
+async def get_settlement_report(
+    start: date,
+    end: date,
+    payment_method: Optional[PaymentMethod] = None,
+    status: Optional[PaymentStatus] = None
+):
+    """Daily totals per payment method and status, served from rollups"""
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+
+    return await settlement_report(
+        db[ROLLUP_COLLECTION],
+        start,
+        end,
+        payment_method=payment_method.value if payment_method else None,
+        status=status.value if status else None
+    )
+
+
+@app.post("/settlements/backfill")
+async def backfill_settlement_rollups(start: Optional[date] = None, end: Optional[date] = None):
+    """Rebuild rollups for a day range from transaction_logs"""
+    if start and end and end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+
+    try:
+        return await backfill_rollups(db, start, end, archive_store.archived_until())
+    except BackfillInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/archive/run")
+async def run_transaction_archiver():
+    """Move whole months older than the hot window into archive files"""
+    try:
+        return await archive_expired(db, archive_store)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/gateways")
+async def get_gateways():
+    """Per-gateway latency and error-rate averages used for routing (this worker only)"""
+    return {"gateways": gateway_router.snapshot()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request and phase latency histograms in Prometheus text format"""
+    return PlainTextResponse(request_metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/slow")
+async def get_slow_requests(limit: Optional[int] = None):
+    """Most recent slow requests with their phase breakdown (this worker only)"""
+    return {
+        "threshold_ms": request_metrics.slow_request_seconds * 1000,
+        "requests": request_metrics.slow_requests(limit)
+    }
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -364,10 +1135,54 @@ async def health_check():
 
 
 # Add startup and shutdown events
+@app.on_event("startup")
+async def startup_event():
+    """Open the MongoDB pool and warm it before taking traffic"""
+    global client, db, velocity_sync_task, event_tailer_task, authorization_sweep_task, reconcile_task
+    global trusted_proxies_task
+    client = AsyncIOMotorClient(MONGODB_URI, **mongo_client_kwargs())
+    # Payments are money movements: acknowledge writes only once a majority has them
+    db = client.get_database("movie_booking", write_concern=write_concern("critical"))
+
+    try:
+        await warm_up_pool(client)
+    except Exception as e:
+        logger.error(f"Failed to warm up MongoDB connection pool: {e}")
+
+    await guard_write_version(db)
+
+    trusted_proxies_task = await trusted_proxies.start()
+
+    if velocity_checker.enabled:
+        velocity_sync_task = asyncio.create_task(velocity_checker.run_sync_loop())
+
+    await resolve_publishing_mode(db)
+    if not inline_publishing():
+        event_tailer_task = asyncio.create_task(TransactionEventTailer(db).run())
+
+    if AUTHORIZATION_SWEEP_SECONDS > 0:
+        authorization_sweep_task = asyncio.create_task(run_authorization_sweeper())
+
+    if PAYMENT_RECONCILE_SECONDS > 0:
+        reconcile_task = asyncio.create_task(run_payment_reconciler())
+
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on app shutdown"""
+    for task in (
+        velocity_sync_task, event_tailer_task, authorization_sweep_task, reconcile_task, trusted_proxies_task
+    ):
+        if task:
+            task.cancel()
+    # Losing hedge calls may still need their approvals voided
+    await gateway_router.settle()
     await cleanup_event_publisher()
+    await close_redis()
+    if request_metrics.metrics_dir:
+        request_metrics.flush()
+    if client:
+        client.close()
 
 
 if __name__ == "__main__":
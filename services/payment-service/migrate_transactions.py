@@ -0,0 +1,262 @@
+"""
+Transaction log schema migration for Payment Service
+Rewrites legacy (version 1) transaction_logs documents into the compact
+version 2 shape defined in transaction_codec.py, in resumable batches.
+
+Typical rollout:
+
+    python migrate_transactions.py --apply-schema     # validator + compact indexes
+    TRANSACTION_STORAGE_VERSION=2                     # redeploy: write compact documents
+    python migrate_transactions.py --dry-run          # estimate the space saved
+    python migrate_transactions.py                    # rewrite legacy documents
+    TRANSACTION_LEGACY_READS=false                    # redeploy the service
+    python migrate_transactions.py --drop-legacy-indexes
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict
+
+import bson
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+from pymongo.errors import OperationFailure
+
+from transaction_codec import (
+    COMPACT_VERSION,
+    STATUS_CODES,
+    TRANSACTION_STORAGE_VERSION,
+    VERSION_FIELD,
+    encode_transaction,
+    use_write_version,
+)
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "1000"))
+# Passes over the documents a concurrent write made the previous pass skip
+MIGRATION_MAX_PASSES = int(os.getenv("MIGRATION_MAX_PASSES", "3"))
+
+LEGACY_QUERY = {VERSION_FIELD: {"$exists": False}}
+
+LEGACY_INDEXES = ["booking_id_1", "status_1", "created_at_-1"]
+
+# Either schema version is accepted until the migration has finished
+TRANSACTION_VALIDATOR = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "anyOf": [
+            {
+                "required": ["transaction_id", "booking_id", "amount", "payment_method", "status", "created_at"],
+                "properties": {
+                    "transaction_id": {"bsonType": "string"},
+                    "booking_id": {"bsonType": "string"},
+                    "user_id": {"bsonType": ["string", "null"]},
+                    "amount": {"bsonType": "double"},
+                    "payment_method": {"enum": ["credit_card", "debit_card", "digital_wallet", "net_banking"]},
+                    "status": {"enum": ["pending", "success", "failed", "refunded", "authorized", "voided"]},
+                    "created_at": {"bsonType": "date"},
+                },
+            },
+            {
+                "required": [VERSION_FIELD, "t", "b", "a", "m", "s", "c"],
+                "properties": {
+                    VERSION_FIELD: {"enum": [COMPACT_VERSION]},
+                    "t": {"bsonType": "string"},
+                    "b": {"bsonType": "string"},
+                    "u": {"bsonType": "string"},
+                    "a": {"bsonType": ["int", "long"]},
+                    "m": {"bsonType": "int"},
+                    "s": {"bsonType": "int"},
+                    "d": {"bsonType": "object"},
+                    "g": {"bsonType": "object"},
+                    "f": {"bsonType": "string"},
+                    "c": {"bsonType": "date"},
+                    "up": {"bsonType": "date"},
+                },
+            },
+        ],
+    }
+}
+
+
+async def apply_schema(db):
+    """Install the dual-version validator and the compact indexes"""
+    await db.command({"collMod": "transaction_logs", "validator": TRANSACTION_VALIDATOR})
+
+    collection = db.transaction_logs
+    await collection.create_index(
+        [("t", ASCENDING)], unique=True, name="t_1",
+        partialFilterExpression={VERSION_FIELD: COMPACT_VERSION},
+    )
+    await collection.create_index([("b", ASCENDING)], name="b_1")
+    await collection.create_index([("s", ASCENDING)], name="s_1")
+    await collection.create_index([("c", DESCENDING)], name="c_-1")
+    # Only open authorizations, oldest first, for the stale-authorization sweep
+    await collection.create_index(
+        [("c", ASCENDING)], name="authorized_c_1",
+        partialFilterExpression={"s": STATUS_CODES["authorized"]},
+    )
+
+    # Compact documents have no transaction_id, so the legacy unique index
+    # must only cover legacy documents or the second compact insert collides
+    indexes = await collection.index_information()
+    legacy_unique = indexes.get("transaction_id_1")
+    if legacy_unique and "partialFilterExpression" not in legacy_unique:
+        await collection.drop_index("transaction_id_1")
+    await collection.create_index(
+        [("transaction_id", ASCENDING)], unique=True, name="transaction_id_1",
+        partialFilterExpression={"transaction_id": {"$exists": True}},
+    )
+    logger.info("Applied compact transaction_logs schema and indexes")
+
+
+async def compact_schema_ready(db) -> bool:
+    """
+    Whether transaction_logs accepts compact documents
+    A database created before the compact schema keeps its old validator, which
+    requires transaction_id and a double amount, and a unique transaction_id
+    index over every document, until --apply-schema has run.
+    """
+    collection = db.transaction_logs
+    indexes = await collection.index_information()
+    legacy_unique = indexes.get("transaction_id_1")
+    if "t_1" not in indexes or (legacy_unique and "partialFilterExpression" not in legacy_unique):
+        return False
+
+    listing = await db.command({"listCollections": 1, "filter": {"name": "transaction_logs"}})
+    collections = listing["cursor"]["firstBatch"]
+    validator = collections[0].get("options", {}).get("validator") if collections else None
+    return not validator or validator == TRANSACTION_VALIDATOR
+
+
+async def guard_write_version(db, requested: int = TRANSACTION_STORAGE_VERSION) -> int:
+    """
+    Write the requested version only if transaction_logs accepts it
+    Called at service startup; returns the version new transactions are written in
+    """
+    version = requested
+    if requested >= COMPACT_VERSION:
+        try:
+            ready = await compact_schema_ready(db)
+        except Exception as e:
+            logger.error(f"Could not check the transaction_logs schema: {e}")
+            ready = False
+        if not ready:
+            logger.error(
+                "transaction_logs lacks the compact schema; run migrate_transactions.py --apply-schema. "
+                "Writing version 1 transactions until then"
+            )
+            version = 1
+    use_write_version(version)
+    return version
+
+
+async def drop_legacy_indexes(db):
+    """Drop indexes that only serve version 1 documents once none remain"""
+    remaining = await db.transaction_logs.count_documents(LEGACY_QUERY, limit=1)
+    if remaining:
+        raise RuntimeError("Legacy transaction documents remain; run the migration first")
+
+    indexes = await db.transaction_logs.index_information()
+    for name in LEGACY_INDEXES + ["transaction_id_1"]:
+        if name in indexes:
+            await db.transaction_logs.drop_index(name)
+            logger.info(f"Dropped legacy index {name}")
+
+
+def snapshot_filter(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Match a legacy document only while it is unchanged since it was read"""
+    return {
+        "_id": document["_id"],
+        **LEGACY_QUERY,
+        "status": document.get("status"),
+        "updated_at": document.get("updated_at"),
+    }
+
+
+async def migrate(
+    db, batch_size: int = MIGRATION_BATCH_SIZE, dry_run: bool = False, max_passes: int = MIGRATION_MAX_PASSES
+) -> Dict[str, Any]:
+    """
+    Replace legacy documents with their compact encoding
+    A refund, capture or void can update a document between the read and its
+    replace. Each replace is conditioned on the document still being legacy
+    with the status and updated_at it was read with, so such a document is
+    skipped rather than overwritten with stale fields, and picked up by the
+    next pass. The job can be stopped and re-run at any point.
+    """
+    stats = {"documents": 0, "legacy_bytes": 0, "compact_bytes": 0, "replaced": 0, "skipped": 0, "passes": 0}
+    batch = []
+    skipped = 0
+
+    async def flush():
+        nonlocal batch, skipped
+        if batch and not dry_run:
+            result = await db.transaction_logs.bulk_write(batch, ordered=False)
+            stats["replaced"] += result.modified_count
+            skipped += len(batch) - result.matched_count
+        batch = []
+
+    while stats["passes"] < max(1, max_passes):
+        stats["passes"] += 1
+        skipped = 0
+        cursor = db.transaction_logs.find(LEGACY_QUERY).batch_size(batch_size)
+        async for document in cursor:
+            compact = encode_transaction(document, COMPACT_VERSION)
+            stats["documents"] += 1
+            stats["legacy_bytes"] += len(bson.encode(document))
+            stats["compact_bytes"] += len(bson.encode(compact))
+
+            batch.append(ReplaceOne(snapshot_filter(document), compact))
+            if len(batch) >= batch_size:
+                await flush()
+                logger.info(f"Migrated {stats['documents']} transactions")
+
+        await flush()
+        stats["skipped"] = skipped
+        if not skipped:
+            break
+        logger.info(f"{skipped} transactions changed during pass {stats['passes']}")
+
+    if stats["skipped"]:
+        logger.warning(f"{stats['skipped']} transactions kept changing; re-run the migration for them")
+    if stats["legacy_bytes"]:
+        stats["saved_ratio"] = round(1 - stats["compact_bytes"] / stats["legacy_bytes"], 3)
+    return stats
+
+
+async def run_migration(dry_run: bool = False, apply: bool = False, drop_indexes: bool = False):
+    """Standalone migration entry point"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from shared.mongo_config import mongo_client_kwargs, write_concern
+
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"), **mongo_client_kwargs())
+    try:
+        db = client.get_database("movie_booking", write_concern=write_concern("critical"))
+        if apply:
+            await apply_schema(db)
+        elif drop_indexes:
+            await drop_legacy_indexes(db)
+        else:
+            result = await migrate(db, dry_run=dry_run)
+            logger.info(f"Migration {'estimate' if dry_run else 'complete'}: {result}")
+    except OperationFailure as e:
+        logger.error(f"Migration failed: {e}")
+        raise
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Migrate transaction_logs to the compact schema")
+    parser.add_argument("--dry-run", action="store_true", help="Estimate savings without writing")
+    parser.add_argument("--apply-schema", action="store_true", help="Install the validator and compact indexes")
+    parser.add_argument("--drop-legacy-indexes", action="store_true", help="Drop version 1 indexes after migrating")
+    args = parser.parse_args()
+
+    asyncio.run(run_migration(args.dry_run, args.apply_schema, args.drop_legacy_indexes))
@@ -0,0 +1,46 @@
+"""
+Token-bucket rate limiting for Payment Service
+The buckets, key functions and middleware live in shared/rate_limiter.py;
+this module binds them to the payment Redis client and settings.
+"""
+
+import os
+from typing import Callable, Optional
+
+from redis_client import get_redis
+from shared.rate_limiter import (
+    LocalTokenBuckets,
+    RateLimitMiddleware,
+    RateLimitPolicy,
+    RateLimitRequest,
+    RateLimitResult,
+    RateLimiter as SharedRateLimiter,
+    TrustedProxies,
+    body_field_key,
+    body_items_key,
+    build_result,
+    client_key_for,
+    rate_limit_headers,
+)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_LOCAL_MAX_KEYS = int(os.getenv("RATE_LIMIT_LOCAL_MAX_KEYS", "100000"))
+# Peers allowed to set X-Consumer-ID / X-User-ID / X-Forwarded-For, e.g. "kong,booking-service"
+RATE_LIMIT_TRUSTED_PROXIES = os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "")
+
+# Hostnames among them are resolved at startup (see main.startup_event), not per request
+trusted_proxies = TrustedProxies.from_spec(RATE_LIMIT_TRUSTED_PROXIES)
+client_key = client_key_for(trusted_proxies)
+
+
+class RateLimiter(SharedRateLimiter):
+    """Payment buckets in the service's Redis"""
+
+    def __init__(
+        self,
+        redis_getter: Callable = get_redis,
+        key_prefix: str = "payment:ratelimit:",
+        local: Optional[LocalTokenBuckets] = None,
+        enabled: bool = RATE_LIMIT_ENABLED,
+    ):
+        super().__init__(redis_getter, key_prefix, local or LocalTokenBuckets(RATE_LIMIT_LOCAL_MAX_KEYS), enabled)
@@ -0,0 +1,81 @@
+"""
+Reconciliation of payments with an unknown gateway outcome
+A gateway call that timed out and could not be voided may still have charged
+the card (see gateway_router). Such a payment is stored as "pending" with the
+gateway that holds it, gets no payment event and is not reported as failed:
+the booking service keeps the booking waiting instead of letting the user pay
+again.
+
+The worker holding the PAYMENT_RECONCILE_LEASE voids these attempts every
+PAYMENT_RECONCILE_SECONDS, keyed by transaction id (the idempotency key the
+gateway was called with). A confirmed void turns the payment "failed", which
+announces payment.failed; an attempt that cannot be voided yet stays pending
+for the next pass.
+"""
+
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from transaction_codec import iter_transactions, update_transaction
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+FAILED = "failed"
+
+OUTCOME_UNKNOWN = "OUTCOME_UNKNOWN"
+
+# How often unknown outcomes are reconciled (0 disables the loop)
+PAYMENT_RECONCILE_SECONDS = int(os.getenv("PAYMENT_RECONCILE_SECONDS", "60"))
+PAYMENT_RECONCILE_LEASE = "payment-reconciler"
+PAYMENT_RECONCILE_BATCH_SIZE = int(os.getenv("PAYMENT_RECONCILE_BATCH_SIZE", "100"))
+
+
+def unknown_outcome_fields(gateway: Optional[str]) -> Dict[str, Any]:
+    """gateway_response of a payment the gateway may or may not have charged"""
+    return {"gateway": gateway, "gateway_status": OUTCOME_UNKNOWN, "error_code": OUTCOME_UNKNOWN}
+
+
+async def unknown_outcomes(collection, limit: int = PAYMENT_RECONCILE_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """Oldest pending payments"""
+    pending = []
+    async for transaction in iter_transactions(
+        collection, {"status": PENDING}, sort_field="created_at", with_version=True
+    ):
+        pending.append(transaction)
+        if len(pending) >= limit:
+            break
+    return pending
+
+
+async def reconcile_unknown_outcomes(
+    collection, router, limit: int = PAYMENT_RECONCILE_BATCH_SIZE
+) -> List[Dict[str, Any]]:
+    """Void one batch of pending payments at their gateway, returning the ones this call failed"""
+    reconciled = []
+    for transaction in await unknown_outcomes(collection, limit):
+        gateway_response = transaction.get("gateway_response") or {}
+        if not await router.reconcile(gateway_response.get("gateway"), transaction["transaction_id"]):
+            logger.warning(f"Payment {transaction['transaction_id']} could not be voided yet; still pending")
+            continue
+
+        fields = {
+            "status": FAILED,
+            "failure_reason": "Gateway outcome unknown; the attempt was voided",
+            "gateway_response": {
+                **gateway_response,
+                "gateway_status": "VOIDED",
+                "void_reference": f"void_{uuid.uuid4().hex[:12]}",
+            },
+            "updated_at": datetime.now(timezone.utc),
+        }
+        result = await update_transaction(collection, transaction, fields, expected={"status": PENDING})
+        if result.modified_count == 1:
+            reconciled.append({**transaction, **fields})
+
+    if reconciled:
+        logger.info(f"Reconciled {len(reconciled)} payments with an unknown gateway outcome")
+    return reconciled
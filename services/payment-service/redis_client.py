@@ -0,0 +1,46 @@
+"""
+Shared Redis connection for Payment Service
+Redis is optional: features that use it fall back to in-process state
+when REDIS_URL is unset or the redis package is not installed
+"""
+
+import logging
+import os
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis.asyncio as redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    redis = None
+    REDIS_AVAILABLE = False
+
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+_redis_client = None
+
+
+def get_redis() -> Optional["redis.Redis"]:
+    """Return the process-wide Redis client, or None when Redis is not configured"""
+    global _redis_client
+
+    if not REDIS_URL or not REDIS_AVAILABLE:
+        return None
+
+    if _redis_client is None:
+        _redis_client = redis.from_url(REDIS_URL)
+        logger.info(f"Redis client created for {REDIS_URL}")
+
+    return _redis_client
+
+
+async def close_redis():
+    """Close the Redis client on shutdown"""
+    global _redis_client
+
+    if _redis_client is not None:
+        await _redis_client.close()
+        _redis_client = None
+        logger.info("Redis client closed")
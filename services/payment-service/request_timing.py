@@ -0,0 +1,279 @@
+"""
+Per-phase request timing for Payment Service
+Handlers mark phases (parse, validation, gateway, mongo, rollup, publish) with
+request_phase(); the middleware reports them in a Server-Timing header, folds
+them into latency histograms served as Prometheus text on /metrics, and keeps
+a sample of slow requests in a ring buffer.
+
+Under gunicorn each worker has its own histograms. With METRICS_DIR set,
+workers write snapshots there and /metrics merges every worker's data, so a
+scrape sees the whole service whichever worker answers it.
+"""
+
+import bisect
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMING_ENABLED = os.getenv("REQUEST_TIMING_ENABLED", "true").lower() == "true"
+
+# Requests at or above this total duration are candidates for the slow log
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+SLOW_LOG_SIZE = int(os.getenv("SLOW_LOG_SIZE", "200"))
+SLOW_LOG_SAMPLE_RATE = float(os.getenv("SLOW_LOG_SAMPLE_RATE", "1.0"))
+
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "10"))
+
+# Histogram upper bounds in seconds (Prometheus "le" labels)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_PREFIX = "payment"
+
+
+class RequestTiming:
+    """Phase durations collected while one request is handled"""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.start = clock()
+        self.last_mark = self.start
+        self.phases: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def mark(self, name: str):
+        """Record the time since the previous mark (or the request start) as a phase"""
+        now = self.clock()
+        self.add(name, now - self.last_mark)
+        self.last_mark = now
+
+    def elapsed(self) -> float:
+        return self.clock() - self.start
+
+
+current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("current_timing", default=None)
+
+
+@contextmanager
+def request_phase(name: str) -> Iterator[None]:
+    """Time a block as a phase of the current request (no-op outside a request)"""
+    timing = current_timing.get()
+    if timing is None:
+        yield
+        return
+
+    started = timing.clock()
+    try:
+        yield
+    finally:
+        now = timing.clock()
+        timing.add(name, now - started)
+        timing.last_mark = now
+
+
+def mark_phase(name: str):
+    """Close a phase that started at the previous mark, e.g. request parsing"""
+    timing = current_timing.get()
+    if timing is not None:
+        timing.mark(name)
+
+
+def server_timing_header(phases: Dict[str, float], total: float) -> str:
+    """Server-Timing value with durations in milliseconds"""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in phases.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def merge(self, counts: List[int], total: float, count: int):
+        for index, value in enumerate(counts):
+            self.counts[index] += value
+        self.sum += total
+        self.count += count
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class RequestMetrics:
+    """Request and phase histograms plus the slow-request ring buffer"""
+
+    def __init__(
+        self,
+        slow_request_ms: float = SLOW_REQUEST_MS,
+        slow_log_size: int = SLOW_LOG_SIZE,
+        slow_log_sample_rate: float = SLOW_LOG_SAMPLE_RATE,
+        metrics_dir: str = METRICS_DIR,
+    ):
+        self.slow_request_seconds = slow_request_ms / 1000
+        self.slow_log_sample_rate = slow_log_sample_rate
+        self.slow_log: Deque[Dict[str, Any]] = deque(maxlen=slow_log_size)
+        self.metrics_dir = metrics_dir
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.last_flush = time.monotonic()
+
+    def _observe(self, name: str, labels: Labels, seconds: float):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def record(self, method: str, route: str, status: int, total: float, phases: Dict[str, float]):
+        status_class = f"{status // 100}xx"
+        self._observe("request_duration_seconds", (("method", method), ("route", route), ("status", status_class)), total)
+        for phase, seconds in phases.items():
+            self._observe("request_phase_duration_seconds", (("route", route), ("phase", phase)), seconds)
+
+        if total >= self.slow_request_seconds and random.random() < self.slow_log_sample_rate:
+            self.slow_log.append({
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "method": method,
+                "route": route,
+                "status": status,
+                "duration_ms": round(total * 1000, 1),
+                "phases_ms": {phase: round(seconds * 1000, 1) for phase, seconds in phases.items()},
+            })
+
+        if self.metrics_dir and time.monotonic() - self.last_flush >= METRICS_FLUSH_SECONDS:
+            self.flush()
+
+    def slow_requests(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Slow-log entries, newest first"""
+        entries = list(reversed(self.slow_log))
+        return entries[:limit] if limit else entries
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [
+            {"name": name, "labels": list(labels), **histogram.snapshot()}
+            for (name, labels), histogram in self.histograms.items()
+        ]
+
+    def flush(self):
+        """Write this worker's histograms where the other workers can merge them"""
+        self.last_flush = time.monotonic()
+        path = os.path.join(self.metrics_dir, f"worker-{os.getpid()}.json")
+        try:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning(f"Failed to write metrics snapshot: {e}")
+
+    def merged(self) -> Dict[Tuple[str, Labels], Histogram]:
+        """Live histograms of this worker plus the latest snapshots of the others"""
+        merged: Dict[Tuple[str, Labels], Histogram] = {}
+
+        def add(name, labels, counts, total, count):
+            histogram = merged.setdefault((name, labels), Histogram())
+            histogram.merge(counts, total, count)
+
+        for (name, labels), histogram in self.histograms.items():
+            add(name, labels, histogram.counts, histogram.sum, histogram.count)
+
+        if self.metrics_dir and os.path.isdir(self.metrics_dir):
+            own = f"worker-{os.getpid()}.json"
+            for filename in os.listdir(self.metrics_dir):
+                if filename == own or not filename.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.metrics_dir, filename)) as f:
+                        entries = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                for entry in entries:
+                    labels = tuple(tuple(pair) for pair in entry["labels"])
+                    add(entry["name"], labels, entry["counts"], entry["sum"], entry["count"])
+
+        return merged
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        described = set()
+
+        for (name, labels), histogram in sorted(self.merged().items()):
+            metric = f"{METRIC_PREFIX}_{name}"
+            if metric not in described:
+                described.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{label_text},le="+Inf"}} {histogram.count}')
+            lines.append(f"{metric}_sum{{{label_text}}} {histogram.sum:.6f}")
+            lines.append(f"{metric}_count{{{label_text}}} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+class ServerTimingMiddleware:
+    """
+    Pure ASGI middleware that times each HTTP request, adds Server-Timing to
+    the response and records the request once its body has been sent
+    """
+
+    def __init__(self, app, metrics: RequestMetrics, exclude_paths: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.metrics = metrics
+        self.exclude_paths = exclude_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not REQUEST_TIMING_ENABLED or scope["path"].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing_header(timing.phases, timing.elapsed())
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", header.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timing.reset(token)
+            # Route templates keep label cardinality bounded (/payments/{transaction_id})
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            self.metrics.record(scope["method"], route_path, status, timing.elapsed(), timing.phases)
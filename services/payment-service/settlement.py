@@ -0,0 +1,393 @@
+"""
+Settlement Rollups for Payment Service
+Maintains per day x payment method x status totals so settlement reports
+read a handful of small documents instead of scanning transaction_logs
+
+Totals are kept as integer cents (total_cents), like the compact storage
+codec, so thousands of $inc updates never accumulate float error. Buckets
+written before that keep their float total_amount until they are backfilled;
+reports add it in.
+
+Amounts are gross: a payment is counted once, in the bucket of its current
+status, and a refunded payment moves from "success" to "refunded" with its
+full amount. Refund records themselves (negative amounts) are not rolled up,
+so net settled = success and gross captured = success + refunded.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from shared.leases import LEASES_COLLECTION, lease_owner, release_lease, take_lease
+from transaction_codec import from_minor_units, normalize_stage, to_minor_units, transaction_filter
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = "payment_rollups"
+DAY_FORMAT = "%Y-%m-%d"
+
+# How long a backfill may hold the backfill lease
+SETTLEMENT_BACKFILL_LEASE_SECONDS = int(os.getenv("SETTLEMENT_BACKFILL_LEASE_SECONDS", "3600"))
+SETTLEMENT_BACKFILL_LEASE = "settlement-backfill"
+
+
+class BackfillInProgress(RuntimeError):
+    """Another backfill holds the backfill lease"""
+
+
+def _value(field: Any) -> Any:
+    """Unwrap enum members so rollup keys hold plain strings"""
+    return field.value if isinstance(field, Enum) else field
+
+
+def rollup_day(timestamp: datetime) -> str:
+    """Bucket a timestamp into its UTC settlement day"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return timestamp.strftime(DAY_FORMAT)
+
+
+def rollup_id(day: str, payment_method: str, status: str) -> str:
+    """Deterministic rollup document key"""
+    return f"{day}|{payment_method}|{status}"
+
+
+def rollup_update(transaction: Dict[str, Any], status: Any, sign: int = 1) -> UpdateOne:
+    """Build the $inc upsert that adds (or removes) one transaction from a bucket"""
+    day = rollup_day(transaction["created_at"])
+    payment_method = _value(transaction["payment_method"])
+    status = _value(status)
+
+    return UpdateOne(
+        {"_id": rollup_id(day, payment_method, status)},
+        {
+            "$inc": {"count": sign, "total_cents": sign * to_minor_units(transaction["amount"])},
+            "$set": {"updated_at": datetime.now(timezone.utc)},
+            "$setOnInsert": {"day": day, "payment_method": payment_method, "status": status},
+        },
+        upsert=True,
+    )
+
+
+async def record_transactions(collection, transactions: List[Dict[str, Any]]):
+    """Fold newly written transactions into their rollup buckets"""
+    if not transactions:
+        return
+
+    try:
+        await collection.bulk_write(
+            [rollup_update(transaction, transaction["status"]) for transaction in transactions],
+            ordered=False,
+        )
+    except Exception as e:
+        # Rollups can always be rebuilt with backfill_rollups; never fail a payment over them
+        logger.error(f"Failed to update payment rollups: {e}")
+
+
+async def record_transaction(collection, transaction: Dict[str, Any]):
+    """Fold a single newly written transaction into its rollup bucket"""
+    await record_transactions(collection, [transaction])
+
+
+async def record_status_changes(collection, transactions: List[Dict[str, Any]], old_status: Any, new_status: Any):
+    """Move transactions from their old status bucket to the new one"""
+    if not transactions:
+        return
+
+    operations = []
+    for transaction in transactions:
+        operations.append(rollup_update(transaction, old_status, sign=-1))
+        operations.append(rollup_update(transaction, new_status))
+
+    try:
+        await collection.bulk_write(operations, ordered=False)
+    except Exception as e:
+        logger.error(f"Failed to move payment rollup from {_value(old_status)} to {_value(new_status)}: {e}")
+
+
+async def record_status_change(collection, transaction: Dict[str, Any], old_status: Any, new_status: Any):
+    """Move a transaction from its old status bucket to the new one"""
+    await record_status_changes(collection, [transaction], old_status, new_status)
+
+
+def _live_delta(field: str, backfill_id: Optional[str]) -> Dict[str, Any]:
+    """What live $inc updates added to a bucket field since the backfill took its snapshot"""
+    base = {"$cond": [{"$eq": ["$backfill_base.id", backfill_id]}, f"$backfill_base.{field}", 0]}
+    return {"$subtract": [{"$ifNull": [f"${field}", 0]}, base]}
+
+
+def backfill_pipeline(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    backfill_id: Optional[str] = None,
+    created_before: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Aggregation pipeline that recomputes rollups from transaction_logs
+    Each rebuilt bucket is stamped with backfill_id so the run can tell which
+    buckets in its range it did not reproduce. Only transactions created before
+    created_before are read; an existing bucket keeps whatever live updates
+    added since its snapshot on top of the rebuilt totals.
+    """
+    pipeline: List[Dict[str, Any]] = []
+
+    created_at: Dict[str, Any] = {}
+    if start:
+        created_at["$gte"] = datetime.combine(start, time.min, tzinfo=timezone.utc)
+    if end:
+        created_at["$lt"] = datetime.combine(end + timedelta(days=1), time.min, tzinfo=timezone.utc)
+    if created_before and ("$lt" not in created_at or created_before < created_at["$lt"]):
+        created_at["$lt"] = created_before
+    if created_at:
+        pipeline.append({"$match": transaction_filter({"created_at": created_at})})
+
+    # Present compact and legacy documents alike: API field names, major units
+    pipeline.append(normalize_stage())
+
+    # Refund records are not rolled up: the refunded payment is (see module docstring)
+    pipeline.append({"$match": {"amount_cents": {"$gte": 0}}})
+
+    pipeline.extend([
+        {
+            "$group": {
+                "_id": {
+                    "day": {"$dateToString": {"format": DAY_FORMAT, "date": "$created_at", "timezone": "UTC"}},
+                    "payment_method": "$payment_method",
+                    "status": "$status",
+                },
+                "count": {"$sum": 1},
+                "total_cents": {"$sum": "$amount_cents"},
+            }
+        },
+        {
+            "$project": {
+                "_id": {"$concat": ["$_id.day", "|", "$_id.payment_method", "|", "$_id.status"]},
+                "day": "$_id.day",
+                "payment_method": "$_id.payment_method",
+                "status": "$_id.status",
+                "count": 1,
+                "total_cents": 1,
+                "backfill_id": backfill_id,
+                "updated_at": "$$NOW",
+            }
+        },
+        {
+            "$merge": {
+                "into": ROLLUP_COLLECTION,
+                "on": "_id",
+                "whenMatched": [
+                    {
+                        "$set": {
+                            "count": {"$add": ["$$new.count", _live_delta("count", backfill_id)]},
+                            "total_cents": {"$add": ["$$new.total_cents", _live_delta("total_cents", backfill_id)]},
+                            "backfill_id": "$$new.backfill_id",
+                            "updated_at": "$$new.updated_at",
+                        }
+                    },
+                    {"$unset": ["backfill_base", "total_amount"]},
+                ],
+                "whenNotMatched": "insert",
+            }
+        },
+    ])
+
+    return pipeline
+
+
+def _day_filter(start: Optional[date], end: Optional[date]) -> Dict[str, Any]:
+    day_filter: Dict[str, Any] = {}
+    if start:
+        day_filter["$gte"] = start.strftime(DAY_FORMAT)
+    if end:
+        day_filter["$lte"] = end.strftime(DAY_FORMAT)
+    return {"day": day_filter} if day_filter else {}
+
+
+async def backfill_rollups(
+    db,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    archived_until: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """
+    Rebuild rollups for a day range (inclusive) from transaction_logs
+    Payments keep updating rollups with $inc while this runs, so each bucket in
+    the range first records its current totals (backfill_base). $merge then
+    sets the rebuilt totals plus whatever live updates added since, so reports
+    never see the range empty and no live update is overwritten. Buckets the
+    rebuild did not produce (no transactions left) are removed afterwards, or
+    keep only their live updates if a payment touched them meanwhile.
+
+    A payment whose status changes while the rebuild reads it, or that is
+    written while the snapshot is taken, may be counted twice or not at all;
+    the next backfill corrects it. Runs hold the backfill lease, so a second
+    one raises BackfillInProgress instead of mixing snapshots.
+    Days before archived_until have left the hot collection, so their rollups are kept.
+    """
+    if archived_until is not None:
+        first_hot_day = archived_until.date()
+        if start is None or start < first_hot_day:
+            start = first_hot_day
+        if end is not None and end < start:
+            return {"start": start.isoformat(), "end": end.isoformat(), "rollups_rebuilt": 0, "rollups_removed": 0}
+
+    leases = db[LEASES_COLLECTION]
+    owner = lease_owner()
+    duration = timedelta(seconds=SETTLEMENT_BACKFILL_LEASE_SECONDS)
+    if not await take_lease(leases, SETTLEMENT_BACKFILL_LEASE, owner, duration):
+        raise BackfillInProgress("Another settlement backfill is in progress")
+
+    try:
+        rollups = db[ROLLUP_COLLECTION]
+        backfill_id = uuid.uuid4().hex
+        days = _day_filter(start, end)
+        started_at = datetime.now(timezone.utc)
+
+        await rollups.update_many(days, [{
+            "$set": {
+                "backfill_base": {
+                    "id": backfill_id,
+                    "count": {"$ifNull": ["$count", 0]},
+                    "total_cents": {"$ifNull": ["$total_cents", 0]},
+                }
+            }
+        }])
+
+        cursor = db.transaction_logs.aggregate(
+            backfill_pipeline(start, end, backfill_id, created_before=started_at), allowDiskUse=True
+        )
+        await cursor.to_list(length=None)
+
+        removed = await rollups.delete_many({
+            **days,
+            "backfill_id": {"$ne": backfill_id},
+            "backfill_base.id": backfill_id,
+            "updated_at": {"$lt": started_at},
+        })
+        # Not rebuilt but updated meanwhile: keep only what live updates added
+        await rollups.update_many({**days, "backfill_base.id": backfill_id}, [
+            {
+                "$set": {
+                    "count": _live_delta("count", backfill_id),
+                    "total_cents": _live_delta("total_cents", backfill_id),
+                }
+            },
+            {"$unset": ["backfill_base", "total_amount"]},
+        ])
+        rebuilt = await rollups.count_documents({**days, "backfill_id": backfill_id})
+        logger.info(f"Rebuilt {rebuilt} payment rollups (removed {removed.deleted_count} stale)")
+    finally:
+        await release_lease(leases, SETTLEMENT_BACKFILL_LEASE, owner)
+
+    return {
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None,
+        "rollups_rebuilt": rebuilt,
+        "rollups_removed": removed.deleted_count,
+    }
+
+
+async def settlement_report(
+    collection,
+    start: date,
+    end: date,
+    payment_method: Optional[str] = None,
+    status: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Summarise rollups for a day range (inclusive)
+    Every amount is gross (see module docstring); "settlement" spells out gross
+    captured, refunded and net settled for the successful payments in the range.
+    """
+    query = _day_filter(start, end)
+    if payment_method:
+        query["payment_method"] = payment_method
+    if status:
+        query["status"] = status
+
+    days: Dict[str, Dict[str, Any]] = {}
+    by_method: Dict[str, Dict[str, Any]] = {}
+    by_status: Dict[str, Dict[str, Any]] = {}
+    totals = {"count": 0, "total_amount": 0}
+
+    async for rollup in collection.find(query, {"_id": 0, "updated_at": 0}).sort("day", 1):
+        count = rollup.get("count", 0)
+        # Sums stay in integer cents; total_amount is the float total of older buckets
+        cents = rollup.get("total_cents", 0) + to_minor_units(rollup.get("total_amount", 0))
+        if count == 0:
+            continue
+
+        day = days.setdefault(rollup["day"], {"day": rollup["day"], "count": 0, "total_amount": 0, "buckets": []})
+        day["count"] += count
+        day["total_amount"] += cents
+        day["buckets"].append({
+            "payment_method": rollup["payment_method"],
+            "status": rollup["status"],
+            "count": count,
+            "total_amount": from_minor_units(cents),
+        })
+
+        for group, key in ((by_method, rollup["payment_method"]), (by_status, rollup["status"])):
+            entry = group.setdefault(key, {"count": 0, "total_amount": 0})
+            entry["count"] += count
+            entry["total_amount"] += cents
+
+        totals["count"] += count
+        totals["total_amount"] += cents
+
+    for entry in [*days.values(), *by_method.values(), *by_status.values(), totals]:
+        entry["total_amount"] = from_minor_units(entry["total_amount"])
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "days": list(days.values()),
+        "by_payment_method": by_method,
+        "by_status": by_status,
+        "totals": totals,
+        "settlement": settlement_totals(by_status),
+    }
+
+
+def settlement_totals(by_status: Dict[str, Dict[str, Any]]) -> Dict[str, float]:
+    """Gross captured, refunded and net settled amounts from the per-status totals"""
+    settled = by_status.get("success", {}).get("total_amount", 0.0)
+    refunded = by_status.get("refunded", {}).get("total_amount", 0.0)
+    return {
+        "gross_captured": from_minor_units(to_minor_units(settled) + to_minor_units(refunded)),
+        "refunded": refunded,
+        "net_settled": settled,
+    }
+
+
+async def run_backfill(start: Optional[date] = None, end: Optional[date] = None):
+    """Standalone backfill job entry point"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from shared.mongo_config import mongo_client_kwargs
+    from transaction_archive import ArchiveStore
+
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"), **mongo_client_kwargs())
+    try:
+        result = await backfill_rollups(client.movie_booking, start, end, ArchiveStore().archived_until())
+        logger.info(f"Backfill complete: {result}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Rebuild payment settlement rollups")
+    parser.add_argument("--start", type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day to rebuild (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    asyncio.run(run_backfill(args.start, args.end))
@@ -0,0 +1,242 @@
+"""
+Unit tests for two-phase payments
+Tests authorize, capture, void, batch capture and the stale-authorization sweep
+"""
+
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+
+from authorizations import transition_authorizations, void_expired_authorizations
+from main import PaymentMethod, PaymentStatus, TransactionLog, app
+from transaction_codec import decode_transaction, encode_transaction
+
+
+class FakeCursor:
+    """Async cursor over a fixed list of documents"""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, *args):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+def make_authorization(transaction_id: str = "txn_1", status: str = "authorized", minutes_ago: int = 1) -> dict:
+    created = datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)
+    return encode_transaction(TransactionLog(
+        transaction_id=transaction_id,
+        booking_id=f"booking_{transaction_id}",
+        user_id="user_1",
+        amount=150.0,
+        payment_method=PaymentMethod.CREDIT_CARD,
+        status=status,
+        payment_details={"card_number": "****-****-****-1111"},
+        created_at=created,
+        updated_at=created,
+        gateway_response={"gateway_transaction_id": "gtw_1", "gateway_status": "AUTHORIZED"},
+        failure_reason="",
+    ).model_dump())
+
+
+def write_result(modified_count: int) -> MagicMock:
+    result = MagicMock()
+    result.modified_count = modified_count
+    return result
+
+
+@pytest.fixture
+def mock_db():
+    db = MagicMock()
+    db.transaction_logs.insert_one = AsyncMock()
+    db.transaction_logs.update_one = AsyncMock(return_value=write_result(1))
+    db.transaction_logs.bulk_write = AsyncMock()
+    return db
+
+
+class TestAuthorizeCapture:
+    """Test cases for the authorize, capture and void endpoints"""
+
+    def test_authorize_stores_authorized_without_event(self, mock_db):
+        payment = {
+            "booking_id": "booking_auth",
+            "user_id": "user_auth",
+            "amount": 150.0,
+            "payment_method": "credit_card",
+            "payment_details": {"card_number": "4111111111110002", "cvv": "123"},
+        }
+
+        with patch("main.db", mock_db), \
+             patch("main.simulate_payment_processing", AsyncMock(return_value=True)), \
+             patch("main.publish_payment_event", AsyncMock()) as mock_publish:
+            response = TestClient(app).post("/payments/authorize", json=payment)
+
+        data = response.json()
+        assert data["success"] is True
+        assert data["status"] == "authorized"
+        assert data["transaction_id"]
+
+        stored = mock_db.transaction_logs.insert_one.call_args[0][0]
+        assert stored["s"] == 4
+        assert stored["g"]["gs"] == "AUTHORIZED"
+        mock_publish.assert_not_awaited()
+
+    def test_capture_is_conditional_and_announced(self, mock_db):
+        mock_db.transaction_logs.find_one = AsyncMock(return_value=make_authorization())
+
+        with patch("main.db", mock_db), \
+             patch("main.publish_payment_events", AsyncMock()) as mock_publish:
+            response = TestClient(app).post("/payments/txn_1/capture")
+
+        assert response.json()["status"] == "success"
+        update_filter, update = mock_db.transaction_logs.update_one.call_args[0]
+        assert update_filter == {"t": "txn_1", "s": 4}
+        assert update["$set"]["s"] == 1
+        assert update["$set"]["g"]["gs"] == "CAPTURED"
+        assert update["$set"]["g"]["gt"] == "gtw_1"
+
+        events = mock_publish.call_args[0][0]
+        assert [event_type for event_type, _ in events] == ["payment.success"]
+        assert events[0][1]["amount"] == 150.0
+
+    def test_capture_retry_is_idempotent(self, mock_db):
+        mock_db.transaction_logs.find_one = AsyncMock(return_value=make_authorization(status="success"))
+
+        with patch("main.db", mock_db):
+            response = TestClient(app).post("/payments/txn_1/capture")
+
+        assert response.status_code == 200
+        assert response.json()["message"] == "Payment already captured"
+        mock_db.transaction_logs.update_one.assert_not_awaited()
+
+    def test_void_after_capture_conflicts(self, mock_db):
+        mock_db.transaction_logs.find_one = AsyncMock(return_value=make_authorization(status="success"))
+
+        with patch("main.db", mock_db):
+            response = TestClient(app).post("/payments/txn_1/void")
+
+        assert response.status_code == 409
+        assert response.json()["detail"] == "Cannot void a success payment"
+
+    def test_capture_that_lost_a_race_reports_final_state(self, mock_db):
+        mock_db.transaction_logs.find_one = AsyncMock(
+            side_effect=[make_authorization(), make_authorization(status="voided")]
+        )
+        mock_db.transaction_logs.update_one = AsyncMock(return_value=write_result(0))
+
+        with patch("main.db", mock_db):
+            response = TestClient(app).post("/payments/txn_1/capture")
+
+        assert response.status_code == 409
+        assert response.json()["detail"] == "Cannot capture a voided payment"
+
+
+class TestBatchCapture:
+    """Test cases for POST /payments/capture/batch"""
+
+    def test_batch_capture_reports_each_item(self, mock_db):
+        documents = [
+            make_authorization("txn_1"),
+            make_authorization("txn_2"),
+            make_authorization("txn_3", status="voided"),
+            make_authorization("txn_4", status="success"),
+        ]
+        mock_db.transaction_logs.find.return_value = FakeCursor(documents)
+        mock_db.transaction_logs.bulk_write = AsyncMock(return_value=write_result(2))
+
+        with patch("main.db", mock_db), \
+             patch("main.publish_payment_events", AsyncMock()) as mock_publish:
+            response = TestClient(app).post("/payments/capture/batch", json={
+                "transaction_ids": ["txn_1", "txn_2", "txn_3", "txn_4", "txn_5", "txn_1"]
+            })
+
+        data = response.json()
+        assert data["total"] == 5
+        assert data["captured"] == 3
+        assert [result["message"] for result in data["results"]] == [
+            "Payment captured",
+            "Payment captured",
+            "Cannot capture a voided payment",
+            "Payment already captured",
+            "Transaction not found",
+        ]
+
+        operations = mock_db.transaction_logs.bulk_write.call_args_list[0][0][0]
+        assert [operation._filter for operation in operations] == [{"t": "txn_1", "s": 4}, {"t": "txn_2", "s": 4}]
+        assert len(mock_publish.call_args[0][0]) == 2
+
+    def test_empty_batch_rejected(self, mock_db):
+        with patch("main.db", mock_db):
+            response = TestClient(app).post("/payments/capture/batch", json={"transaction_ids": []})
+
+        assert response.status_code == 400
+
+
+class TestTransitions:
+    """Test cases for bulk transitions and the stale-authorization sweep"""
+
+    @pytest.mark.asyncio
+    async def test_bulk_transition_keeps_only_its_own_writes(self):
+        authorizations = [
+            {**decode_transaction(make_authorization(transaction_id)), "v": 2} for transaction_id in ("txn_1", "txn_2")
+        ]
+        collection = MagicMock()
+        collection.bulk_write = AsyncMock(return_value=write_result(1))
+
+        def current_state(query, projection=None):
+            operations = collection.bulk_write.call_args[0][0]
+            ours = operations[0]._doc["$set"]["g"]
+            winner = {**make_authorization("txn_1", status="success"), "g": ours}
+            rival = make_authorization("txn_2", status="voided")
+            return FakeCursor([winner, rival])
+
+        collection.find.side_effect = current_state
+
+        moved = await transition_authorizations(
+            collection, [(transaction, {"capture_reference": "cap"}) for transaction in authorizations], "success"
+        )
+
+        assert [transaction["transaction_id"] for transaction in moved] == ["txn_1"]
+
+    @pytest.mark.asyncio
+    async def test_sweep_voids_expired_authorizations(self):
+        now = datetime.now(timezone.utc)
+        collection = MagicMock()
+        collection.find.side_effect = [FakeCursor([make_authorization("txn_old", minutes_ago=30)]), FakeCursor([])]
+        collection.bulk_write = AsyncMock(return_value=write_result(1))
+
+        voided = await void_expired_authorizations(collection, ttl_seconds=900, now=now)
+
+        compact_query = collection.find.call_args_list[0][0][0]
+        assert compact_query["s"] == 4
+        assert compact_query["c"] == {"$lt": now - timedelta(seconds=900)}
+        assert voided[0]["status"] == "voided"
+        assert voided[0]["gateway_response"]["reason"] == "Authorization expired"
+
+    @pytest.mark.asyncio
+    async def test_sweeper_only_sweeps_while_holding_the_lease(self):
+        import main
+
+        # The first pass finds the lease held elsewhere, the second holds it
+        take_lease = AsyncMock(side_effect=[None, {"owner": "this-worker"}])
+        sleep = AsyncMock(side_effect=[None, None, asyncio.CancelledError()])
+        with patch.object(main, "take_lease", take_lease), patch.object(main, "db", MagicMock()), \
+                patch.object(main, "void_stale_authorizations", AsyncMock()) as sweep, \
+                patch.object(main.asyncio, "sleep", sleep):
+            with pytest.raises(asyncio.CancelledError):
+                await main.run_authorization_sweeper()
+
+        sweep.assert_awaited_once()
+        assert take_lease.call_args[0][1] == "authorization-sweeper"
@@ -0,0 +1,127 @@
+"""
+Unit tests for POST /payments/batch
+Tests bounded concurrency, bulk persistence, batched events and per-item results
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+from pymongo.errors import BulkWriteError
+
+from main import app
+
+
+def make_payment(index: int, amount: float = 100.0) -> dict:
+    return {
+        "booking_id": f"booking_{index}",
+        "user_id": f"user_{index}",
+        "amount": amount,
+        "payment_method": "credit_card",
+        "payment_details": {"card_number": f"4111111111{index:06d}", "cvv": "123"},
+    }
+
+
+@pytest.fixture
+def mock_db():
+    db = MagicMock()
+    db.transaction_logs.insert_many = AsyncMock()
+    return db
+
+
+class TestBatchPayments:
+    """Test cases for the batch payments endpoint"""
+
+    def test_batch_persists_and_publishes_once(self, mock_db):
+        payments = [make_payment(i) for i in range(5)]
+
+        with patch("main.db", mock_db), \
+             patch("main.simulate_payment_processing", AsyncMock(return_value=True)), \
+             patch("main.publish_payment_events", AsyncMock()) as mock_publish:
+            response = TestClient(app).post("/payments/batch", json={"payments": payments})
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == 5
+        assert data["succeeded"] == 5
+        assert [result["index"] for result in data["results"]] == list(range(5))
+        assert all(result["transaction_id"] for result in data["results"])
+
+        mock_db.transaction_logs.insert_many.assert_awaited_once()
+        documents = mock_db.transaction_logs.insert_many.call_args[0][0]
+        assert len(documents) == 5
+        assert mock_db.transaction_logs.insert_many.call_args[1] == {"ordered": False}
+        assert all(document["v"] == 2 for document in documents)
+        assert all("cvv" not in document["d"] for document in documents)
+
+        events = mock_publish.call_args[0][0]
+        assert [event_type for event_type, _ in events] == ["payment.success"] * 5
+
+    def test_invalid_items_are_reported_not_logged(self, mock_db):
+        payments = [make_payment(0), make_payment(1, amount=-5), make_payment(2, amount=20000)]
+
+        with patch("main.db", mock_db), \
+             patch("main.simulate_payment_processing", AsyncMock(return_value=False)), \
+             patch("main.publish_payment_events", AsyncMock()) as mock_publish:
+            response = TestClient(app).post("/payments/batch", json={"payments": payments})
+
+        results = response.json()["results"]
+        assert results[0]["status"] == "failed"
+        assert results[1]["message"] == "Invalid payment amount"
+        assert results[2]["message"] == "Payment amount exceeds limit"
+        assert len(mock_db.transaction_logs.insert_many.call_args[0][0]) == 1
+        assert [event_type for event_type, _ in mock_publish.call_args[0][0]] == ["payment.failed"]
+
+    def test_concurrency_is_bounded(self, mock_db):
+        in_flight = 0
+        peak = 0
+
+        async def gateway(*args):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return True
+
+        with patch("main.db", mock_db), \
+             patch("main.PAYMENT_BATCH_CONCURRENCY", 3), \
+             patch("main.simulate_payment_processing", gateway), \
+             patch("main.publish_payment_events", AsyncMock()):
+            response = TestClient(app).post(
+                "/payments/batch", json={"payments": [make_payment(i) for i in range(12)]}
+            )
+
+        assert response.json()["succeeded"] == 12
+        assert peak == 3
+
+    def test_bulk_write_errors_fail_only_affected_items(self, mock_db):
+        mock_db.transaction_logs.insert_many.side_effect = BulkWriteError(
+            {"writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate"}]}
+        )
+
+        with patch("main.db", mock_db), \
+             patch("main.simulate_payment_processing", AsyncMock(return_value=True)), \
+             patch("main.publish_payment_events", AsyncMock()) as mock_publish:
+            response = TestClient(app).post(
+                "/payments/batch", json={"payments": [make_payment(i) for i in range(3)]}
+            )
+
+        data = response.json()
+        assert [result["success"] for result in data["results"]] == [True, False, True]
+        assert len(mock_publish.call_args[0][0]) == 2
+
+    def test_batch_size_limit(self, mock_db):
+        with patch("main.db", mock_db), patch("main.PAYMENT_BATCH_MAX_ITEMS", 2):
+            response = TestClient(app).post(
+                "/payments/batch", json={"payments": [make_payment(i) for i in range(3)]}
+            )
+
+        assert response.status_code == 400
+        assert "maximum" in response.json()["detail"]
+
+    def test_empty_batch(self, mock_db):
+        with patch("main.db", mock_db):
+            response = TestClient(app).post("/payments/batch", json={"payments": []})
+
+        assert response.status_code == 400
@@ -0,0 +1,325 @@
+"""
+Unit tests for latency-aware gateway routing
+Tests EWMA ranking, failover, cooldown, hedging, the payment integration and
+reconciliation of unknown outcomes
+"""
+
+import asyncio
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+
+from gateway_router import (
+    GatewayError,
+    GatewayOutcomeUnknown,
+    GatewayResult,
+    GatewayRouter,
+    GatewayStats,
+    GatewayUnavailable,
+)
+from main import PaymentMethod, TransactionLog, app
+from reconciliation import reconcile_unknown_outcomes, unknown_outcome_fields
+from transaction_codec import encode_transaction
+
+
+class FakeGateway:
+    """Gateway answering after a fixed delay, or failing"""
+
+    def __init__(self, name, delay=0.0, approve=True, fail=False, methods=("credit_card",), voids=True):
+        self.name = name
+        self.methods = set(methods)
+        self.delay = delay
+        self.approve = approve
+        self.fail = fail
+        self.voids = voids
+        self.calls = []
+        self.voided = []
+
+    async def charge(self, payment_method, amount, payment_details, idempotency_key=None):
+        self.calls.append(idempotency_key)
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise GatewayError("unavailable")
+        return self.approve
+
+    async def void(self, idempotency_key):
+        self.voided.append(idempotency_key)
+        return self.voids
+
+
+class FakeCursor:
+    """Async cursor over a fixed list of documents"""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, *args):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_router(gateways, **options):
+    options.setdefault("explore_rate", 0.0)
+    options.setdefault("hedge_after_ms", 0)
+    return GatewayRouter(gateways, **options)
+
+
+class TestRanking:
+    """Test cases for EWMA statistics and gateway order"""
+
+    def test_ewma_moves_toward_new_samples(self):
+        stats = GatewayStats(alpha=0.5)
+        stats.observe(1.0, error=False)
+        stats.observe(0.2, error=True)
+
+        assert stats.latency == pytest.approx(0.6)
+        assert stats.error_rate == pytest.approx(0.5)
+        assert stats.score(penalty=10) == pytest.approx(0.6 * 6)
+
+    def test_fastest_supporting_gateway_first(self):
+        slow, fast, wallet = FakeGateway("slow"), FakeGateway("fast"), FakeGateway("wallet", methods=("digital_wallet",))
+        router = make_router([slow, fast, wallet])
+        router.stats["slow"].observe(1.5, error=False)
+        router.stats["fast"].observe(0.4, error=False)
+
+        assert [gateway.name for gateway in router.rank("credit_card")] == ["fast", "slow"]
+        assert [gateway.name for gateway in router.rank("digital_wallet")] == ["wallet"]
+
+    def test_error_rate_triggers_cooldown(self):
+        clock = FakeClock()
+        flaky, steady = FakeGateway("flaky"), FakeGateway("steady")
+        router = make_router([flaky, steady], clock=clock, error_threshold=0.5, cooldown_seconds=30)
+        router.stats["steady"].observe(2.0, error=False)
+        for _ in range(5):
+            router._observe(flaky, 0.1, error=True)
+
+        assert [gateway.name for gateway in router.rank("credit_card")] == ["steady", "flaky"]
+        clock.now += 31
+        assert router.rank("credit_card")[0].name == "flaky"
+
+
+class TestProcessing:
+    """Test cases for failover and hedged requests"""
+
+    @pytest.mark.asyncio
+    async def test_fails_over_to_next_gateway(self):
+        broken, backup = FakeGateway("broken", fail=True), FakeGateway("backup", delay=0.01)
+        router = make_router([broken, backup])
+        router.stats["backup"].observe(1.0, error=False)
+
+        result = await router.process("credit_card", 10.0, {}, idempotency_key="txn_1")
+
+        assert result == GatewayResult(approved=True, gateway="backup", latency_ms=result.latency_ms)
+        assert broken.calls == ["txn_1"] and backup.calls == ["txn_1"]
+        assert router.stats["broken"].error_rate == 1.0
+
+    @pytest.mark.asyncio
+    async def test_decline_is_not_an_error(self):
+        router = make_router([FakeGateway("only", approve=False)])
+
+        result = await router.process("credit_card", 10.0, {})
+
+        assert not result
+        assert router.stats["only"].error_rate == 0.0
+
+    @pytest.mark.asyncio
+    async def test_all_gateways_failing_raises(self):
+        router = make_router([FakeGateway("a", fail=True), FakeGateway("b", fail=True)])
+
+        with pytest.raises(GatewayUnavailable):
+            await router.process("credit_card", 10.0, {})
+        with pytest.raises(GatewayUnavailable):
+            await router.process("net_banking", 10.0, {})
+
+    @pytest.mark.asyncio
+    async def test_hedges_after_latency_budget(self):
+        stalled, quick = FakeGateway("stalled", delay=0.5), FakeGateway("quick", delay=0.01)
+        router = make_router([stalled, quick], hedge_after_ms=20)
+
+        started = asyncio.get_running_loop().time()
+        result = await router.process("credit_card", 10.0, {}, idempotency_key="txn_2")
+        elapsed = asyncio.get_running_loop().time() - started
+
+        assert result.gateway == "quick" and result.hedged
+        assert elapsed < 0.2
+        # The losing call runs to completion, teaches the router how slow it
+        # was and has its approval voided so the customer is charged once
+        await router.settle()
+        assert router.stats["stalled"].samples == 1
+        assert router.rank("credit_card")[0].name == "quick"
+        assert stalled.voided == ["txn_2"] and quick.voided == []
+
+    @pytest.mark.asyncio
+    async def test_double_approval_keeps_one_charge(self):
+        slow, fast = FakeGateway("slow", delay=0.1), FakeGateway("fast", delay=0.05)
+        router = make_router([slow, fast], hedge_after_ms=20)
+
+        result = await router.process("credit_card", 10.0, {}, idempotency_key="txn_3")
+        await router.settle()
+
+        assert result.gateway == "fast"
+        charged = [gateway.name for gateway in (slow, fast) if gateway.calls and not gateway.voided]
+        assert charged == ["fast"]
+
+    @pytest.mark.asyncio
+    async def test_declined_hedge_winner_voids_approved_loser(self):
+        slow, fast = FakeGateway("slow", delay=0.1), FakeGateway("fast", delay=0.05, approve=False)
+        router = make_router([slow, fast], hedge_after_ms=20)
+
+        result = await router.process("credit_card", 10.0, {}, idempotency_key="txn_4")
+        await router.settle()
+
+        assert not result
+        assert slow.voided == ["txn_4"]
+
+    @pytest.mark.asyncio
+    async def test_timeout_fails_over_once_voided(self):
+        hung, backup = FakeGateway("hung", delay=1.0), FakeGateway("backup")
+        router = make_router([hung, backup], timeout_ms=20)
+        router.stats["backup"].observe(1.0, error=False)
+
+        result = await router.process("credit_card", 10.0, {}, idempotency_key="txn_5")
+
+        assert result.gateway == "backup"
+        assert hung.voided == ["txn_5"]
+        assert router.stats["hung"].error_rate == 1.0
+
+    @pytest.mark.asyncio
+    async def test_timeout_without_void_does_not_fail_over(self):
+        hung, backup = FakeGateway("hung", delay=1.0, voids=False), FakeGateway("backup")
+        router = make_router([hung, backup], timeout_ms=20)
+        router.stats["backup"].observe(1.0, error=False)
+
+        with pytest.raises(GatewayOutcomeUnknown) as unknown:
+            await router.process("credit_card", 10.0, {}, idempotency_key="txn_6")
+        assert (unknown.value.gateway, unknown.value.idempotency_key) == ("hung", "txn_6")
+        with pytest.raises(GatewayOutcomeUnknown):
+            await router.process("credit_card", 10.0, {})
+
+        assert backup.calls == []
+
+
+class TestPaymentIntegration:
+    """Test cases for gateway details on payment transactions"""
+
+    def test_gateway_recorded_on_transaction(self):
+        mock_db = MagicMock()
+        mock_db.transaction_logs.insert_one = AsyncMock()
+        payment = {
+            "booking_id": "booking_route",
+            "user_id": "user_route",
+            "amount": 100.0,
+            "payment_method": "credit_card",
+            "payment_details": {"card_number": "4111111111110003", "cvv": "123"},
+        }
+        outcome = GatewayResult(approved=True, gateway="gateway_b", latency_ms=412.6, hedged=True)
+
+        with patch("main.db", mock_db), \
+             patch("main.gateway_router.process", AsyncMock(return_value=outcome)), \
+             patch("main.publish_payment_event", AsyncMock()):
+            client = TestClient(app)
+            response = client.post("/payments", json=payment)
+            gateways = client.get("/gateways").json()["gateways"]
+
+        assert response.json()["status"] == "success"
+        stored = mock_db.transaction_logs.insert_one.call_args[0][0]
+        assert stored["g"]["gw"] == "gateway_b"
+        assert stored["g"]["pt"] == 413
+        assert stored["g"]["hg"] is True
+        assert {gateway["gateway"] for gateway in gateways} == {"gateway_a", "gateway_b", "wallet_gateway"}
+
+    def test_unknown_outcome_is_pending_and_not_announced(self):
+        mock_db = MagicMock()
+        mock_db.transaction_logs.insert_one = AsyncMock()
+        payment = {
+            "booking_id": "booking_unknown",
+            "user_id": "user_unknown",
+            "amount": 100.0,
+            "payment_method": "credit_card",
+            "payment_details": {"card_number": "4111111111110004", "cvv": "123"},
+        }
+        unknown = GatewayOutcomeUnknown("gateway_a: timed out", "gateway_a", "txn")
+
+        with patch("main.db", mock_db), \
+             patch("main.gateway_router.process", AsyncMock(side_effect=unknown)), \
+             patch("main.publish_payment_event", AsyncMock()) as mock_publish:
+            response = TestClient(app).post("/payments", json=payment)
+
+        data = response.json()
+        assert data["success"] is False
+        assert data["status"] == "pending"
+        assert data["transaction_id"]
+        stored = mock_db.transaction_logs.insert_one.call_args[0][0]
+        assert stored["s"] == 0
+        assert stored["g"]["gw"] == "gateway_a"
+        assert stored["g"]["gs"] == "OUTCOME_UNKNOWN"
+        mock_publish.assert_not_awaited()
+
+
+def make_pending(transaction_id: str, gateway: str = "hung") -> dict:
+    now = datetime.now(timezone.utc)
+    return encode_transaction(TransactionLog(
+        transaction_id=transaction_id,
+        booking_id=f"booking_{transaction_id}",
+        user_id="user_1",
+        amount=100.0,
+        payment_method=PaymentMethod.CREDIT_CARD,
+        status="pending",
+        payment_details={"card_number": "****-****-****-1111"},
+        created_at=now,
+        updated_at=now,
+        gateway_response=unknown_outcome_fields(gateway),
+        failure_reason="",
+    ).model_dump())
+
+
+class TestReconciliation:
+    """Test cases for voiding payments with an unknown gateway outcome"""
+
+    @pytest.mark.asyncio
+    async def test_voided_payment_becomes_failed(self):
+        gateway = FakeGateway("hung")
+        collection = MagicMock()
+        collection.find.side_effect = [FakeCursor([make_pending("txn_7")]), FakeCursor([])]
+        collection.update_one = AsyncMock(return_value=MagicMock(modified_count=1))
+
+        reconciled = await reconcile_unknown_outcomes(collection, make_router([gateway]))
+
+        assert collection.find.call_args_list[0][0][0]["s"] == 0
+        assert gateway.voided == ["txn_7"]
+        assert reconciled[0]["status"] == "failed"
+        assert reconciled[0]["gateway_response"]["gateway_status"] == "VOIDED"
+        update = collection.update_one.call_args[0]
+        assert update[0]["s"] == 0
+        assert update[1]["$set"]["s"] == 2
+
+    @pytest.mark.asyncio
+    async def test_payment_stays_pending_until_voided(self):
+        gateway = FakeGateway("hung", voids=False)
+        collection = MagicMock()
+        collection.find.side_effect = [FakeCursor([make_pending("txn_8")]), FakeCursor([])]
+        collection.update_one = AsyncMock()
+
+        reconciled = await reconcile_unknown_outcomes(collection, make_router([gateway]))
+
+        assert reconciled == []
+        assert gateway.voided == ["txn_8"]
+        collection.update_one.assert_not_awaited()
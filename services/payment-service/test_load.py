@@ -21,9 +21,14 @@ class LoadTestPaymentService:
         self.base_url = base_url
         self.results = []
 
-    async def single_payment_request(self, session: aiohttp.ClientSession, booking_id: str = None) -> Dict[str, Any]:
-        """Make a single payment request and measure response time"""
-        start_time = time.time()
+    async def single_payment_request(self, session: aiohttp.ClientSession, booking_id: str = None,
+                                     intended_start: float = None) -> Dict[str, Any]:
+        """
+        Make a single payment request and measure response time
+        When intended_start is given, latency is measured from the scheduled send
+        time so delays caused by a slow service are not omitted
+        """
+        start_time = intended_start if intended_start is not None else time.time()
         
         payment_data = {
             "booking_id": booking_id or f"booking_{uuid.uuid4().hex[:8]}",
@@ -107,26 +112,28 @@ class LoadTestPaymentService:
         """Test sustained load over time"""
         print(f"📈 Starting sustained load test: {requests_per_second} RPS for {duration_seconds} seconds")
         
-        results = []
-        start_time = time.time()
-        end_time = start_time + duration_seconds
-        
-        connector = aiohttp.TCPConnector(limit=50)
+        connector = aiohttp.TCPConnector(limit=1000)
         timeout = aiohttp.ClientTimeout(total=30)
         
         async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-            while time.time() < end_time:
-                batch_start = time.time()
-                
-                # Create batch of requests
-                tasks = [self.single_payment_request(session) for _ in range(requests_per_second)]
-                batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-                results.extend([r for r in batch_results if isinstance(r, dict)])
-                
-                # Wait for next second
-                batch_duration = time.time() - batch_start
-                if batch_duration < 1.0:
-                    await asyncio.sleep(1.0 - batch_duration)
+            # Open loop: every request is scheduled against the start time and
+            # fired without waiting for earlier ones, so slow responses cannot
+            # lower the arrival rate or hide queueing delay
+            tasks = []
+            start_time = time.time()
+            interval = 1.0 / requests_per_second
+            
+            for i in range(duration_seconds * requests_per_second):
+                intended_start = start_time + i * interval
+                delay = intended_start - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(
+                    self.single_payment_request(session, intended_start=intended_start)
+                ))
+            
+            batch_results = await asyncio.gather(*tasks, return_exceptions=True)
+            results = [r for r in batch_results if isinstance(r, dict)]
         
         total_requests = len(results)
         successful_requests = [r for r in results if r.get("success")]
@@ -0,0 +1,38 @@
+"""
+Unit tests for the MongoDB client profile
+Tests client options, write concerns per operation class and pool warm-up
+"""
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from shared import mongo_config
+from shared.mongo_config import mongo_client_kwargs, warm_up_pool, write_concern
+
+
+class TestMongoConfig:
+    """Test cases for the shared Mongo client settings"""
+
+    def test_client_kwargs(self):
+        kwargs = mongo_client_kwargs()
+        assert kwargs["minPoolSize"] == mongo_config.MONGO_MIN_POOL_SIZE
+        assert kwargs["maxPoolSize"] == mongo_config.MONGO_MAX_POOL_SIZE
+        assert kwargs["compressors"] == "zstd,zlib"
+        assert kwargs["readPreference"] == "primary"
+
+    def test_write_concern_per_operation_class(self):
+        assert write_concern("critical").document["w"] == "majority"
+        assert write_concern("logs").document["w"] == 1
+
+        with patch.dict(mongo_config.WRITE_CONCERNS, {"logs": "0"}):
+            assert write_concern("logs").document["w"] == 0
+
+    @pytest.mark.asyncio
+    async def test_warm_up_opens_min_pool(self):
+        client = MagicMock()
+        client.admin.command = AsyncMock(return_value={"ok": 1})
+
+        await warm_up_pool(client, 4)
+        await warm_up_pool(client, 0)
+
+        assert client.admin.command.await_count == 4
@@ -0,0 +1,186 @@
+"""
+Unit tests for token-bucket rate limiting
+Tests bucket refill, Redis script calls, local fallback and the middleware
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+
+from main import app
+from rate_limiter import (
+    LocalTokenBuckets,
+    RateLimitPolicy,
+    RateLimitRequest,
+    RateLimiter,
+    TrustedProxies,
+    build_result,
+    client_key,
+    client_key_for,
+    rate_limit_headers,
+)
+
+
+class FakeClock:
+    def __init__(self, now: float = 100.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_policy(spec: str = "3/3") -> RateLimitPolicy:
+    return RateLimitPolicy.from_spec("test", spec, client_key)
+
+
+def make_payment(user_id: str = "user_1") -> dict:
+    return {
+        "booking_id": "booking_1",
+        "user_id": user_id,
+        "amount": 100.0,
+        "payment_method": "credit_card",
+        "payment_details": {"card_number": "4111111111111111", "cvv": "123"},
+    }
+
+
+class TestLocalTokenBuckets:
+    """Test cases for the in-process fallback buckets"""
+
+    def test_burst_then_refill(self):
+        clock = FakeClock()
+        buckets = LocalTokenBuckets(clock=clock)
+
+        assert [buckets.take("k", rate=1.0, capacity=3)[0] for _ in range(4)] == [True, True, True, False]
+
+        clock.now += 1.0
+        assert buckets.take("k", rate=1.0, capacity=3)[0]
+        assert not buckets.take("k", rate=1.0, capacity=3)[0]
+
+    def test_headers_for_rejection(self):
+        policy = make_policy("10/60")
+        buckets = LocalTokenBuckets(clock=FakeClock())
+        for _ in range(10):
+            buckets.take("k", policy.rate, policy.capacity)
+
+        allowed, tokens = buckets.take("k", policy.rate, policy.capacity)
+        headers = rate_limit_headers(build_result(policy, allowed, tokens))
+
+        assert headers["RateLimit-Limit"] == "10"
+        assert headers["RateLimit-Remaining"] == "0"
+        assert headers["Retry-After"] == "6"
+
+
+class TestRateLimiter:
+    """Test cases for the Redis-backed limiter"""
+
+    @pytest.mark.asyncio
+    async def test_uses_redis_script(self):
+        script = AsyncMock(return_value=[1, "4.5"])
+        redis_client = MagicMock()
+        redis_client.register_script.return_value = script
+        limiter = RateLimiter(redis_getter=lambda: redis_client)
+
+        result = await limiter.acquire(make_policy("10/60"), "ip:1.2.3.4")
+
+        assert result.allowed and result.remaining == 4
+        script.assert_awaited_once_with(keys=["payment:ratelimit:test:ip:1.2.3.4"], args=[10 / 60, 10, 1])
+        await limiter.acquire(make_policy("10/60"), "ip:1.2.3.4")
+        redis_client.register_script.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_local_buckets(self):
+        redis_client = MagicMock()
+        redis_client.register_script.return_value = AsyncMock(side_effect=ConnectionError("down"))
+        limiter = RateLimiter(redis_getter=lambda: redis_client, local=LocalTokenBuckets(clock=FakeClock()))
+        policy = make_policy("1/60")
+
+        assert (await limiter.acquire(policy, "k")).allowed
+        assert not (await limiter.acquire(policy, "k")).allowed
+
+    def test_client_key_trusts_headers_only_from_proxies(self):
+        key_func = client_key_for(TrustedProxies(["10.0.0.0/24"]))
+        headers = {"x-forwarded-for": "6.6.6.6, 9.9.9.9, 10.0.0.1"}
+
+        # The leftmost hop is whatever the client sent; the rightmost untrusted one connected to the proxy
+        assert key_func(RateLimitRequest("POST", "/payments", dict(headers), "10.0.0.2")) == "ip:9.9.9.9"
+        assert key_func(RateLimitRequest("POST", "/payments", {**headers, "x-user-id": "abc"}, "10.0.0.2")) == (
+            "consumer:abc"
+        )
+        # A direct caller cannot pick its bucket with headers
+        assert key_func(RateLimitRequest("POST", "/payments", {**headers, "x-user-id": "abc"}, "9.9.9.9")) == (
+            "ip:9.9.9.9"
+        )
+        assert client_key(RateLimitRequest("POST", "/payments", {"x-consumer-id": "abc"}, "10.0.0.2")) == (
+            "ip:10.0.0.2"
+        )
+
+    @pytest.mark.asyncio
+    async def test_trusted_proxy_hostnames_are_resolved_off_the_request_path(self):
+        trusted = TrustedProxies.from_spec("kong, 10.1.0.0/16")
+        loop = asyncio.get_running_loop()
+        getaddrinfo = AsyncMock(return_value=[(2, 1, 6, "", ("172.20.0.5", 0))])
+
+        with patch.object(loop, "getaddrinfo", getaddrinfo):
+            # Membership checks never resolve; only refresh() does
+            assert "172.20.0.5" not in trusted
+            getaddrinfo.assert_not_awaited()
+            task = await trusted.start()
+            task.cancel()
+
+        assert "172.20.0.5" in trusted and "10.1.2.3" in trusted
+        assert "172.20.0.6" not in trusted and None not in trusted
+
+        # A failed lookup keeps the last known addresses
+        with patch.object(loop, "getaddrinfo", AsyncMock(side_effect=OSError("dns down"))):
+            await trusted.refresh()
+        assert "172.20.0.5" in trusted
+
+
+class TestRateLimitMiddleware:
+    """Test cases for per-route policies on the payment API"""
+
+    def test_per_user_limit_returns_429_with_headers(self):
+        mock_db = MagicMock()
+        mock_db.transaction_logs.insert_one = AsyncMock()
+
+        with patch("main.db", mock_db), \
+             patch("main.simulate_payment_processing", AsyncMock(return_value=True)), \
+             patch("main.publish_payment_event", AsyncMock()), \
+             patch("main.payments_user_policy.capacity", 2), \
+             patch("main.payments_user_policy.period", 60.0):
+            client = TestClient(app)
+            responses = [client.post("/payments", json=make_payment()) for _ in range(3)]
+            other_user = client.post("/payments", json=make_payment("user_2"))
+
+        assert [response.status_code for response in responses] == [200, 200, 429]
+        assert responses[0].json()["success"] is True  # body was replayed to the handler
+        assert responses[0].headers["RateLimit-Remaining"] == "1"
+        assert responses[2].headers["Retry-After"] == "30"
+        assert "payments-user" in responses[2].json()["detail"]
+        assert other_user.status_code == 200
+
+    def test_batch_spends_per_user_tokens_per_payment(self):
+        mock_db = MagicMock()
+        mock_db.transaction_logs.insert_many = AsyncMock()
+
+        with patch("main.db", mock_db), \
+             patch("main.simulate_payment_processing", AsyncMock(return_value=True)), \
+             patch("main.publish_payment_events", AsyncMock()), \
+             patch("main.payments_batch_user_policy.capacity", 3), \
+             patch("main.payments_batch_user_policy.period", 60.0):
+            client = TestClient(app)
+            first = client.post("/payments/batch", json={"payments": [make_payment(), make_payment()]})
+            second = client.post(
+                "/payments/batch", json={"payments": [make_payment(), make_payment(), make_payment("user_2")]}
+            )
+            third = client.post("/payments/batch", json={"payments": [make_payment("user_2")]})
+
+        assert first.status_code == 200
+        assert second.status_code == 429
+        assert "payments-user" in second.json()["detail"]
+        assert third.status_code == 200
+
+    def test_unlimited_routes_have_no_headers(self):
+        response = TestClient(app).get("/health")
+        assert "RateLimit-Limit" not in response.headers
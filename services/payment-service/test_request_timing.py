@@ -0,0 +1,142 @@
+"""
+Unit tests for per-phase request timing
+Tests phase accounting, Server-Timing headers, histograms, the slow log and /metrics
+"""
+
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from main import app
+from request_timing import (
+    RequestMetrics,
+    RequestTiming,
+    ServerTimingMiddleware,
+    current_timing,
+    request_phase,
+    server_timing_header,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def parse_server_timing(header: str) -> dict:
+    phases = {}
+    for entry in header.split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        phases[name] = float(duration)
+    return phases
+
+
+class TestPhases:
+    """Test cases for phase accounting"""
+
+    def test_phases_accumulate(self):
+        clock = FakeClock()
+        timing = RequestTiming(clock)
+        token = current_timing.set(timing)
+        try:
+            clock.now += 0.004
+            timing.mark("parse")
+            with request_phase("mongo"):
+                clock.now += 0.010
+            with request_phase("mongo"):
+                clock.now += 0.005
+        finally:
+            current_timing.reset(token)
+
+        assert timing.phases == pytest.approx({"parse": 0.004, "mongo": 0.015})
+        with request_phase("ignored"):
+            pass  # no current request: nothing to record
+
+    def test_server_timing_header(self):
+        header = server_timing_header({"gateway": 0.5, "mongo": 0.0123}, 0.6)
+        assert header == "gateway;dur=500.0, mongo;dur=12.3, total;dur=600.0"
+
+
+class TestRequestMetrics:
+    """Test cases for histograms, the slow log and worker merging"""
+
+    def test_prometheus_histogram(self):
+        metrics = RequestMetrics(slow_request_ms=1000)
+        metrics.record("POST", "/payments", 200, 0.02, {"gateway": 0.015})
+        metrics.record("POST", "/payments", 200, 0.3, {"gateway": 0.2})
+
+        text = metrics.render_prometheus()
+
+        labels = 'method="POST",route="/payments",status="2xx"'
+        assert "# TYPE payment_request_duration_seconds histogram" in text
+        assert f'payment_request_duration_seconds_bucket{{{labels},le="0.025"}} 1' in text
+        assert f'payment_request_duration_seconds_bucket{{{labels},le="0.5"}} 2' in text
+        assert f'payment_request_duration_seconds_count{{{labels}}} 2' in text
+        assert 'payment_request_phase_duration_seconds_count{route="/payments",phase="gateway"} 2' in text
+
+    def test_slow_log_is_a_bounded_ring(self):
+        metrics = RequestMetrics(slow_request_ms=100, slow_log_size=2, slow_log_sample_rate=1.0)
+        metrics.record("POST", "/payments", 200, 0.05, {})
+        for duration in (0.2, 0.3, 0.4):
+            metrics.record("POST", "/payments", 200, duration, {"gateway": duration - 0.01})
+
+        entries = metrics.slow_requests()
+        assert [entry["duration_ms"] for entry in entries] == [400.0, 300.0]
+        assert entries[0]["phases_ms"] == {"gateway": 390.0}
+
+    def test_merges_other_workers_snapshots(self, tmp_path):
+        other = RequestMetrics()
+        other.record("GET", "/health", 200, 0.001, {})
+        (tmp_path / "worker-1.json").write_text(json.dumps(other.snapshot()))
+
+        metrics = RequestMetrics(metrics_dir=str(tmp_path))
+        metrics.record("GET", "/health", 200, 0.001, {})
+
+        assert 'route="/health",status="2xx"} 2' in metrics.render_prometheus()
+
+
+class TestServerTimingMiddleware:
+    """Test cases for the middleware and the payment endpoints"""
+
+    def test_header_and_route_template(self):
+        echo = FastAPI()
+
+        @echo.get("/items/{item_id}")
+        async def get_item(item_id: str):
+            with request_phase("lookup"):
+                return {"item_id": item_id}
+
+        metrics = RequestMetrics()
+        echo.add_middleware(ServerTimingMiddleware, metrics=metrics)
+        response = TestClient(echo).get("/items/42")
+
+        assert set(parse_server_timing(response.headers["Server-Timing"])) == {"lookup", "total"}
+        assert 'route="/items/{item_id}"' in metrics.render_prometheus()
+
+    def test_payment_phases(self):
+        mock_db = MagicMock()
+        mock_db.transaction_logs.insert_one = AsyncMock()
+        payment = {
+            "booking_id": "booking_timing",
+            "user_id": "user_timing",
+            "amount": 100.0,
+            "payment_method": "credit_card",
+            "payment_details": {"card_number": "4111111111110001", "cvv": "123"},
+        }
+
+        with patch("main.db", mock_db), \
+             patch("main.simulate_payment_processing", AsyncMock(return_value=True)), \
+             patch("main.publish_payment_event", AsyncMock()):
+            client = TestClient(app)
+            response = client.post("/payments", json=payment)
+            metrics = client.get("/metrics")
+
+        phases = parse_server_timing(response.headers["Server-Timing"])
+        assert {"parse", "validation", "gateway", "mongo", "rollup", "publish", "total"} <= set(phases)
+        assert "server-timing" not in metrics.headers
+        assert 'route="/payments",phase="gateway"' in metrics.text
@@ -0,0 +1,220 @@
+"""
+Unit tests for settlement rollups
+Tests incremental $inc updates, the backfill pipeline and report aggregation
+"""
+
+import pytest
+from datetime import date, datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+from main import PaymentMethod, PaymentStatus
+from settlement import (
+    BackfillInProgress,
+    backfill_pipeline,
+    backfill_rollups,
+    record_status_change,
+    record_transaction,
+    rollup_day,
+    rollup_update,
+    settlement_report,
+)
+
+
+class FakeCursor:
+    """Async cursor over a fixed list of rollup documents"""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, *args):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+@pytest.fixture
+def transaction():
+    return {
+        "transaction_id": "txn_1",
+        "amount": 150.0,
+        "payment_method": PaymentMethod.CREDIT_CARD,
+        "status": PaymentStatus.SUCCESS,
+        "created_at": datetime(2024, 3, 1, 23, 30, tzinfo=timezone.utc),
+    }
+
+
+class TestRollupUpdates:
+    """Test cases for incremental rollup maintenance"""
+
+    def test_rollup_day_uses_utc(self):
+        from datetime import timedelta
+
+        local = datetime(2024, 3, 2, 1, 0, tzinfo=timezone(timedelta(hours=5)))
+        assert rollup_day(local) == "2024-03-01"
+
+    def test_rollup_update_document(self, transaction):
+        update = rollup_update(transaction, transaction["status"])
+
+        assert update._filter == {"_id": "2024-03-01|credit_card|success"}
+        assert update._doc["$inc"] == {"count": 1, "total_cents": 15000}
+        assert update._doc["$setOnInsert"] == {
+            "day": "2024-03-01",
+            "payment_method": "credit_card",
+            "status": "success",
+        }
+        assert update._upsert is True
+
+    @pytest.mark.asyncio
+    async def test_record_transaction(self, transaction):
+        collection = MagicMock()
+        collection.bulk_write = AsyncMock()
+
+        await record_transaction(collection, transaction)
+
+        operations = collection.bulk_write.call_args[0][0]
+        assert len(operations) == 1
+
+    @pytest.mark.asyncio
+    async def test_record_status_change_moves_bucket(self, transaction):
+        collection = MagicMock()
+        collection.bulk_write = AsyncMock()
+
+        await record_status_change(collection, transaction, "success", PaymentStatus.REFUNDED)
+
+        decrement, increment = collection.bulk_write.call_args[0][0]
+        assert decrement._filter["_id"].endswith("|success")
+        assert decrement._doc["$inc"] == {"count": -1, "total_cents": -15000}
+        assert increment._filter["_id"].endswith("|refunded")
+        assert increment._doc["$inc"] == {"count": 1, "total_cents": 15000}
+
+    @pytest.mark.asyncio
+    async def test_rollup_failure_does_not_raise(self, transaction):
+        collection = MagicMock()
+        collection.bulk_write = AsyncMock(side_effect=Exception("mongo down"))
+
+        await record_transaction(collection, transaction)
+
+
+class TestBackfillAndReport:
+    """Test cases for the backfill pipeline and settlement report"""
+
+    def test_backfill_pipeline_range(self):
+        pipeline = backfill_pipeline(date(2024, 3, 1), date(2024, 3, 31))
+
+        compact, legacy = pipeline[0]["$match"]["$or"]
+        assert compact["c"] == legacy["created_at"]
+        assert legacy["created_at"]["$gte"] == datetime(2024, 3, 1, tzinfo=timezone.utc)
+        assert legacy["created_at"]["$lt"] == datetime(2024, 4, 1, tzinfo=timezone.utc)
+        assert "$project" in pipeline[1]
+        # Refund records are left out: rollups count the refunded payment instead
+        assert pipeline[2] == {"$match": {"amount_cents": {"$gte": 0}}}
+        assert pipeline[3]["$group"]["total_cents"] == {"$sum": "$amount_cents"}
+        assert pipeline[-1]["$merge"]["into"] == "payment_rollups"
+
+    def test_backfill_merge_keeps_live_updates(self):
+        started_at = datetime(2024, 3, 15, 12, 0, tzinfo=timezone.utc)
+        pipeline = backfill_pipeline(date(2024, 3, 1), date(2024, 3, 31), "run_1", created_before=started_at)
+
+        assert pipeline[0]["$match"]["$or"][1]["created_at"]["$lt"] == started_at
+        merge = pipeline[-1]["$merge"]
+        assert merge["whenMatched"] != "replace"
+        added = merge["whenMatched"][0]["$set"]["count"]["$add"]
+        assert added[0] == "$$new.count"
+        # Rebuilt count plus what $inc added since the snapshot of this run
+        assert added[1] == {"$subtract": [
+            {"$ifNull": ["$count", 0]},
+            {"$cond": [{"$eq": ["$backfill_base.id", "run_1"]}, "$backfill_base.count", 0]},
+        ]}
+        assert merge["whenMatched"][1] == {"$unset": ["backfill_base", "total_amount"]}
+
+    @pytest.fixture
+    def backfill_db(self):
+        calls = []
+        rollups = MagicMock()
+        rollups.update_many = AsyncMock(side_effect=lambda query, update: calls.append("update") or MagicMock())
+        rollups.delete_many = AsyncMock(side_effect=lambda query: calls.append("delete") or MagicMock(deleted_count=1))
+        rollups.count_documents = AsyncMock(return_value=4)
+        leases = MagicMock()
+        leases.find_one_and_update = AsyncMock(return_value={"_id": "settlement-backfill"})
+        leases.update_one = AsyncMock()
+        db = MagicMock()
+        db.__getitem__.side_effect = lambda name: leases if name == "job_leases" else rollups
+        cursor = MagicMock()
+        cursor.to_list = AsyncMock(side_effect=lambda length: calls.append("merge") or [])
+        db.transaction_logs.aggregate.return_value = cursor
+        return db, rollups, leases, calls
+
+    @pytest.mark.asyncio
+    async def test_backfill_merges_before_removing_stale_buckets(self, backfill_db):
+        db, rollups, leases, calls = backfill_db
+
+        result = await backfill_rollups(db, date(2024, 3, 1), date(2024, 3, 31))
+
+        assert calls == ["update", "merge", "delete", "update"]
+        backfill_id = db.transaction_logs.aggregate.call_args[0][0][-2]["$project"]["backfill_id"]
+        snapshot = rollups.update_many.call_args_list[0][0][1][0]["$set"]["backfill_base"]
+        assert snapshot["id"] == backfill_id
+        stale = rollups.delete_many.call_args[0][0]
+        assert stale["backfill_id"] == {"$ne": backfill_id}
+        assert stale["backfill_base.id"] == backfill_id
+        assert "$lt" in stale["updated_at"]
+        # Buckets updated meanwhile but not rebuilt keep only their live delta
+        assert rollups.update_many.call_args_list[1][0][0]["backfill_base.id"] == backfill_id
+        assert result["rollups_rebuilt"] == 4 and result["rollups_removed"] == 1
+        leases.update_one.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_backfill_refused_while_another_runs(self, backfill_db):
+        db, rollups, leases, calls = backfill_db
+        leases.find_one_and_update.return_value = None
+
+        with pytest.raises(BackfillInProgress):
+            await backfill_rollups(db, date(2024, 3, 1), date(2024, 3, 31))
+
+        assert calls == []
+
+    def test_backfill_pipeline_full_rebuild(self):
+        pipeline = backfill_pipeline()
+        assert "$match" not in pipeline[0]
+
+    @pytest.mark.asyncio
+    async def test_settlement_report_is_gross(self):
+        collection = MagicMock()
+        # 300.00 captured, of which one 50.00 payment was refunded afterwards
+        collection.find.return_value = FakeCursor([
+            {"day": "2024-03-01", "payment_method": "credit_card", "status": "success", "count": 2, "total_cents": 25000},
+            {"day": "2024-03-01", "payment_method": "credit_card", "status": "refunded", "count": 1, "total_cents": 5000},
+        ])
+
+        report = await settlement_report(collection, date(2024, 3, 1), date(2024, 3, 1))
+
+        assert report["by_status"]["refunded"] == {"count": 1, "total_amount": 50.0}
+        assert report["totals"] == {"count": 3, "total_amount": 300.0}
+        assert report["settlement"] == {"gross_captured": 300.0, "refunded": 50.0, "net_settled": 250.0}
+
+    @pytest.mark.asyncio
+    async def test_settlement_report_totals(self):
+        collection = MagicMock()
+        collection.find.return_value = FakeCursor([
+            {"day": "2024-03-01", "payment_method": "credit_card", "status": "success", "count": 3, "total_cents": 30010},
+            {"day": "2024-03-01", "payment_method": "debit_card", "status": "failed", "count": 1, "total_cents": 5000},
+            # A bucket from before cents: its float total is carried alongside new increments
+            {"day": "2024-03-02", "payment_method": "credit_card", "status": "success", "count": 2, "total_amount": 0.1,
+             "total_cents": 9980},
+            {"day": "2024-03-02", "payment_method": "credit_card", "status": "refunded", "count": 0, "total_cents": 0},
+        ])
+
+        report = await settlement_report(collection, date(2024, 3, 1), date(2024, 3, 2))
+
+        query = collection.find.call_args[0][0]
+        assert query == {"day": {"$gte": "2024-03-01", "$lte": "2024-03-02"}}
+        assert [day["day"] for day in report["days"]] == ["2024-03-01", "2024-03-02"]
+        assert report["by_payment_method"]["credit_card"] == {"count": 5, "total_amount": 400.0}
+        assert report["by_status"]["failed"]["count"] == 1
+        assert "refunded" not in report["by_status"]
+        assert report["totals"] == {"count": 6, "total_amount": 450.0}
@@ -0,0 +1,301 @@
+"""
+Unit tests for the transaction archive
+Tests the block-compressed file format, mmap reads, range pruning and the archiver
+"""
+
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+from transaction_archive import (
+    ArchiveInProgress,
+    ArchiveReader,
+    ArchiveStore,
+    ArchiveWriter,
+    archive_expired,
+    archive_month,
+    hot_transaction_ids,
+    hot_window_start,
+    matches,
+    merge_documents,
+)
+
+
+class FakeCursor:
+    """Async cursor over a fixed list of documents"""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, *args):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+def make_transaction(day: int, minute: int, status: str = "success") -> dict:
+    created = datetime(2024, 1, day, 12, minute)  # naive, as returned by Motor
+    return {
+        "_id": f"oid_{day}_{minute}",
+        "transaction_id": f"txn_{day}_{minute}",
+        "booking_id": f"booking_{day}",
+        "amount": 20.0,
+        "payment_method": "credit_card",
+        "status": status,
+        "payment_details": {"card_number": "****-****-****-1111"},
+        "created_at": created,
+        "updated_at": created,
+    }
+
+
+def write_archive(path, documents, block_records=3):
+    writer = ArchiveWriter(str(path), block_records=block_records)
+    for document in documents:
+        writer.write(document)
+    writer.close()
+
+
+class TestArchiveFormat:
+    """Test cases for writing and reading archive files"""
+
+    def test_round_trip(self, tmp_path):
+        documents = [make_transaction(day, 0) for day in range(1, 8)]
+        path = tmp_path / "transaction_logs-2024-01.txnarchive"
+        write_archive(path, documents)
+
+        reader = ArchiveReader(str(path))
+        try:
+            assert reader.count == 7
+            assert len(reader.blocks) == 3
+            restored = [doc for position in range(len(reader.blocks)) for doc in reader.read_block(position)]
+        finally:
+            reader.close()
+
+        assert [doc["transaction_id"] for doc in restored] == [doc["transaction_id"] for doc in documents]
+        assert "_id" not in restored[0]
+        assert restored[0]["created_at"] == datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+        assert [entry.name for entry in tmp_path.iterdir()] == ["transaction_logs-2024-01.txnarchive"]
+
+    def test_block_pruning_by_time_range(self, tmp_path):
+        path = tmp_path / "transaction_logs-2024-01.txnarchive"
+        write_archive(path, [make_transaction(day, 0) for day in range(1, 10)])
+
+        reader = ArchiveReader(str(path))
+        try:
+            selected = reader.blocks_for_range(
+                datetime(2024, 1, 4, tzinfo=timezone.utc), datetime(2024, 1, 6, tzinfo=timezone.utc)
+            )
+        finally:
+            reader.close()
+
+        assert selected == [1]
+
+    def test_rejects_foreign_files(self, tmp_path):
+        path = tmp_path / "bogus.txnarchive"
+        path.write_bytes(b"not an archive at all")
+
+        with pytest.raises(ValueError):
+            ArchiveReader(str(path))
+
+    def test_matches_export_filter(self):
+        document = make_transaction(5, 0)
+        query = {
+            "created_at": {"$gte": datetime(2024, 1, 5, tzinfo=timezone.utc)},
+            "status": "success",
+        }
+        assert matches(document, query)
+        assert not matches(document, {**query, "status": "failed"})
+
+
+class TestArchiveStore:
+    """Test cases for transparent archive queries"""
+
+    @pytest.mark.asyncio
+    async def test_iter_documents_filters_and_orders(self, tmp_path):
+        store = ArchiveStore(str(tmp_path))
+        write_archive(
+            store.path_for(datetime(2024, 1, 1, tzinfo=timezone.utc)),
+            [make_transaction(day, 0, "success" if day % 2 else "failed") for day in range(1, 11)],
+        )
+
+        query = {
+            "created_at": {
+                "$gte": datetime(2024, 1, 3, tzinfo=timezone.utc),
+                "$lt": datetime(2024, 1, 9, tzinfo=timezone.utc),
+            },
+            "status": "success",
+        }
+        found = [doc["transaction_id"] async for doc in store.iter_documents(query)]
+
+        assert found == ["txn_3_0", "txn_5_0", "txn_7_0"]
+        assert store.archived_until() == datetime(2024, 2, 1, tzinfo=timezone.utc)
+        assert store.covers(datetime(2024, 1, 15, tzinfo=timezone.utc))
+        assert not store.covers(datetime(2024, 2, 1, tzinfo=timezone.utc))
+
+    @pytest.mark.asyncio
+    async def test_find_by_transaction_id(self, tmp_path):
+        store = ArchiveStore(str(tmp_path))
+        write_archive(
+            store.path_for(datetime(2024, 1, 1, tzinfo=timezone.utc)),
+            [make_transaction(day, 0) for day in range(1, 8)],
+        )
+
+        found = await store.find("txn_6_0")
+
+        assert found["booking_id"] == "booking_6"
+        assert await store.find("txn_missing") is None
+
+    @pytest.mark.asyncio
+    async def test_find_only_reads_blocks_that_may_hold_the_id(self, tmp_path, monkeypatch):
+        store = ArchiveStore(str(tmp_path))
+        write_archive(
+            store.path_for(datetime(2024, 1, 1, tzinfo=timezone.utc)),
+            [make_transaction(day, minute) for day in range(1, 29) for minute in range(10)],
+            block_records=20,
+        )
+        read = []
+        read_block = ArchiveReader.read_block
+        monkeypatch.setattr(
+            ArchiveReader, "read_block", lambda reader, position: read.append(position) or read_block(reader, position)
+        )
+
+        assert (await store.find("txn_27_4"))["booking_id"] == "booking_27"
+        assert read == [13]
+
+        read.clear()
+        for transaction_id in [f"txn_missing_{index}" for index in range(20)]:
+            assert await store.find(transaction_id) is None
+        # About 1% false positives per block across 14 blocks
+        assert len(read) < 20
+
+    @pytest.mark.asyncio
+    async def test_export_skips_archived_copies_of_hot_transactions(self, tmp_path):
+        store = ArchiveStore(str(tmp_path))
+        write_archive(
+            store.path_for(datetime(2024, 1, 1, tzinfo=timezone.utc)),
+            [make_transaction(day, 0) for day in range(1, 5)],
+        )
+        # txn_2_0 was refunded after its month was sealed and is back in MongoDB
+        february = {**make_transaction(1, 0), "transaction_id": "txn_feb", "created_at": datetime(2024, 2, 1)}
+        hot = [make_transaction(2, 0, "refunded"), february]
+        collection = MagicMock()
+        collection.find.side_effect = lambda query, *args: FakeCursor([] if query.get("v") == 2 else hot[:1])
+
+        hot_ids = await hot_transaction_ids(collection, {}, store.archived_until())
+
+        async def hot_documents():
+            for document in hot:
+                yield document
+
+        merged = [doc async for doc in merge_documents(store.iter_documents({}, exclude=hot_ids), hot_documents())]
+        assert hot_ids == {"txn_2_0"}
+        assert [(doc["transaction_id"], doc["status"]) for doc in merged] == [
+            ("txn_1_0", "success"), ("txn_2_0", "refunded"), ("txn_3_0", "success"),
+            ("txn_4_0", "success"), ("txn_feb", "success"),
+        ]
+
+
+class TestArchiver:
+    """Test cases for moving months out of the hot collection"""
+
+    def make_db(self, documents):
+        db = MagicMock()
+        db.__getitem__.return_value.find_one_and_update = AsyncMock(return_value={"_id": "transaction-archiver"})
+        db.__getitem__.return_value.update_one = AsyncMock()
+        db.transaction_logs.count_documents = AsyncMock(return_value=len(documents))
+        # Every fixture document is legacy-shaped, so the compact scan comes back empty
+        db.transaction_logs.find.side_effect = lambda query, *args: FakeCursor(
+            [] if query.get("v") == 2 else documents
+        )
+        db.transaction_logs.delete_many = AsyncMock(return_value=MagicMock(deleted_count=len(documents)))
+        return db
+
+    @pytest.mark.asyncio
+    async def test_archive_month_writes_then_deletes(self, tmp_path):
+        documents = [make_transaction(day, 0) for day in range(1, 5)]
+        db = self.make_db(documents)
+        store = ArchiveStore(str(tmp_path))
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+        result = await archive_month(db, store, start)
+
+        assert result == {"partition": "2024-01", "archived": 4, "deleted": 4}
+        assert store.has_partition(start)
+        # Only the archived version of each document is deleted
+        delete_filter = db.transaction_logs.delete_many.call_args[0][0]
+        assert len(delete_filter["$or"]) == 4
+        assert delete_filter["$or"][0]["$or"][1] == {
+            "transaction_id": "txn_1_0",
+            "updated_at": datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc),
+        }
+
+    @pytest.mark.asyncio
+    async def test_sealed_month_resumes_and_reseals_updated_documents(self, tmp_path):
+        store = ArchiveStore(str(tmp_path))
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        write_archive(store.path_for(start), [make_transaction(day, 0) for day in range(1, 5)])
+
+        # A crash left the month hot, and txn_2_0 was refunded after it was sealed
+        refunded = {**make_transaction(2, 0, "refunded"), "updated_at": datetime(2024, 6, 1)}
+        db = self.make_db([refunded])
+        db.transaction_logs.count_documents = AsyncMock(return_value=4)
+        db.transaction_logs.delete_many = AsyncMock(side_effect=[
+            MagicMock(deleted_count=3), MagicMock(deleted_count=1),
+        ])
+
+        result = await archive_month(db, store, start)
+
+        assert result == {"partition": "2024-01", "archived": 4, "deleted": 4}
+        reader = ArchiveReader(store.path_for(start))
+        try:
+            restored = [doc for position in range(len(reader.blocks)) for doc in reader.read_block(position)]
+        finally:
+            reader.close()
+        assert [doc["transaction_id"] for doc in restored] == ["txn_1_0", "txn_2_0", "txn_3_0", "txn_4_0"]
+        assert restored[1]["status"] == "refunded"
+        resealed_filter = db.transaction_logs.delete_many.call_args[0][0]
+        assert resealed_filter["$or"][1]["$or"][1]["updated_at"] == datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+    @pytest.mark.asyncio
+    async def test_count_mismatch_keeps_hot_data(self, tmp_path):
+        db = self.make_db([make_transaction(1, 0)])
+        db.transaction_logs.count_documents = AsyncMock(return_value=2)
+        store = ArchiveStore(str(tmp_path))
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+        with pytest.raises(RuntimeError):
+            await archive_month(db, store, start)
+
+        db.transaction_logs.delete_many.assert_not_called()
+        assert not store.has_partition(start)
+        assert list(tmp_path.iterdir()) == []
+
+    @pytest.mark.asyncio
+    async def test_archive_expired_walks_months_before_hot_window(self, tmp_path):
+        db = self.make_db([])
+        db.transaction_logs.find_one = AsyncMock(return_value={"created_at": datetime(2024, 1, 20)})
+        now = datetime(2024, 6, 15, tzinfo=timezone.utc)
+
+        result = await archive_expired(db, ArchiveStore(str(tmp_path)), now=now)
+
+        assert hot_window_start(now) == datetime(2024, 3, 1, tzinfo=timezone.utc)
+        assert [partition["partition"] for partition in result["partitions"]] == ["2024-01", "2024-02"]
+
+    @pytest.mark.asyncio
+    async def test_archive_run_needs_the_lease(self, tmp_path):
+        db = self.make_db([])
+        db.__getitem__.return_value.find_one_and_update = AsyncMock(return_value=None)
+
+        with pytest.raises(ArchiveInProgress):
+            await archive_expired(db, ArchiveStore(str(tmp_path)))
+
+        db.transaction_logs.find_one.assert_not_called()
+        db.__getitem__.return_value.update_one.assert_not_called()
@@ -0,0 +1,218 @@
+"""
+Unit tests for the transaction read-through cache
+Tests LRU eviction, TTL expiry, Redis backing and endpoint integration
+"""
+
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+
+from main import app
+from transaction_cache import INVALIDATE_LUA, SET_IF_VERSION_LUA, TransactionCache
+
+
+def no_redis():
+    return None
+
+
+class FakeRedis:
+    """The commands and scripts the cache uses, over a dict"""
+
+    def __init__(self):
+        self.values = {}
+
+    async def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def register_script(self, lua):
+        async def run(keys, args):
+            payload_key, version_key = keys
+            if lua == INVALIDATE_LUA:
+                self.values[version_key] = str(int(self.values.get(version_key, b"0")) + 1).encode()
+                self.values.pop(payload_key, None)
+                return 1
+            assert lua == SET_IF_VERSION_LUA
+            if self.values.get(version_key, b"").decode() != args[2]:
+                return 0
+            self.values[payload_key] = args[0]
+            return 1
+        return run
+
+
+class TestLocalCache:
+    """Test cases for the in-process LRU tier"""
+
+    @pytest.mark.asyncio
+    async def test_read_through_loads_once(self):
+        cache = TransactionCache(redis_getter=no_redis)
+        loader = AsyncMock(return_value=b'{"transaction_id":"txn_1"}')
+
+        first = await cache.get_or_load("txn_1", loader)
+        second = await cache.get_or_load("txn_1", loader)
+
+        assert first == second == b'{"transaction_id":"txn_1"}'
+        loader.assert_awaited_once_with("txn_1")
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    @pytest.mark.asyncio
+    async def test_missing_transactions_are_not_cached(self):
+        cache = TransactionCache(redis_getter=no_redis)
+        loader = AsyncMock(return_value=None)
+
+        assert await cache.get_or_load("txn_missing", loader) is None
+        assert await cache.get_or_load("txn_missing", loader) is None
+        assert loader.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self):
+        cache = TransactionCache(max_entries=2, redis_getter=no_redis)
+
+        await cache.set("a", b"1")
+        await cache.set("b", b"2")
+        await cache.get("a")
+        await cache.set("c", b"3")
+
+        assert await cache.get("a") == b"1"
+        assert await cache.get("b") is None
+        assert await cache.get("c") == b"3"
+
+    @pytest.mark.asyncio
+    async def test_ttl_expiry(self):
+        cache = TransactionCache(ttl_seconds=10, local_ttl_seconds=60, redis_getter=no_redis)
+
+        with patch("transaction_cache.time.monotonic", return_value=100.0):
+            await cache.set("a", b"1")
+        with patch("transaction_cache.time.monotonic", return_value=109.0):
+            assert await cache.get("a") == b"1"
+        with patch("transaction_cache.time.monotonic", return_value=111.0):
+            assert await cache.get("a") is None
+
+    @pytest.mark.asyncio
+    async def test_local_ttl_bounds_staleness_without_redis(self):
+        # Another worker's invalidation never reaches this process without Redis
+        cache = TransactionCache(ttl_seconds=30, local_ttl_seconds=2, redis_getter=no_redis)
+
+        with patch("transaction_cache.time.monotonic", return_value=100.0):
+            await cache.set("a", b"1")
+        with patch("transaction_cache.time.monotonic", return_value=103.0):
+            assert await cache.get("a") is None
+
+    @pytest.mark.asyncio
+    async def test_invalidate(self):
+        cache = TransactionCache(redis_getter=no_redis)
+        await cache.set("a", b"1")
+
+        await cache.invalidate("a")
+
+        assert await cache.get("a") is None
+
+
+class TestRedisBackedCache:
+    """Test cases for the shared Redis tier"""
+
+    @pytest.mark.asyncio
+    async def test_redis_hit_populates_local_tier(self):
+        redis_client = AsyncMock()
+        redis_client.mget.return_value = [b"payload", None]
+        cache = TransactionCache(redis_getter=lambda: redis_client)
+
+        assert await cache.get("a") == b"payload"
+        assert await cache.get("a") == b"payload"
+        redis_client.mget.assert_awaited_once_with(["payment:transaction:a", "payment:transaction:a:version"])
+
+    @pytest.mark.asyncio
+    async def test_invalidate_deletes_redis_key(self):
+        redis_client = FakeRedis()
+        cache = TransactionCache(redis_getter=lambda: redis_client)
+
+        await cache.set("a", b"payload")
+        await cache.invalidate("a")
+
+        assert redis_client.values == {"payment:transaction:a:version": b"1"}
+
+    @pytest.mark.asyncio
+    async def test_redis_errors_fall_back_to_loader(self):
+        redis_client = AsyncMock()
+        redis_client.mget.side_effect = ConnectionError("redis down")
+        redis_client.set.side_effect = ConnectionError("redis down")
+        cache = TransactionCache(redis_getter=lambda: redis_client)
+        loader = AsyncMock(return_value=b"payload")
+
+        assert await cache.get_or_load("a", loader) == b"payload"
+
+    @pytest.mark.asyncio
+    async def test_load_overtaken_by_invalidation_is_not_cached(self):
+        redis_client = FakeRedis()
+        reader = TransactionCache(redis_getter=lambda: redis_client)
+        refunder = TransactionCache(redis_getter=lambda: redis_client)
+
+        async def load_then_refund(transaction_id):
+            # The refund lands on another replica after this read hit MongoDB
+            await refunder.invalidate(transaction_id)
+            return b'{"status":"success"}'
+
+        assert await reader.get_or_load("a", load_then_refund) == b'{"status":"success"}'
+        assert "payment:transaction:a" not in redis_client.values
+        assert await reader.get("a") is None
+
+        fresh = AsyncMock(return_value=b'{"status":"refunded"}')
+        assert await reader.get_or_load("a", fresh) == b'{"status":"refunded"}'
+        assert redis_client.values["payment:transaction:a"] == b'{"status":"refunded"}'
+
+    @pytest.mark.asyncio
+    async def test_local_load_overtaken_by_invalidation_is_not_cached(self):
+        cache = TransactionCache(redis_getter=no_redis)
+
+        async def load_then_refund(transaction_id):
+            await cache.invalidate(transaction_id)
+            return b'{"status":"success"}'
+
+        await cache.get_or_load("a", load_then_refund)
+
+        assert await cache.get("a") is None
+
+
+class TestTransactionEndpoint:
+    """Test cases for GET /payments/{transaction_id} through the cache"""
+
+    def test_get_transaction_uses_cache(self):
+        now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        document = {
+            "transaction_id": "txn_cached",
+            "booking_id": "booking_1",
+            "amount": 25.0,
+            "payment_method": "credit_card",
+            "status": "success",
+            "payment_details": {"card_number": "****-****-****-1111"},
+            "created_at": now,
+            "updated_at": now,
+        }
+        mock_db = MagicMock()
+        mock_db.transaction_logs.find_one = AsyncMock(return_value=document)
+
+        with patch("main.db", mock_db), \
+             patch("main.transaction_cache", TransactionCache(redis_getter=no_redis)):
+            client = TestClient(app)
+            first = client.get("/payments/txn_cached")
+            second = client.get("/payments/txn_cached")
+
+        assert first.status_code == second.status_code == 200
+        body = first.json()
+        assert body["transaction_id"] == "txn_cached"
+        assert "_id" not in body
+        assert mock_db.transaction_logs.find_one.await_count == 1
+        assert mock_db.transaction_logs.find_one.call_args[0][1] == {"_id": 0}
+
+    def test_get_transaction_not_found(self):
+        mock_db = MagicMock()
+        mock_db.transaction_logs.find_one = AsyncMock(return_value=None)
+
+        with patch("main.db", mock_db), \
+             patch("main.transaction_cache", TransactionCache(redis_getter=no_redis)):
+            response = TestClient(app).get("/payments/txn_missing")
+
+        assert response.status_code == 404
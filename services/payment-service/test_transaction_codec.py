@@ -0,0 +1,265 @@
+"""
+Unit tests for the transaction storage codec
+Tests compact encoding, mixed-version filters, merged scans and the migration
+"""
+
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+from pymongo.errors import DuplicateKeyError, WriteError
+
+from main import PaymentMethod, PaymentStatus, TransactionLog
+from migrate_transactions import TRANSACTION_VALIDATOR, guard_write_version, migrate
+from transaction_codec import (
+    decode_transaction,
+    encode_transaction,
+    find_transaction,
+    iter_transactions,
+    to_minor_units,
+    transaction_filter,
+    update_transaction,
+    write_version,
+)
+
+
+class FakeCursor:
+    """Async cursor over a fixed list of documents"""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, *args):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class PreSeriesCollection:
+    """transaction_logs as created before the compact schema"""
+
+    def __init__(self):
+        self.documents = []
+
+    async def index_information(self):
+        return {
+            "_id_": {"key": [("_id", 1)]},
+            "transaction_id_1": {"key": [("transaction_id", 1)], "unique": True},
+        }
+
+    async def insert_one(self, document):
+        if not isinstance(document.get("transaction_id"), str) or not isinstance(document.get("amount"), float):
+            raise WriteError("Document failed validation", 121)
+        # The unique index treats a missing transaction_id as null
+        if any(existing.get("transaction_id") == document.get("transaction_id") for existing in self.documents):
+            raise DuplicateKeyError("E11000 duplicate key error index: transaction_id_1")
+        self.documents.append(document)
+
+
+def make_transaction(transaction_id: str = "txn_1", minute: int = 0, **fields) -> dict:
+    created = datetime(2024, 1, 1, 12, minute, tzinfo=timezone.utc)
+    return TransactionLog(
+        transaction_id=transaction_id,
+        booking_id="booking_1",
+        user_id="user_1",
+        amount=fields.pop("amount", 19.99),
+        payment_method=PaymentMethod.CREDIT_CARD,
+        status=fields.pop("status", PaymentStatus.SUCCESS),
+        payment_details={"card_number": "****-****-****-1111"},
+        created_at=created,
+        updated_at=created,
+        gateway_response={"gateway_transaction_id": "gw_1", "gateway_status": "APPROVED", "processing_time_ms": 120},
+        failure_reason="",
+        **fields,
+    ).model_dump()
+
+
+class TestCodec:
+    """Test cases for encoding and decoding documents"""
+
+    def test_round_trip(self):
+        document = make_transaction()
+        stored = encode_transaction(document)
+
+        assert stored["v"] == 2
+        assert stored["a"] == 1999
+        assert stored["m"] == 1 and stored["s"] == 1
+        assert stored["g"] == {"gt": "gw_1", "gs": "APPROVED", "pt": 120}
+        assert "transaction_id" not in stored and "failure_reason" not in stored
+
+        decoded = decode_transaction(stored)
+        assert TransactionLog.model_validate(decoded) == TransactionLog.model_validate(document)
+
+    def test_amounts_are_exact_cents(self):
+        assert to_minor_units(0.1 + 0.2) == 30
+        assert to_minor_units(-25.005) == -2501
+        assert encode_transaction(make_transaction(amount=1234.56))["a"] == 123456
+
+    def test_legacy_documents_pass_through(self):
+        legacy = encode_transaction(make_transaction(), version=1)
+        assert legacy["status"] == "success"
+        assert decode_transaction(legacy) is legacy
+
+    def test_filter_matches_both_versions(self):
+        assert transaction_filter({"status": PaymentStatus.REFUNDED, "booking_id": "b1"}) == {
+            "$or": [{"s": 3, "b": "b1"}, {"status": "refunded", "booking_id": "b1"}]
+        }
+
+
+class TestStorageAccess:
+    """Test cases for reads and updates across schema versions"""
+
+    @pytest.mark.asyncio
+    async def test_update_uses_the_stored_version(self):
+        collection = MagicMock()
+        collection.find_one = AsyncMock(return_value=encode_transaction(make_transaction()))
+        collection.update_one = AsyncMock()
+
+        transaction = await find_transaction(collection, {"transaction_id": "txn_1"})
+        await update_transaction(collection, transaction, {"status": PaymentStatus.REFUNDED})
+
+        assert transaction["amount"] == 19.99
+        collection.update_one.assert_awaited_once_with({"t": "txn_1"}, {"$set": {"s": 3}})
+
+    @pytest.mark.asyncio
+    async def test_conditional_update_on_legacy_document(self):
+        collection = MagicMock()
+        collection.find_one = AsyncMock(return_value=encode_transaction(make_transaction(), version=1))
+        collection.update_one = AsyncMock()
+
+        transaction = await find_transaction(collection, {"transaction_id": "txn_1"})
+        await update_transaction(
+            collection, transaction, {"status": PaymentStatus.VOIDED}, expected={"status": PaymentStatus.AUTHORIZED}
+        )
+
+        collection.update_one.assert_awaited_once_with(
+            {"transaction_id": "txn_1", "status": "authorized"}, {"$set": {"status": "voided"}}
+        )
+
+    @pytest.mark.asyncio
+    async def test_legacy_read_retries_after_migration(self):
+        collection = MagicMock()
+        collection.find_one = AsyncMock(return_value=encode_transaction(make_transaction(), version=1))
+        collection.update_one = AsyncMock(
+            side_effect=[MagicMock(matched_count=0), MagicMock(matched_count=1, modified_count=1)]
+        )
+
+        transaction = await find_transaction(collection, {"transaction_id": "txn_1"})
+        result = await update_transaction(
+            collection, transaction, {"status": PaymentStatus.REFUNDED}, expected={"status": PaymentStatus.SUCCESS}
+        )
+
+        assert result.modified_count == 1
+        collection.update_one.assert_awaited_with({"t": "txn_1", "s": 1}, {"$set": {"s": 3}})
+
+    @pytest.mark.asyncio
+    async def test_sorted_scan_merges_versions(self):
+        compact = [encode_transaction(make_transaction(f"txn_{minute}", minute)) for minute in (0, 2, 4)]
+        legacy = [encode_transaction(make_transaction(f"txn_{minute}", minute), version=1) for minute in (1, 3)]
+        collection = MagicMock()
+        collection.find.side_effect = [FakeCursor(compact), FakeCursor(legacy)]
+
+        documents = [document async for document in iter_transactions(collection, {}, "created_at")]
+
+        assert [document["transaction_id"] for document in documents] == [f"txn_{minute}" for minute in range(5)]
+
+
+class TestMigration:
+    """Test cases for rewriting legacy documents"""
+
+    @pytest.mark.asyncio
+    async def test_migrate_replaces_only_legacy_documents(self):
+        legacy = [
+            {"_id": index, **encode_transaction(make_transaction(f"txn_{index}"), version=1)}
+            for index in range(3)
+        ]
+        db = MagicMock()
+        db.transaction_logs.find.return_value = FakeCursor(legacy)
+        db.transaction_logs.bulk_write = AsyncMock(
+            side_effect=[MagicMock(matched_count=2, modified_count=2), MagicMock(matched_count=1, modified_count=1)]
+        )
+
+        result = await migrate(db, batch_size=2)
+
+        batches = [call[0][0] for call in db.transaction_logs.bulk_write.call_args_list]
+        assert [len(batch) for batch in batches] == [2, 1]
+        first = batches[0][0]
+        assert first._filter == {
+            "_id": 0, "v": {"$exists": False}, "status": "success", "updated_at": legacy[0]["updated_at"],
+        }
+        assert first._doc["t"] == "txn_0" and first._doc["a"] == 1999
+        assert result["documents"] == 3
+        assert result["compact_bytes"] < result["legacy_bytes"]
+
+    @pytest.mark.asyncio
+    async def test_document_changed_since_read_is_retried_next_pass(self):
+        before = {"_id": 0, **encode_transaction(make_transaction(), version=1)}
+        refunded = {**before, "status": "refunded", "updated_at": datetime(2024, 1, 2, tzinfo=timezone.utc)}
+        db = MagicMock()
+        db.transaction_logs.find.side_effect = [FakeCursor([before]), FakeCursor([refunded])]
+        db.transaction_logs.bulk_write = AsyncMock(
+            side_effect=[MagicMock(matched_count=0, modified_count=0), MagicMock(matched_count=1, modified_count=1)]
+        )
+
+        result = await migrate(db)
+
+        second_pass = db.transaction_logs.bulk_write.call_args_list[1][0][0][0]
+        assert second_pass._doc["s"] == 3
+        assert result["passes"] == 2 and result["skipped"] == 0 and result["replaced"] == 1
+
+    @pytest.mark.asyncio
+    async def test_dry_run_writes_nothing(self):
+        db = MagicMock()
+        db.transaction_logs.find.return_value = FakeCursor([{"_id": 0, **make_transaction()}])
+        db.transaction_logs.bulk_write = AsyncMock()
+
+        result = await migrate(db, dry_run=True)
+
+        db.transaction_logs.bulk_write.assert_not_called()
+        assert result["saved_ratio"] > 0
+
+
+class TestWriteVersionGuard:
+    """Test cases for writing compact documents only once the schema accepts them"""
+
+    @pytest.mark.asyncio
+    async def test_pre_series_schema_keeps_writing_version_1(self):
+        db = MagicMock()
+        db.transaction_logs = PreSeriesCollection()
+        db.command = AsyncMock(return_value={"cursor": {"firstBatch": [
+            {"name": "transaction_logs", "options": {"validator": {"$jsonSchema": {"required": ["transaction_id"]}}}}
+        ]}})
+
+        with pytest.raises(WriteError):
+            await db.transaction_logs.insert_one(encode_transaction(make_transaction("txn_1"), version=2))
+
+        assert await guard_write_version(db, requested=2) == 1
+        for transaction_id in ("txn_1", "txn_2"):
+            await db.transaction_logs.insert_one(encode_transaction(make_transaction(transaction_id)))
+
+        assert write_version() == 1
+        assert [document["transaction_id"] for document in db.transaction_logs.documents] == ["txn_1", "txn_2"]
+
+    @pytest.mark.asyncio
+    async def test_applied_schema_writes_compact(self):
+        db = MagicMock()
+        db.transaction_logs.index_information = AsyncMock(return_value={
+            "t_1": {"key": [("t", 1)], "unique": True, "partialFilterExpression": {"v": 2}},
+            "transaction_id_1": {
+                "key": [("transaction_id", 1)], "unique": True,
+                "partialFilterExpression": {"transaction_id": {"$exists": True}},
+            },
+        })
+        db.command = AsyncMock(return_value={"cursor": {"firstBatch": [
+            {"name": "transaction_logs", "options": {"validator": TRANSACTION_VALIDATOR}}
+        ]}})
+
+        assert await guard_write_version(db, requested=2) == 2
+        assert encode_transaction(make_transaction())["v"] == 2
@@ -0,0 +1,245 @@
+"""
+Unit tests for change-stream event publishing
+Tests change-to-event mapping, batching, checkpointing, the stream lease and inline publishing
+"""
+
+import json
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+from pymongo.errors import DuplicateKeyError
+
+from transaction_events import (
+    STREAM_ID,
+    LeaseLost,
+    TransactionEventTailer,
+    change_to_event,
+    event_id_for,
+    inline_publishing,
+    resolve_publishing_mode,
+    transaction_event,
+)
+from transaction_codec import encode_transaction
+
+
+def make_transaction(transaction_id: str = "txn_1", status: str = "success", **fields) -> dict:
+    document = {
+        "transaction_id": transaction_id,
+        "booking_id": "booking_1",
+        "user_id": "user_1",
+        "amount": 25.0,
+        "payment_method": "credit_card",
+        "status": status,
+        "gateway_response": {"gateway_status": "APPROVED"},
+        "failure_reason": "",
+        "created_at": datetime(2024, 1, 1, tzinfo=timezone.utc),
+        "updated_at": datetime(2024, 1, 1, tzinfo=timezone.utc),
+    }
+    document.update(fields)
+    return document
+
+
+def insert_change(document: dict) -> dict:
+    return {"operationType": "insert", "fullDocument": document}
+
+
+class FakeStream:
+    """Change stream that yields the queued changes, then None for each quiet poll"""
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.current = []
+        self.resume_token = None
+
+    async def try_next(self):
+        if not self.current:
+            if not self.batches:
+                raise StopAsyncIteration
+            self.current = list(self.batches.pop(0)) + [None]
+        change = self.current.pop(0)
+        if change is not None:
+            self.resume_token = {"_data": change["fullDocument"]["transaction_id"]}
+        return change
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+def make_db(stream):
+    db = MagicMock()
+    db.transaction_logs.watch.return_value = stream
+    offsets = MagicMock()
+    offsets.update_one = AsyncMock(return_value=MagicMock(matched_count=1))
+    db.__getitem__.return_value = offsets
+    return db, offsets
+
+
+class TestChangeToEvent:
+    """Test cases for mapping committed changes to payment events"""
+
+    def test_insert_success(self):
+        event_type, event = change_to_event(insert_change(make_transaction()))
+
+        assert event_type == "payment.success"
+        assert event["event_id"] == event_id_for("txn_1", "payment.success")
+        assert event["user_id"] == "user_1"
+        assert "failure_reason" not in event
+
+    def test_failed_includes_reason(self):
+        event_type, event = change_to_event(
+            insert_change(make_transaction(status="failed", failure_reason="Card declined"))
+        )
+        assert event_type == "payment.failed"
+        assert event["failure_reason"] == "Card declined"
+
+    def test_refund_record_and_original_flip(self):
+        refund = make_transaction(
+            "refund_1", "refunded", amount=-25.0,
+            gateway_response={"original_transaction": "txn_1", "reason": "Cancelled"},
+        )
+        event_type, event = change_to_event(insert_change(refund))
+        assert event_type == "payment.refunded"
+        assert event["refund_amount"] == 25.0
+        assert event["original_transaction_id"] == "txn_1"
+
+        original_flip = {
+            "operationType": "update",
+            "updateDescription": {"updatedFields": {"status": "refunded"}},
+            "fullDocument": make_transaction(status="refunded"),
+        }
+        assert change_to_event(original_flip) is None
+
+    def test_compact_documents_are_decoded(self):
+        event_type, event = change_to_event(insert_change(encode_transaction(make_transaction())))
+
+        assert event_type == "payment.success"
+        assert event["amount"] == 25.0
+        assert event["payment_method"] == "credit_card"
+        assert event["gateway_response"] == {"gateway_status": "APPROVED"}
+
+    def test_authorizations_announced_on_capture_and_void(self):
+        assert change_to_event(insert_change(encode_transaction(make_transaction(status="authorized")))) is None
+
+        captured = {
+            "operationType": "update",
+            "updateDescription": {"updatedFields": {"s": 1}},
+            "fullDocument": encode_transaction(make_transaction()),
+        }
+        assert change_to_event(captured)[0] == "payment.success"
+
+        voided = make_transaction(status="voided", gateway_response={"reason": "Authorization expired"})
+        event_type, event = change_to_event(insert_change(encode_transaction(voided)))
+        assert event_type == "payment.voided"
+        assert event["reason"] == "Authorization expired"
+
+    def test_updates_without_status_and_pending_are_ignored(self):
+        assert change_to_event({
+            "operationType": "update",
+            "updateDescription": {"updatedFields": {"updated_at": "now"}},
+            "fullDocument": make_transaction(),
+        }) is None
+        assert change_to_event(insert_change(make_transaction(status="pending"))) is None
+        assert change_to_event({
+            "operationType": "update",
+            "updateDescription": {"updatedFields": {"status": "success"}},
+            "fullDocument": None,
+        }) is None
+
+    def test_restored_transactions_are_not_announced_again(self):
+        restored = encode_transaction(make_transaction(restored_at=datetime(2024, 6, 1, tzinfo=timezone.utc)))
+        assert change_to_event(insert_change(restored)) is None
+
+        refunded = {
+            "operationType": "update",
+            "updateDescription": {"updatedFields": {"s": 3}},
+            "fullDocument": {**restored, "s": 3, "g": {"ot": "txn_0"}},
+        }
+        assert change_to_event(refunded)[0] == "payment.refunded"
+
+
+class TestTransactionEventTailer:
+    """Test cases for batching and lossless checkpoints"""
+
+    @pytest.mark.asyncio
+    async def test_batches_publish_then_checkpoint(self):
+        stream = FakeStream([[insert_change(make_transaction(f"txn_{i}")) for i in range(5)]])
+        db, offsets = make_db(stream)
+        publish = AsyncMock()
+        tailer = TransactionEventTailer(db, publish=publish, batch_size=3, owner="me")
+
+        with pytest.raises(StopAsyncIteration):
+            await tailer.tail({"_data": "start"})
+
+        assert db.transaction_logs.watch.call_args[1]["resume_after"] == {"_data": "start"}
+        assert [len(call[0][0]) for call in publish.call_args_list] == [3, 2]
+        tokens = [call[0][1]["$set"]["resume_token"] for call in offsets.update_one.call_args_list]
+        assert tokens == [{"_data": "txn_2"}, {"_data": "txn_4"}]
+        assert offsets.update_one.call_args[0][0] == {"_id": STREAM_ID, "owner": "me"}
+
+    @pytest.mark.asyncio
+    async def test_failed_publish_does_not_checkpoint(self):
+        stream = FakeStream([[insert_change(make_transaction())]])
+        db, offsets = make_db(stream)
+        tailer = TransactionEventTailer(db, publish=AsyncMock(side_effect=ConnectionError("broker down")))
+
+        with pytest.raises(ConnectionError):
+            await tailer.tail(None)
+
+        offsets.update_one.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_lost_lease_stops_tailing(self):
+        stream = FakeStream([[insert_change(make_transaction())]])
+        db, offsets = make_db(stream)
+        offsets.update_one.return_value = MagicMock(matched_count=0)
+
+        with pytest.raises(LeaseLost):
+            await TransactionEventTailer(db, publish=AsyncMock()).tail(None)
+
+    @pytest.mark.asyncio
+    async def test_lease_held_elsewhere(self):
+        db, offsets = make_db(FakeStream([]))
+        offsets.find_one_and_update = AsyncMock(side_effect=DuplicateKeyError("dup"))
+
+        assert await TransactionEventTailer(db, publish=AsyncMock()).acquire_lease() is None
+
+
+class TestInlinePublishing:
+    """Test cases for events published by the request handlers"""
+
+    @pytest.mark.asyncio
+    async def test_auto_mode_uses_the_change_stream_on_a_replica_set(self, monkeypatch):
+        import transaction_events
+
+        monkeypatch.setattr(transaction_events, "_publishing_mode", "inline")
+        replica_set = MagicMock(command=AsyncMock(return_value={"setName": "rs0"}))
+        standalone = MagicMock(command=AsyncMock(return_value={"isWritablePrimary": True}))
+
+        assert await resolve_publishing_mode(replica_set, "auto") == "change_stream"
+        assert not inline_publishing()
+        assert await resolve_publishing_mode(standalone, "auto") == "inline"
+        assert inline_publishing()
+        # An explicit mode is kept whatever the deployment
+        assert await resolve_publishing_mode(standalone, "change_stream") == "change_stream"
+
+    @pytest.mark.asyncio
+    async def test_voided_authorization_is_published_with_reason(self, monkeypatch):
+        import event_publisher
+
+        publisher = event_publisher.PaymentEventPublisher()
+        publisher.exchange = MagicMock(publish=AsyncMock())
+        publisher._initialized = True
+        monkeypatch.setattr(event_publisher, "payment_event_publisher", publisher)
+
+        voided = make_transaction(status="voided", gateway_response={"reason": "Authorization expired"})
+        await event_publisher.publish_payment_events([transaction_event(voided)])
+
+        publisher.exchange.publish.assert_awaited_once()
+        message = publisher.exchange.publish.call_args[0][0]
+        assert publisher.exchange.publish.call_args[1]["routing_key"] == "payment.voided"
+        body = json.loads(message.body)
+        assert body["reason"] == "Authorization expired"
+        assert body["event_id"] == event_id_for("txn_1", "payment.voided")
@@ -0,0 +1,154 @@
+"""
+Unit tests for the transaction export stream
+Tests query building, projection and NDJSON/CSV serialization
+"""
+
+import csv
+import io
+import json
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+
+from main import app
+from transaction_export import (
+    EXPORT_FIELDS,
+    EXPORT_PROJECTION,
+    ExportFormat,
+    build_export_filter,
+    open_export_cursor,
+    stream_csv,
+    stream_ndjson,
+)
+
+
+class FakeCursor:
+    """Minimal async cursor mirroring the Motor chaining API"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.sort_args = None
+        self.batch = None
+
+    def sort(self, *args):
+        self.sort_args = args
+        return self
+
+    def batch_size(self, size):
+        self.batch = size
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+def make_transaction(index: int) -> dict:
+    created = datetime(2024, 1, 1, 12, 0, index, tzinfo=timezone.utc)
+    return {
+        "transaction_id": f"txn_{index}",
+        "booking_id": f"booking_{index}",
+        "amount": 10.5 + index,
+        "payment_method": "credit_card",
+        "status": "success",
+        "failure_reason": "",
+        "created_at": created,
+        "updated_at": created,
+    }
+
+
+async def collect(stream) -> bytes:
+    return b"".join([chunk async for chunk in stream])
+
+
+class TestExportFilter:
+    """Test cases for export query construction"""
+
+    def test_empty_filter(self):
+        assert build_export_filter() == {}
+
+    def test_time_range_and_fields(self):
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2024, 2, 1, tzinfo=timezone.utc)
+
+        query = build_export_filter(start=start, end=end, status="success", payment_method="debit_card")
+
+        assert query == {
+            "created_at": {"$gte": start, "$lt": end},
+            "status": "success",
+            "payment_method": "debit_card",
+        }
+
+    @pytest.mark.asyncio
+    async def test_cursor_uses_projection_and_batch_size(self):
+        collection = MagicMock()
+        compact, legacy = FakeCursor([]), FakeCursor([])
+        collection.find.side_effect = [compact, legacy]
+
+        await collect(open_export_cursor(collection, {"status": "success"}, batch_size=500))
+
+        queries = [call[0] for call in collection.find.call_args_list]
+        assert queries == [
+            ({"s": 1, "v": 2}, EXPORT_PROJECTION),
+            ({"status": "success", "v": {"$exists": False}}, EXPORT_PROJECTION),
+        ]
+        assert EXPORT_PROJECTION["_id"] == 0
+        assert "payment_details" not in EXPORT_PROJECTION
+        assert "d" not in EXPORT_PROJECTION
+        assert compact.sort_args == ("c", 1)
+        assert legacy.sort_args == ("created_at", 1)
+        assert compact.batch == legacy.batch == 500
+
+
+class TestExportStreams:
+    """Test cases for NDJSON and CSV streaming"""
+
+    @pytest.mark.asyncio
+    async def test_ndjson_stream(self):
+        cursor = FakeCursor([make_transaction(i) for i in range(3)])
+
+        body = await collect(stream_ndjson(cursor))
+        lines = body.decode().splitlines()
+
+        assert len(lines) == 3
+        first = json.loads(lines[0])
+        assert first["transaction_id"] == "txn_0"
+        assert first["created_at"] == "2024-01-01T12:00:00+00:00"
+
+    @pytest.mark.asyncio
+    async def test_ndjson_stream_is_chunked(self):
+        cursor = FakeCursor([make_transaction(i) for i in range(50)])
+
+        chunks = [chunk async for chunk in stream_ndjson(cursor, chunk_size=512)]
+
+        assert len(chunks) > 1
+        assert all(len(chunk) < 1024 for chunk in chunks)
+        assert b"".join(chunks).count(b"\n") == 50
+
+    @pytest.mark.asyncio
+    async def test_csv_stream(self):
+        cursor = FakeCursor([make_transaction(i) for i in range(2)])
+
+        body = await collect(stream_csv(cursor))
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+
+        assert list(rows[0].keys()) == EXPORT_FIELDS
+        assert [row["transaction_id"] for row in rows] == ["txn_0", "txn_1"]
+
+    def test_export_endpoint(self):
+        mock_db = MagicMock()
+        mock_db.transaction_logs.find.side_effect = [FakeCursor([]), FakeCursor([make_transaction(1)])]
+
+        with patch("main.db", mock_db):
+            client = TestClient(app)
+            response = client.get("/payments/export", params={"format": ExportFormat.CSV.value, "status": "success"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert "txn_1" in response.text
+        query = mock_db.transaction_logs.find.call_args[0][0]
+        assert query == {"status": "success", "v": {"$exists": False}}
@@ -0,0 +1,184 @@
+"""
+Unit tests for pre-gateway velocity checks
+Tests sliding windows, per-dimension limits, Redis sync and the 429 response
+"""
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+
+from main import app
+from velocity import SlidingWindow, VelocityChecker, card_fingerprint, velocity_keys
+
+CARD_KEY = b"test-card-key"
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakePipeline:
+    """Records pipelined commands and answers them from a dict"""
+
+    def __init__(self, store):
+        self.store = store
+        self.commands = []
+
+    def incrby(self, key, amount):
+        self.commands.append(("incrby", key, amount))
+
+    def expire(self, key, seconds):
+        self.commands.append(("expire", key, seconds))
+
+    def mget(self, keys):
+        self.commands.append(("mget", keys))
+
+    async def execute(self):
+        results = []
+        for command in self.commands:
+            if command[0] == "incrby":
+                self.store[command[1]] = self.store.get(command[1], 0) + command[2]
+                results.append(self.store[command[1]])
+            elif command[0] == "expire":
+                results.append(True)
+            else:
+                results.append([self.store.get(key) for key in command[1]])
+        return results
+
+
+def make_checker(clock, limits=None, redis_client=None):
+    return VelocityChecker(
+        limits=limits or {"user": 100, "card": 3, "booking": 100},
+        window_seconds=60,
+        bucket_seconds=1,
+        enabled=True,
+        redis_getter=lambda: redis_client,
+        clock=clock,
+    )
+
+
+class TestSlidingWindow:
+    """Test cases for the ring buffer"""
+
+    def test_old_buckets_drop_out(self):
+        window = SlidingWindow(buckets=5, head=100)
+        window.add(100)
+        window.add(102)
+        window.add(102)
+
+        assert window.total == 3
+        window.advance(105)
+        assert window.total == 2
+        window.advance(200)
+        assert window.total == 0
+
+
+class TestVelocityChecker:
+    """Test cases for per-dimension attempt limits"""
+
+    def test_card_limit_rejects_and_recovers(self):
+        clock = FakeClock()
+        checker = make_checker(clock)
+        keys = velocity_keys("user_1", "booking_1", {"card_number": "4111111111111111"}, CARD_KEY)
+
+        assert all(checker.check(keys) is None for _ in range(3))
+        violation = checker.check(keys)
+        assert violation.dimension == "card"
+        assert violation.retry_after == 60
+
+        clock.now += 61
+        assert checker.check(keys) is None
+
+    def test_rejected_attempts_are_not_counted(self):
+        clock = FakeClock()
+        checker = make_checker(clock, limits={"user": 1, "card": 100, "booking": 100})
+        first = velocity_keys("user_1", "booking_1", {"card_number": "4111111111111111"}, CARD_KEY)
+        second = velocity_keys("user_1", "booking_2", {"card_number": "5555555555554444"}, CARD_KEY)
+
+        assert checker.check(first) is None
+        assert checker.check(second).dimension == "user"
+        assert checker._windows[("booking", "booking_2")].total == 0
+
+    def test_card_key_is_a_fingerprint(self):
+        keys = dict(velocity_keys("u", "b", {"card_number": "4111-1111-1111-1111"}, CARD_KEY))
+        assert keys["card"] == card_fingerprint("4111111111111111", CARD_KEY)
+        assert len(keys["card"]) == 16
+        assert keys["card"] != card_fingerprint("5555555555554444", CARD_KEY)
+        assert keys["card"] != card_fingerprint("4111111111111111", b"other-secret")
+
+    def test_no_card_dimension_without_a_key(self):
+        keys = dict(velocity_keys("u", "b", {"card_number": "4111111111111111"}, b""))
+        assert set(keys) == {"user", "booking"}
+        with pytest.raises(ValueError):
+            card_fingerprint("4111111111111111", b"")
+
+    def test_disabled_checker_admits_everything(self):
+        checker = make_checker(FakeClock(), limits={"user": 1})
+        checker.enabled = False
+        assert all(checker.check([("user", "u")]) is None for _ in range(5))
+
+    @pytest.mark.asyncio
+    async def test_sync_shares_counts_between_replicas(self):
+        clock = FakeClock()
+        store = {}
+        redis_client = MagicMock()
+        redis_client.pipeline.side_effect = lambda transaction=False: FakePipeline(store)
+        first = make_checker(clock, redis_client=redis_client)
+        second = make_checker(clock, redis_client=redis_client)
+        keys = [("card", "abc")]
+
+        for _ in range(2):
+            assert first.check(keys) is None
+        await first.sync()
+
+        assert second.check(keys) is None  # second only knows its own attempt so far
+        await second.sync()
+
+        assert second._windows[("card", "abc")].total == 3
+        assert second.check(keys).dimension == "card"
+
+    @pytest.mark.asyncio
+    async def test_sync_failure_keeps_pending_increments(self):
+        redis_client = MagicMock()
+        pipeline = FakePipeline({})
+        pipeline.execute = AsyncMock(side_effect=ConnectionError("redis down"))
+        redis_client.pipeline.return_value = pipeline
+        checker = make_checker(FakeClock(), redis_client=redis_client)
+
+        checker.check([("card", "abc")])
+        await checker.sync()
+
+        assert sum(checker._pending.values()) == 1
+
+
+class TestVelocityEndpoint:
+    """Test cases for the 429 path in POST /payments"""
+
+    def test_over_limit_is_rejected_before_gateway(self):
+        checker = make_checker(FakeClock(), limits={"user": 100, "card": 1, "booking": 100})
+        mock_db = MagicMock()
+        mock_db.transaction_logs.insert_one = AsyncMock()
+        payment = {
+            "booking_id": "booking_1",
+            "user_id": "user_1",
+            "amount": 100.0,
+            "payment_method": "credit_card",
+            "payment_details": {"card_number": "4111111111111111", "cvv": "123"},
+        }
+
+        with patch("main.velocity_checker", checker), patch("main.db", mock_db), \
+             patch("velocity.VELOCITY_CARD_KEY", CARD_KEY), \
+             patch("main.simulate_payment_processing", AsyncMock(return_value=True)) as mock_gateway, \
+             patch("main.publish_payment_event", AsyncMock()):
+            client = TestClient(app)
+            assert client.post("/payments", json=payment).status_code == 200
+            response = client.post("/payments", json={**payment, "booking_id": "booking_2"})
+
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "60"
+        assert mock_gateway.await_count == 1
+        assert mock_db.transaction_logs.insert_one.await_count == 1
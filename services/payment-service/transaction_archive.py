@@ -0,0 +1,590 @@
+"""
+Transaction Archive for Payment Service
+Keeps transaction_logs to a rolling hot window by sealing whole months into
+compressed archive files, and reads those files back through mmap so exports
+can query history transparently.
+
+Archive file layout (one file per month, e.g. transaction_logs-2024-01.txnarchive):
+
+    MAGIC | block 0 | block 1 | ... | index JSON | index length (8 bytes) | MAGIC
+
+Each block is zlib-compressed JSONL sorted by created_at. The index lists every
+block's offset, length, record count and created_at range, so a time-range read
+only decompresses the blocks it needs. It also carries a Bloom filter of each
+block's transaction ids, so a lookup by id only decompresses blocks that may
+hold it.
+"""
+
+import asyncio
+import base64
+import glob
+import hashlib
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+
+from shared.leases import LEASES_COLLECTION, lease_owner, release_lease, take_lease
+from transaction_codec import first_transaction, iter_transactions, storage_projection, transaction_filter
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_HOT_RETENTION_DAYS = int(os.getenv("TRANSACTION_HOT_RETENTION_DAYS", "90"))
+TRANSACTION_ARCHIVE_DIR = os.getenv("TRANSACTION_ARCHIVE_DIR", "./archive")
+ARCHIVE_BLOCK_RECORDS = int(os.getenv("ARCHIVE_BLOCK_RECORDS", "2000"))
+# How long an archive run may hold the archiver lease between months
+ARCHIVE_LEASE_SECONDS = int(os.getenv("ARCHIVE_LEASE_SECONDS", "3600"))
+
+ARCHIVE_MAGIC = b"TXNARCH1"
+ARCHIVE_SUFFIX = ".txnarchive"
+DATETIME_FIELDS = ("created_at", "updated_at")
+ARCHIVE_LEASE = "transaction-archiver"
+
+# Set on documents copied back from the archive; the change-stream relay does
+# not announce their insert, since the transaction itself is not new
+RESTORED_FIELD = "restored_at"
+
+# Bloom filter sizing: 10 bits and 7 hashes per id give about 1% false positives
+ID_FILTER_BITS_PER_ID = 10
+ID_FILTER_HASHES = 7
+
+
+class ArchiveInProgress(RuntimeError):
+    """Another archive run holds the archiver lease"""
+
+
+def month_start(timestamp: datetime) -> datetime:
+    """First instant (UTC) of the month containing timestamp"""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    timestamp = timestamp.astimezone(timezone.utc)
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(start: datetime) -> datetime:
+    """First instant of the following month"""
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(start: datetime) -> str:
+    """Monthly partition key, e.g. 2024-01"""
+    return start.strftime("%Y-%m")
+
+
+def hot_window_start(now: Optional[datetime] = None) -> datetime:
+    """
+    Oldest month that stays in MongoDB
+    Whole months before this boundary are eligible for archiving
+    """
+    now = now or datetime.now(timezone.utc)
+    return month_start(now - timedelta(days=TRANSACTION_HOT_RETENTION_DAYS))
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return str(value)
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+class IdFilter:
+    """Bloom filter over one block's transaction ids; never misses an id it holds"""
+
+    def __init__(self, size_bits: int, bits: Optional[bytearray] = None):
+        # Whole bytes, so the decoded filter hashes over the same size
+        self.size_bits = max((size_bits + 7) // 8 * 8, 8)
+        self.bits = bits if bits is not None else bytearray(self.size_bits // 8)
+
+    @classmethod
+    def for_ids(cls, transaction_ids: List[str]) -> "IdFilter":
+        id_filter = cls(len(transaction_ids) * ID_FILTER_BITS_PER_ID)
+        for transaction_id in transaction_ids:
+            id_filter.add(transaction_id)
+        return id_filter
+
+    @classmethod
+    def decode(cls, encoded: str) -> "IdFilter":
+        bits = bytearray(base64.b64decode(encoded))
+        return cls(len(bits) * 8, bits)
+
+    def _positions(self, transaction_id: str) -> Iterator[int]:
+        digest = hashlib.blake2b(transaction_id.encode(), digest_size=16).digest()
+        first, step = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        for round_ in range(ID_FILTER_HASHES):
+            yield (first + round_ * step) % self.size_bits
+
+    def add(self, transaction_id: str):
+        for position in self._positions(transaction_id):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, transaction_id: str) -> bool:
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(transaction_id))
+
+    def encode(self) -> str:
+        return base64.b64encode(bytes(self.bits)).decode()
+
+
+class ArchiveWriter:
+    """Streams documents into a block-compressed archive file"""
+
+    def __init__(self, path: str, block_records: int = ARCHIVE_BLOCK_RECORDS):
+        self.path = path
+        # Unique per writer, so two runs sealing the same month never share a temp file
+        self.temp_path = f"{path}.{uuid.uuid4().hex[:12]}.tmp"
+        self.block_records = block_records
+        self.index: List[Dict[str, Any]] = []
+        self.count = 0
+        self._block: List[str] = []
+        self._block_ids: List[str] = []
+        self._block_range: Tuple[Optional[str], Optional[str]] = (None, None)
+        self._file = open(self.temp_path, "wb")
+        self._file.write(ARCHIVE_MAGIC)
+
+    def write(self, document: Dict[str, Any]):
+        document = {key: value for key, value in document.items() if key != "_id"}
+        created_at = _encode(document["created_at"])
+        first, _ = self._block_range
+        self._block_range = (first or created_at, created_at)
+        self._block.append(json.dumps(document, default=_encode, separators=(",", ":")))
+        self._block_ids.append(document["transaction_id"])
+        self.count += 1
+
+        if len(self._block) >= self.block_records:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._block:
+            return
+
+        payload = zlib.compress("\n".join(self._block).encode(), 6)
+        self.index.append({
+            "offset": self._file.tell(),
+            "length": len(payload),
+            "count": len(self._block),
+            "min_created_at": self._block_range[0],
+            "max_created_at": self._block_range[1],
+            "ids": IdFilter.for_ids(self._block_ids).encode(),
+        })
+        self._file.write(payload)
+        self._block = []
+        self._block_ids = []
+        self._block_range = (None, None)
+
+    def close(self):
+        """Write the index and atomically move the file into place"""
+        self._flush_block()
+        index = json.dumps({"count": self.count, "blocks": self.index}).encode()
+        self._file.write(index)
+        self._file.write(struct.pack(">Q", len(index)))
+        self._file.write(ARCHIVE_MAGIC)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class ArchiveReader:
+    """Memory-mapped reader for one archive file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._map[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC or self._map[-len(ARCHIVE_MAGIC):] != ARCHIVE_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a transaction archive")
+
+        trailer = len(self._map) - len(ARCHIVE_MAGIC) - 8
+        (index_length,) = struct.unpack(">Q", self._map[trailer:trailer + 8])
+        index = json.loads(self._map[trailer - index_length:trailer])
+        self.count = index["count"]
+        self.blocks = index["blocks"]
+
+    def blocks_for_range(self, start: Optional[datetime], end: Optional[datetime]) -> List[int]:
+        """Indexes of blocks whose created_at range overlaps [start, end)"""
+        selected = []
+        for position, block in enumerate(self.blocks):
+            if end and datetime.fromisoformat(block["min_created_at"]) >= _as_utc(end):
+                continue
+            if start and datetime.fromisoformat(block["max_created_at"]) < _as_utc(start):
+                continue
+            selected.append(position)
+        return selected
+
+    def id_filters(self) -> List[Optional[IdFilter]]:
+        """Per-block id filters; None for blocks sealed before filters were written"""
+        return [IdFilter.decode(block["ids"]) if "ids" in block else None for block in self.blocks]
+
+    def read_block(self, position: int) -> List[Dict[str, Any]]:
+        """Decompress one block straight out of the mapped file"""
+        block = self.blocks[position]
+        payload = zlib.decompress(self._map[block["offset"]:block["offset"] + block["length"]])
+        documents = []
+        for line in payload.decode().split("\n"):
+            document = json.loads(line)
+            for field in DATETIME_FIELDS:
+                if document.get(field):
+                    document[field] = datetime.fromisoformat(document[field])
+            documents.append(document)
+        return documents
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def matches(document: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    """Evaluate the export filter shape ($gte/$lt ranges and equality) in memory"""
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if value is None:
+                return False
+            if isinstance(value, datetime):
+                value = _as_utc(value)
+            if "$gte" in condition and value < _as_utc(condition["$gte"]):
+                return False
+            if "$lt" in condition and value >= _as_utc(condition["$lt"]):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class ArchiveStore:
+    """Directory of monthly archive partitions"""
+
+    def __init__(self, archive_dir: str = TRANSACTION_ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+        # path -> (file signature, per-block id filters); a re-sealed file gets a new signature
+        self._id_filters: Dict[str, Tuple[Tuple[int, int], List[Optional[IdFilter]]]] = {}
+
+    def path_for(self, start: datetime) -> str:
+        return os.path.join(self.archive_dir, f"transaction_logs-{partition_name(start)}{ARCHIVE_SUFFIX}")
+
+    def partitions(self) -> List[Tuple[datetime, str]]:
+        """(month start, path) for every sealed partition, oldest first"""
+        partitions = []
+        for path in glob.glob(os.path.join(self.archive_dir, f"transaction_logs-*{ARCHIVE_SUFFIX}")):
+            name = os.path.basename(path)[len("transaction_logs-"):-len(ARCHIVE_SUFFIX)]
+            start = datetime.strptime(name, "%Y-%m").replace(tzinfo=timezone.utc)
+            partitions.append((start, path))
+        return sorted(partitions)
+
+    def archived_until(self) -> Optional[datetime]:
+        """End of the newest archived month, or None when nothing is archived"""
+        partitions = self.partitions()
+        return next_month(partitions[-1][0]) if partitions else None
+
+    def has_partition(self, start: datetime) -> bool:
+        return os.path.exists(self.path_for(start))
+
+    def covers(self, start: Optional[datetime]) -> bool:
+        """Whether a query starting at `start` can reach archived data"""
+        archived_until = self.archived_until()
+        return archived_until is not None and (start is None or _as_utc(start) < archived_until)
+
+    async def iter_documents(
+        self, query: Dict[str, Any], exclude: Optional[Set[str]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield archived documents matching an export query in created_at order
+        Blocks are decompressed one at a time off the event loop, so memory is
+        bounded by a single block regardless of archive size. Transactions in
+        `exclude` are skipped.
+        """
+        created_at = query.get("created_at", {})
+        start, end = created_at.get("$gte"), created_at.get("$lt")
+
+        for partition_start, path in self.partitions():
+            if end and partition_start >= _as_utc(end):
+                break
+            if start and next_month(partition_start) <= _as_utc(start):
+                continue
+
+            reader = await asyncio.to_thread(ArchiveReader, path)
+            try:
+                for position in reader.blocks_for_range(start, end):
+                    documents = await asyncio.to_thread(reader.read_block, position)
+                    for document in documents:
+                        if exclude and document["transaction_id"] in exclude:
+                            continue
+                        if matches(document, query):
+                            yield document
+            finally:
+                reader.close()
+
+    def _load_id_filters(self, path: str) -> List[Optional[IdFilter]]:
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._id_filters.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        reader = ArchiveReader(path)
+        try:
+            filters = reader.id_filters()
+        finally:
+            reader.close()
+        self._id_filters[path] = (signature, filters)
+        return filters
+
+    async def find(self, transaction_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look one transaction up across every partition, newest first
+        Each file's block id filters are cached in memory, so only blocks that
+        may hold the id are decompressed; an unknown id usually reads none.
+        """
+        for _, path in reversed(self.partitions()):
+            filters = await asyncio.to_thread(self._load_id_filters, path)
+            candidates = [
+                position for position, id_filter in enumerate(filters)
+                if id_filter is None or transaction_id in id_filter
+            ]
+            if not candidates:
+                continue
+
+            reader = await asyncio.to_thread(ArchiveReader, path)
+            try:
+                for position in candidates:
+                    for document in await asyncio.to_thread(reader.read_block, position):
+                        if document.get("transaction_id") == transaction_id:
+                            return document
+            finally:
+                reader.close()
+        return None
+
+
+def _created_at(document: Dict[str, Any]) -> datetime:
+    return _as_utc(document["created_at"])
+
+
+async def hot_transaction_ids(collection, query: Dict[str, Any], archived_until: datetime) -> Set[str]:
+    """
+    Ids still in MongoDB from archived months within the query's time range
+    A resumed month or a restored transaction has a copy in both places, and
+    the hot one is current. Other filters are ignored on purpose: the archived
+    copy must be skipped even when only its stale state matches the query.
+    """
+    created_at = dict(query.get("created_at", {}))
+    end = created_at.get("$lt")
+    created_at["$lt"] = archived_until if end is None else min(_as_utc(end), archived_until)
+    documents = iter_transactions(collection, {"created_at": created_at}, projection=storage_projection(["transaction_id"]))
+    return {document["transaction_id"] async for document in documents}
+
+
+async def merge_documents(*sources) -> AsyncIterator[Dict[str, Any]]:
+    """Merge async document sources that are each ordered by created_at"""
+    iterators = [source.__aiter__() for source in sources]
+
+    async def next_or_none(iterator):
+        try:
+            return await iterator.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    heads = [await next_or_none(iterator) for iterator in iterators]
+    while any(head is not None for head in heads):
+        position = min(
+            (position for position, head in enumerate(heads) if head is not None),
+            key=lambda position: _created_at(heads[position]),
+        )
+        yield heads[position]
+        heads[position] = await next_or_none(iterators[position])
+
+
+def archived_versions(path: str) -> List[Tuple[str, Optional[datetime]]]:
+    """
+    (transaction_id, updated_at) of every document in a sealed file
+    Reads every block back, so it doubles as the check that the file is whole.
+    """
+    reader = ArchiveReader(path)
+    try:
+        versions = [
+            (document["transaction_id"], document.get("updated_at"))
+            for position in range(len(reader.blocks))
+            for document in reader.read_block(position)
+        ]
+    finally:
+        reader.close()
+    if len(versions) != reader.count:
+        raise RuntimeError(f"{path} holds {len(versions)} documents, its index says {reader.count}")
+    return versions
+
+
+def reseal(path: str, documents: List[Dict[str, Any]]) -> int:
+    """
+    Rewrite a sealed file with `documents` replacing archived ones of the same
+    transaction_id, keeping created_at order; returns the documents written
+    """
+    replaced = {document["transaction_id"] for document in documents}
+    reader = ArchiveReader(path)
+    writer = ArchiveWriter(path)
+    try:
+        archived = (
+            document
+            for position in range(len(reader.blocks))
+            for document in reader.read_block(position)
+            if document["transaction_id"] not in replaced
+        )
+        for document in heapq.merge(archived, sorted(documents, key=_created_at), key=_created_at):
+            writer.write(document)
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    finally:
+        reader.close()
+    return writer.count
+
+
+async def delete_archived(collection, versions: List[Tuple[str, Optional[datetime]]]) -> int:
+    """
+    Delete hot documents that are still at their archived version
+    A transaction updated after it was read for the archive no longer matches
+    and stays in MongoDB until the next run re-seals it.
+    """
+    deleted = 0
+    for offset in range(0, len(versions), ARCHIVE_BLOCK_RECORDS):
+        chunk = versions[offset:offset + ARCHIVE_BLOCK_RECORDS]
+        result = await collection.delete_many({"$or": [
+            transaction_filter({"transaction_id": transaction_id, "updated_at": updated_at})
+            for transaction_id, updated_at in chunk
+        ]})
+        deleted += result.deleted_count
+    return deleted
+
+
+async def archive_month(db, store: ArchiveStore, start: datetime) -> Dict[str, Any]:
+    """
+    Seal one month of transaction_logs into an archive file, verify it, then
+    remove the archived documents from the hot collection
+
+    A month that is already sealed but still has hot documents (a crash
+    before the delete, a transaction updated while it was being archived, or
+    one brought back by a refund) is resumed: hot documents matching the file
+    are deleted, the rest are merged into a re-sealed file and then deleted.
+    """
+    end = next_month(start)
+    month_filter = {"created_at": {"$gte": start, "$lt": end}}
+    expected = await db.transaction_logs.count_documents(transaction_filter(month_filter))
+
+    if expected == 0:
+        return {"partition": partition_name(start), "archived": 0, "deleted": 0}
+
+    path = store.path_for(start)
+    deleted = 0
+    if store.has_partition(start):
+        versions = await asyncio.to_thread(archived_versions, path)
+        deleted += await delete_archived(db.transaction_logs, versions)
+
+        remaining = [
+            document async for document in iter_transactions(db.transaction_logs, month_filter, "created_at")
+        ]
+        if not remaining:
+            logger.info(f"Resumed archive of {partition_name(start)}: deleted {deleted} archived transactions")
+            return {"partition": partition_name(start), "archived": len(versions), "deleted": deleted}
+
+        written = await asyncio.to_thread(reseal, path, remaining)
+        logger.info(f"Re-sealed {partition_name(start)} with {len(remaining)} updated transactions")
+    else:
+        os.makedirs(store.archive_dir, exist_ok=True)
+        writer = ArchiveWriter(path)
+        try:
+            # Archive files hold API-shaped documents whatever the storage schema version
+            documents = iter_transactions(
+                db.transaction_logs, month_filter, "created_at", batch_size=ARCHIVE_BLOCK_RECORDS
+            )
+            async for document in documents:
+                writer.write(document)
+
+            if writer.count != expected:
+                raise RuntimeError(
+                    f"Archive for {partition_name(start)} wrote {writer.count} documents, expected {expected}"
+                )
+            await asyncio.to_thread(writer.close)
+        except Exception:
+            writer.abort()
+            raise
+        written = writer.count
+
+    # Re-read the sealed file before deleting anything from MongoDB
+    versions = await asyncio.to_thread(archived_versions, path)
+    if len(versions) != written:
+        raise RuntimeError(f"Archive for {partition_name(start)} failed verification")
+
+    deleted += await delete_archived(db.transaction_logs, versions)
+    logger.info(f"Archived {len(versions)} transactions for {partition_name(start)}")
+
+    return {"partition": partition_name(start), "archived": len(versions), "deleted": deleted}
+
+
+async def archive_expired(db, store: ArchiveStore, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Archive every whole month older than the hot window
+    Runs hold the archiver lease, renewed before each month, so a second run
+    started meanwhile (another worker, replica or the cron job) raises
+    ArchiveInProgress instead of sealing the same files.
+    """
+    leases = db[LEASES_COLLECTION]
+    owner = lease_owner()
+    duration = timedelta(seconds=ARCHIVE_LEASE_SECONDS)
+    if not await take_lease(leases, ARCHIVE_LEASE, owner, duration):
+        raise ArchiveInProgress("Another archive run is in progress")
+
+    try:
+        boundary = hot_window_start(now)
+        oldest = await first_transaction(db.transaction_logs, {"created_at": {"$lt": boundary}}, "created_at")
+
+        partitions = []
+        if oldest:
+            start = month_start(oldest["created_at"])
+            while start < boundary:
+                if not await take_lease(leases, ARCHIVE_LEASE, owner, duration):
+                    raise ArchiveInProgress("Lost the archiver lease")
+                partitions.append(await archive_month(db, store, start))
+                start = next_month(start)
+    finally:
+        await release_lease(leases, ARCHIVE_LEASE, owner)
+
+    return {"hot_window_start": boundary.isoformat(), "partitions": partitions}
+
+
+async def run_archiver():
+    """Standalone archiver entry point"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from shared.mongo_config import mongo_client_kwargs, write_concern
+
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"), **mongo_client_kwargs())
+    try:
+        # delete_many must not be acknowledged before the deletes are durable
+        db = client.get_database("movie_booking", write_concern=write_concern("critical"))
+        result = await archive_expired(db, ArchiveStore())
+        logger.info(f"Archiver complete: {result}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_archiver())
@@ -0,0 +1,230 @@
+"""
+Read-through cache for transaction lookups
+Keeps serialized transactions in a local LRU with TTL, optionally backed by
+Redis so every replica shares the same warm entries
+
+A load that started before an invalidation must not put its stale result
+back. Locally, invalidate marks the loads in flight for that id. In Redis,
+invalidate bumps a per-transaction version, and a load only stores its result
+if the version is still the one it read when the cache missed.
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_CACHE_SIZE = int(os.getenv("TRANSACTION_CACHE_SIZE", "10000"))
+TRANSACTION_CACHE_TTL = float(os.getenv("TRANSACTION_CACHE_TTL", "30"))
+
+# Local entries only live this long, so an invalidation on one replica (or
+# worker) is seen by the others within this bound. Without Redis it is the
+# only bound, since invalidations cannot reach other processes at all
+TRANSACTION_CACHE_LOCAL_TTL = float(os.getenv("TRANSACTION_CACHE_LOCAL_TTL", "2"))
+
+# Versions must outlive any load that read them; an expired version looks like
+# a never-invalidated transaction to a load that started before it existed
+TRANSACTION_CACHE_VERSION_TTL = int(os.getenv("TRANSACTION_CACHE_VERSION_TTL", "3600"))
+
+# KEYS: payload, version; ARGV: payload, ttl, version read before the load ("" if none)
+SET_IF_VERSION_LUA = """
+local current = redis.call('GET', KEYS[2])
+if (current or '') ~= ARGV[3] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+# KEYS: payload, version; ARGV: version ttl
+INVALIDATE_LUA = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+
+class _Load:
+    """A loader call in flight; invalidate marks it stale"""
+    __slots__ = ("stale",)
+
+    def __init__(self):
+        self.stale = False
+
+
+class TransactionCache:
+    """LRU + TTL cache of serialized transaction JSON keyed by transaction_id"""
+
+    def __init__(
+        self,
+        max_entries: int = TRANSACTION_CACHE_SIZE,
+        ttl_seconds: float = TRANSACTION_CACHE_TTL,
+        local_ttl_seconds: float = TRANSACTION_CACHE_LOCAL_TTL,
+        redis_getter: Callable = get_redis,
+        key_prefix: str = "payment:transaction:",
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.local_ttl_seconds = local_ttl_seconds
+        self.redis_getter = redis_getter
+        self.key_prefix = key_prefix
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._loads: Dict[str, List[_Load]] = {}
+        self._scripts = {}
+        self._script_client = None
+        self.hits = 0
+        self.misses = 0
+
+    def _script(self, redis_client, lua: str):
+        if self._script_client is not redis_client:
+            self._scripts = {}
+            self._script_client = redis_client
+        if lua not in self._scripts:
+            self._scripts[lua] = redis_client.register_script(lua)
+        return self._scripts[lua]
+
+    def _version_key(self, transaction_id: str) -> str:
+        return f"{self.key_prefix}{transaction_id}:version"
+
+    @property
+    def _local_ttl(self) -> float:
+        return min(self.ttl_seconds, self.local_ttl_seconds)
+
+    def _get_local(self, transaction_id: str) -> Optional[bytes]:
+        entry = self._entries.get(transaction_id)
+        if entry is None:
+            return None
+
+        expires_at, payload = entry
+        if expires_at <= time.monotonic():
+            del self._entries[transaction_id]
+            return None
+
+        self._entries.move_to_end(transaction_id)
+        return payload
+
+    def _set_local(self, transaction_id: str, payload: bytes, ttl: float):
+        self._entries[transaction_id] = (time.monotonic() + ttl, payload)
+        self._entries.move_to_end(transaction_id)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _lookup(self, transaction_id: str) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        (payload, version) from the local tier, then Redis
+        version is "" when the transaction was never invalidated and None when
+        Redis is unavailable, in which case a load must not write to Redis.
+        """
+        payload = self._get_local(transaction_id)
+        if payload is not None:
+            return payload, None
+
+        redis_client = self.redis_getter()
+        if redis_client is None:
+            return None, None
+
+        try:
+            payload, version = await redis_client.mget(
+                [self.key_prefix + transaction_id, self._version_key(transaction_id)]
+            )
+        except Exception as e:
+            logger.warning(f"Transaction cache Redis read failed: {e}")
+            return None, None
+
+        if payload is not None:
+            self._set_local(transaction_id, payload, self._local_ttl)
+        return payload, version.decode() if version is not None else ""
+
+    async def get(self, transaction_id: str) -> Optional[bytes]:
+        """Look up a transaction in the local tier, then Redis"""
+        payload, _ = await self._lookup(transaction_id)
+        return payload
+
+    async def set(self, transaction_id: str, payload: bytes, version: Optional[str] = None):
+        """
+        Store a serialized transaction in both tiers
+        With a version (from the lookup that missed), neither tier is written
+        if an invalidation has bumped it since.
+        """
+        redis_client = self.redis_getter()
+        if redis_client is None:
+            self._set_local(transaction_id, payload, self._local_ttl)
+            return
+
+        ttl = max(1, int(self.ttl_seconds))
+        try:
+            if version is None:
+                await redis_client.set(self.key_prefix + transaction_id, payload, ex=ttl)
+            else:
+                stored = await self._script(redis_client, SET_IF_VERSION_LUA)(
+                    keys=[self.key_prefix + transaction_id, self._version_key(transaction_id)],
+                    args=[payload, ttl, version],
+                )
+                if not int(stored):
+                    return
+        except Exception as e:
+            logger.warning(f"Transaction cache Redis write failed: {e}")
+        self._set_local(transaction_id, payload, self._local_ttl)
+
+    async def invalidate(self, transaction_id: str):
+        """Drop a transaction after its status changes"""
+        self._entries.pop(transaction_id, None)
+        for load in self._loads.get(transaction_id, ()):
+            load.stale = True
+
+        redis_client = self.redis_getter()
+        if redis_client is None:
+            return
+
+        try:
+            await self._script(redis_client, INVALIDATE_LUA)(
+                keys=[self.key_prefix + transaction_id, self._version_key(transaction_id)],
+                args=[TRANSACTION_CACHE_VERSION_TTL],
+            )
+        except Exception as e:
+            logger.warning(f"Transaction cache Redis invalidation failed: {e}")
+
+    async def get_or_load(
+        self,
+        transaction_id: str,
+        loader: Callable[[str], Awaitable[Optional[bytes]]],
+    ) -> Optional[bytes]:
+        """Read-through lookup; misses are not cached so new transactions appear immediately"""
+        payload, version = await self._lookup(transaction_id)
+        if payload is not None:
+            self.hits += 1
+            return payload
+
+        self.misses += 1
+        load = _Load()
+        self._loads.setdefault(transaction_id, []).append(load)
+        try:
+            payload = await loader(transaction_id)
+            if payload is None or load.stale:
+                return payload
+
+            if version is None and self.redis_getter() is not None:
+                # The version could not be read, so a Redis write might be stale
+                self._set_local(transaction_id, payload, self._local_ttl)
+            else:
+                await self.set(transaction_id, payload, version)
+            if load.stale:
+                # Invalidated while the Redis write was in flight
+                self._entries.pop(transaction_id, None)
+            return payload
+        finally:
+            loads = self._loads[transaction_id]
+            loads.remove(load)
+            if not loads:
+                del self._loads[transaction_id]
+
+    def clear(self):
+        """Drop all local entries"""
+        self._entries.clear()
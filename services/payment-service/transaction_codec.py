@@ -0,0 +1,404 @@
+"""
+Storage codec for transaction_logs
+Maps the API's TransactionLog shape to a compact, versioned on-disk document
+and back. All reads and writes of transaction_logs go through this module so
+the rest of the service only ever sees API-shaped dicts.
+
+Schema versions:
+
+    1  legacy: API field names, float amount, enum strings (no "v" field)
+    2  compact: short field names, integer minor units (cents), integer enum
+       codes and short gateway_response keys, tagged with "v": 2
+
+New documents are written in version 1 until TRANSACTION_STORAGE_VERSION=2
+is set, which needs the validator and indexes from
+migrate_transactions.py --apply-schema. The service checks for them at startup
+and keeps writing version 1 while they are missing (see use_write_version).
+Version 1 documents stay readable until migrate_transactions.py has rewritten
+them; set TRANSACTION_LEGACY_READS=false afterwards so queries stop matching
+both shapes.
+"""
+
+import logging
+import os
+from decimal import ROUND_HALF_UP, Decimal
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Version new documents are written with (1 keeps writing the legacy shape)
+TRANSACTION_STORAGE_VERSION = int(os.getenv("TRANSACTION_STORAGE_VERSION", "1"))
+TRANSACTION_LEGACY_READS = os.getenv("TRANSACTION_LEGACY_READS", "true").lower() == "true"
+
+COMPACT_VERSION = 2
+VERSION_FIELD = "v"
+
+# API field -> compact field
+FIELD_NAMES = {
+    "transaction_id": "t",
+    "booking_id": "b",
+    "user_id": "u",
+    "amount": "a",
+    "payment_method": "m",
+    "status": "s",
+    "payment_details": "d",
+    "created_at": "c",
+    "updated_at": "up",
+    "gateway_response": "g",
+    "failure_reason": "f",
+}
+API_NAMES = {compact: field for field, compact in FIELD_NAMES.items()}
+
+# Codes are append-only: never renumber, only add
+PAYMENT_METHOD_CODES = {
+    "credit_card": 1,
+    "debit_card": 2,
+    "digital_wallet": 3,
+    "net_banking": 4,
+}
+STATUS_CODES = {
+    "pending": 0,
+    "success": 1,
+    "failed": 2,
+    "refunded": 3,
+    "authorized": 4,
+    "voided": 5,
+}
+ENUM_CODES = {"payment_method": PAYMENT_METHOD_CODES, "status": STATUS_CODES}
+ENUM_NAMES = {field: {code: name for name, code in codes.items()} for field, codes in ENUM_CODES.items()}
+
+GATEWAY_FIELD_NAMES = {
+    "gateway_transaction_id": "gt",
+    "authorization_code": "ac",
+    "gateway_status": "gs",
+    "processing_time_ms": "pt",
+    "error_code": "ec",
+    "refund_reference": "rr",
+    "original_transaction": "ot",
+    "reason": "r",
+    "error": "er",
+    "message": "ms",
+    "capture_reference": "cr",
+    "void_reference": "vr",
+    "batch_id": "bi",
+    "gateway": "gw",
+    "hedged": "hg",
+}
+GATEWAY_API_NAMES = {compact: field for field, compact in GATEWAY_FIELD_NAMES.items()}
+
+MINOR_UNITS = 100
+
+
+def _value(field: Any) -> Any:
+    return field.value if isinstance(field, Enum) else field
+
+
+def to_minor_units(amount: Any) -> int:
+    """Exact cents for a float/Decimal amount"""
+    return int((Decimal(str(amount)) * MINOR_UNITS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor_units(cents: int) -> float:
+    return cents / MINOR_UNITS
+
+
+_write_version = TRANSACTION_STORAGE_VERSION
+
+
+def write_version() -> int:
+    return _write_version
+
+
+def use_write_version(version: int):
+    """Set the version encode_transaction writes by default"""
+    global _write_version
+    _write_version = version
+
+
+def version_of(document: Dict[str, Any]) -> int:
+    return document.get(VERSION_FIELD, 1)
+
+
+def encode_value(field: str, value: Any) -> Any:
+    """Storage representation of one API field value"""
+    value = _value(value)
+    if value is None:
+        return None
+    if field == "amount":
+        return to_minor_units(value)
+    if field in ENUM_CODES:
+        return ENUM_CODES[field][value]
+    if field == "gateway_response":
+        return {GATEWAY_FIELD_NAMES.get(key, key): _value(item) for key, item in value.items()}
+    return value
+
+
+def decode_value(field: str, value: Any) -> Any:
+    """API representation of one stored field value"""
+    if value is None:
+        return None
+    if field == "amount":
+        return from_minor_units(value)
+    if field in ENUM_NAMES:
+        return ENUM_NAMES[field][value]
+    if field == "gateway_response":
+        return {GATEWAY_API_NAMES.get(key, key): item for key, item in value.items()}
+    return value
+
+
+def encode_transaction(document: Dict[str, Any], version: Optional[int] = None) -> Dict[str, Any]:
+    """Turn an API-shaped transaction (TransactionLog.model_dump()) into a stored document"""
+    if version is None:
+        version = _write_version
+    if version < COMPACT_VERSION:
+        return {key: _value(value) for key, value in document.items()}
+
+    stored: Dict[str, Any] = {VERSION_FIELD: COMPACT_VERSION}
+    for field, value in document.items():
+        if field == "_id":
+            stored["_id"] = value
+            continue
+        # Unset optional fields are simply left out
+        if value is None:
+            continue
+        stored[FIELD_NAMES.get(field, field)] = encode_value(field, value)
+    return stored
+
+
+def decode_transaction(stored: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn a stored document of any version into the API shape"""
+    if version_of(stored) < COMPACT_VERSION:
+        return stored
+
+    document: Dict[str, Any] = {}
+    for key, value in stored.items():
+        if key == VERSION_FIELD:
+            continue
+        field = API_NAMES.get(key, key)
+        document[field] = decode_value(field, value)
+    return document
+
+
+def _encode_condition(field: str, condition: Any) -> Any:
+    if isinstance(condition, dict):
+        encoded = {}
+        for operator, operand in condition.items():
+            if operator in ("$in", "$nin"):
+                encoded[operator] = [encode_value(field, item) for item in operand]
+            elif operator == "$exists":
+                encoded[operator] = operand
+            else:
+                encoded[operator] = encode_value(field, operand)
+        return encoded
+    return encode_value(field, condition)
+
+
+def compact_filter(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate an API-shaped filter ({field: value | {$op: value}}) to compact storage"""
+    return {FIELD_NAMES.get(field, field): _encode_condition(field, condition) for field, condition in query.items()}
+
+
+def legacy_filter(query: Dict[str, Any]) -> Dict[str, Any]:
+    """The same filter for version 1 documents (enum members unwrapped to strings)"""
+    legacy: Dict[str, Any] = {}
+    for field, condition in query.items():
+        if isinstance(condition, dict):
+            legacy[field] = {
+                operator: [_value(item) for item in operand] if isinstance(operand, list) else _value(operand)
+                for operator, operand in condition.items()
+            }
+        else:
+            legacy[field] = _value(condition)
+    return legacy
+
+
+def transaction_filter(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Storage filter matching both schema versions while legacy reads are on"""
+    if not TRANSACTION_LEGACY_READS:
+        return compact_filter(query)
+    return {"$or": [compact_filter(query), legacy_filter(query)]}
+
+
+def storage_projection(fields: List[str]) -> Dict[str, Any]:
+    """Projection covering the given API fields in every readable version"""
+    projection: Dict[str, Any] = {"_id": 0, VERSION_FIELD: 1}
+    for field in fields:
+        projection[FIELD_NAMES.get(field, field)] = 1
+        if TRANSACTION_LEGACY_READS:
+            projection[field] = 1
+    return projection
+
+
+def transaction_update(fields: Dict[str, Any], version: int) -> Dict[str, Any]:
+    """$set document for a stored transaction of the given version"""
+    if version < COMPACT_VERSION:
+        return {"$set": {field: _value(value) for field, value in fields.items()}}
+    return {"$set": {FIELD_NAMES.get(field, field): encode_value(field, value) for field, value in fields.items()}}
+
+
+def versioned_transaction(stored: Dict[str, Any]) -> Dict[str, Any]:
+    """API-shaped document with "v" kept so it can be updated in its own shape"""
+    return {**decode_transaction(stored), VERSION_FIELD: version_of(stored)}
+
+
+async def find_transaction(collection, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """find_one returning an API-shaped document (with "v" kept for updates)"""
+    stored = await collection.find_one(transaction_filter(query), {"_id": 0})
+    if stored is None:
+        return None
+    return versioned_transaction(stored)
+
+
+def transaction_key(transaction: Dict[str, Any], expected: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Filter for one transaction read with find_transaction, in its stored shape
+    expected adds API-shaped conditions (e.g. {"status": "authorized"}) so the
+    update only applies while the document is still in that state.
+    """
+    query = {"transaction_id": transaction["transaction_id"], **(expected or {})}
+    if transaction.get(VERSION_FIELD, 1) >= COMPACT_VERSION:
+        return compact_filter(query)
+    return legacy_filter(query)
+
+
+def transaction_update_one(
+    transaction: Dict[str, Any], fields: Dict[str, Any], expected: Optional[Dict[str, Any]] = None
+) -> UpdateOne:
+    """The same update as update_transaction, for bulk_write"""
+    return UpdateOne(
+        transaction_key(transaction, expected),
+        transaction_update(fields, transaction.get(VERSION_FIELD, 1)),
+    )
+
+
+async def update_transaction(
+    collection, transaction: Dict[str, Any], fields: Dict[str, Any], expected: Optional[Dict[str, Any]] = None
+):
+    """
+    Update fields on a transaction previously read with find_transaction
+    A legacy read that no longer matches is retried once in the compact shape,
+    since the migration may have rewritten the document in between. Callers
+    check matched_count to detect a transaction that changed state instead.
+    """
+    version = transaction.get(VERSION_FIELD, 1)
+    result = await collection.update_one(transaction_key(transaction, expected), transaction_update(fields, version))
+    if result.matched_count == 0 and version < COMPACT_VERSION:
+        migrated = {**transaction, VERSION_FIELD: COMPACT_VERSION}
+        result = await collection.update_one(
+            transaction_key(migrated, expected), transaction_update(fields, COMPACT_VERSION)
+        )
+    return result
+
+
+async def first_transaction(
+    collection, query: Dict[str, Any], sort_field: str
+) -> Optional[Dict[str, Any]]:
+    """API-shaped document with the smallest sort_field across every readable version"""
+    compact_sort = [(FIELD_NAMES.get(sort_field, sort_field), 1)]
+    if not TRANSACTION_LEGACY_READS:
+        stored = await collection.find_one(compact_filter(query), {"_id": 0}, sort=compact_sort)
+        return decode_transaction(stored) if stored else None
+
+    candidates = [
+        await collection.find_one(
+            {**compact_filter(query), VERSION_FIELD: COMPACT_VERSION}, {"_id": 0}, sort=compact_sort
+        ),
+        await collection.find_one(
+            {**legacy_filter(query), VERSION_FIELD: {"$exists": False}}, {"_id": 0}, sort=[(sort_field, 1)]
+        ),
+    ]
+    documents = [decode_transaction(stored) for stored in candidates if stored]
+    return min(documents, key=lambda document: document[sort_field], default=None)
+
+
+async def iter_transactions(
+    collection,
+    query: Dict[str, Any],
+    sort_field: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    batch_size: int = 1000,
+    with_version: bool = False,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Iterate API-shaped transactions, optionally sorted ascending by one field
+    With legacy reads on, each schema version is scanned with its own filter
+    and index and the two sorted streams are merged, since no single index
+    can order documents whose sort key lives under different names.
+    with_version keeps "v" on each document, as find_transaction does.
+    """
+    decode = versioned_transaction if with_version else decode_transaction
+
+    def cursor_for(filter_query, sort_key):
+        cursor = collection.find(filter_query, projection)
+        if sort_key:
+            cursor = cursor.sort(sort_key, 1)
+        return cursor.batch_size(batch_size)
+
+    compact_sort = FIELD_NAMES.get(sort_field, sort_field) if sort_field else None
+
+    if not TRANSACTION_LEGACY_READS:
+        async for stored in cursor_for(compact_filter(query), compact_sort):
+            yield decode(stored)
+        return
+
+    if sort_field is None:
+        async for stored in cursor_for(transaction_filter(query), None):
+            yield decode(stored)
+        return
+
+    compact = cursor_for({**compact_filter(query), VERSION_FIELD: COMPACT_VERSION}, compact_sort).__aiter__()
+    legacy = cursor_for({**legacy_filter(query), VERSION_FIELD: {"$exists": False}}, sort_field).__aiter__()
+
+    async def next_or_none(iterator):
+        try:
+            return decode(await iterator.__anext__())
+        except StopAsyncIteration:
+            return None
+
+    left, right = await next_or_none(compact), await next_or_none(legacy)
+    while left is not None or right is not None:
+        if right is None or (left is not None and left[sort_field] <= right[sort_field]):
+            yield left
+            left = await next_or_none(compact)
+        else:
+            yield right
+            right = await next_or_none(legacy)
+
+
+def normalize_stage() -> Dict[str, Any]:
+    """
+    Aggregation $project that presents either schema version in API field names
+    (amounts in major units, enums as names) for pipelines such as rollup backfill
+    amount_cents carries the exact integer amount for sums that must not drift.
+    """
+    def enum_name(field: str) -> Dict[str, Any]:
+        names = ENUM_NAMES[field]
+        branches = [{"case": {"$eq": [f"${FIELD_NAMES[field]}", code]}, "then": name} for code, name in names.items()]
+        return {"$switch": {"branches": branches, "default": f"${field}"}}
+
+    return {
+        "$project": {
+            "_id": 0,
+            "transaction_id": {"$ifNull": ["$t", "$transaction_id"]},
+            "created_at": {"$ifNull": ["$c", "$created_at"]},
+            "amount": {
+                "$cond": [
+                    {"$eq": [f"${VERSION_FIELD}", COMPACT_VERSION]},
+                    {"$divide": ["$a", MINOR_UNITS]},
+                    "$amount",
+                ]
+            },
+            "amount_cents": {
+                "$cond": [
+                    {"$eq": [f"${VERSION_FIELD}", COMPACT_VERSION]},
+                    "$a",
+                    {"$toLong": {"$round": [{"$multiply": ["$amount", MINOR_UNITS]}, 0]}},
+                ]
+            },
+            "payment_method": enum_name("payment_method"),
+            "status": enum_name("status"),
+        }
+    }
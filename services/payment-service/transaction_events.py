@@ -0,0 +1,296 @@
+"""
+Change-stream event publishing for Payment Service
+Tails transaction_logs and turns committed inserts and status updates into
+payment.* events, so the request path only has to write to MongoDB.
+
+The resume token is checkpointed in event_stream_offsets only after the broker
+confirms a batch: a restart resumes exactly where publishing stopped, and an
+event may be re-sent (with the same event_id) but never lost. The offsets
+document doubles as a lease so only one replica tails at a time.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from shared.leases import lease_owner, take_lease
+from transaction_archive import RESTORED_FIELD
+from transaction_codec import FIELD_NAMES, decode_transaction
+
+logger = logging.getLogger(__name__)
+
+# "auto" (default): change_stream when MongoDB is a replica set or sharded cluster, else inline
+# "inline": handlers publish after their write; a failed publish loses the event
+# "change_stream": the tailer publishes; requires a replica set
+EVENT_PUBLISHING_MODE = os.getenv("EVENT_PUBLISHING_MODE", "auto")
+EVENT_STREAM_BATCH_SIZE = int(os.getenv("EVENT_STREAM_BATCH_SIZE", "100"))
+EVENT_STREAM_MAX_WAIT_MS = int(os.getenv("EVENT_STREAM_MAX_WAIT_MS", "200"))
+EVENT_STREAM_LEASE_SECONDS = int(os.getenv("EVENT_STREAM_LEASE_SECONDS", "30"))
+EVENT_STREAM_RETRY_SECONDS = float(os.getenv("EVENT_STREAM_RETRY_SECONDS", "5"))
+
+OFFSETS_COLLECTION = "event_stream_offsets"
+STREAM_ID = "payment-events"
+
+CHANGE_PIPELINE = [
+    # Replaces come from schema migrations, which don't change any payment's state
+    {"$match": {"operationType": {"$in": ["insert", "update"]}}},
+]
+
+PaymentEvent = Tuple[str, Dict[str, Any]]
+
+
+# Mode in effect; "auto" is settled by resolve_publishing_mode at startup
+_publishing_mode = "inline" if EVENT_PUBLISHING_MODE == "auto" else EVENT_PUBLISHING_MODE
+
+
+def inline_publishing() -> bool:
+    """Whether request handlers should publish their own events"""
+    return _publishing_mode != "change_stream"
+
+
+async def resolve_publishing_mode(db, requested: str = EVENT_PUBLISHING_MODE) -> str:
+    """
+    Settle the publishing mode at service startup
+    "auto" uses the change stream wherever the deployment supports one; the
+    lossy inline mode is logged so a deployment running it is noticed
+    """
+    global _publishing_mode
+    mode = requested
+    if requested == "auto":
+        try:
+            hello = await db.command("hello")
+        except Exception as e:
+            logger.error(f"Could not check for a replica set: {e}")
+            hello = {}
+        mode = "change_stream" if hello.get("setName") or hello.get("msg") == "isdbgrid" else "inline"
+
+    if mode != "change_stream":
+        logger.warning(
+            "Publishing payment events inline: an event whose publish fails is lost. "
+            "Run MongoDB as a replica set for change-stream publishing (EVENT_PUBLISHING_MODE)"
+        )
+    _publishing_mode = mode
+    return mode
+
+
+def event_id_for(transaction_id: str, event_type: str) -> str:
+    """Stable event id so every publisher of the same fact emits the same id"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"payment:{transaction_id}:{event_type}"))
+
+
+def _value(field: Any) -> Any:
+    return field.value if isinstance(field, Enum) else field
+
+
+def _timestamp(value: Any) -> str:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return datetime.now(timezone.utc).isoformat()
+
+
+def transaction_event(document: Dict[str, Any]) -> Optional[PaymentEvent]:
+    """Event announcing a transaction document's current state, if it warrants one"""
+    status = _value(document.get("status"))
+    gateway_response = document.get("gateway_response") or {}
+
+    if status == "refunded":
+        # Refund records carry the original transaction; the original's own
+        # flip to "refunded" is the same fact and is not announced twice
+        original_transaction_id = gateway_response.get("original_transaction")
+        if not original_transaction_id:
+            return None
+        return "payment.refunded", {
+            "event_id": event_id_for(document["transaction_id"], "payment.refunded"),
+            "event_type": "payment.refunded",
+            "booking_id": document["booking_id"],
+            "user_id": document.get("user_id"),
+            "original_transaction_id": original_transaction_id,
+            "refund_transaction_id": document["transaction_id"],
+            "refund_amount": abs(document["amount"]),
+            "reason": gateway_response.get("reason"),
+            "timestamp": _timestamp(document.get("created_at")),
+        }
+
+    if status == "voided":
+        return "payment.voided", {
+            "event_id": event_id_for(document["transaction_id"], "payment.voided"),
+            "event_type": "payment.voided",
+            "booking_id": document["booking_id"],
+            "user_id": document.get("user_id"),
+            "transaction_id": document["transaction_id"],
+            "amount": document["amount"],
+            "payment_method": _value(document["payment_method"]),
+            "reason": gateway_response.get("reason"),
+            "timestamp": _timestamp(document.get("updated_at")),
+        }
+
+    # Authorizations are announced when they are captured (status "success")
+    if status not in ("success", "failed"):
+        return None
+
+    event_type = f"payment.{status}"
+    event = {
+        "event_id": event_id_for(document["transaction_id"], event_type),
+        "event_type": event_type,
+        "booking_id": document["booking_id"],
+        "transaction_id": document["transaction_id"],
+        "amount": document["amount"],
+        "payment_method": _value(document["payment_method"]),
+        "gateway_response": gateway_response,
+        "user_id": document.get("user_id"),
+        "timestamp": _timestamp(document.get("updated_at")),
+    }
+    if status == "failed":
+        event["failure_reason"] = document.get("failure_reason")
+    return event_type, event
+
+
+def change_to_event(change: Dict[str, Any]) -> Optional[PaymentEvent]:
+    """Map one change-stream document to a payment event"""
+    operation = change.get("operationType")
+
+    if operation == "update":
+        updated_fields = (change.get("updateDescription") or {}).get("updatedFields") or {}
+        if "status" not in updated_fields and FIELD_NAMES["status"] not in updated_fields:
+            return None
+
+    document = change.get("fullDocument")
+    if document is None:
+        # Updated and then deleted (e.g. archived) before the lookup ran
+        return None
+
+    if operation == "insert" and RESTORED_FIELD in document:
+        # Copied back from the archive; its events went out when it was first written
+        return None
+
+    return transaction_event(decode_transaction(document))
+
+
+class LeaseLost(Exception):
+    """Another replica took over the stream"""
+
+
+class TransactionEventTailer:
+    """Publishes payment events from the transaction_logs change stream"""
+
+    def __init__(
+        self,
+        db,
+        publish: Optional[Callable[[List[PaymentEvent]], Awaitable[None]]] = None,
+        batch_size: int = EVENT_STREAM_BATCH_SIZE,
+        max_wait_ms: int = EVENT_STREAM_MAX_WAIT_MS,
+        lease_seconds: int = EVENT_STREAM_LEASE_SECONDS,
+        owner: Optional[str] = None,
+    ):
+        if publish is None:
+            from event_publisher import publish_payment_events_confirmed
+            publish = publish_payment_events_confirmed
+
+        self.db = db
+        self.publish = publish
+        self.batch_size = batch_size
+        self.max_wait_ms = max_wait_ms
+        self.lease = timedelta(seconds=lease_seconds)
+        self.owner = owner or lease_owner()
+        self.published = 0
+
+    @property
+    def offsets(self):
+        return self.db[OFFSETS_COLLECTION]
+
+    async def acquire_lease(self) -> Optional[Dict[str, Any]]:
+        """Take or renew the stream lease; returns the offsets document when held"""
+        return await take_lease(self.offsets, STREAM_ID, self.owner, self.lease)
+
+    async def checkpoint(self, resume_token: Optional[Dict[str, Any]]):
+        """Persist the resume token and extend the lease, or raise LeaseLost"""
+        now = datetime.now(timezone.utc)
+        update: Dict[str, Any] = {"lease_until": now + self.lease, "updated_at": now}
+        if resume_token is not None:
+            update["resume_token"] = resume_token
+
+        result = await self.offsets.update_one({"_id": STREAM_ID, "owner": self.owner}, {"$set": update})
+        if result.matched_count == 0:
+            raise LeaseLost(f"Lease for {STREAM_ID} is held by another replica")
+
+    async def read_batch(self, stream) -> List[PaymentEvent]:
+        """Collect up to batch_size events, returning early once the stream goes quiet"""
+        events: List[PaymentEvent] = []
+        while len(events) < self.batch_size:
+            change = await stream.try_next()
+            if change is None:
+                break
+            event = change_to_event(change)
+            if event is not None:
+                events.append(event)
+        return events
+
+    async def tail(self, resume_token: Optional[Dict[str, Any]]):
+        """Publish batches until the stream errors or the lease is lost"""
+        checkpoint_every = self.lease.total_seconds() / 3
+        last_checkpoint = asyncio.get_running_loop().time()
+
+        async with self.db.transaction_logs.watch(
+            CHANGE_PIPELINE,
+            full_document="updateLookup",
+            resume_after=resume_token,
+            max_await_time_ms=self.max_wait_ms,
+            batch_size=self.batch_size,
+        ) as stream:
+            while True:
+                events = await self.read_batch(stream)
+                token = stream.resume_token
+
+                if events:
+                    await self.publish(events)
+                    self.published += len(events)
+
+                now = asyncio.get_running_loop().time()
+                if events or now - last_checkpoint >= checkpoint_every:
+                    await self.checkpoint(token)
+                    last_checkpoint = now
+
+    async def run(self):
+        """Hold the lease and tail forever, resuming from the last checkpoint after any failure"""
+        logger.info(f"Change-stream event publisher starting as {self.owner}")
+        while True:
+            try:
+                offsets = await self.acquire_lease()
+                if offsets is None:
+                    await asyncio.sleep(self.lease.total_seconds() / 2)
+                    continue
+
+                await self.tail(offsets.get("resume_token"))
+            except asyncio.CancelledError:
+                raise
+            except LeaseLost as e:
+                logger.warning(str(e))
+            except Exception as e:
+                logger.error(f"Change-stream event publisher failed, resuming: {e}")
+                await asyncio.sleep(EVENT_STREAM_RETRY_SECONDS)
+
+
+async def run_tailer():
+    """Standalone tailer entry point"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from event_publisher import cleanup_event_publisher
+    from shared.mongo_config import mongo_client_kwargs, write_concern
+
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"), **mongo_client_kwargs())
+    try:
+        db = client.get_database("movie_booking", write_concern=write_concern("critical"))
+        await TransactionEventTailer(db).run()
+    finally:
+        await cleanup_event_publisher()
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_tailer())
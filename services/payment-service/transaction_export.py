@@ -0,0 +1,135 @@
+"""
+Transaction Export for Payment Service
+Streams transaction logs as NDJSON or CSV for finance reconciliation
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, Optional
+
+from transaction_codec import iter_transactions, storage_projection
+
+# Documents pulled from the server per getMore round trip
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Bytes buffered before a chunk is handed to the response
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "65536"))
+
+# Columns included in every export, in CSV column order
+EXPORT_FIELDS = [
+    "transaction_id",
+    "booking_id",
+    "amount",
+    "payment_method",
+    "status",
+    "failure_reason",
+    "created_at",
+    "updated_at",
+]
+
+# Projection keeps payment_details and gateway_response off the wire
+EXPORT_PROJECTION = storage_projection(EXPORT_FIELDS)
+
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+
+def build_export_filter(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    status: Optional[str] = None,
+    payment_method: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Build the transaction_logs query for an export request"""
+    query: Dict[str, Any] = {}
+
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+
+    if status:
+        query["status"] = status
+
+    if payment_method:
+        query["payment_method"] = payment_method
+
+    return query
+
+
+def open_export_cursor(collection, query: Dict[str, Any], batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Open a server-side cursor over matching transactions
+    Results are ordered by created_at so the created_at indexes serve the scan
+    """
+    return iter_transactions(collection, query, "created_at", EXPORT_PROJECTION, batch_size)
+
+
+def serialize_value(value: Any) -> Any:
+    """Convert BSON values into JSON/CSV friendly values"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def export_row(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten a transaction document into the export column set"""
+    return {field: serialize_value(document.get(field)) for field in EXPORT_FIELDS}
+
+
+async def stream_ndjson(cursor, chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yield NDJSON chunks; memory is bounded by chunk_size plus one cursor batch"""
+    buffer = io.StringIO()
+
+    async for document in cursor:
+        buffer.write(json.dumps(export_row(document), separators=(",", ":")))
+        buffer.write("\n")
+
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def stream_csv(cursor, chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yield CSV chunks with a header row"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+
+    async for document in cursor:
+        writer.writerow(export_row(document))
+
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def stream_export(cursor, export_format: ExportFormat) -> AsyncIterator[bytes]:
+    """Pick the serializer for the requested format"""
+    if export_format == ExportFormat.CSV:
+        return stream_csv(cursor)
+    return stream_ndjson(cursor)
@@ -0,0 +1,276 @@
+"""
+Velocity checks for Payment Service
+Counts payment attempts per user, card and booking in sliding windows so
+abusive traffic (card testing, retry storms) is rejected before it reaches
+the gateway. Decisions are made from in-memory ring buffers; counts are
+exchanged with the other replicas through Redis in the background.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+VELOCITY_CHECKS_ENABLED = os.getenv("VELOCITY_CHECKS_ENABLED", "true").lower() == "true"
+VELOCITY_WINDOW_SECONDS = int(os.getenv("VELOCITY_WINDOW_SECONDS", "60"))
+VELOCITY_BUCKET_SECONDS = int(os.getenv("VELOCITY_BUCKET_SECONDS", "1"))
+VELOCITY_MAX_KEYS = int(os.getenv("VELOCITY_MAX_KEYS", "100000"))
+VELOCITY_SYNC_INTERVAL = float(os.getenv("VELOCITY_SYNC_INTERVAL", "1.0"))
+# Required secret for card fingerprints. An unkeyed hash of a PAN can be
+# reversed by enumerating card numbers, so without it the card dimension is off
+VELOCITY_CARD_KEY = os.getenv("VELOCITY_CARD_KEY", "").encode()
+
+# Attempts allowed per window for each dimension (0 disables the dimension)
+VELOCITY_LIMITS = {
+    "user": int(os.getenv("VELOCITY_MAX_ATTEMPTS_PER_USER", "20")),
+    "card": int(os.getenv("VELOCITY_MAX_ATTEMPTS_PER_CARD", "10")),
+    "booking": int(os.getenv("VELOCITY_MAX_ATTEMPTS_PER_BOOKING", "5")),
+}
+
+VelocityKey = Tuple[str, str]
+
+
+def card_fingerprint(card_number: str, key: Optional[bytes] = None) -> str:
+    """Keyed hash of a card number so raw PANs never leave the request"""
+    key = VELOCITY_CARD_KEY if key is None else key
+    if not key:
+        raise ValueError("VELOCITY_CARD_KEY is not set")
+    digits = "".join(ch for ch in card_number if ch.isdigit())
+    return hashlib.blake2b(digits.encode(), digest_size=8, key=key).hexdigest()
+
+
+def velocity_keys(
+    user_id: str, booking_id: str, payment_details: dict, card_key: Optional[bytes] = None
+) -> List[VelocityKey]:
+    """Dimensions a payment attempt is counted against; cards only when a card key is set"""
+    card_key = VELOCITY_CARD_KEY if card_key is None else card_key
+    keys = [("user", user_id), ("booking", booking_id)]
+    card_number = payment_details.get("card_number")
+    if card_number and card_key:
+        keys.append(("card", card_fingerprint(str(card_number), card_key)))
+    return keys
+
+
+class SlidingWindow:
+    """
+    Fixed-size ring of per-bucket counts covering one window
+    Slots are recycled as time advances, and a running total keeps checks O(1)
+    """
+
+    __slots__ = ("counts", "head", "total")
+
+    def __init__(self, buckets: int, head: int):
+        self.counts = array("I", bytes(4 * buckets))
+        self.head = head
+        self.total = 0
+
+    def advance(self, bucket: int):
+        """Move the newest slot to `bucket`, clearing slots that fell out of the window"""
+        size = len(self.counts)
+        if bucket <= self.head:
+            return
+
+        if bucket - self.head >= size:
+            self.counts = array("I", bytes(4 * size))
+            self.total = 0
+        else:
+            for slot in range(self.head + 1, bucket + 1):
+                position = slot % size
+                self.total -= self.counts[position]
+                self.counts[position] = 0
+        self.head = bucket
+
+    def add(self, bucket: int, amount: int = 1):
+        self.advance(bucket)
+        self.counts[bucket % len(self.counts)] += amount
+        self.total += amount
+
+    def load(self, first_bucket: int, values: List[int]):
+        """Overwrite slots from first_bucket onwards with cluster-wide counts"""
+        self.advance(first_bucket + len(values) - 1)
+        for offset, value in enumerate(values):
+            bucket = first_bucket + offset
+            if bucket <= self.head - len(self.counts):
+                continue
+            position = bucket % len(self.counts)
+            self.total += value - self.counts[position]
+            self.counts[position] = value
+
+    def oldest_bucket(self) -> Optional[int]:
+        """Oldest bucket in the window that still holds attempts"""
+        size = len(self.counts)
+        for bucket in range(self.head - size + 1, self.head + 1):
+            if self.counts[bucket % size]:
+                return bucket
+        return None
+
+
+@dataclass
+class VelocityViolation:
+    dimension: str
+    limit: int
+    window_seconds: int
+    retry_after: int
+
+    @property
+    def message(self) -> str:
+        return (
+            f"Too many payment attempts for this {self.dimension}: "
+            f"limit is {self.limit} per {self.window_seconds} seconds"
+        )
+
+
+class VelocityChecker:
+    """Sliding-window attempt limits shared across replicas through Redis"""
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, int]] = None,
+        window_seconds: int = VELOCITY_WINDOW_SECONDS,
+        bucket_seconds: int = VELOCITY_BUCKET_SECONDS,
+        max_keys: int = VELOCITY_MAX_KEYS,
+        enabled: bool = VELOCITY_CHECKS_ENABLED,
+        redis_getter: Callable = get_redis,
+        key_prefix: str = "payment:velocity:",
+        clock: Callable[[], float] = time.time,
+    ):
+        self.limits = dict(VELOCITY_LIMITS if limits is None else limits)
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.buckets = max(1, math.ceil(window_seconds / bucket_seconds))
+        self.max_keys = max_keys
+        self.enabled = enabled
+        self.redis_getter = redis_getter
+        self.key_prefix = key_prefix
+        self.clock = clock
+        self._windows: "OrderedDict[VelocityKey, SlidingWindow]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str, int], int] = {}
+        self._touched: set = set()
+        self.rejected = 0
+
+        if enabled and self.limits.get("card") and not VELOCITY_CARD_KEY:
+            logger.warning("VELOCITY_CARD_KEY is not set; per-card velocity checks are disabled")
+
+    def _bucket(self) -> int:
+        # Wall-clock buckets so every replica agrees on bucket boundaries
+        return int(self.clock() // self.bucket_seconds)
+
+    def _window(self, key: VelocityKey, bucket: int) -> SlidingWindow:
+        window = self._windows.get(key)
+        if window is None:
+            window = SlidingWindow(self.buckets, bucket)
+            self._windows[key] = window
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(key)
+        window.advance(bucket)
+        return window
+
+    def _retry_after(self, window: SlidingWindow) -> int:
+        oldest = window.oldest_bucket()
+        if oldest is None:
+            return self.bucket_seconds
+        expires = (oldest + self.buckets) * self.bucket_seconds
+        return max(1, math.ceil(expires - self.clock()))
+
+    def check(self, keys: List[VelocityKey]) -> Optional[VelocityViolation]:
+        """
+        Admit or reject one attempt without awaiting anything
+        An admitted attempt is counted against every dimension; a rejected one
+        is not counted, so a blocked card frees up once its window drains.
+        """
+        if not self.enabled:
+            return None
+
+        bucket = self._bucket()
+        keys = [key for key in keys if self.limits.get(key[0], 0) > 0]
+        windows = [self._window(key, bucket) for key in keys]
+        self._touched.update(keys)
+
+        for (dimension, _), window in zip(keys, windows):
+            limit = self.limits[dimension]
+            if window.total >= limit:
+                self.rejected += 1
+                return VelocityViolation(dimension, limit, self.window_seconds, self._retry_after(window))
+
+        for (dimension, value), window in zip(keys, windows):
+            window.add(bucket)
+            pending_key = (dimension, value, bucket)
+            self._pending[pending_key] = self._pending.get(pending_key, 0) + 1
+
+        return None
+
+    def _redis_key(self, dimension: str, value: str, bucket: int) -> str:
+        return f"{self.key_prefix}{dimension}:{value}:{bucket}"
+
+    async def sync(self):
+        """
+        Push local increments to Redis and pull cluster-wide counts for every key
+        seen since the last sync, in one pipelined round trip
+        """
+        redis_client = self.redis_getter()
+        if redis_client is None:
+            self._pending.clear()
+            self._touched.clear()
+            return
+
+        if not self._pending and not self._touched:
+            return
+
+        pending, self._pending = self._pending, {}
+        touched, self._touched = self._touched, set()
+        touched.update((dimension, value) for dimension, value, _ in pending)
+        touched = list(touched)
+
+        bucket = self._bucket()
+        first_bucket = bucket - self.buckets + 1
+        expiry = self.window_seconds + self.bucket_seconds
+
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for (dimension, value, pending_bucket), amount in pending.items():
+                redis_key = self._redis_key(dimension, value, pending_bucket)
+                pipe.incrby(redis_key, amount)
+                pipe.expire(redis_key, expiry)
+            for dimension, value in touched:
+                pipe.mget([self._redis_key(dimension, value, b) for b in range(first_bucket, bucket + 1)])
+            results = await pipe.execute()
+        except Exception as e:
+            # Keep the increments for the next round; local counts stay authoritative meanwhile
+            for pending_key, amount in pending.items():
+                self._pending[pending_key] = self._pending.get(pending_key, 0) + amount
+            logger.error(f"Velocity sync with Redis failed: {e}")
+            return
+
+        for (dimension, value), counts in zip(touched, results[2 * len(pending):]):
+            window = self._windows.get((dimension, value))
+            if window is None:
+                continue
+            values = [int(count or 0) for count in counts]
+            # Attempts admitted while the pipeline was in flight are not in Redis yet
+            for offset in range(len(values)):
+                values[offset] += self._pending.get((dimension, value, first_bucket + offset), 0)
+            window.load(first_bucket, values)
+
+    async def run_sync_loop(self, interval: float = VELOCITY_SYNC_INTERVAL):
+        """Background task that keeps replicas' counters converged"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.sync()
+
+    def reset(self):
+        self._windows.clear()
+        self._pending.clear()
+        self._touched.clear()
+        self.rejected = 0
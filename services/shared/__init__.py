@@ -0,0 +1,5 @@
+"""
+Code shared by the Python services
+Each service image copies this package next to its own modules (see the
+service Dockerfiles); local runs and tests put services/ on the import path.
+"""
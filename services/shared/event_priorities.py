@@ -0,0 +1,24 @@
+"""
+Default AMQP priorities of the events on movie_app_events
+Publishers tag each message with its event type's priority unless the caller
+sets one, and the notification worker falls back to the same table for
+untagged messages, so every service reads it from here.
+"""
+
+# AMQP priority (0-9) per routing key; the notification queues deliver higher first
+EVENT_PRIORITIES = {
+    "booking.confirmed": 9,
+    "booking.cancelled": 5,
+    "booking.refunded": 1,
+    "payment.success": 9,
+    "payment.failed": 9,
+    "payment.refunded": 1,
+    "payment.voided": 1,
+    # Older publishers used this routing key for refunds
+    "payment.refund": 1,
+}
+DEFAULT_PRIORITY = 5
+
+
+def event_priority(event_type: str) -> int:
+    return EVENT_PRIORITIES.get(event_type, DEFAULT_PRIORITY)
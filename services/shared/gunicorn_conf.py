@@ -0,0 +1,50 @@
+"""
+Gunicorn settings shared by the Python services
+Each service's gunicorn_conf.py star-imports this module and sets its own
+bind address, so the app runs in several Uvicorn worker processes and every
+core serves requests.
+
+The app is imported once in the master (preload) and workers fork from it.
+Motor, aio-pika, Redis and httpx clients are created in each worker's startup,
+after the fork, so every worker owns connections bound to its own event loop.
+Background loops started there run once per worker; jobs that must run once
+per deployment take a lease instead (see shared/leases.py).
+
+Signals:
+    TERM  finish in-flight requests (up to GUNICORN_GRACEFUL_TIMEOUT) and exit
+    HUP   start fresh workers, then drain and stop the old ones; with preload
+          on, new code needs a full restart (or GUNICORN_PRELOAD=false)
+"""
+
+import multiprocessing
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# Seconds a worker gets to drain in-flight requests before it is killed
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Recycle workers after this many requests (0 = never); jitter staggers restarts
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+
+
+def bind_address(default_port: str) -> str:
+    """BIND, or all interfaces on PORT (default_port when unset)"""
+    return os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', default_port)}")
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked")
+
+
+def worker_exit(server, worker):
+    server.log.info(f"Worker {worker.pid} exited")
@@ -0,0 +1,45 @@
+"""
+Leases for singleton background jobs shared by the Python services
+Every gunicorn worker of every replica starts the same background loops. A job
+that must run once per deployment takes a lease document first: whoever holds
+an unexpired lease keeps renewing it, and another worker only takes over once
+the holder has stopped renewing for the lease duration.
+"""
+
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+LEASES_COLLECTION = "job_leases"
+
+
+def lease_owner() -> str:
+    """Identity of this worker process; call it after the fork"""
+    return f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+async def take_lease(collection, lease_id: str, owner: str, duration: timedelta) -> Optional[Dict[str, Any]]:
+    """Take or renew a lease; returns the lease document when owner holds it"""
+    now = datetime.now(timezone.utc)
+    try:
+        return await collection.find_one_and_update(
+            {
+                "_id": lease_id,
+                "$or": [{"owner": owner}, {"lease_until": {"$lt": now}}, {"owner": None}],
+            },
+            {"$set": {"owner": owner, "lease_until": now + duration}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # The document exists and someone else holds an unexpired lease
+        return None
+
+
+async def release_lease(collection, lease_id: str, owner: str):
+    """Give a lease up early so the next run need not wait for it to expire"""
+    await collection.update_one({"_id": lease_id, "owner": owner}, {"$set": {"owner": None}})
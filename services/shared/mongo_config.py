@@ -0,0 +1,58 @@
+"""
+MongoDB client profile shared by the Python services
+Pool sizing, wire compression, read preference and per-operation-class write
+concerns come from the same MONGO_* environment variables in every service
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict
+
+from pymongo import WriteConcern
+
+logger = logging.getLogger(__name__)
+
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,zlib")
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+MONGO_WTIMEOUT_MS = int(os.getenv("MONGO_WTIMEOUT_MS", "5000"))
+
+# Write concern per operation class: payments and bookings must survive a
+# primary failover, notification logs are best-effort audit data
+WRITE_CONCERNS = {
+    "critical": os.getenv("MONGO_WRITE_CONCERN_CRITICAL", "majority"),
+    "logs": os.getenv("MONGO_WRITE_CONCERN_LOGS", "1"),
+}
+
+
+def mongo_client_kwargs() -> Dict[str, Any]:
+    """Keyword arguments for AsyncIOMotorClient"""
+    return {
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "compressors": MONGO_COMPRESSORS,
+        "readPreference": MONGO_READ_PREFERENCE,
+    }
+
+
+def write_concern(operation_class: str) -> WriteConcern:
+    """WriteConcern for an operation class ('critical' or 'logs')"""
+    w = WRITE_CONCERNS[operation_class]
+    return WriteConcern(w=int(w) if w.isdigit() else w, wtimeout=MONGO_WTIMEOUT_MS)
+
+
+async def warm_up_pool(client, min_pool_size: int = MONGO_MIN_POOL_SIZE):
+    """
+    Open min_pool_size connections up front
+    Concurrent pings each check out their own connection, so the first real
+    requests don't pay TCP, TLS and auth setup
+    """
+    if min_pool_size <= 0:
+        return
+
+    await asyncio.gather(*[client.admin.command("ping") for _ in range(min_pool_size)])
+    logger.info(f"MongoDB connection pool warmed with {min_pool_size} connections")
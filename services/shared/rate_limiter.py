@@ -0,0 +1,394 @@
+"""
+Token-bucket rate limiting shared by the Python services
+Buckets live in Redis and are updated by one atomic Lua script, so every
+replica enforces the same limits. When Redis is unset or unreachable the
+limiter falls back to per-process buckets instead of failing open.
+
+Each service binds the limiter to its own Redis client, key prefix and
+settings in its rate_limiter module.
+"""
+
+import asyncio
+import ipaddress
+import json
+import logging
+import math
+import socket
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] bucket key; ARGV rate (tokens/s), capacity, cost.
+# Time comes from the Redis server so replica clock skew can't mint tokens.
+TOKEN_BUCKET_LUA = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+@dataclass
+class RateLimitRequest:
+    """What key functions get to look at"""
+    method: str
+    path: str
+    headers: Dict[str, str]
+    client_host: Optional[str]
+    body: Any = None
+
+
+# A bucket key, or bucket keys with the tokens each one costs (e.g. per user in a batch)
+KeyFunc = Callable[[RateLimitRequest], Optional[Union[str, Dict[str, int]]]]
+
+
+@dataclass
+class RateLimitPolicy:
+    name: str
+    capacity: int
+    period: float
+    key_func: KeyFunc
+    needs_body: bool = False
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+    @classmethod
+    def from_spec(cls, name: str, spec: str, key_func: KeyFunc, needs_body: bool = False) -> "RateLimitPolicy":
+        """Parse '<requests>/<seconds>', e.g. '30/60' for a burst of 30 refilling over a minute"""
+        capacity, period = spec.split("/")
+        return cls(name, int(capacity), float(period), key_func, needs_body)
+
+
+@dataclass
+class RateLimitResult:
+    policy: RateLimitPolicy
+    allowed: bool
+    remaining: int
+    reset_after: int
+    retry_after: int
+
+
+def build_result(policy: RateLimitPolicy, allowed: bool, tokens: float) -> RateLimitResult:
+    return RateLimitResult(
+        policy=policy,
+        allowed=allowed,
+        remaining=max(0, math.floor(tokens)),
+        reset_after=math.ceil((policy.capacity - tokens) / policy.rate),
+        retry_after=0 if allowed else max(1, math.ceil((1 - tokens) / policy.rate)),
+    )
+
+
+def rate_limit_headers(result: RateLimitResult) -> Dict[str, str]:
+    """RateLimit-* headers (IETF httpapi draft) plus Retry-After when rejected"""
+    headers = {
+        "RateLimit-Limit": str(result.policy.capacity),
+        "RateLimit-Remaining": str(result.remaining),
+        "RateLimit-Reset": str(result.reset_after),
+        "RateLimit-Policy": f"{result.policy.capacity};w={int(result.policy.period)};name=\"{result.policy.name}\"",
+    }
+    if not result.allowed:
+        headers["Retry-After"] = str(result.retry_after)
+    return headers
+
+
+class LocalTokenBuckets:
+    """In-process buckets used when Redis can't be reached"""
+
+    def __init__(self, max_keys: int = 100000, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, key: str, rate: float, capacity: int, cost: int = 1) -> Tuple[bool, float]:
+        now = self.clock()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+        return allowed, tokens
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class RateLimiter:
+    """Distributed token buckets with a local fallback"""
+
+    def __init__(
+        self,
+        redis_getter: Callable,
+        key_prefix: str,
+        local: Optional[LocalTokenBuckets] = None,
+        enabled: bool = True,
+    ):
+        self.redis_getter = redis_getter
+        self.key_prefix = key_prefix
+        self.local = local or LocalTokenBuckets()
+        self.enabled = enabled
+        self._script = None
+        self._script_client = None
+
+    def _get_script(self, redis_client):
+        if self._script is None or self._script_client is not redis_client:
+            # register_script sends EVALSHA and only falls back to EVAL on NOSCRIPT
+            self._script = redis_client.register_script(TOKEN_BUCKET_LUA)
+            self._script_client = redis_client
+        return self._script
+
+    async def acquire(self, policy: RateLimitPolicy, key: str, cost: int = 1) -> RateLimitResult:
+        bucket_key = f"{self.key_prefix}{policy.name}:{key}"
+
+        redis_client = self.redis_getter()
+        if redis_client is not None:
+            try:
+                allowed, tokens = await self._get_script(redis_client)(
+                    keys=[bucket_key], args=[policy.rate, policy.capacity, cost]
+                )
+                return build_result(policy, bool(int(allowed)), float(tokens))
+            except Exception as e:
+                logger.warning(f"Redis rate limiter unavailable, using local buckets: {e}")
+
+        allowed, tokens = self.local.take(bucket_key, policy.rate, policy.capacity, cost)
+        return build_result(policy, allowed, tokens)
+
+
+class TrustedProxies:
+    """
+    Peers whose identity and X-Forwarded-For headers are believed
+    Entries are IP addresses, CIDR ranges or hostnames (e.g. "kong"). Hostnames
+    are resolved by refresh(), which the service awaits at startup and then
+    repeats every resolve_seconds in a background task (start()); lookups on
+    the request path only read the resolved set and never touch DNS.
+    """
+
+    def __init__(self, entries: Iterable[str] = (), resolve_seconds: float = 60.0):
+        self.networks = []
+        self.hostnames = []
+        for entry in entries:
+            try:
+                self.networks.append(ipaddress.ip_network(entry, strict=False))
+            except ValueError:
+                self.hostnames.append(entry)
+        self.resolve_seconds = resolve_seconds
+        self._addresses: Dict[str, Set[str]] = {}
+        self._resolved: Set[str] = set()
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "TrustedProxies":
+        """Parse a comma-separated list, e.g. 'kong,10.0.0.0/8'"""
+        return cls(entry.strip() for entry in spec.split(",") if entry.strip())
+
+    async def refresh(self):
+        """Resolve the hostname entries with the loop's resolver; a failed lookup keeps its last addresses"""
+        loop = asyncio.get_running_loop()
+        for hostname in self.hostnames:
+            try:
+                infos = await loop.getaddrinfo(hostname, None, type=socket.SOCK_STREAM)
+            except OSError as e:
+                logger.warning(f"Cannot resolve trusted proxy {hostname}: {e}")
+                continue
+            self._addresses[hostname] = {sockaddr[0] for *_, sockaddr in infos}
+        self._resolved = set().union(*self._addresses.values())
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.resolve_seconds)
+            await self.refresh()
+
+    async def start(self) -> Optional[asyncio.Task]:
+        """Resolve hostnames now and keep them fresh in the background; None without hostnames"""
+        if not self.hostnames:
+            return None
+        await self.refresh()
+        return asyncio.create_task(self._refresh_loop())
+
+    def __contains__(self, host: Optional[str]) -> bool:
+        if not host:
+            return False
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return any(address in network for network in self.networks) or host in self._resolved
+
+
+def client_key_for(trusted_proxies: TrustedProxies) -> KeyFunc:
+    """
+    Caller identity: consumer header from a trusted proxy, else the client IP
+    Headers from any other peer are ignored, or a client could pick its own
+    bucket. Behind trusted proxies the client IP is the rightmost
+    X-Forwarded-For hop that is not itself a trusted proxy, since hops to
+    its left are whatever the client sent.
+    """
+    def key_func(request: RateLimitRequest) -> Optional[str]:
+        peer = request.client_host
+        if peer not in trusted_proxies:
+            return f"ip:{peer}" if peer else None
+
+        consumer = request.headers.get("x-consumer-id") or request.headers.get("x-user-id")
+        if consumer:
+            return f"consumer:{consumer}"
+
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if hop not in trusted_proxies:
+                return f"ip:{hop}"
+        return f"ip:{hops[0] if hops else peer}"
+    return key_func
+
+
+def body_field_key(field: str) -> KeyFunc:
+    """Key on a top-level field of the JSON request body"""
+    def key_func(request: RateLimitRequest) -> Optional[str]:
+        if isinstance(request.body, dict) and request.body.get(field):
+            return str(request.body[field])
+        return None
+    return key_func
+
+
+def body_items_key(items_field: str, field: str) -> KeyFunc:
+    """
+    Key on a field of each item in a list in the JSON request body
+    Each distinct value is charged one token per item, so a batch spends the
+    same per-user tokens as sending its items one by one.
+    """
+    def key_func(request: RateLimitRequest) -> Optional[Dict[str, int]]:
+        items = request.body.get(items_field) if isinstance(request.body, dict) else None
+        if not isinstance(items, list):
+            return None
+        costs: Dict[str, int] = {}
+        for item in items:
+            if isinstance(item, dict) and item.get(field):
+                key = str(item[field])
+                costs[key] = costs.get(key, 0) + 1
+        return costs or None
+    return key_func
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware applying per-route policies before the request reaches a handler
+    The request body is only read (and replayed downstream) for routes whose
+    policies key on it.
+    """
+
+    def __init__(self, app, limiter: RateLimiter, routes: Dict[Tuple[str, str], List[RateLimitPolicy]]):
+        self.app = app
+        self.limiter = limiter
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.limiter.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        policies = self.routes.get((scope["method"], scope["path"]))
+        if not policies:
+            await self.app(scope, receive, send)
+            return
+
+        body = None
+        if any(policy.needs_body for policy in policies):
+            raw_body, receive = await self._buffer_body(receive)
+            try:
+                body = json.loads(raw_body) if raw_body else None
+            except ValueError:
+                body = None
+
+        client = scope.get("client")
+        request = RateLimitRequest(
+            method=scope["method"],
+            path=scope["path"],
+            headers={name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]},
+            client_host=client[0] if client else None,
+            body=body,
+        )
+
+        results = []
+        for policy in policies:
+            keys = policy.key_func(request)
+            if keys is None:
+                continue
+            for key, cost in ({keys: 1} if isinstance(keys, str) else keys).items():
+                result = await self.limiter.acquire(policy, key, cost)
+                results.append(result)
+                if not result.allowed:
+                    await self._reject(result, send)
+                    return
+
+        if not results:
+            await self.app(scope, receive, send)
+            return
+
+        # Report the policy closest to running out
+        headers = rate_limit_headers(min(results, key=lambda result: result.remaining))
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    async def _buffer_body(self, receive):
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        raw_body = b"".join(chunks)
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": raw_body, "more_body": False}
+            return await receive()
+
+        return raw_body, replay
+
+    async def _reject(self, result: RateLimitResult, send):
+        payload = json.dumps({"detail": f"Rate limit exceeded for {result.policy.name}"}).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+        headers += [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in rate_limit_headers(result).items()
+        ]
+        await send({"type": "http.response.start", "status": 429, "headers": headers})
+        await send({"type": "http.response.body", "body": payload})